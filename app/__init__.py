@@ -52,6 +52,9 @@ def create_app(config_name=None):
     from app.views.account import account_bp
     from app.views.system import system_bp
     from app.views.admin import admin_bp
+    from app.routes.exports import exports_bp
+    # 上游推送回调（app.routes.webhooks）写入 app/models.py 的表，这里的 app.database
+    # 没有这些表，等号码相关接口迁到同一套模型后再注册，以免推送应答202后无法写库
     
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(project_bp, url_prefix='/api/projects')
@@ -59,6 +62,7 @@ def create_app(config_name=None):
     app.register_blueprint(account_bp, url_prefix='/api/account')
     app.register_blueprint(system_bp, url_prefix='/api/system')
     app.register_blueprint(admin_bp, url_prefix='/api/admin')
+    app.register_blueprint(exports_bp, url_prefix='/api/exports')
     
     # 全局错误处理器
     register_error_handlers(app)
@@ -130,4 +134,8 @@ def register_error_handlers(app):
     
     @app.errorhandler(403)
     def forbidden(error):
-        return jsonify({"error": "禁止访问", "code": 403}), 403 
\ No newline at end of file
+        return jsonify({"error": "禁止访问", "code": 403}), 403
+    
+    # 上游熔断时返回503并带Retry-After
+    from app.services.resilience import CircuitOpenError, circuit_open_response
+    app.register_error_handler(CircuitOpenError, circuit_open_response) 
\ No newline at end of file
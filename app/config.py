@@ -21,6 +21,15 @@ class Config(object):
     # 缓存配置
     CACHE_TYPE = 'SimpleCache'
     CACHE_DEFAULT_TIMEOUT = 300
+    CACHE_MAX_ENTRIES = 100000  # 内存缓存最多条目数，超出后按LRU淘汰
+    CACHE_STRIPES = 16  # 内存缓存分段数（每段一把锁）
+    CACHE_SWEEP_INTERVAL = 30  # 后台清理过期条目并上报统计的间隔（秒）
+    # CACHE_TYPE 为 RedisCache / TieredCache 时使用；memory:// 为进程内替身，不需要启动Redis
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    CACHE_L1_MAX_ENTRIES = 10000  # 两级缓存中进程内L1的最多条目数
+    CACHE_L1_TTL = 30  # L1条目最长保留时间（秒），失效广播丢失时旧值最多保留这么久
+    CACHE_INVALIDATION_CHANNEL = 'cache:invalidate'  # 失效广播频道
+    CACHE_COMPRESS_THRESHOLD = 1024  # 序列化后超过该字节数时压缩
     
     # 限流配置
     RATELIMIT_DEFAULT = "200 per day, 50 per hour"
@@ -38,6 +47,117 @@ class Config(object):
     BABEL_DEFAULT_LOCALE = 'zh_CN'
     BABEL_TRANSLATION_DIRECTORIES = './translations'
 
+    # 上游接码平台配置
+    SMS_API_BASE_URL = os.environ.get('SMS_API_BASE_URL', 'http://localhost:8000/api')
+    SMS_API_KEY = os.environ.get('SMS_API_KEY', '')
+    USE_MOCK_API = os.environ.get('USE_MOCK_API', 'true').lower() == 'true'
+    SMS_API_MAX_IN_FLIGHT = int(os.environ.get('SMS_API_MAX_IN_FLIGHT', 8))  # 每个上游的最大在途请求数
+    SMS_API_POOL_MAXSIZE = 32  # 每个上游的keep-alive连接池大小
+    SMS_API_CONNECT_TIMEOUT = 3  # 连接超时（秒）
+    SMS_API_READ_TIMEOUT = 10  # 读取超时（秒）
+    SMS_API_DEFAULT_DEADLINE = 10  # 单次上游操作（含重试）的截止时间（秒）
+    UPSTREAM_REQUEST_DEADLINE = 15  # 一次API请求内所有上游调用的总截止时间（秒）
+    SMS_API_DEADLINES = {'get_sms_code': 5, 'check_balance': 5}  # 按操作覆盖截止时间
+    SMS_API_MAX_RETRIES = 2  # 单次操作最大重试次数
+    SMS_API_RETRYABLE_OPS = ('get_projects', 'search_projects', 'get_sms_code', 'check_balance', 'release_phone_number')  # 幂等操作，超时后也可以重试
+    SMS_API_RETRY_BUDGET_RATIO = 0.1  # 重试量占正常请求量的上限比例
+    SMS_API_BREAKER_FAILURE_THRESHOLD = 5  # 连续失败多少次后熔断
+    SMS_API_BREAKER_RESET_TIMEOUT = 30  # 熔断后多少秒进入半开状态
+    SMS_API_HEDGE_DELAY = None  # get_sms_code对冲请求的延迟（秒），None表示关闭
+    BATCH_GET_MAX_COUNT = 50  # 批量取号单次最大数量
+    BATCH_SMS_MAX_COUNT = 500  # 批量查询短信单次最多请求ID数
+    BATCH_RELEASE_MAX_COUNT = 5000  # 批量释放单次最多请求ID数（POST请求体）
+    BATCH_RELEASE_QUERY_MAX_COUNT = 100  # 通过GET查询参数批量释放时的上限
+
+    # 黑名单索引配置
+    BLACKLIST_INDEX_PATH = os.environ.get('BLACKLIST_INDEX_PATH', 'instance/blacklist.idx')  # 各工作进程共享的索引文件
+    BLACKLIST_INDEX_CHECK_INTERVAL = 1  # 检查索引文件是否被其他进程更新的间隔（秒）
+    BLACKLIST_IMPORT_MAX_COUNT = 500000  # 批量导入黑名单单次最多号码数
+
+    # 后台导出任务配置
+    EXPORT_SPOOL_DIR = os.environ.get('EXPORT_SPOOL_DIR', 'instance/exports')  # 导出文件目录，多进程部署时需共享
+    EXPORT_JOB_WORKERS = 2  # 执行导出任务的进程数
+    EXPORT_JOB_USE_PROCESSES = True  # 使用进程池执行（False时使用线程池）
+    EXPORT_JOB_START_METHOD = 'spawn'  # 子进程启动方式
+    EXPORT_JOB_MAX_PER_USER = 2  # 每个用户同时进行的导出任务上限
+    EXPORT_JOB_TTL = 86400  # 导出文件保留时间（秒）
+    EXPORT_JOB_CLEANUP_INTERVAL = 600  # 清理过期导出文件的间隔（秒）
+    EXPORT_JOB_STALE_SECONDS = 300  # 执行中的任务超过该秒数没有更新状态即视为进程已退出
+    STATISTICS_EXPORT_MAX_DAYS = 366  # 统计报表导出的最大日期范围（天）
+
+    # 统计接口缓存配置
+    STATS_CACHE_ENABLED = True
+    STATS_CACHE_TTL = 300  # 缓存有效期（秒），数据写入后会提前失效
+    STATS_CACHE_MAX_ENTRIES = 1000  # 进程内缓存最多条目数
+    STATS_CACHE_MAX_BYTES = 16 * 1024 * 1024  # 进程内缓存最多占用字节数
+    STATS_CACHE_WAIT_TIMEOUT = 30  # 等待相同请求计算结果的最长时间（秒）
+    STATS_CACHE_REDIS_URL = os.environ.get('STATS_CACHE_REDIS_URL')  # 配置后所有工作进程共享缓存
+
+    # 多上游平台配置，为空时只使用 SMS_API_BASE_URL
+    # 例如 [{'name': 'a', 'base_url': 'http://a/api', 'api_key': '', 'weight': 1.0,
+    #        'projects': {'wechat_login': 'wx'}, 'prices': {'wechat_login': 0.8}}]
+    # projects省略表示支持所有项目，prices为上游成本价，高于项目售价的平台不参与取号
+    SMS_API_PROVIDERS = []
+    SMS_PROVIDER_WINDOW_SECONDS = 300  # 成功率/延迟统计的滑动窗口（秒）
+    SMS_PROVIDER_WINDOW_SIZE = 100  # 滑动窗口最多保留的样本数
+    SMS_PROVIDER_DEFAULT_LATENCY = 0.5  # 没有样本的平台的估计延迟（秒）
+    SMS_PROVIDER_EXPLORE_RATE = 0.05  # 随机尝试非最优平台的概率
+
+    # 验证码长轮询配置
+    SMS_WAIT_MAX_SECONDS = 30  # wait参数上限（秒）
+    SMS_WAIT_POLL_INTERVAL = 2  # 共享轮询的上游请求间隔（秒）
+
+    # 后台验证码轮询器配置（默认启用，设置 SMS_POLLER_ENABLED=false 关闭）
+    SMS_POLLER_ENABLED = os.environ.get('SMS_POLLER_ENABLED', 'true').lower() == 'true'
+    SMS_POLLER_BATCH_SIZE = 100  # 每批最多查询的号码数
+    SMS_POLLER_INITIAL_INTERVAL = 2  # 号码的首次轮询间隔（秒）
+    SMS_POLLER_BACKOFF = 1.5  # 未收到短信时轮询间隔的增长倍数
+    SMS_POLLER_MAX_INTERVAL = 15  # 轮询间隔上限（秒）
+    SMS_POLLER_MAX_AGE = 1200  # 号码取出后最多跟踪的时长（秒）
+    SMS_POLLER_LEASE_RENEW_INTERVAL = 20  # 恢复遗留号码的租约续约间隔（秒），租约有效期为其3倍且不少于60秒
+
+    # 号码超时清理配置（超时时间取 SYSTEM_SETTINGS['sms_timeout']）
+    EXPIRY_SWEEPER_ENABLED = os.environ.get('EXPIRY_SWEEPER_ENABLED', 'true').lower() == 'true'
+    EXPIRY_SWEEP_INTERVAL = 15  # 清理间隔（秒）
+    EXPIRY_SWEEP_BATCH_SIZE = 200  # 每批处理的号码数
+    EXPIRY_SWEEP_MAX_BATCHES = 50  # 每轮最多处理的批次数
+    EXPIRY_MAX_RELEASE_ATTEMPTS = 3  # 超时号码上游释放失败后最多尝试的次数
+
+    # 上游短信推送（回调）配置
+    SMS_WEBHOOK_SECRETS = {'default': os.environ.get('SMS_WEBHOOK_SECRET', '')}  # 平台名 -> 签名密钥，为空表示不接受该平台推送
+    SMS_WEBHOOK_MAX_BATCH = 1000  # 单次推送最大条数
+    SMS_INGEST_QUEUE_SIZE = 50000  # 写入队列上限，超出后返回503
+    SMS_INGEST_BATCH_SIZE = 500  # 每批写库的最大条数
+    SMS_INGEST_FLUSH_INTERVAL = 0.2  # 凑批最长等待时间（秒）
+    SMS_INGEST_MAX_ATTEMPTS = 3  # 写库失败重试次数
+    SMS_INGEST_SPOOL_DIR = os.environ.get('SMS_INGEST_SPOOL_DIR', 'instance/sms_ingest')  # 写库失败的推送转存目录
+    SMS_INGEST_REPLAY_INTERVAL = 30  # 重放转存推送的间隔（秒）
+
+    # 验证码提取规则配置
+    CODE_RULES_RELOAD_INTERVAL = 10  # 检查其他进程修改规则的间隔（秒），本进程的修改立即生效
+    CODE_RULES_LEARN_MIN_SUPPORT = 3  # 同一模板被上游确认多少次后保存为规则
+    CODE_RULES_MAX_LEARNED = 20  # 每个 (项目, 发送方前缀) 最多自动学习的规则数
+    CODE_RULES_SENDER_PREFIX_LEN = 5  # 自动学习的规则使用的发送方号码前缀长度
+
+    # 号码事件推送（SSE）配置
+    SSE_HEARTBEAT_SECONDS = 15  # 心跳间隔（秒）
+    SSE_BUFFER_SIZE = 100  # 每个连接的事件缓冲上限，超出后断开并要求客户端重新同步
+    SSE_MAX_DURATION = 600  # 单个连接最长保持时间（秒），到期后客户端自动重连
+    SSE_RETRY_MS = 3000  # 客户端重连间隔（毫秒）
+
+    # 号码池配置（按项目预取上游号码）
+    NUMBER_POOL_ENABLED = os.environ.get('NUMBER_POOL_ENABLED', 'true').lower() == 'true'
+    NUMBER_POOL_LOW_WATERMARK = 2  # 低于该数量时触发补货
+    NUMBER_POOL_HIGH_WATERMARK = 10  # 补货目标数量
+    NUMBER_POOL_WATERMARKS = {}  # 按项目覆盖水位，例如 {'wechat_login': (5, 30)}
+    NUMBER_POOL_MAX_SIZE = 200  # 单个项目号码池上限
+    NUMBER_POOL_TTL = 600  # 池中号码闲置超过该秒数后释放
+    NUMBER_POOL_REFILL_INTERVAL = 5  # 补货线程轮询间隔（秒）
+    NUMBER_POOL_DEMAND_INTERVAL = 300  # 需求EWMA刷新间隔（秒）
+    NUMBER_POOL_DEMAND_WINDOW_HOURS = 24  # 需求统计窗口（小时）
+    NUMBER_POOL_DEMAND_ALPHA = 0.3  # 需求EWMA平滑系数
+    NUMBER_POOL_COVERAGE_MINUTES = 10  # 号码池需覆盖的需求时长（分钟）
+
 # 开发环境配置
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -47,6 +167,11 @@ class DevelopmentConfig(Config):
 class TestingConfig(Config):
     TESTING = True
     DATABASE_URI = 'sqlite:///:memory:'
+    NUMBER_POOL_ENABLED = False
+    SMS_POLLER_ENABLED = False
+    EXPIRY_SWEEPER_ENABLED = False
+    EXPORT_JOB_USE_PROCESSES = False
+    CACHE_REDIS_URL = 'memory://'
 
 # 生产环境配置
 class ProductionConfig(Config):
@@ -3,6 +3,7 @@
 
 import jwt
 import time
+import hashlib
 from functools import wraps
 from flask import request, jsonify, current_app, g
 from app.database import db
@@ -56,7 +57,12 @@ def generate_jwt_token(user_id, username, is_admin=False, expiry=3600):
     
     return token
 
-@cached(ttl=300)  # 缓存5分钟
+def _token_cache_key(token):
+    """令牌的缓存键，只用摘要，不把令牌原文写进缓存"""
+    return hashlib.sha256((token or '').encode('utf-8')).hexdigest()
+
+# 缓存5分钟；无效令牌缓存1分钟，避免反复解码同一个无效令牌
+@cached(ttl=300, key=_token_cache_key, negative_ttl=60)
 def validate_token(token):
     """验证令牌并返回用户ID"""
     if not token:
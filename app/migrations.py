@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+数据库结构迁移
+
+create_all 只会创建缺少的表，不会给已有的表加列和索引。已经部署的数据库升级后执行
+python migrate_db.py，按版本号顺序执行还没有执行过的步骤，执行记录保存在
+schema_migrations 表中。
+
+每个步骤在执行前检查表、列、索引是否已经存在，在 create_all 新建的库上执行、
+或者重复执行都是安全的。步骤中的表结构单独定义、不引用模型：模型以后还会变，
+迁移步骤要保持当时的结构。
+
+新增步骤:
+    @migration('0002', '号码表增加xxx列')
+    def _phone_numbers_xxx(conn):
+        add_column(conn, 'phone_numbers', Column('xxx', String(50)))
+"""
+
+import logging
+from datetime import datetime
+from sqlalchemy import (MetaData, Table, Column, ForeignKey, Integer, Float, String, Text, Boolean, Date, DateTime,
+                        Index, inspect, text)
+
+logger = logging.getLogger(__name__)
+
+# (版本号, 说明, 执行函数)，按版本号排序
+MIGRATIONS = []
+
+_history = Table(
+    'schema_migrations', MetaData(),
+    Column('version', String(20), primary_key=True),
+    Column('description', String(200)),
+    Column('applied_at', DateTime, nullable=False)
+)
+
+def migration(version, description):
+    """注册一个迁移步骤"""
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return func
+    return decorator
+
+def has_table(conn, table):
+    return inspect(conn).has_table(table)
+
+def has_column(conn, table, column):
+    return column in {item['name'] for item in inspect(conn).get_columns(table)}
+
+def has_index(conn, table, name):
+    return name in {item['name'] for item in inspect(conn).get_indexes(table)}
+
+def add_column(conn, table, column):
+    """
+    给已有的表加一列（只支持可为空的列）
+
+    返回:
+        bool: 是否执行了变更；表不存在或列已存在时跳过
+    """
+    if not has_table(conn, table) or has_column(conn, table, column.name):
+        return False
+    quote = conn.dialect.identifier_preparer.quote
+    column_type = column.type.compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {quote(table)} ADD COLUMN {quote(column.name)} {column_type}"))
+    logger.info(f"已添加列 {table}.{column.name}")
+    return True
+
+def create_index(conn, table, name, *columns, unique=False):
+    """
+    在已有的表上建索引
+
+    返回:
+        bool: 是否执行了变更；表不存在、缺少索引列（同名的另一套模型的表）或同名索引已存在时跳过
+    """
+    if not has_table(conn, table) or has_index(conn, table, name):
+        return False
+    if not all(has_column(conn, table, column) for column in columns):
+        return False
+    reflected = Table(table, MetaData(), autoload_with=conn)
+    Index(name, *[reflected.c[column] for column in columns], unique=unique).create(conn)
+    logger.info(f"已创建索引 {name}")
+    return True
+
+def create_table(conn, table):
+    """
+    建表（连同表上定义的索引）
+
+    返回:
+        bool: 是否执行了变更；表已存在时跳过
+    """
+    if has_table(conn, table.name):
+        return False
+    table.create(conn)
+    logger.info(f"已创建表 {table.name}")
+    return True
+
+def applied_versions(engine):
+    """已经执行过的步骤版本号"""
+    with engine.begin() as conn:
+        _history.create(conn, checkfirst=True)
+        return {row.version for row in conn.execute(_history.select())}
+
+def status(engine):
+    """
+    各步骤的执行情况
+
+    返回:
+        list: [(版本号, 说明, 是否已执行)]
+    """
+    applied = applied_versions(engine)
+    return [(version, description, version in applied) for version, description, _ in MIGRATIONS]
+
+def upgrade(engine):
+    """
+    按顺序执行还没有执行过的步骤，每个步骤一个事务
+
+    返回:
+        list: 本次执行的版本号
+    """
+    applied = applied_versions(engine)
+    done = []
+    for version, description, func in MIGRATIONS:
+        if version in applied:
+            continue
+        logger.info(f"执行迁移 {version}: {description}")
+        with engine.begin() as conn:
+            func(conn)
+            conn.execute(_history.insert().values(
+                version=version, description=description, applied_at=datetime.utcnow()
+            ))
+        done.append(version)
+    return done
+
+@migration('0001', '号码表（app.models.number）保存上游请求ID和上游平台')
+def _phone_numbers_upstream(conn):
+    # 只处理 app/models/number.py 的号码表（有 message_count 列）
+    if not has_table(conn, 'phone_numbers') or not has_column(conn, 'phone_numbers', 'message_count'):
+        return
+    add_column(conn, 'phone_numbers', Column('upstream_request_id', String(100)))
+    add_column(conn, 'phone_numbers', Column('provider', String(50)))
+
+@migration('0002', '号码表（app/models.py）记录提供号码的上游平台')
+def _phone_numbers_provider(conn):
+    add_column(conn, 'phone_numbers', Column('provider', String(50)))
+
+@migration('0003', '上游推送短信记录表 sms_deliveries')
+def _sms_deliveries(conn):
+    metadata = MetaData()
+    phone_number_id = Column('phone_number_id', Integer)
+    if has_table(conn, 'phone_numbers'):
+        # 外键引用的表要在同一个MetaData中
+        Table('phone_numbers', metadata, autoload_with=conn)
+        phone_number_id = Column('phone_number_id', Integer, ForeignKey('phone_numbers.id'))
+    create_table(conn, Table(
+        'sms_deliveries', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('content_hash', String(64), nullable=False, unique=True),
+        Column('provider', String(50)),
+        Column('request_id', String(100), index=True),
+        Column('number', String(20), index=True),
+        Column('sender', String(50)),
+        Column('content', Text, nullable=False),
+        Column('code', String(20)),
+        phone_number_id,
+        Column('received_at', DateTime),
+        Column('created_at', DateTime)
+    ))
+
+@migration('0004', '验证码提取规则表 code_rules')
+def _code_rules(conn):
+    metadata = MetaData()
+    project_id = Column('project_id', Integer)
+    if has_table(conn, 'projects'):
+        Table('projects', metadata, autoload_with=conn)
+        project_id = Column('project_id', Integer, ForeignKey('projects.id'))
+    create_table(conn, Table(
+        'code_rules', metadata,
+        Column('id', Integer, primary_key=True),
+        project_id,
+        Column('sender_prefix', String(20)),
+        Column('pattern', Text, nullable=False),
+        Column('priority', Integer),
+        Column('source', String(20)),
+        Column('support', Integer),
+        Column('enabled', Boolean),
+        Column('created_at', DateTime),
+        Column('updated_at', DateTime, index=True),
+        Index('ix_code_rules_scope', 'project_id', 'sender_prefix')
+    ))
+
+@migration('0005', '短信表保存提取出的验证码，按号码请求和接收时间建索引')
+def _sms_messages_code(conn):
+    add_column(conn, 'sms_messages', Column('code', String(20)))
+    create_index(conn, 'sms_messages', 'ix_sms_messages_request_received', 'phone_request_id', 'received_at')
+
+@migration('0006', '超时清理：号码表 (status, created_at) 索引和后台任务租约表 job_leases')
+def _expiry_sweeper(conn):
+    create_index(conn, 'phone_numbers', 'ix_phone_numbers_status_created', 'status', 'created_at')
+    create_table(conn, Table(
+        'job_leases', MetaData(),
+        Column('name', String(50), primary_key=True),
+        Column('owner', String(100), nullable=False),
+        Column('expires_at', DateTime, nullable=False),
+        Column('updated_at', DateTime)
+    ))
+
+@migration('0007', '号码表按号码建索引（拉黑时按号码批量更新）')
+def _phone_numbers_number(conn):
+    create_index(conn, 'phone_numbers', 'ix_phone_numbers_number', 'number')
+
+@migration('0008', '统计汇总表 stats_hourly / stats_daily')
+def _stats_rollups(conn):
+    metadata = MetaData()
+    for name, bucket_type in (('stats_hourly', DateTime), ('stats_daily', Date)):
+        create_table(conn, Table(
+            name, metadata,
+            Column('user_id', Integer, primary_key=True, autoincrement=False),
+            Column('project_id', Integer, primary_key=True, autoincrement=False),
+            Column('bucket', bucket_type, primary_key=True),
+            Column('numbers', Integer, nullable=False),
+            Column('successes', Integer, nullable=False),
+            Column('spend', Float, nullable=False),
+            Column('refunds', Float, nullable=False),
+            Index(f'ix_{name}_bucket', 'bucket')
+        ))
+    # 建表后执行 python backfill_rollups.py 补齐历史数据
+
+@migration('0009', '统计接口的范围查询索引')
+def _statistics_range_indexes(conn):
+    create_index(conn, 'transactions', 'ix_transactions_user_type_created', 'user_id', 'type', 'created_at')
+    create_index(conn, 'phone_requests', 'ix_phone_requests_user_created', 'user_id', 'created_at')
+
+@migration('0010', '号码表（app/models.py）保存上游请求ID')
+def _routes_phone_numbers_upstream(conn):
+    add_column(conn, 'phone_numbers', Column('upstream_request_id', String(100)))
+    create_index(conn, 'phone_numbers', 'ix_phone_numbers_upstream_request_id', 'upstream_request_id')
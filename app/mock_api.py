@@ -1,7 +1,11 @@
+import json
 import random
 import string
 import time
+import threading
 from datetime import datetime
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 class MockSMSApi:
     """模拟SMS API服务，用于本地测试"""
@@ -192,4 +196,122 @@ class MockSMSApi:
         }
 
 # 创建全局实例
-mock_api = MockSMSApi() 
\ No newline at end of file
+mock_api = MockSMSApi() 
+
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    """监听队列加长的HTTP服务（默认队列长度5，压测时连接会被重置）"""
+    request_queue_size = 128
+
+
+class MockUpstreamServer:
+    """
+    本地HTTP模拟上游，用于压测和多上游测试
+    
+    把 MockSMSApi 暴露为与真实上游相同的HTTP接口，可配置延迟和失败率。
+    
+    用法:
+        server = MockUpstreamServer(latency=0.05, failure_rate=0.1).start()
+        client = SMSApiClient(base_url=server.base_url, api_key='test')
+        ...
+        server.stop()
+    """
+    
+    def __init__(self, api=None, latency=0.0, failure_rate=0.0, host='127.0.0.1', port=0):
+        self.api = api or MockSMSApi()
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.request_count = 0
+        self.connection_count = 0
+        self._server = _MockHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+    
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    def start(self):
+        """在后台线程中启动服务"""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        """停止服务"""
+        self._server.shutdown()
+        self._server.server_close()
+    
+    def _dispatch(self, method, path, query, body):
+        """把HTTP请求映射到模拟API的方法"""
+        parts = [p for p in path.split('/') if p]
+        if method == 'GET' and parts == ['projects']:
+            return self.api.get_projects()
+        if method == 'GET' and parts == ['projects', 'search']:
+            return self.api.search_projects(query.get('keyword', [''])[0])
+        if method == 'POST' and parts == ['numbers']:
+            return self.api.get_phone_number(body.get('project_code'))
+        if method == 'POST' and parts == ['numbers', 'specific']:
+            return self.api.get_specific_phone_number(body.get('project_code'), body.get('number'))
+        if method == 'POST' and parts == ['numbers', 'blacklist']:
+            return self.api.blacklist_phone_number(body.get('number'), body.get('reason'))
+        if method == 'POST' and len(parts) == 3 and parts[0] == 'numbers' and parts[2] == 'release':
+            return self.api.release_phone_number(parts[1])
+        if method == 'GET' and len(parts) == 2 and parts[0] == 'sms':
+            return self.api.get_sms_code(parts[1])
+        if method == 'GET' and parts == ['account', 'balance']:
+            return self.api.check_balance()
+        return None
+    
+    def _make_handler(self):
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            # 使用HTTP/1.1以支持keep-alive
+            protocol_version = 'HTTP/1.1'
+            # 关闭Nagle算法，否则keep-alive连接上的小响应会被延迟确认拖慢
+            disable_nagle_algorithm = True
+            
+            def setup(self):
+                server.connection_count += 1
+                super().setup()
+            
+            def _handle(self, method):
+                server.request_count += 1
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                try:
+                    body = json.loads(raw) if raw else {}
+                except ValueError:
+                    body = {}
+                
+                if server.latency:
+                    time.sleep(server.latency)
+                
+                url = urlparse(self.path)
+                if server.failure_rate and random.random() < server.failure_rate:
+                    status, result = 500, {'success': False, 'message': '模拟上游故障'}
+                else:
+                    result = server._dispatch(method, url.path, parse_qs(url.query), body)
+                    status = 200 if result is not None else 404
+                    if result is None:
+                        result = {'success': False, 'message': '接口不存在'}
+                
+                payload = json.dumps(result, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            
+            def do_GET(self):
+                self._handle('GET')
+            
+            def do_POST(self):
+                self._handle('POST')
+            
+            def log_message(self, format, *args):
+                pass
+        
+        return Handler
@@ -227,15 +227,31 @@ class PhoneNumber(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     number = db.Column(db.String(20), nullable=False)
-    status = db.Column(db.String(20), default='available')  # available, used, blacklisted, released
+    status = db.Column(db.String(20), default='available')  # available, used, blacklisted, released, expired
     project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     sms_code = db.Column(db.String(20))  # 收到的短信验证码
-    request_id = db.Column(db.String(100))  # 上游平台请求ID
+    request_id = db.Column(db.String(100))  # 本地请求ID，返回给客户端
+    upstream_request_id = db.Column(db.String(100))  # 上游平台的请求ID，查询短信和释放号码时使用
+    provider = db.Column(db.String(50))  # 提供该号码的上游平台
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     released_at = db.Column(db.DateTime)  # 释放时间
     
+    __table_args__ = (
+        # 超时清理按 (status, created_at) 分批扫描
+        db.Index('ix_phone_numbers_status_created', 'status', 'created_at'),
+        # 拉黑时按号码批量修改状态
+        db.Index('ix_phone_numbers_number', 'number'),
+        # 上游推送短信按上游请求ID匹配号码
+        db.Index('ix_phone_numbers_upstream_request_id', 'upstream_request_id'),
+    )
+    
+    @property
+    def upstream_id(self):
+        """调用上游时使用的请求ID（迁移前取的号码没有记录上游请求ID，沿用本地请求ID）"""
+        return self.upstream_request_id or self.request_id
+    
     def to_dict(self):
         """将手机号码对象转换为字典"""
         return {
@@ -247,6 +263,7 @@ class PhoneNumber(db.Model):
             'user_id': self.user_id,
             'sms_code': self.sms_code,
             'request_id': self.request_id,
+            'provider': self.provider,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat(),
             'released_at': self.released_at.isoformat() if self.released_at else None
@@ -283,6 +300,11 @@ class Transaction(db.Model):
     reference_id = db.Column(db.String(100))  # 订单号或其他引用ID
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        # 统计接口按用户、交易类型和时间范围汇总消费
+        db.Index('ix_transactions_user_type_created', 'user_id', 'type', 'created_at'),
+    )
+    
     def to_dict(self):
         """将交易记录对象转换为字典"""
         return {
@@ -314,6 +336,11 @@ class PhoneRequest(db.Model):
     project = db.relationship('Project', backref='phone_requests')
     sms_messages = db.relationship('SMS', backref='phone_request', lazy=True)
     
+    __table_args__ = (
+        # 统计接口按用户和时间范围扫描
+        db.Index('ix_phone_requests_user_created', 'user_id', 'created_at'),
+    )
+    
     def to_dict(self):
         """将号码请求对象转换为字典"""
         return {
@@ -336,8 +363,13 @@ class SMS(db.Model):
     phone_request_id = db.Column(db.Integer, db.ForeignKey('phone_requests.id'), nullable=False)
     sender = db.Column(db.String(50))
     content = db.Column(db.Text, nullable=False)
+    code = db.Column(db.String(20))  # 提取出的验证码，空字符串表示已提取但没有验证码
     received_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_sms_messages_request_received', 'phone_request_id', 'received_at'),
+    )
+    
     def to_dict(self):
         """将短信对象转换为字典"""
         return {
@@ -345,5 +377,122 @@ class SMS(db.Model):
             'phone_request_id': self.phone_request_id,
             'sender': self.sender,
             'content': self.content,
+            'code': self.code,
             'received_at': self.received_at.isoformat()
-        } 
\ No newline at end of file
+        } 
+
+class SmsDelivery(db.Model):
+    """上游推送的短信记录（按内容哈希去重）"""
+    __tablename__ = 'sms_deliveries'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), unique=True, nullable=False)  # 推送内容的SHA-256，用于幂等
+    provider = db.Column(db.String(50))  # 推送的上游平台
+    request_id = db.Column(db.String(100), index=True)
+    number = db.Column(db.String(20), index=True)
+    sender = db.Column(db.String(50))
+    content = db.Column(db.Text, nullable=False)
+    code = db.Column(db.String(20))  # 提取出的验证码
+    phone_number_id = db.Column(db.Integer, db.ForeignKey('phone_numbers.id'))  # 匹配到的号码，未匹配时为空
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        """将推送记录转换为字典"""
+        return {
+            'id': self.id,
+            'provider': self.provider,
+            'request_id': self.request_id,
+            'number': self.number,
+            'sender': self.sender,
+            'content': self.content,
+            'code': self.code,
+            'phone_number_id': self.phone_number_id,
+            'received_at': self.received_at.isoformat() if self.received_at else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class CodeRule(db.Model):
+    """验证码提取规则（按项目和发送方号码前缀）"""
+    __tablename__ = 'code_rules'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=True)  # 为空表示所有项目
+    sender_prefix = db.Column(db.String(20), nullable=True)  # 发送方号码前缀，例如 106、95588，为空表示所有发送方
+    pattern = db.Column(db.Text, nullable=False)  # 正则，有且只有一个捕获组（验证码）
+    priority = db.Column(db.Integer, default=0)  # 同一范围内数字越小越优先
+    source = db.Column(db.String(20), default='manual')  # manual 手工配置, learned 自动学习
+    support = db.Column(db.Integer, default=0)  # 自动学习时被确认的次数
+    enabled = db.Column(db.Boolean, default=True)  # 删除规则时只停用，以便其他进程增量加载时感知
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    
+    __table_args__ = (
+        db.Index('ix_code_rules_scope', 'project_id', 'sender_prefix'),
+    )
+    
+    def to_dict(self):
+        """将提取规则转换为字典"""
+        return {
+            'id': self.id,
+            'project_id': self.project_id,
+            'sender_prefix': self.sender_prefix,
+            'pattern': self.pattern,
+            'priority': self.priority,
+            'source': self.source,
+            'support': self.support,
+            'enabled': self.enabled,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class JobLease(db.Model):
+    """后台任务租约（多进程部署时保证同一任务只有一个进程在执行）"""
+    __tablename__ = 'job_leases'
+    
+    name = db.Column(db.String(50), primary_key=True)  # 任务名称
+    owner = db.Column(db.String(100), nullable=False)  # 持有者（主机名:进程号:随机串）
+    expires_at = db.Column(db.DateTime, nullable=False)  # 租约到期时间，到期后其他进程可以接管
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        """将租约转换为字典"""
+        return {
+            'name': self.name,
+            'owner': self.owner,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class StatsHourly(db.Model):
+    """按小时汇总的用量统计，由 app.services.rollups 在业务事务中增量维护"""
+    __tablename__ = 'stats_hourly'
+    
+    # 汇总表是派生数据，不加外键，避免增量更新时再去锁用户和项目表
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    project_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    bucket = db.Column(db.DateTime, primary_key=True)  # 取号时间所在的整点
+    numbers = db.Column(db.Integer, nullable=False, default=0)  # 取号数
+    successes = db.Column(db.Integer, nullable=False, default=0)  # 收到验证码的号码数
+    spend = db.Column(db.Float, nullable=False, default=0)  # 消费金额
+    refunds = db.Column(db.Float, nullable=False, default=0)  # 退款金额
+    
+    __table_args__ = (
+        db.Index('ix_stats_hourly_bucket', 'bucket'),
+    )
+
+class StatsDaily(db.Model):
+    """按天汇总的用量统计，由 app.services.rollups 在业务事务中增量维护"""
+    __tablename__ = 'stats_daily'
+    
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    project_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    bucket = db.Column(db.Date, primary_key=True)  # 取号日期
+    numbers = db.Column(db.Integer, nullable=False, default=0)
+    successes = db.Column(db.Integer, nullable=False, default=0)
+    spend = db.Column(db.Float, nullable=False, default=0)
+    refunds = db.Column(db.Float, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.Index('ix_stats_daily_bucket', 'bucket'),
+    )
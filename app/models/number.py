@@ -18,6 +18,8 @@ class PhoneNumber(BaseModel):
     __tablename__ = 'phone_numbers'
     
     request_id = Column(String(50), unique=True, nullable=False, index=True)
+    upstream_request_id = Column(String(100), nullable=True)  # 上游平台的请求ID，查询短信和释放号码时使用
+    provider = Column(String(50), nullable=True)  # 提供该号码的上游平台
     number = Column(String(20), nullable=False, index=True)
     project_id = Column(Integer, ForeignKey('projects.id'))
     user_id = Column(Integer, ForeignKey('users.id'))
@@ -2,6 +2,7 @@ from flask import Blueprint, request, jsonify, current_app
 from datetime import datetime
 from app.models import db, User, Transaction
 from app.utils import token_required, admin_required, SMSApiClient, validate_pagination_params
+from app.services.stats_cache import stats_cache
 
 # 创建蓝图
 account_bp = Blueprint('account', __name__)
@@ -166,6 +167,7 @@ def topup_account():
             reference_id=f'topup-{user.id}-{int(datetime.utcnow().timestamp())}'
         )
         db.session.add(transaction)
+        stats_cache.invalidate_user(user.id)
         db.session.commit()
         
         return jsonify({
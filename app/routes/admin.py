@@ -1,8 +1,15 @@
-from flask import Blueprint, request, jsonify
-from app.models import db, User, Project, PhoneNumber, Transaction, BlacklistedNumber
+from flask import Blueprint, request, jsonify, current_app
+from app.models import db, User, Project, PhoneNumber, Transaction, BlacklistedNumber, CodeRule
+from app.services.code_rules import code_rules, validate_pattern
+from app.services.blacklist_index import blacklist_index, mark_blacklisted
+from app.services.event_bus import event_bus
+from app.services.sms_poller import sms_poller
 from app.utils import token_required, admin_required
-from sqlalchemy import or_, func
+from sqlalchemy import or_, func, insert, select
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
+import re
+import time
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -239,6 +246,197 @@ def admin_delete_number(number_id):
     db.session.commit()
     return jsonify({'message': '号码已删除'})
 
+# 验证码提取规则管理
+@admin_bp.route('/code-rules', methods=['GET'])
+@token_required
+@admin_required
+def admin_get_code_rules():
+    page = int(request.args.get('page', 1))
+    per_page = min(int(request.args.get('per_page', 20)), 100)
+    query = CodeRule.query
+    if request.args.get('project_id'):
+        query = query.filter(CodeRule.project_id == int(request.args['project_id']))
+    if request.args.get('sender_prefix'):
+        query = query.filter(CodeRule.sender_prefix == request.args['sender_prefix'])
+    if request.args.get('source'):
+        query = query.filter(CodeRule.source == request.args['source'])
+    if request.args.get('enabled') in ('true', 'false'):
+        query = query.filter(CodeRule.enabled.is_(request.args['enabled'] == 'true'))
+    pagination = query.order_by(CodeRule.project_id, CodeRule.sender_prefix, CodeRule.priority).paginate(
+        page=page, per_page=per_page, error_out=False)
+    return jsonify({
+        'items': [rule.to_dict() for rule in pagination.items],
+        'total': pagination.total,
+        'pages': pagination.pages,
+        'page': page,
+        'per_page': per_page
+    })
+
+@admin_bp.route('/code-rules', methods=['POST'])
+@token_required
+@admin_required
+def admin_create_code_rule():
+    data = request.get_json() or {}
+    pattern = data.get('pattern')
+    error = validate_pattern(pattern)
+    if error:
+        return jsonify({'message': error}), 400
+    project_id = data.get('project_id')
+    if project_id is not None and not Project.query.get(project_id):
+        return jsonify({'message': '项目不存在'}), 404
+
+    rule = CodeRule(
+        project_id=project_id,
+        sender_prefix=data.get('sender_prefix') or None,
+        pattern=pattern,
+        priority=data.get('priority', 0),
+        source='manual',
+        enabled=data.get('enabled', True)
+    )
+    db.session.add(rule)
+    db.session.commit()
+    code_rules.reload()
+    return jsonify({'message': '规则创建成功', 'rule': rule.to_dict()}), 201
+
+@admin_bp.route('/code-rules/<int:rule_id>', methods=['PUT'])
+@token_required
+@admin_required
+def admin_update_code_rule(rule_id):
+    rule = CodeRule.query.get(rule_id)
+    if not rule:
+        return jsonify({'message': '规则不存在'}), 404
+    data = request.get_json() or {}
+    if 'pattern' in data:
+        error = validate_pattern(data['pattern'])
+        if error:
+            return jsonify({'message': error}), 400
+        rule.pattern = data['pattern']
+    if 'project_id' in data:
+        if data['project_id'] is not None and not Project.query.get(data['project_id']):
+            return jsonify({'message': '项目不存在'}), 404
+        rule.project_id = data['project_id']
+    if 'sender_prefix' in data:
+        rule.sender_prefix = data['sender_prefix'] or None
+    rule.priority = data.get('priority', rule.priority)
+    rule.enabled = data.get('enabled', rule.enabled)
+    db.session.commit()
+    code_rules.reload()
+    return jsonify({'message': '规则已更新', 'rule': rule.to_dict()})
+
+@admin_bp.route('/code-rules/<int:rule_id>', methods=['DELETE'])
+@token_required
+@admin_required
+def admin_delete_code_rule(rule_id):
+    rule = CodeRule.query.get(rule_id)
+    if not rule:
+        return jsonify({'message': '规则不存在'}), 404
+    # 只停用不删除，其他进程按updated_at增量加载时才能感知
+    rule.enabled = False
+    db.session.commit()
+    code_rules.reload()
+    return jsonify({'message': '规则已删除'})
+
+@admin_bp.route('/code-rules/test', methods=['POST'])
+@token_required
+@admin_required
+def admin_test_code_rules():
+    data = request.get_json() or {}
+    content = data.get('content')
+    if not content:
+        return jsonify({'message': '缺少短信内容'}), 400
+    code, rule = code_rules.match(content, project_id=data.get('project_id'), sender=data.get('sender'))
+    return jsonify({'code': code, 'rule': rule})
+
+# 黑名单批量导入
+_NUMBER_RE = re.compile(r'^\+?\d{5,20}$')
+
+@admin_bp.route('/blacklist/import', methods=['POST'])
+@token_required
+@admin_required
+def admin_import_blacklist():
+    """
+    批量导入黑名单号码
+
+    请求参数:
+        JSON: {"numbers": [...], "reason": "原因"}
+        或 multipart 上传文本/CSV文件（字段名 file，每行一个号码，取第一列），reason 放在表单中
+
+    只写入本地黑名单，不逐个调用上游拉黑接口。已在黑名单中的号码跳过，相关号码记录
+    由一条UPDATE统一标记为拉黑。
+    """
+    started = time.monotonic()
+    upload = request.files.get('file')
+    if upload:
+        raw = [line.split(',', 1)[0] for line in upload.read().decode('utf-8-sig', errors='ignore').splitlines()]
+        reason = request.form.get('reason')
+    else:
+        data = request.get_json(silent=True) or {}
+        raw = data.get('numbers')
+        reason = data.get('reason')
+        if not isinstance(raw, list):
+            return jsonify({'message': '请提供号码列表 numbers 或上传文件 file'}), 400
+
+    max_count = current_app.config.get('BLACKLIST_IMPORT_MAX_COUNT', 500000)
+    if len(raw) > max_count:
+        return jsonify({'message': f'单次最多导入 {max_count} 个号码'}), 400
+
+    numbers = []
+    seen = set()
+    invalid = 0
+    duplicates = 0
+    for item in raw:
+        number = str(item).strip().strip('"\'') if item is not None else ''
+        if not number:
+            continue
+        if not _NUMBER_RE.match(number):
+            invalid += 1
+            continue
+        if number in seen:
+            duplicates += 1
+            continue
+        seen.add(number)
+        numbers.append(number)
+
+    # 先把其他进程新增的黑名单合并进索引，再用索引过滤已存在的号码
+    blacklist_index.refresh()
+    new_numbers = blacklist_index.missing(numbers)
+
+    phones = []
+    if new_numbers:
+        blacklisted_table = BlacklistedNumber.__table__
+        now = datetime.utcnow()
+        try:
+            before_id = db.session.query(func.max(BlacklistedNumber.id)).scalar() or 0
+            db.session.execute(insert(blacklisted_table), [
+                {'number': number, 'reason': reason, 'created_at': now} for number in new_numbers
+            ])
+            # 本次新增的号码对应的号码记录，一条UPDATE全部标记为拉黑
+            phones = mark_blacklisted(PhoneNumber.__table__.c.number.in_(
+                select(blacklisted_table.c.number).where(blacklisted_table.c.id > before_id)
+            ))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({'message': '部分号码已被其他请求拉黑，请重新导入'}), 409
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'message': f'导入黑名单失败: {str(e)}'}), 500
+
+        blacklist_index.added(new_numbers)
+        for phone in phones:
+            sms_poller.untrack(phone['request_id'])
+            event_bus.publish(phone['user_id'], 'blacklisted', phone)
+
+    return jsonify({
+        'message': f'黑名单导入完成: 新增 {len(new_numbers)} 个号码',
+        'imported': len(new_numbers),
+        'existing': len(numbers) - len(new_numbers),
+        'invalid': invalid,
+        'duplicates': duplicates,
+        'affected_numbers': len(phones),
+        'elapsed': round(time.monotonic() - started, 3)
+    })
+
 # 通知管理
 from app.routes.notifications import Notification
 
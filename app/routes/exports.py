@@ -0,0 +1,107 @@
+from flask import Blueprint, request, jsonify, send_file
+from app.utils import token_required
+from app.services.export_jobs import export_jobs
+import os
+
+# 创建蓝图
+exports_bp = Blueprint('exports', __name__)
+
+# 注册到应用时创建导出目录并启动清理线程
+exports_bp.record_once(lambda state: export_jobs.init_app(state.app))
+
+
+def job_response(job):
+    """任务状态，已完成的附带下载地址"""
+    job = dict(job)
+    job.pop('params', None)
+    if job['status'] == 'completed':
+        job['download_url'] = f"{request.url_root}api/exports/{job['job_id']}/download?token={request.args.get('token', '')}"
+    return job
+
+
+def get_own_job(job_id):
+    """查询当前用户的任务，不存在或不属于当前用户时返回None"""
+    job = export_jobs.get(job_id)
+    if job is None or job['user_id'] != request.user_id:
+        return None
+    return job
+
+
+@exports_bp.route('', methods=['GET'])
+@token_required
+def list_export_jobs():
+    """
+    列出我的导出任务
+
+    返回:
+        成功: {'jobs': [任务状态]}
+    """
+    return jsonify({'jobs': [job_response(job) for job in export_jobs.list(request.user_id)]}), 200
+
+
+@exports_bp.route('/<job_id>', methods=['GET'])
+@token_required
+def get_export_job(job_id):
+    """
+    查询导出任务进度
+
+    返回:
+        成功: {'job': 任务状态}，完成后包含 download_url
+        失败: {'message': '错误信息'}, 错误状态码
+    """
+    job = get_own_job(job_id)
+    if job is None:
+        return jsonify({'message': '导出任务不存在'}), 404
+    return jsonify({'job': job_response(job)}), 200
+
+
+@exports_bp.route('/<job_id>', methods=['DELETE'])
+@exports_bp.route('/<job_id>/cancel', methods=['POST'])
+@token_required
+def cancel_export_job(job_id):
+    """
+    取消导出任务
+
+    返回:
+        成功: {'message': '已请求取消导出任务', 'job': 任务状态}
+        失败: {'message': '错误信息'}, 错误状态码
+    """
+    if get_own_job(job_id) is None:
+        return jsonify({'message': '导出任务不存在'}), 404
+    job = export_jobs.cancel(job_id)
+    if job['status'] in ('completed', 'failed'):
+        return jsonify({'message': '导出任务已结束，无法取消', 'job': job_response(job)}), 400
+    return jsonify({'message': '已请求取消导出任务', 'job': job_response(job)}), 200
+
+
+@exports_bp.route('/<job_id>/download', methods=['GET'])
+@token_required
+def download_export(job_id):
+    """
+    下载导出文件，支持Range请求断点续传
+
+    返回:
+        成功: 文件内容（200或206）
+        失败: {'message': '错误信息'}, 错误状态码
+    """
+    job = get_own_job(job_id)
+    if job is None:
+        return jsonify({'message': '导出任务不存在'}), 404
+    if job['status'] != 'completed':
+        return jsonify({'message': f"导出任务尚未完成，当前状态: {job['status']}"}), 409
+
+    path = export_jobs.file_path(job_id)
+    if not os.path.exists(path):
+        return jsonify({'message': '导出文件已过期，请重新导出'}), 410
+
+    # conditional=True 时由werkzeug处理Range/If-Range/ETag，返回206分段内容
+    response = send_file(
+        path,
+        mimetype=job['mimetype'],
+        as_attachment=True,
+        download_name=job['filename'],
+        conditional=True,
+        max_age=0
+    )
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
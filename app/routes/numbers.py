@@ -1,53 +1,46 @@
-from flask import Blueprint, request, jsonify, current_app, send_file
+from flask import Blueprint, request, jsonify, current_app, send_file, Response, stream_with_context
 from datetime import datetime, timedelta
 from app.models import db, PhoneNumber, Project, User, BlacklistedNumber, Transaction, PhoneRequest, SMS
 from app.utils import token_required, admin_required, SMSApiClient, calculate_price, validate_pagination_params
-from sqlalchemy import desc, func
+from app.services.number_pool import number_pool
+from app.services.provider_router import provider_router
+from app.services.sms_waiter import sms_waiter
+from app.services.event_bus import event_bus, publish_number_event
+from app.services.sms_poller import sms_poller
+from app.services.code_rules import code_rules
+from app.services.expiry_sweeper import expiry_sweeper
+from app.services.blacklist_index import blacklist_index, mark_blacklisted
+from app.services.number_export import (
+    EXPORT_FORMATS, number_export_query, iter_number_rows, encode_rows, export_filename, export_mimetype
+)
+from app.services.export_jobs import export_jobs, ExportJobLimitError
+from app.services.billing import debit_balance, InsufficientBalanceError
+from app.services.rollups import record_codes
+from app.services.resilience import CircuitOpenError, circuit_open_response, upstream_deadline
+from sqlalchemy import desc, func, insert, update, and_, bindparam
+from sqlalchemy.exc import IntegrityError
 import uuid
+import time
 import random
 import string
 import os
-import csv
 import json
-import io
-import pandas as pd
 import re
 
-# 定义验证码提取函数
-def extract_verification_code(content):
-    """
-    从短信内容中提取验证码
-    
-    参数:
-        content: 短信内容
-        
-    返回:
-        提取出的验证码，如果未找到则返回空字符串
-    """
-    # 常见的验证码模式
-    patterns = [
-        r'验证码[是为:]?\s*([0-9]{4,6})',  # 验证码是123456
-        r'code[: ]([0-9]{4,6})',  # code: 123456
-        r'码[是为:]?\s*([0-9]{4,6})',  # 码是123456
-        r'[验证认证校验].*?([0-9]{4,6})',  # 您的验证码123456
-        r'([0-9]{4,6})[^0-9]*验证',  # 123456是您的验证码
-        r'([0-9]{6})',  # 直接匹配6位数字
-        r'([0-9]{4})'   # 直接匹配4位数字
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, content)
-        if match:
-            return match.group(1)
-    
-    return ""
-
 # 创建蓝图
 numbers_bp = Blueprint('numbers', __name__)
 
+# 注册到应用时启动号码超时清理
+numbers_bp.record_once(lambda state: expiry_sweeper.init_app(state.app))
+# 映射黑名单索引
+numbers_bp.record_once(lambda state: blacklist_index.init_app(state.app))
+# 上游熔断时返回503并带Retry-After
+numbers_bp.record_once(lambda state: state.app.register_error_handler(CircuitOpenError, circuit_open_response))
+
 
 @numbers_bp.route('/get', methods=['GET', 'POST'])
 @token_required
+@upstream_deadline
 def get_phone_number():
     """
     取号（获取手机号）
@@ -81,7 +74,7 @@ def get_phone_number():
     # 查询用户
     user = User.query.get(request.user_id)
     
-    # 检查余额
+    # 预检查余额（快速失败，实际扣费由条件UPDATE原子完成）
     if user.balance < project.price:
         return jsonify({'message': f'余额不足，当前余额: {user.balance}，需要: {project.price}'}), 400
     
@@ -90,8 +83,10 @@ def get_phone_number():
     
     # 尝试连接SMS API获取手机号
     try:
-        api_client = SMSApiClient()
-        api_result = api_client.get_phone_number(project_code)
+        # 按项目选择上游平台，成本价高于售价的平台不参与
+        api_client = provider_router.client(max_cost=project.price)
+        # 优先从预热的号码池出池，池为空时回退到上游取号
+        api_result = number_pool.acquire(project_code, api_client)
         
         # 如果使用模拟API或者成功获取号码
         if api_client.use_mock or api_result.get('success', False):
@@ -107,30 +102,29 @@ def get_phone_number():
             new_phone.project_id = project.id
             new_phone.user_id = user.id
             new_phone.request_id = request_id
+            new_phone.upstream_request_id = (api_result.get('phone_number') or {}).get('request_id')
+            new_phone.provider = api_result.get('provider')
             new_phone.created_at = datetime.utcnow()
             new_phone.updated_at = datetime.utcnow()
             
             db.session.add(new_phone)
             
-            # 创建消费记录
-            transaction = Transaction(
-                user_id=user.id,
-                amount=-project.price,
-                balance=user.balance - project.price,
-                type='consume',
-                description=f'获取项目{project.name}的手机号码',
-                reference_id=request_id
-            )
-            
-            db.session.add(transaction)
-            
-            # 扣除余额
-            user.balance -= project.price
+            # 原子扣费并创建消费记录
+            try:
+                debit_balance(user.id, project.price, f'获取项目{project.name}的手机号码', request_id,
+                              project_id=project.id, quantity=1, at=new_phone.created_at)
+            except InsufficientBalanceError:
+                db.session.rollback()
+                # 号码未售出，放回号码池
+                number_pool.restock(project_code, [api_result])
+                return jsonify({'message': f'余额不足，需要: {project.price}'}), 400
             
             db.session.commit()
             
             # 查询添加的记录并返回
             phone = PhoneNumber.query.filter_by(request_id=request_id).first()
+            # 交给后台轮询器查询验证码
+            sms_poller.track(phone)
             
             return jsonify({
                 'message': '获取号码成功',
@@ -140,6 +134,10 @@ def get_phone_number():
         else:
             return jsonify({'message': f'无法获取手机号: {api_result.get("message", "未知错误")}'}), 400
             
+    except CircuitOpenError:
+        # 交给全局错误处理器返回503
+        db.session.rollback()
+        raise
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': f'处理号码失败: {str(e)}'}), 500
@@ -147,6 +145,7 @@ def get_phone_number():
 
 @numbers_bp.route('/get-specific', methods=['GET', 'POST'])
 @token_required
+@upstream_deadline
 def get_specific_phone_number():
     """
     指定取号（获取指定手机号）
@@ -183,12 +182,12 @@ def get_specific_phone_number():
     # 查询用户
     user = User.query.get(request.user_id)
     
-    # 检查余额
+    # 预检查余额（快速失败，实际扣费由条件UPDATE原子完成）
     if user.balance < project.price:
         return jsonify({'message': f'余额不足，当前余额: {user.balance}，需要: {project.price}'}), 400
     
-    # 检查号码是否在黑名单中
-    if BlacklistedNumber.query.filter_by(number=number).first():
+    # 检查号码是否在黑名单中（查内存映射的索引，不访问数据库）
+    if blacklist_index.contains(number):
         return jsonify({'message': f'号码 {number} 已被拉黑'}), 400
     
     # 检查号码是否已被他人使用
@@ -200,7 +199,7 @@ def get_specific_phone_number():
     
     # 尝试通过SMS API获取指定号码
     try:
-        api_client = SMSApiClient()
+        api_client = provider_router.client(max_cost=project.price)
         api_result = api_client.get_specific_phone_number(project_code, number)
         
         # 如果使用模拟API或者成功获取号码
@@ -213,30 +212,30 @@ def get_specific_phone_number():
             new_phone.project_id = project.id
             new_phone.user_id = user.id
             new_phone.request_id = request_id
+            new_phone.upstream_request_id = (api_result.get('phone_number') or {}).get('request_id')
+            new_phone.provider = api_result.get('provider')
             new_phone.created_at = datetime.utcnow()
             new_phone.updated_at = datetime.utcnow()
             
             db.session.add(new_phone)
             
-            # 创建消费记录
-            transaction = Transaction(
-                user_id=user.id,
-                amount=-project.price,
-                balance=user.balance - project.price,
-                type='consume',
-                description=f'获取项目{project.name}的指定手机号码',
-                reference_id=request_id
-            )
-            
-            db.session.add(transaction)
-            
-            # 扣除余额
-            user.balance -= project.price
+            # 原子扣费并创建消费记录
+            try:
+                debit_balance(user.id, project.price, f'获取项目{project.name}的指定手机号码', request_id,
+                              project_id=project.id, quantity=1, at=new_phone.created_at)
+            except InsufficientBalanceError:
+                db.session.rollback()
+                # 号码未售出，还给上游
+                if new_phone.upstream_request_id:
+                    api_client.release_phone_number(new_phone.upstream_request_id, provider=api_result.get('provider'))
+                return jsonify({'message': f'余额不足，需要: {project.price}'}), 400
             
             db.session.commit()
             
             # 查询添加的记录并返回
             phone = PhoneNumber.query.filter_by(request_id=request_id).first()
+            # 交给后台轮询器查询验证码
+            sms_poller.track(phone)
             
             return jsonify({
                 'message': '获取号码成功',
@@ -246,6 +245,10 @@ def get_specific_phone_number():
         else:
             return jsonify({'message': f'无法获取指定号码: {api_result.get("message", "未知错误")}'}), 400
             
+    except CircuitOpenError:
+        # 交给全局错误处理器返回503
+        db.session.rollback()
+        raise
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': f'处理号码失败: {str(e)}'}), 500
@@ -253,17 +256,25 @@ def get_specific_phone_number():
 
 @numbers_bp.route('/sms/<request_id>', methods=['GET', 'POST'])
 @token_required
+@upstream_deadline
 def get_sms_code(request_id):
     """
     获取短信验证码
     
     请求参数:
         request_id: 请求ID
+        wait: 最长等待秒数（可选），验证码到达或超时后返回，不传则立即返回
     
     返回:
         成功: {'message': '获取验证码成功', 'code': 验证码, 'phone_number': 号码信息}
         失败: {'message': '错误信息'}, 错误状态码
     """
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        return jsonify({'message': 'wait参数必须是数字'}), 400
+    wait = min(max(wait, 0), current_app.config.get('SMS_WAIT_MAX_SECONDS', 30))
+    
     # 查询号码
     phone = PhoneNumber.query.filter_by(
         request_id=request_id, 
@@ -281,45 +292,151 @@ def get_sms_code(request_id):
     
     # 如果已有验证码，直接返回
     if phone.sms_code:
-        return jsonify({
-            'message': '获取验证码成功',
-            'code': phone.sms_code,
-            'phone_number': phone.to_dict()
-        }), 200
+        return sms_code_response(phone)
+    
+    # 后台轮询器正在跟踪该号码时只做本地查询
+    if sms_poller.is_tracking(request_id):
+        if wait > 0:
+            phone_id = phone.id
+            db.session.close()
+            sms_waiter.wait(request_id, None, wait)
+            phone = PhoneNumber.query.get(phone_id)
+        return sms_code_response(phone, '暂未收到短信')
     
     # 尝试通过SMS API获取验证码
     try:
-        api_client = SMSApiClient()
-        api_result = api_client.get_sms_code(request_id)
+        api_client = provider_router.client()
+        provider = phone.provider
+        upstream_id = phone.upstream_id
+        if wait > 0:
+            # 长轮询：同一请求ID的等待者共享一个上游轮询，等待期间不占用数据库连接
+            phone_id = phone.id
+            db.session.close()
+            api_result = sms_waiter.wait(
+                request_id,
+                lambda: api_client.get_sms_code(upstream_id, provider=provider),
+                wait,
+                current_app.config.get('SMS_WAIT_POLL_INTERVAL', 2)
+            )
+            phone = PhoneNumber.query.get(phone_id)
+            # 等待期间其他请求可能已经保存了验证码
+            if phone.sms_code:
+                return sms_code_response(phone)
+        else:
+            api_result = api_client.get_sms_code(upstream_id, provider=provider)
         
         # 如果使用模拟API或者成功获取验证码
         if api_client.use_mock or api_result.get('success', False):
             # 从API结果中获取验证码，如果未找到则生成随机验证码
             sms_code = api_result.get('code') if api_result.get('code') else ''.join(random.choices(string.digits, k=6))
             
+            # 第一次写入验证码时计入收码统计
+            if phone.sms_code is None:
+                record_codes([phone.id])
+            
             # 更新号码状态和验证码
             phone.status = 'used'
             phone.sms_code = sms_code
             phone.updated_at = datetime.utcnow()
             
             db.session.commit()
+            publish_number_event(phone, 'sms', code=sms_code)
             
-            return jsonify({
-                'message': '获取验证码成功',
-                'code': sms_code,
-                'phone_number': phone.to_dict(),
-                'release_url': f"{request.url_root}api/numbers/release/{request_id}?token={request.args.get('token', '')}"
-            }), 200
+            return sms_code_response(phone)
         else:
-            return jsonify({'message': f'无法获取验证码: {api_result.get("message", "未知错误")}'}), 400
+            return sms_code_response(phone, api_result.get("message", "未知错误"))
             
+    except CircuitOpenError:
+        # 交给全局错误处理器返回503
+        db.session.rollback()
+        raise
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': f'获取验证码失败: {str(e)}'}), 500
 
 
+def sms_code_response(phone, reason=None):
+    """
+    获取验证码接口的响应，立即查询和长轮询（wait）共用
+
+    号码已有验证码时返回200，否则返回400和原因；两种情况都带释放号码的链接。
+    """
+    release_url = f"{request.url_root}api/numbers/release/{phone.request_id}?token={request.args.get('token', '')}"
+    if phone.sms_code:
+        return jsonify({
+            'message': '获取验证码成功',
+            'code': phone.sms_code,
+            'phone_number': phone.to_dict(),
+            'release_url': release_url
+        }), 200
+    return jsonify({
+        'message': f'无法获取验证码: {reason or "暂未收到短信"}',
+        'release_url': release_url
+    }), 400
+
+
+@numbers_bp.route('/stream', methods=['GET'])
+@token_required
+def stream_events():
+    """
+    以Server-Sent Events推送当前用户的号码事件
+    
+    事件类型:
+        sms: 收到验证码
+        released / expired / blacklisted: 号码状态变化
+        resync: 部分事件已丢失，客户端应重新查询号码状态
+    
+    请求参数:
+        token: 认证令牌（EventSource无法设置请求头，通过URL传递）
+        last_event_id: 断线重连时最后收到的事件ID（也可通过Last-Event-ID请求头传递）
+    """
+    user_id = request.user_id
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or None
+    
+    heartbeat = current_app.config.get('SSE_HEARTBEAT_SECONDS', 15)
+    max_duration = current_app.config.get('SSE_MAX_DURATION', 600)
+    subscription, resync = event_bus.subscribe(
+        user_id,
+        last_event_id,
+        current_app.config.get('SSE_BUFFER_SIZE', 100)
+    )
+    # 订阅期间不占用数据库连接
+    db.session.remove()
+    
+    def generate():
+        try:
+            # 提示客户端断线后的重连间隔
+            yield f"retry: {current_app.config.get('SSE_RETRY_MS', 3000)}\n\n"
+            if resync:
+                yield "event: resync\ndata: {}\n\n"
+            
+            expires_at = time.monotonic() + max_duration
+            while time.monotonic() < expires_at:
+                event = subscription.get(heartbeat)
+                if event is not None:
+                    yield f"id: {event.id}\nevent: {event.type}\ndata: {json.dumps(event.data, ensure_ascii=False)}\n\n"
+                elif subscription.closed:
+                    if subscription.close_reason == 'overflow':
+                        yield "event: resync\ndata: {}\n\n"
+                    break
+                else:
+                    yield ": heartbeat\n\n"
+        finally:
+            event_bus.unsubscribe(subscription)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+
 @numbers_bp.route('/release/<request_id>', methods=['GET', 'POST'])
 @token_required
+@upstream_deadline
 def release_phone_number(request_id):
     """
     释放号码
@@ -343,13 +460,13 @@ def release_phone_number(request_id):
             'help': f'请检查请求ID {request_id} 是否正确, 并确认是您的号码'
         }), 404
     
-    if phone.status == 'released':
+    if phone.status in ('released', 'expired'):
         return jsonify({'message': '号码已释放', 'phone_number': phone.to_dict()}), 200
     
     # 尝试通过SMS API释放号码
     try:
-        api_client = SMSApiClient()
-        api_result = api_client.release_phone_number(request_id)
+        api_client = provider_router.client()
+        api_result = api_client.release_phone_number(phone.upstream_id, provider=phone.provider)
         
         # 如果使用模拟API或者成功释放号码
         if api_client.use_mock or api_result.get('success', False):
@@ -359,6 +476,8 @@ def release_phone_number(request_id):
             phone.updated_at = datetime.utcnow()
             
             db.session.commit()
+            sms_poller.untrack(request_id)
+            publish_number_event(phone, 'released')
             
             return jsonify({
                 'message': '号码释放成功',
@@ -367,6 +486,10 @@ def release_phone_number(request_id):
         else:
             return jsonify({'message': f'无法释放号码: {api_result.get("message", "未知错误")}'}), 400
             
+    except CircuitOpenError:
+        # 交给全局错误处理器返回503
+        db.session.rollback()
+        raise
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': f'释放号码失败: {str(e)}'}), 500
@@ -374,6 +497,7 @@ def release_phone_number(request_id):
 
 @numbers_bp.route('/blacklist', methods=['GET', 'POST'])
 @token_required
+@upstream_deadline
 def blacklist_number():
     """
     拉黑号码
@@ -403,10 +527,11 @@ def blacklist_number():
         }), 400
     
     # 检查号码是否已在黑名单中
-    existing = BlacklistedNumber.query.filter_by(number=number).first()
-    if existing:
-        # 返回200而不是400，并显示成功消息
-        return jsonify({'message': f'号码 {number} 已在黑名单中', 'blacklisted_number': existing.to_dict()}), 200
+    if blacklist_index.contains(number):
+        existing = BlacklistedNumber.query.filter_by(number=number).first()
+        if existing:
+            # 返回200而不是400，并显示成功消息
+            return jsonify({'message': f'号码 {number} 已在黑名单中', 'blacklisted_number': existing.to_dict()}), 200
     
     # 尝试通过SMS API拉黑号码
     try:
@@ -424,13 +549,21 @@ def blacklist_number():
             
             db.session.add(blacklisted)
             
-            # 更新相关的号码记录状态
-            phones = PhoneNumber.query.filter_by(number=number).all()
-            for phone in phones:
-                phone.status = 'blacklisted'
-                phone.updated_at = datetime.utcnow()
+            # 一条UPDATE修改相关号码记录的状态
+            phones = mark_blacklisted(PhoneNumber.__table__.c.number == number)
             
-            db.session.commit()
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # 并发请求已先拉黑了该号码
+                db.session.rollback()
+                existing = BlacklistedNumber.query.filter_by(number=number).first()
+                return jsonify({'message': f'号码 {number} 已在黑名单中', 'blacklisted_number': existing.to_dict()}), 200
+            
+            blacklist_index.added([number])
+            for phone in phones:
+                sms_poller.untrack(phone['request_id'])
+                event_bus.publish(phone['user_id'], 'blacklisted', phone)
             
             return jsonify({
                 'message': '号码已加入黑名单',
@@ -439,6 +572,10 @@ def blacklist_number():
         else:
             return jsonify({'message': f'无法拉黑号码: {api_result.get("message", "未知错误")}'}), 400
             
+    except CircuitOpenError:
+        # 交给全局错误处理器返回503
+        db.session.rollback()
+        raise
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': f'拉黑号码失败: {str(e)}'}), 500
@@ -510,16 +647,19 @@ def get_my_numbers():
 
 @numbers_bp.route('/batch-get', methods=['GET', 'POST'])
 @token_required
+@upstream_deadline
 def batch_get_numbers():
     """
     批量取号（批量获取手机号）
     
     请求参数:
         project_code: 项目代码
-        count: 需要获取的号码数量(1-10)
+        count: 需要获取的号码数量(1-BATCH_GET_MAX_COUNT)
+    
+    上游取号并发进行，只保留并扣费实际获取到的号码，失败的部分不扣费。
     
     返回:
-        成功: {'message': '批量获取号码成功', 'phone_numbers': 号码列表}
+        成功: {'message': '批量获取号码成功', 'phone_numbers': 号码列表, 'failed': 失败列表}
         失败: {'message': '错误信息'}, 错误状态码
     """
     # 支持GET和POST请求
@@ -531,6 +671,7 @@ def batch_get_numbers():
     # 获取项目代码和数量
     project_code = args.get('project_code')
     count = args.get('count', 1)
+    max_count = current_app.config.get('BATCH_GET_MAX_COUNT', 50)
     
     # 验证参数
     if not project_code:
@@ -541,8 +682,8 @@ def batch_get_numbers():
     
     try:
         count = int(count)
-        if count < 1 or count > 10:
-            return jsonify({'message': '数量必须在1-10之间'}), 400
+        if count < 1 or count > max_count:
+            return jsonify({'message': f'数量必须在1-{max_count}之间'}), 400
     except ValueError:
         return jsonify({'message': '数量必须是整数'}), 400
     
@@ -557,67 +698,72 @@ def batch_get_numbers():
     # 计算总价
     total_price = project.price * count
     
-    # 检查余额
+    # 预检查余额（快速失败，实际扣费由条件UPDATE原子完成）
     if user.balance < total_price:
         return jsonify({'message': f'余额不足，当前余额: {user.balance}，需要: {total_price}'}), 400
     
-    # 批量获取号码
-    phone_numbers = []
-    request_ids = []
-    
     try:
-        api_client = SMSApiClient()
+        api_client = provider_router.client(max_cost=project.price)
         
-        for _ in range(count):
-            # 生成请求ID
-            request_id = f"req_{uuid.uuid4().hex[:8]}"
-            request_ids.append(request_id)
-            
-            # 获取手机号
-            api_result = api_client.get_phone_number(project_code)
-            
-            # 如果使用模拟API或者成功获取号码
+        # 先从号码池出池，不足部分并发向上游获取
+        api_results = number_pool.acquire_many(project_code, count, api_client)
+        
+        # 收集成功获取的号码，失败的部分不扣费
+        now = datetime.utcnow()
+        rows = []
+        failed = []
+        for index, api_result in enumerate(api_results):
             if api_client.use_mock or api_result.get('success', False):
                 # 从API结果中获取号码，如果未找到则生成模拟号码
                 phone_data = api_result.get('phone_number', {})
                 phone_number = phone_data.get('number') if phone_data else f"138{random.randint(10000000, 99999999)}"
-                
-                # 创建手机号记录
-                new_phone = PhoneNumber()
-                new_phone.number = phone_number
-                new_phone.status = 'available'
-                new_phone.project_id = project.id
-                new_phone.user_id = user.id
-                new_phone.request_id = request_id
-                new_phone.created_at = datetime.utcnow()
-                new_phone.updated_at = datetime.utcnow()
-                
-                db.session.add(new_phone)
-                
-                # 保存到结果列表
-                phone_numbers.append(new_phone)
+                rows.append({
+                    'number': phone_number,
+                    'status': 'available',
+                    'project_id': project.id,
+                    'user_id': user.id,
+                    'request_id': f"req_{uuid.uuid4().hex[:8]}",
+                    'upstream_request_id': phone_data.get('request_id') if phone_data else None,
+                    'provider': api_result.get('provider'),
+                    'created_at': now,
+                    'updated_at': now
+                })
             else:
-                # 回滚已添加的记录
-                db.session.rollback()
-                return jsonify({'message': f'获取第 {len(phone_numbers)+1} 个号码失败: {api_result.get("message", "未知错误")}'}), 400
+                failed.append({
+                    'index': index,
+                    'reason': api_result.get('message', '未知错误')
+                })
         
-        # 创建消费记录
-        transaction = Transaction(
-            user_id=user.id,
-            amount=-total_price,
-            balance=user.balance - total_price,
-            type='consume',
-            description=f'批量获取{count}个项目{project.name}的手机号码',
-            reference_id=','.join(request_ids)
-        )
+        if not rows:
+            # 全部因熔断失败时按上游不可用处理
+            retry_after = [r.get('retry_after') for r in api_results if r.get('retry_after')]
+            if len(retry_after) == len(api_results):
+                raise CircuitOpenError(project_code, max(retry_after))
+            reason = failed[0]['reason'] if failed else '未知错误'
+            return jsonify({'message': f'批量获取号码失败: {reason}', 'failed': failed}), 400
         
-        db.session.add(transaction)
+        request_ids = [row['request_id'] for row in rows]
+        obtained_price = project.price * len(rows)
         
-        # 扣除余额
-        user.balance -= total_price
+        # 一次批量插入所有号码记录
+        db.session.execute(insert(PhoneNumber), rows)
+        
+        # 原子扣费并创建消费记录（只按实际获取到的数量计费）
+        try:
+            debit_balance(user.id, obtained_price, f'批量获取{len(rows)}个项目{project.name}的手机号码', ','.join(request_ids),
+                          project_id=project.id, quantity=len(rows), at=now)
+        except InsufficientBalanceError:
+            db.session.rollback()
+            # 号码未售出，放回号码池
+            number_pool.restock(project_code, api_results)
+            return jsonify({'message': f'余额不足，需要: {obtained_price}'}), 400
         
         db.session.commit()
         
+        # 查询添加的记录并返回
+        phone_numbers = PhoneNumber.query.filter(PhoneNumber.request_id.in_(request_ids)).all()
+        sms_poller.track_many(phone_numbers)
+        
         # 构建响应数据
         response_data = []
         for phone in phone_numbers:
@@ -628,13 +774,24 @@ def batch_get_numbers():
         # 构建批量操作链接
         batch_release_url = f"{request.url_root}api/numbers/batch-release?token={args.get('token', '')}&request_ids={','.join(request_ids)}"
         
+        message = '批量获取号码成功'
+        if failed:
+            message = f'批量获取号码部分成功: {len(rows)}个成功, {len(failed)}个失败（失败部分未扣费）'
+        
         return jsonify({
-            'message': '批量获取号码成功',
+            'message': message,
             'phone_numbers': response_data,
-            'count': len(phone_numbers),
+            'count': len(rows),
+            'requested': count,
+            'charged': obtained_price,
+            'failed': failed,
             'batch_release_url': batch_release_url
         }), 200
         
+    except CircuitOpenError:
+        # 交给全局错误处理器返回503
+        db.session.rollback()
+        raise
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': f'批量获取号码失败: {str(e)}'}), 500
@@ -642,104 +799,149 @@ def batch_get_numbers():
 
 @numbers_bp.route('/batch-release', methods=['GET', 'POST'])
 @token_required
+@upstream_deadline
 def batch_release_numbers():
     """
     批量释放号码
     
     请求参数:
-        request_ids: 请求ID列表，用逗号分隔
+        request_ids: 请求ID列表，POST JSON请求体中的列表（最多BATCH_RELEASE_MAX_COUNT个），
+                     或逗号分隔的字符串（GET查询参数最多BATCH_RELEASE_QUERY_MAX_COUNT个）
     
     返回:
-        成功: {'message': '批量释放号码成功', 'released': 释放成功的数量}
+        成功: {'message': '批量释放号码完成...', 'released': 释放成功的数量, 'failed': 失败数量,
+               'details': 每个请求ID的结果}
         失败: {'message': '错误信息'}, 错误状态码
     """
     # 支持GET和POST请求
     if request.method == 'GET':
         args = request.args
+        max_count = current_app.config.get('BATCH_RELEASE_QUERY_MAX_COUNT', 100)
     else:
         args = request.json or {}
+        max_count = current_app.config.get('BATCH_RELEASE_MAX_COUNT', 5000)
     
     # 获取请求ID列表
-    request_ids_str = args.get('request_ids')
-    if not request_ids_str:
+    raw_ids = args.get('request_ids')
+    if not raw_ids:
         return jsonify({
             'message': '请提供请求ID列表',
-            'help': '示例请求: /api/numbers/batch-release?token=您的令牌&request_ids=req_12345abc,req_67890def'
+            'help': '示例请求: POST /api/numbers/batch-release {"token": "您的令牌", "request_ids": ["req_12345abc", "req_67890def"]}'
         }), 400
     
-    # 分割ID列表
-    request_ids = [id.strip() for id in request_ids_str.split(',') if id.strip()]
+    # 分割ID列表（去重并保持顺序）
+    if isinstance(raw_ids, str):
+        raw_ids = raw_ids.split(',')
+    request_ids = list(dict.fromkeys(str(req_id).strip() for req_id in raw_ids if str(req_id).strip()))
     if not request_ids:
         return jsonify({'message': '无效的请求ID列表'}), 400
+    if len(request_ids) > max_count:
+        return jsonify({'message': f'一次最多释放{max_count}个号码，更多号码请使用POST请求体提交'}), 400
     
-    # 查询用户
     user_id = request.user_id
+    releasable = ('available', 'used')
     
-    # 查询要释放的号码
-    phones_to_release = PhoneNumber.query.filter(
+    # 一次查询取出要释放的号码
+    phones = db.session.query(
+        PhoneNumber.id, PhoneNumber.request_id, PhoneNumber.upstream_request_id, PhoneNumber.number,
+        PhoneNumber.provider, PhoneNumber.project_id
+    ).filter(
         PhoneNumber.request_id.in_(request_ids),
         PhoneNumber.user_id == user_id,
-        PhoneNumber.status.in_(['available', 'used'])
+        PhoneNumber.status.in_(releasable)
     ).all()
     
-    if not phones_to_release:
+    if not phones:
         return jsonify({'message': '未找到可释放的号码'}), 404
     
-    # 初始化API客户端
-    api_client = SMSApiClient()
+    # 并发向上游释放
+    api_client = provider_router.client()
+    if api_client.use_mock:
+        upstream = [{'success': True}] * len(phones)
+    else:
+        upstream = api_client.release_phone_numbers(
+            [(phone.upstream_request_id or phone.request_id, phone.provider) for phone in phones]
+        )
     
-    # 记录释放结果
-    release_results = {
-        'success': 0,
-        'failed': 0,
-        'details': []
-    }
+    outcomes = {}
+    to_release = []
+    for phone, result in zip(phones, upstream):
+        if result.get('success', False):
+            to_release.append(phone)
+        else:
+            outcomes[phone.request_id] = {
+                'request_id': phone.request_id,
+                'number': phone.number,
+                'status': 'failed',
+                'reason': result.get('message') or '调用API释放失败'
+            }
     
-    # 批量释放号码
-    for phone in phones_to_release:
+    # 一条UPDATE修改整批号码的状态（不支持 RETURNING 时逐个修改）
+    released_ids = set()
+    if to_release:
+        now = datetime.utcnow()
+        phones_table = PhoneNumber.__table__
+        releasable_now = (phones_table.c.user_id == user_id, phones_table.c.status.in_(releasable))
+        values = dict(status='released', released_at=now, updated_at=now)
         try:
-            # 调用API释放号码
-            if api_client.use_mock or api_client.release_phone_number(phone.request_id).get('success', False):
-                # 更新号码状态
-                phone.status = 'released'
-                phone.released_at = datetime.utcnow()
-                phone.updated_at = datetime.utcnow()
-                
-                release_results['success'] += 1
-                release_results['details'].append({
-                    'request_id': phone.request_id,
-                    'number': phone.number,
-                    'status': 'success'
-                })
+            if getattr(db.session.get_bind().dialect, 'update_returning', False):
+                stmt = (update(phones_table)
+                    .where(phones_table.c.id.in_([phone.id for phone in to_release]), *releasable_now)
+                    .values(**values))
+                released_ids = {row[0] for row in db.session.execute(stmt.returning(phones_table.c.request_id))}
             else:
-                release_results['failed'] += 1
-                release_results['details'].append({
-                    'request_id': phone.request_id,
-                    'number': phone.number,
-                    'status': 'failed',
-                    'reason': '调用API释放失败'
-                })
+                # 不支持 RETURNING 时逐个条件更新，按影响行数判断是否释放成功
+                for phone in to_release:
+                    result = db.session.execute(
+                        update(phones_table).where(phones_table.c.id == phone.id, *releasable_now).values(**values)
+                    )
+                    if result.rowcount:
+                        released_ids.add(phone.request_id)
+            db.session.commit()
         except Exception as e:
-            release_results['failed'] += 1
-            release_results['details'].append({
+            db.session.rollback()
+            return jsonify({'message': f'批量释放号码失败: {str(e)}'}), 500
+    
+    for phone in to_release:
+        if phone.request_id in released_ids:
+            outcomes[phone.request_id] = {
                 'request_id': phone.request_id,
                 'number': phone.number,
-                'status': 'failed',
-                'reason': str(e)
+                'status': 'success'
+            }
+            sms_poller.untrack(phone.request_id)
+            event_bus.publish(user_id, 'released', {
+                'request_id': phone.request_id,
+                'number': phone.number,
+                'status': 'released',
+                'project_id': phone.project_id
             })
+        else:
+            # 上游释放成功后号码状态已被其他请求修改
+            outcomes[phone.request_id] = {
+                'request_id': phone.request_id,
+                'number': phone.number,
+                'status': 'failed',
+                'reason': '号码状态已变化'
+            }
     
-    # 提交数据库事务
-    try:
-        db.session.commit()
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'message': f'批量释放号码失败: {str(e)}'}), 500
+    details = [
+        outcomes.get(request_id) or {
+            'request_id': request_id,
+            'status': 'not_found',
+            'reason': '未找到可释放的号码'
+        }
+        for request_id in request_ids
+    ]
+    released = len(released_ids)
+    failed = sum(1 for item in details if item['status'] == 'failed')
     
     return jsonify({
-        'message': f'批量释放号码完成: {release_results["success"]}个成功, {release_results["failed"]}个失败',
-        'released': release_results['success'],
-        'failed': release_results['failed'],
-        'details': release_results['details']
+        'message': f'批量释放号码完成: {released}个成功, {failed}个失败',
+        'released': released,
+        'failed': failed,
+        'not_found': len(details) - released - failed,
+        'details': details
     }), 200
 
 
@@ -747,16 +949,19 @@ def batch_release_numbers():
 @token_required
 def export_numbers():
     """
-    导出号码记录
+    导出号码记录（流式下载）
     
     请求参数:
-        format: 导出格式(csv, json, excel)
+        format: 导出格式(csv, ndjson, json, excel)
         start_date: 开始日期(YYYY-MM-DD)
         end_date: 结束日期(YYYY-MM-DD)
         status: 状态过滤（可选）
+        compress: 是否gzip压缩（可选，true/false）
+        async: 是否提交为后台导出任务（可选，true/false）
     
     返回:
-        成功: {'message': '导出成功', 'download_url': 下载链接}
+        成功: 文件流，按块传输，内存占用与导出行数无关；
+              后台任务时返回 {'message': '导出任务已提交', 'job': 任务状态, 'status_url': 查询地址}, 202
         失败: {'message': '错误信息'}, 错误状态码
     """
     # 支持GET和POST请求
@@ -770,12 +975,13 @@ def export_numbers():
     start_date_str = args.get('start_date')
     end_date_str = args.get('end_date')
     status = args.get('status')
+    compress = str(args.get('compress', 'false')).lower() in ('true', '1', 'gzip')
     
     # 验证格式
-    if export_format not in ['csv', 'json', 'excel']:
+    if export_format not in EXPORT_FORMATS:
         return jsonify({
             'message': '无效的导出格式',
-            'help': '有效的格式: csv, json, excel'
+            'help': '有效的格式: ' + ', '.join(EXPORT_FORMATS)
         }), 400
     
     try:
@@ -794,102 +1000,47 @@ def export_numbers():
     except ValueError:
         return jsonify({'message': '无效的日期格式，请使用YYYY-MM-DD格式'}), 400
     
-    # 查询用户号码
-    query = PhoneNumber.query.filter(
-        PhoneNumber.user_id == request.user_id,
-        PhoneNumber.created_at.between(start_date, end_date)
-    )
-    
-    # 应用状态过滤
-    if status:
-        query = query.filter(PhoneNumber.status == status)
+    if export_format == 'excel':
+        try:
+            import openpyxl  # noqa: F401
+        except ImportError:
+            return jsonify({'message': '服务器未安装openpyxl，无法导出Excel'}), 500
     
-    # 获取数据
-    phones = query.order_by(desc(PhoneNumber.created_at)).all()
+    # 号码记录与项目一次JOIN，按批迭代
+    query = number_export_query(request.user_id, start_date, end_date, status)
     
-    if not phones:
+    if query.first() is None:
         return jsonify({'message': '未找到符合条件的记录'}), 404
     
-    # 准备导出数据
-    export_data = []
-    for phone in phones:
-        # 获取关联的项目信息
-        project = Project.query.get(phone.project_id)
-        project_name = project.name if project else "未知项目"
-        project_code = project.code if project else "未知代码"
-        
-        # 构建记录
-        record = {
-            'id': phone.id,
-            'number': phone.number,
-            'status': phone.status,
-            'project_name': project_name,
-            'project_code': project_code,
-            'request_id': phone.request_id,
-            'created_at': phone.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'updated_at': phone.updated_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'sms_code': phone.sms_code or '',
-            'released_at': phone.released_at.strftime('%Y-%m-%d %H:%M:%S') if phone.released_at else ''
-        }
-        export_data.append(record)
-    
     # 生成文件名
     timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-    filename_base = f"numbers_export_{timestamp}"
-    
-    # 生成响应
-    if export_format == 'csv':
-        # 创建内存文件
-        output = io.StringIO()
-        # 获取字段名（从第一条记录）
-        fieldnames = export_data[0].keys() if export_data else []
-        # 创建CSV写入器
-        writer = csv.DictWriter(output, fieldnames=fieldnames)
-        # 写入表头
-        writer.writeheader()
-        # 写入数据
-        writer.writerows(export_data)
-        
-        # 准备响应
-        output.seek(0)
-        filename = f"{filename_base}.csv"
-        
-        return jsonify({
-            'message': '导出CSV成功',
-            'record_count': len(export_data),
-            'data': output.getvalue()
-        }), 200
-        
-    elif export_format == 'json':
-        # 直接返回JSON数据
-        return jsonify({
-            'message': '导出JSON成功',
-            'record_count': len(export_data),
-            'data': export_data
-        }), 200
-        
-    else:  # excel
+    filename = export_filename(f"numbers_export_{timestamp}", export_format, compress)
+    
+    # 提交后台导出任务，不占用当前请求
+    if str(args.get('async', 'false')).lower() in ('true', '1'):
         try:
-            # 创建DataFrame
-            df = pd.DataFrame(export_data)
-            # 创建内存文件
-            output = io.BytesIO()
-            # 写入Excel
-            df.to_excel(output, index=False)
-            # 准备响应
-            output.seek(0)
-            
-            # 转换为Base64字符串
-            import base64
-            excel_base64 = base64.b64encode(output.getvalue()).decode('utf-8')
-            
-            return jsonify({
-                'message': '导出Excel成功',
-                'record_count': len(export_data),
-                'data': excel_base64
-            }), 200
-        except Exception as e:
-            return jsonify({'message': f'导出Excel失败: {str(e)}'}), 500
+            job = export_jobs.submit(request.user_id, 'numbers', {
+                'start_date': start_date.strftime('%Y-%m-%d'),
+                'end_date': end_date.strftime('%Y-%m-%d'),
+                'status': status
+            }, export_format, compress, filename=filename, mimetype=export_mimetype(export_format, compress))
+        except ExportJobLimitError as e:
+            return jsonify({'message': str(e)}), 429
+        return jsonify({
+            'message': '导出任务已提交',
+            'job': job,
+            'status_url': f"{request.url_root}api/exports/{job['job_id']}?token={args.get('token', '')}"
+        }), 202
+    
+    return Response(
+        stream_with_context(encode_rows(iter_number_rows(query), export_format, compress)),
+        mimetype=export_mimetype(export_format, compress),
+        headers={
+            'Content-Disposition': f'attachment; filename={filename}',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
 
 
 @numbers_bp.route('/batch-sms', methods=['GET', 'POST'])
@@ -900,25 +1051,30 @@ def batch_get_sms():
     
     参数:
         token: 认证令牌
-        request_ids: 请求ID列表，用逗号分隔
+        request_ids: 请求ID列表，用逗号分隔，或POST JSON请求体中的列表，最多BATCH_SMS_MAX_COUNT个
     
     返回:
-        多个请求ID对应的短信信息
+        多个请求ID对应的最新短信信息
     """
     # 从request中获取当前用户ID
     current_user_id = request.user_id
     
-    # 获取请求参数
-    request_ids_str = request.args.get('request_ids', '') or request.form.get('request_ids', '')
+    # 获取请求参数，支持查询参数/表单中逗号分隔的字符串，或JSON请求体中的列表
+    payload = request.get_json(silent=True) if request.method == 'POST' else None
+    raw_ids = (payload or {}).get('request_ids') if isinstance(payload, dict) else None
+    if raw_ids is None:
+        raw_ids = request.args.get('request_ids', '') or request.form.get('request_ids', '')
     
-    if not request_ids_str:
+    if not raw_ids:
         return jsonify({
             'status': 'error',
             'message': '请提供请求ID列表'
         }), 400
     
-    # 解析请求ID列表
-    request_ids = [req_id.strip() for req_id in request_ids_str.split(',') if req_id.strip()]
+    # 解析请求ID列表（去重并保持顺序）
+    if isinstance(raw_ids, str):
+        raw_ids = raw_ids.split(',')
+    request_ids = list(dict.fromkeys(str(req_id).strip() for req_id in raw_ids if str(req_id).strip()))
     
     if not request_ids:
         return jsonify({
@@ -927,19 +1083,56 @@ def batch_get_sms():
         }), 400
     
     # 限制批量查询数量
-    if len(request_ids) > 10:
+    max_count = current_app.config.get('BATCH_SMS_MAX_COUNT', 500)
+    if len(request_ids) > max_count:
         return jsonify({
             'status': 'error',
-            'message': '一次最多查询10个请求ID的短信'
+            'message': f'一次最多查询{max_count}个请求ID的短信'
         }), 400
     
-    # 查询所有请求ID对应的短信
+    # 一次查询取出所有号码请求及各自最新的一条短信
+    matched = db.session.query(
+        PhoneRequest.id, PhoneRequest.request_id, PhoneRequest.user_id, PhoneRequest.project_id,
+        PhoneRequest.phone_number, PhoneRequest.status
+    ).filter(PhoneRequest.request_id.in_(request_ids)).cte('matched_requests')
+    
+    ranked = db.session.query(
+        SMS.id, SMS.phone_request_id, SMS.sender, SMS.content, SMS.code, SMS.received_at,
+        func.row_number().over(
+            partition_by=SMS.phone_request_id,
+            order_by=(SMS.received_at.desc(), SMS.id.desc())
+        ).label('rn')
+    ).join(matched, matched.c.id == SMS.phone_request_id).subquery('ranked_sms')
+    
+    rows = db.session.query(
+        matched.c.request_id, matched.c.user_id, matched.c.project_id, matched.c.phone_number, matched.c.status,
+        ranked.c.id.label('sms_id'), ranked.c.sender, ranked.c.content, ranked.c.code, ranked.c.received_at
+    ).outerjoin(ranked, and_(ranked.c.phone_request_id == matched.c.id, ranked.c.rn == 1)).all()
+    by_request_id = {row.request_id: row for row in rows}
+    
+    # 历史短信没有保存验证码的，批量提取后写回，之后不再重复提取
+    missing = [
+        row for row in rows
+        if row.sms_id is not None and row.code is None and row.user_id == current_user_id
+    ]
+    codes = {}
+    if missing:
+        extracted = code_rules.extract_many([(row.content, row.project_id, row.sender) for row in missing])
+        codes = {row.sms_id: code for row, code in zip(missing, extracted)}
+        sms_table = SMS.__table__
+        db.session.execute(
+            update(sms_table)
+            .where(sms_table.c.id == bindparam('b_id'), sms_table.c.code.is_(None))
+            .values(code=bindparam('b_code')),
+            [{'b_id': sms_id, 'b_code': code} for sms_id, code in codes.items()]
+        )
+        db.session.commit()
+    
     results = {}
     for request_id in request_ids:
-        # 查询号码请求
-        phone_request = PhoneRequest.query.filter_by(request_id=request_id).first()
+        row = by_request_id.get(request_id)
         
-        if not phone_request:
+        if row is None:
             results[request_id] = {
                 'status': 'error',
                 'message': '请求ID不存在'
@@ -947,7 +1140,7 @@ def batch_get_sms():
             continue
         
         # 检查权限（只能查询自己的号码）
-        if phone_request.user_id != current_user_id:
+        if row.user_id != current_user_id:
             results[request_id] = {
                 'status': 'error',
                 'message': '无权查询此请求ID'
@@ -955,17 +1148,14 @@ def batch_get_sms():
             continue
         
         # 检查号码状态
-        if phone_request.status not in ['active', 'used']:
+        if row.status not in ['active', 'used']:
             results[request_id] = {
                 'status': 'error',
-                'message': f'号码状态不正确: {phone_request.status}'
+                'message': f'号码状态不正确: {row.status}'
             }
             continue
         
-        # 查询短信
-        sms = SMS.query.filter_by(phone_request_id=phone_request.id).order_by(SMS.received_at.desc()).first()
-        
-        if not sms:
+        if row.sms_id is None:
             results[request_id] = {
                 'status': 'waiting',
                 'message': '暂无短信，请稍后再试'
@@ -975,13 +1165,13 @@ def batch_get_sms():
         # 返回短信信息
         results[request_id] = {
             'status': 'success',
-            'phone_number': phone_request.phone_number,
+            'phone_number': row.phone_number,
             'sms': {
-                'id': sms.id,
-                'sender': sms.sender,
-                'content': sms.content,
-                'received_at': sms.received_at.isoformat(),
-                'code': extract_verification_code(sms.content)
+                'id': row.sms_id,
+                'sender': row.sender,
+                'content': row.content,
+                'received_at': row.received_at.isoformat(),
+                'code': codes.get(row.sms_id, row.code) or ''
             }
         }
     
@@ -1,7 +1,9 @@
 from flask import Blueprint, request, jsonify, make_response, current_app
-from app.models import db, PhoneNumber, Project, Transaction, User, PhoneRequest, SMS
+from app.models import db, Project, Transaction, PhoneRequest, SMS, StatsHourly, StatsDaily
 from app.utils import token_required, admin_required, api_error_handler, validate_pagination_params
-from sqlalchemy import func, and_, desc
+from app.services.sql_dialect import stats_dialect
+from app.services.stats_cache import stats_cache, user_tag, GLOBAL_TAG
+from sqlalchemy import func, and_, desc, case
 from datetime import datetime, timedelta
 import hashlib
 import functools
@@ -14,47 +16,29 @@ from flask import make_response
 import pandas as pd
 from openpyxl.utils import get_column_letter
 
-# 简单的内存缓存实现
-class SimpleCache:
-    def __init__(self, ttl=300):  # 默认缓存5分钟
-        self.cache = {}
-        self.ttl = ttl
-    
-    def get(self, key):
-        if key in self.cache:
-            value, expiry = self.cache[key]
-            if expiry > time.time():
-                return value
-            else:
-                # 缓存已过期，删除
-                del self.cache[key]
-        return None
-    
-    def set(self, key, value):
-        expiry = time.time() + self.ttl
-        self.cache[key] = (value, expiry)
-    
-    def clear(self):
-        self.cache.clear()
-    
-    def prune_expired(self):
-        """删除所有过期的缓存项"""
-        now = time.time()
-        expired_keys = [k for k, (_, exp) in self.cache.items() if exp <= now]
-        for k in expired_keys:
-            del self.cache[k]
-
-# 创建缓存实例
-stats_cache = SimpleCache(ttl=300)  # 统计数据缓存5分钟
-
 # 创建蓝图
 statistics_bp = Blueprint('statistics', __name__)
 
+# 注册到应用时按配置初始化统计缓存
+statistics_bp.record_once(lambda state: stats_cache.init_app(state.app))
+
+# 统计类型 -> (结果中的标签字段, 标签格式)
+STAT_LABELS = {
+    'hourly': ('hour', '%Y-%m-%d %H:00'),
+    'daily': ('date', '%Y-%m-%d'),
+    'weekly': ('week', '%Y-%W'),
+    'monthly': ('month', '%Y-%m'),
+}
+
 def cached_stats(f):
-    """缓存装饰器，用于缓存统计数据结果"""
+    """
+    缓存装饰器，缓存统计接口成功响应的响应体
+
+    普通用户的结果按 user:<id> 标签缓存，管理员看到的全局统计按 global 标签缓存，
+    用户数据写入后对应标签失效。缓存键不含token，同一用户换token也能命中。
+    """
     @functools.wraps(f)
     def wrapper(*args, **kwargs):
-        # 创建缓存键，基于请求参数和用户ID
         user_id = request.user_id
         is_admin = request.is_admin
         
@@ -62,24 +46,27 @@ def cached_stats(f):
             params = request.args.to_dict()
         else:
             params = request.json or {}
-        
-        # 为缓存键创建唯一字符串
-        param_str = f"user:{user_id}:admin:{is_admin}:" + ":".join(f"{k}={v}" for k, v in sorted(params.items()))
-        cache_key = hashlib.md5(param_str.encode()).hexdigest()
-        
-        # 尝试从缓存获取
-        cached_result = stats_cache.get(cache_key)
-        if cached_result:
-            return cached_result
-        
-        # 执行原函数
-        result = f(*args, **kwargs)
-        
-        # 缓存结果（只缓存成功的结果）
-        if isinstance(result, tuple) and len(result) >= 2 and result[1] == 200:
-            stats_cache.set(cache_key, result)
-        
-        return result
+        params.pop('token', None)
+        
+        scope = 'global' if is_admin else f'user:{user_id}'
+        param_str = json.dumps(params, sort_keys=True, default=str)
+        cache_key = f"{f.__name__}:{scope}:{hashlib.sha1(param_str.encode()).hexdigest()}"
+        tags = [GLOBAL_TAG] if is_admin else [user_tag(user_id)]
+        
+        computed = {}
+        
+        def compute():
+            result = f(*args, **kwargs)
+            computed['result'] = result
+            # 只缓存成功的结果
+            if isinstance(result, tuple) and len(result) >= 2 and result[1] == 200:
+                return result[0].get_data(), True
+            return None, False
+        
+        payload, _ = stats_cache.get_or_compute(cache_key, tags, compute)
+        if 'result' in computed:
+            return computed['result']
+        return current_app.response_class(payload, status=200, mimetype='application/json')
     return wrapper
 
 @statistics_bp.route('', methods=['GET', 'POST'])
@@ -90,10 +77,12 @@ def get_statistics():
     """
     获取统计数据
     
+    数据来自统计汇总表 stats_hourly / stats_daily，按号码的取号时间归桶。
+    
     请求参数:
-        type: 统计类型(daily, weekly, monthly)
+        type: 统计类型(hourly, daily, weekly, monthly)
         start_date: 开始日期(YYYY-MM-DD)
-        end_date: 结束日期(YYYY-MM-DD)
+        end_date: 结束日期(YYYY-MM-DD，包含当天)
     
     返回:
         成功: {'message': '获取统计数据成功', 'statistics': 统计数据}
@@ -111,10 +100,10 @@ def get_statistics():
     end_date_str = args.get('end_date')
     
     # 验证参数
-    if stat_type not in ['daily', 'weekly', 'monthly']:
+    if stat_type not in STAT_LABELS:
         return jsonify({
             'message': '无效的统计类型',
-            'help': '有效的统计类型: daily, weekly, monthly'
+            'help': '有效的统计类型: hourly, daily, weekly, monthly'
         }), 400
     
     try:
@@ -126,7 +115,9 @@ def get_statistics():
         
         if not start_date_str:
             # 根据统计类型设置默认起始日期
-            if stat_type == 'daily':
+            if stat_type == 'hourly':
+                start_date = end_date - timedelta(days=1)  # 24小时
+            elif stat_type == 'daily':
                 start_date = end_date - timedelta(days=30)  # 30天
             elif stat_type == 'weekly':
                 start_date = end_date - timedelta(weeks=12)  # 12周
@@ -149,150 +140,67 @@ def get_statistics():
         'statistics': {}
     }
     
-    # 根据统计类型执行不同的查询
-    if stat_type == 'daily':
-        # 每日号码使用统计
-        phone_stats = db.session.query(
-            func.date(PhoneNumber.created_at).label('date'),
-            func.count(PhoneNumber.id).label('count')
-        )
-        
-        if not is_admin:
-            phone_stats = phone_stats.filter(PhoneNumber.user_id == user_id)
-        
-        phone_stats = (phone_stats
-            .filter(PhoneNumber.created_at.between(start_date, end_date))
-            .group_by(func.date(PhoneNumber.created_at))
-            .order_by(func.date(PhoneNumber.created_at))
-            .all())
-        
-        # 每日消费统计
-        spend_stats = db.session.query(
-            func.date(Transaction.created_at).label('date'),
-            func.sum(Transaction.amount).label('amount')
-        )
-        
-        if not is_admin:
-            spend_stats = spend_stats.filter(Transaction.user_id == user_id)
-        
-        spend_stats = (spend_stats
-            .filter(Transaction.created_at.between(start_date, end_date))
-            .filter(Transaction.type == 'consume')
-            .group_by(func.date(Transaction.created_at))
-            .order_by(func.date(Transaction.created_at))
-            .all())
-        
-        # 格式化结果
-        result['statistics']['phone_usage'] = [
-            {'date': str(item.date), 'count': item.count} for item in phone_stats
-        ]
-        
-        result['statistics']['spending'] = [
-            {'date': str(item.date), 'amount': abs(float(item.amount))} for item in spend_stats
-        ]
+    # 读汇总表：按天（或小时）预聚合，范围内最多几百行，结束日期当天包含在内
+    if stat_type == 'hourly':
+        table = StatsHourly
+        bucket_filter = and_(StatsHourly.bucket >= datetime.combine(start_date.date(), datetime.min.time()),
+                             StatsHourly.bucket < datetime.combine(end_date.date() + timedelta(days=1), datetime.min.time()))
+    else:
+        table = StatsDaily
+        bucket_filter = StatsDaily.bucket.between(start_date.date(), end_date.date())
     
-    elif stat_type == 'weekly':
-        # 周统计逻辑
-        # 提取周数
-        phone_stats = db.session.query(
-            func.strftime('%Y-%W', PhoneNumber.created_at).label('week'),
-            func.count(PhoneNumber.id).label('count')
-        )
-        
-        if not is_admin:
-            phone_stats = phone_stats.filter(PhoneNumber.user_id == user_id)
-        
-        phone_stats = (phone_stats
-            .filter(PhoneNumber.created_at.between(start_date, end_date))
-            .group_by(func.strftime('%Y-%W', PhoneNumber.created_at))
-            .order_by(func.strftime('%Y-%W', PhoneNumber.created_at))
-            .all())
-        
-        # 周消费统计
-        spend_stats = db.session.query(
-            func.strftime('%Y-%W', Transaction.created_at).label('week'),
-            func.sum(Transaction.amount).label('amount')
-        )
-        
-        if not is_admin:
-            spend_stats = spend_stats.filter(Transaction.user_id == user_id)
-        
-        spend_stats = (spend_stats
-            .filter(Transaction.created_at.between(start_date, end_date))
-            .filter(Transaction.type == 'consume')
-            .group_by(func.strftime('%Y-%W', Transaction.created_at))
-            .order_by(func.strftime('%Y-%W', Transaction.created_at))
-            .all())
-        
-        # 格式化结果
-        result['statistics']['phone_usage'] = [
-            {'week': item.week, 'count': item.count} for item in phone_stats
-        ]
-        
-        result['statistics']['spending'] = [
-            {'week': item.week, 'amount': abs(float(item.amount))} for item in spend_stats
-        ]
+    series = db.session.query(
+        table.bucket,
+        func.sum(table.numbers).label('numbers'),
+        func.sum(table.successes).label('successes'),
+        func.sum(table.spend).label('spend'),
+        func.sum(table.refunds).label('refunds')
+    ).filter(bucket_filter)
+    if not is_admin:
+        series = series.filter(table.user_id == user_id)
+    series = series.group_by(table.bucket).order_by(table.bucket).all()
     
-    else:  # monthly
-        # 月度统计逻辑
-        phone_stats = db.session.query(
-            func.strftime('%Y-%m', PhoneNumber.created_at).label('month'),
-            func.count(PhoneNumber.id).label('count')
-        )
-        
-        if not is_admin:
-            phone_stats = phone_stats.filter(PhoneNumber.user_id == user_id)
-        
-        phone_stats = (phone_stats
-            .filter(PhoneNumber.created_at.between(start_date, end_date))
-            .group_by(func.strftime('%Y-%m', PhoneNumber.created_at))
-            .order_by(func.strftime('%Y-%m', PhoneNumber.created_at))
-            .all())
-        
-        # 月度消费统计
-        spend_stats = db.session.query(
-            func.strftime('%Y-%m', Transaction.created_at).label('month'),
-            func.sum(Transaction.amount).label('amount')
-        )
-        
-        if not is_admin:
-            spend_stats = spend_stats.filter(Transaction.user_id == user_id)
-        
-        spend_stats = (spend_stats
-            .filter(Transaction.created_at.between(start_date, end_date))
-            .filter(Transaction.type == 'consume')
-            .group_by(func.strftime('%Y-%m', Transaction.created_at))
-            .order_by(func.strftime('%Y-%m', Transaction.created_at))
-            .all())
-        
-        # 格式化结果
-        result['statistics']['phone_usage'] = [
-            {'month': item.month, 'count': item.count} for item in phone_stats
-        ]
-        
-        result['statistics']['spending'] = [
-            {'month': item.month, 'amount': abs(float(item.amount))} for item in spend_stats
-        ]
+    # 周、月由天的汇总行在内存中合并，标签格式与原来的 %Y-%W / %Y-%m 一致
+    label_key, label_format = STAT_LABELS[stat_type]
+    totals = {}
+    for item in series:
+        label = item.bucket.strftime(label_format)
+        row = totals.setdefault(label, {'numbers': 0, 'successes': 0, 'spend': 0.0, 'refunds': 0.0})
+        row['numbers'] += item.numbers or 0
+        row['successes'] += item.successes or 0
+        row['spend'] += item.spend or 0
+        row['refunds'] += item.refunds or 0
+    
+    result['statistics']['phone_usage'] = [
+        {label_key: label, 'count': row['numbers'], 'success': row['successes']}
+        for label, row in totals.items() if row['numbers']
+    ]
+    
+    result['statistics']['spending'] = [
+        {label_key: label, 'amount': round(row['spend'], 2), 'refund': round(row['refunds'], 2)}
+        for label, row in totals.items() if row['spend']
+    ]
     
     # 添加项目使用统计
     project_stats = db.session.query(
         Project.name,
         Project.code,
-        func.count(PhoneNumber.id).label('count')
-    ).join(PhoneNumber, PhoneNumber.project_id == Project.id)
+        func.sum(StatsDaily.numbers).label('count')
+    ).join(StatsDaily, StatsDaily.project_id == Project.id).filter(
+        StatsDaily.bucket.between(start_date.date(), end_date.date())
+    )
     
     if not is_admin:
-        project_stats = project_stats.filter(PhoneNumber.user_id == user_id)
+        project_stats = project_stats.filter(StatsDaily.user_id == user_id)
     
     project_stats = (project_stats
-        .filter(PhoneNumber.created_at.between(start_date, end_date))
-        .group_by(Project.id)
+        .group_by(Project.id, Project.name, Project.code)
         .order_by(desc('count'))
         .all())
     
     result['statistics']['projects'] = [
-        {'name': item.name, 'code': item.code, 'count': item.count} 
-        for item in project_stats
+        {'name': item.name, 'code': item.code, 'count': int(item.count)}
+        for item in project_stats if item.count
     ]
     
     return jsonify({
@@ -313,10 +221,10 @@ def custom_statistics():
         metrics: 要统计的指标，多个用逗号分隔
                 可选值：sms_count, success_rate, avg_response_time, 
                       cost, project_distribution, hourly_activity
-        project_code: 项目代码过滤（可选）
+        project_code: 项目代码过滤（可选，消费不按项目区分）
         
     返回:
-        自定义统计数据
+        自定义统计数据，profile 中给出执行的查询数和各指标耗时（毫秒）
     """
     # 从request中获取当前用户ID
     current_user_id = request.user_id
@@ -346,10 +254,11 @@ def custom_statistics():
                 'message': '结束日期必须大于等于开始日期'
             }), 400
         
-        if date_range > 90:
+        max_days = current_app.config.get('STATISTICS_EXPORT_MAX_DAYS', 366)
+        if date_range >= max_days:
             return jsonify({
                 'status': 'error',
-                'message': '日期范围不能超过90天'
+                'message': f'日期范围不能超过{max_days}天'
             }), 400
         
         # 解析指标
@@ -368,17 +277,6 @@ def custom_statistics():
                     'message': f'无效的指标: {", ".join(invalid_metrics)}'
                 }), 400
         
-        # 构建查询基础
-        base_query = PhoneRequest.query.filter(
-            PhoneRequest.user_id == current_user_id,
-            PhoneRequest.created_at.between(start_date, end_date)
-        )
-        
-        if project_code:
-            project = Project.query.filter_by(code=project_code).first()
-            if project:
-                base_query = base_query.filter(PhoneRequest.project_id == project.id)
-        
         # 统计结果
         result = {
             'period': {
@@ -389,123 +287,120 @@ def custom_statistics():
             'metrics': {}
         }
         
-        # 统计各个指标
-        if 'sms_count' in metrics:
-            # 短信数量统计
-            sms_count = base_query.count()
-            sms_received = db.session.query(func.count(SMS.id)).join(
-                PhoneRequest, SMS.phone_request_id == PhoneRequest.id
+        dialect = stats_dialect()
+        # 半开区间，结束日期次日零点为上界
+        range_end = end_date + timedelta(seconds=1)
+        query_ms = {}
+        metric_ms = {}
+        
+        request_metrics = [m for m in metrics if m != 'cost']
+        if request_metrics:
+            # 查询一：号码请求 LEFT JOIN 短信，按 (项目, 小时) 一次聚合出请求数、成功数、
+            # 短信数和响应时间，其余指标都由这不超过 项目数×24 行在内存中汇总
+            started = time.perf_counter()
+            hour = dialect.hour_of_day(PhoneRequest.created_at)
+            response_seconds = dialect.seconds_between(PhoneRequest.created_at, SMS.received_at)
+            rows_query = db.session.query(
+                Project.name,
+                Project.code,
+                hour.label('hour'),
+                func.count(func.distinct(PhoneRequest.id)).label('requests'),
+                func.count(func.distinct(case(
+                    (PhoneRequest.status.in_(['used', 'completed']), PhoneRequest.id)
+                ))).label('successes'),
+                func.count(SMS.id).label('sms'),
+                func.sum(response_seconds).label('response_seconds'),
+                func.count(SMS.received_at).label('responses')
+            ).join(
+                Project, Project.id == PhoneRequest.project_id
+            ).outerjoin(
+                SMS, SMS.phone_request_id == PhoneRequest.id
             ).filter(
                 PhoneRequest.user_id == current_user_id,
-                PhoneRequest.created_at.between(start_date, end_date)
+                dialect.time_range(PhoneRequest.created_at, start_date, range_end)
             )
+            if project_code:
+                rows_query = rows_query.filter(Project.code == project_code)
+            rows = rows_query.group_by(Project.id, Project.name, Project.code, hour).all()
+            query_ms['requests'] = round((time.perf_counter() - started) * 1000, 2)
             
-            if project_code and project:
-                sms_received = sms_received.filter(PhoneRequest.project_id == project.id)
-                
-            result['metrics']['sms_count'] = {
-                'total_requests': sms_count,
-                'received_sms': sms_received.scalar() or 0
-            }
-        
-        if 'success_rate' in metrics:
-            # 成功率统计
-            total_requests = base_query.count()
-            successful_requests = base_query.filter(PhoneRequest.status.in_(['used', 'completed'])).count()
+            total_requests = sum(row.requests for row in rows)
+            successful_requests = sum(row.successes or 0 for row in rows)
+            
+            def timed(metric, build):
+                """汇总一个指标，耗时为共享查询的耗时加上汇总本身的耗时"""
+                if metric not in metrics:
+                    return
+                started = time.perf_counter()
+                result['metrics'][metric] = build()
+                metric_ms[metric] = round(query_ms['requests'] + (time.perf_counter() - started) * 1000, 2)
             
-            success_rate = 0
-            if total_requests > 0:
-                success_rate = (successful_requests / total_requests) * 100
-                
-            result['metrics']['success_rate'] = {
+            # 短信数量统计
+            timed('sms_count', lambda: {
+                'total_requests': total_requests,
+                'received_sms': sum(row.sms for row in rows)
+            })
+            
+            # 成功率统计
+            timed('success_rate', lambda: {
                 'total_requests': total_requests,
                 'successful_requests': successful_requests,
-                'rate': round(success_rate, 2)
-            }
-        
-        if 'avg_response_time' in metrics:
-            # 平均响应时间统计
-            response_times = db.session.query(
-                func.avg(func.extract('epoch', SMS.received_at - PhoneRequest.created_at))
-            ).join(
-                PhoneRequest, SMS.phone_request_id == PhoneRequest.id
-            ).filter(
-                PhoneRequest.user_id == current_user_id,
-                PhoneRequest.created_at.between(start_date, end_date)
-            )
+                'rate': round(successful_requests / total_requests * 100, 2) if total_requests else 0
+            })
             
-            if project_code and project:
-                response_times = response_times.filter(PhoneRequest.project_id == project.id)
-                
-            avg_time = response_times.scalar() or 0
+            # 平均响应时间统计（按短信平均）
+            def build_avg_response_time():
+                responses = sum(row.responses for row in rows)
+                avg_time = sum(row.response_seconds or 0 for row in rows) / responses if responses else 0
+                return {
+                    'seconds': round(avg_time, 2),
+                    'formatted': f"{int(avg_time // 60)}分{int(avg_time % 60)}秒"
+                }
+            timed('avg_response_time', build_avg_response_time)
             
-            result['metrics']['avg_response_time'] = {
-                'seconds': round(avg_time, 2),
-                'formatted': f"{int(avg_time // 60)}分{int(avg_time % 60)}秒"
-            }
+            # 项目分布统计
+            def build_project_distribution():
+                projects = {}
+                for row in rows:
+                    entry = projects.setdefault(row.code, {'name': row.name, 'code': row.code, 'count': 0})
+                    entry['count'] += row.requests
+                return list(projects.values())
+            timed('project_distribution', build_project_distribution)
+            
+            # 按小时活跃度统计
+            def build_hourly_activity():
+                hours = [0] * 24
+                for row in rows:
+                    hours[int(row.hour)] += row.requests
+                return {
+                    'hours': hours,
+                    'peak_hour': hours.index(max(hours)),
+                    'total': sum(hours)
+                }
+            timed('hourly_activity', build_hourly_activity)
         
         if 'cost' in metrics:
-            # 消费统计
+            # 查询二：消费统计
+            started = time.perf_counter()
             total_cost = db.session.query(func.sum(Transaction.amount)).filter(
                 Transaction.user_id == current_user_id,
                 Transaction.type == 'consume',
-                Transaction.created_at.between(start_date, end_date)
+                dialect.time_range(Transaction.created_at, start_date, range_end)
             ).scalar() or 0
+            query_ms['cost'] = round((time.perf_counter() - started) * 1000, 2)
             
             result['metrics']['cost'] = {
                 'total': abs(total_cost),
                 'daily_average': round(abs(total_cost) / (date_range + 1), 2)
             }
+            metric_ms['cost'] = query_ms['cost']
         
-        if 'project_distribution' in metrics:
-            # 项目分布统计
-            project_stats = db.session.query(
-                Project.name, Project.code, func.count(PhoneRequest.id)
-            ).join(
-                PhoneRequest, Project.id == PhoneRequest.project_id
-            ).filter(
-                PhoneRequest.user_id == current_user_id,
-                PhoneRequest.created_at.between(start_date, end_date)
-            ).group_by(
-                Project.id
-            ).all()
-            
-            projects = []
-            for name, code, count in project_stats:
-                projects.append({
-                    'name': name,
-                    'code': code,
-                    'count': count
-                })
-            
-            result['metrics']['project_distribution'] = projects
-        
-        if 'hourly_activity' in metrics:
-            # 按小时活跃度统计
-            hourly_stats = db.session.query(
-                func.extract('hour', PhoneRequest.created_at), 
-                func.count(PhoneRequest.id)
-            ).filter(
-                PhoneRequest.user_id == current_user_id,
-                PhoneRequest.created_at.between(start_date, end_date)
-            )
-            
-            if project_code and project:
-                hourly_stats = hourly_stats.filter(PhoneRequest.project_id == project.id)
-                
-            hourly_stats = hourly_stats.group_by(
-                func.extract('hour', PhoneRequest.created_at)
-            ).all()
-            
-            hours = [0] * 24
-            for hour, count in hourly_stats:
-                hours[int(hour)] = count
-            
-            result['metrics']['hourly_activity'] = {
-                'hours': hours,
-                'peak_hour': hours.index(max(hours)),
-                'total': sum(hours)
-            }
+        # 查询次数和各指标耗时（毫秒）
+        result['profile'] = {
+            'queries': len(query_ms),
+            'query_ms': query_ms,
+            'metric_ms': metric_ms
+        }
         
         return jsonify(result)
         
@@ -521,6 +416,198 @@ def custom_statistics():
             'message': f'服务器错误: {str(e)}'
         }), 500
 
+def build_statistics_report(user_id, start_date, end_date, report_type, project_code=None, progress=None):
+    """
+    生成统计报表数据
+
+    参数:
+        user_id: 用户ID
+        start_date, end_date: 统计区间（含两端）
+        report_type: 报表类型(daily, project, summary)
+        project_code: 项目代码过滤（可选）
+        progress: 进度回调 progress(已完成, 总数)（可选，后台导出任务使用）
+
+    返回:
+        list: 报表行
+    """
+    date_range = (end_date - start_date).days
+    # 成功的请求计1，其余计0，与总数在同一次扫描中聚合
+    successful = func.sum(case((PhoneRequest.status.in_(['used', 'completed']), 1), else_=0))
+
+    project_id = None
+    if project_code and report_type != 'project':
+        project = Project.query.filter_by(code=project_code).first()
+        if project:
+            project_id = project.id
+
+    if report_type == 'daily':
+        # 按天统计：请求数和成功数一条GROUP BY，消费一条GROUP BY，查询数与天数无关
+        request_day = func.date(PhoneRequest.created_at)
+        request_stats = db.session.query(
+            request_day, func.count(PhoneRequest.id), successful
+        ).filter(
+            PhoneRequest.user_id == user_id,
+            PhoneRequest.created_at.between(start_date, end_date)
+        )
+        if project_id is not None:
+            request_stats = request_stats.filter(PhoneRequest.project_id == project_id)
+        requests_by_day = {
+            str(day): (total or 0, success or 0)
+            for day, total, success in request_stats.group_by(request_day)
+        }
+        if progress:
+            progress(1, 2)
+
+        cost_day = func.date(Transaction.created_at)
+        costs_by_day = {
+            str(day): amount or 0
+            for day, amount in db.session.query(cost_day, func.sum(Transaction.amount)).filter(
+                Transaction.user_id == user_id,
+                Transaction.type == 'consume',
+                Transaction.created_at.between(start_date, end_date)
+            ).group_by(cost_day)
+        }
+        if progress:
+            progress(2, 2)
+
+        # 没有数据的日期也输出一行
+        data = []
+        for offset in range(date_range + 1):
+            day = (start_date + timedelta(days=offset)).strftime('%Y-%m-%d')
+            total_requests, successful_requests = requests_by_day.get(day, (0, 0))
+            data.append({
+                'date': day,
+                'total_requests': total_requests,
+                'successful_requests': successful_requests,
+                'success_rate': round(successful_requests / total_requests * 100, 2) if total_requests else 0,
+                'cost': abs(costs_by_day.get(day, 0))
+            })
+
+    elif report_type == 'project':
+        # 按项目统计：请求数和成功数一条GROUP BY，平均响应时间一条GROUP BY
+        project_stats = db.session.query(
+            Project.id, Project.name, Project.code, func.count(PhoneRequest.id), successful
+        ).join(
+            PhoneRequest, Project.id == PhoneRequest.project_id
+        ).filter(
+            PhoneRequest.user_id == user_id,
+            PhoneRequest.created_at.between(start_date, end_date)
+        ).group_by(
+            Project.id, Project.name, Project.code
+        ).all()
+        if progress:
+            progress(1, 2)
+
+        # 计算平均响应时间
+        avg_times = dict(db.session.query(
+            PhoneRequest.project_id,
+            func.avg(stats_dialect().seconds_between(PhoneRequest.created_at, SMS.received_at))
+        ).join(
+            PhoneRequest, SMS.phone_request_id == PhoneRequest.id
+        ).filter(
+            PhoneRequest.user_id == user_id,
+            PhoneRequest.created_at.between(start_date, end_date)
+        ).group_by(PhoneRequest.project_id).all())
+        if progress:
+            progress(2, 2)
+
+        data = [{
+            'project_name': name,
+            'project_code': code,
+            'total_requests': count,
+            'successful_requests': success or 0,
+            'success_rate': round((success or 0) / count * 100, 2) if count else 0,
+            'avg_response_time': round(avg_times.get(project_pk) or 0, 2)
+        } for project_pk, name, code, count, success in project_stats]
+
+    else:  # summary
+        # 汇总统计：请求数、成功数、项目数一次扫描
+        summary = db.session.query(
+            func.count(PhoneRequest.id), successful, func.count(func.distinct(PhoneRequest.project_id))
+        ).filter(
+            PhoneRequest.user_id == user_id,
+            PhoneRequest.created_at.between(start_date, end_date)
+        )
+        if project_id is not None:
+            summary = summary.filter(PhoneRequest.project_id == project_id)
+        request_count, successful_count, project_count = summary.one()
+        request_count = request_count or 0
+        successful_count = successful_count or 0
+
+        # 成功率
+        success_rate = 0
+        if request_count > 0:
+            success_rate = (successful_count / request_count) * 100
+
+        # 总消费
+        total_cost = db.session.query(func.sum(Transaction.amount)).filter(
+            Transaction.user_id == user_id,
+            Transaction.type == 'consume',
+            Transaction.created_at.between(start_date, end_date)
+        ).scalar() or 0
+
+        # 每日平均请求数
+        daily_avg = request_count / (date_range + 1) if date_range > 0 else request_count
+
+        data = [{
+            'period_start': start_date.strftime('%Y-%m-%d'),
+            'period_end': end_date.strftime('%Y-%m-%d'),
+            'total_days': date_range + 1,
+            'total_requests': request_count,
+            'successful_requests': successful_count,
+            'success_rate': round(success_rate, 2),
+            'total_cost': abs(total_cost),
+            'daily_average_requests': round(daily_avg, 2),
+            'project_count': project_count or 0
+        }]
+
+    return data
+
+
+# 统计报表导出格式: 格式 -> (文件扩展名, MIME类型)
+REPORT_FORMATS = {
+    'json': ('json', 'application/json'),
+    'csv': ('csv', 'text/csv'),
+    'excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+def render_statistics_report(data, export_format, report_type):
+    """
+    把报表数据编码为文件内容
+
+    返回:
+        bytes: 文件内容，CSV/Excel没有数据时为None
+    """
+    if export_format == 'json':
+        # 导出为JSON
+        return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+
+    if not data:
+        return None
+
+    if export_format == 'csv':
+        # 导出为CSV
+        output = StringIO()
+        writer = csv.DictWriter(output, fieldnames=data[0].keys())
+        writer.writeheader()
+        writer.writerows(data)
+        return output.getvalue().encode('utf-8')
+
+    # 导出为Excel
+    df = pd.DataFrame(data)
+    output = BytesIO()
+
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name=report_type.capitalize())
+
+        # 调整列宽
+        worksheet = writer.sheets[report_type.capitalize()]
+        for i, col in enumerate(df.columns):
+            max_len = max(df[col].astype(str).map(len).max(), len(col)) + 2
+            worksheet.column_dimensions[get_column_letter(i + 1)].width = max_len
+
+    return output.getvalue()
+
 @statistics_bp.route('/export', methods=['GET', 'POST'])
 @token_required
 def export_statistics():
@@ -581,219 +668,51 @@ def export_statistics():
                 'message': '结束日期必须大于等于开始日期'
             }), 400
         
-        if date_range > 90:
+        max_days = current_app.config.get('STATISTICS_EXPORT_MAX_DAYS', 366)
+        if date_range >= max_days:
             return jsonify({
                 'status': 'error',
-                'message': '日期范围不能超过90天'
+                'message': f'日期范围不能超过{max_days}天'
             }), 400
         
-        # 根据报表类型生成数据
-        data = []
+        # 数据量大时提交后台导出任务，立即返回任务ID
+        if str(request.args.get('async') or request.form.get('async') or '').lower() in ('true', '1'):
+            from app.services.export_jobs import export_jobs, ExportJobLimitError
+            extension, content_type = REPORT_FORMATS[export_format]
+            try:
+                job = export_jobs.submit(current_user_id, 'statistics', {
+                    'start_date': start_date_str,
+                    'end_date': end_date_str,
+                    'type': report_type,
+                    'project_code': project_code
+                }, export_format, filename=f"statistics_{report_type}_{start_date_str}_to_{end_date_str}.{extension}",
+                    mimetype=content_type)
+            except ExportJobLimitError as e:
+                return jsonify({'status': 'error', 'message': str(e)}), 429
+            return jsonify({
+                'status': 'success',
+                'message': '导出任务已提交',
+                'job': job,
+                'status_url': f"{request.url_root}api/exports/{job['job_id']}?token={request.args.get('token', '')}"
+            }), 202
         
-        if report_type == 'daily':
-            # 按天统计
-            daily_stats = []
-            current_date = start_date
-            
-            while current_date <= end_date:
-                next_day = current_date + timedelta(days=1)
-                
-                # 查询当天数据
-                query = PhoneRequest.query.filter(
-                    PhoneRequest.user_id == current_user_id,
-                    PhoneRequest.created_at.between(current_date, next_day - timedelta(seconds=1))
-                )
-                
-                if project_code:
-                    project = Project.query.filter_by(code=project_code).first()
-                    if project:
-                        query = query.filter(PhoneRequest.project_id == project.id)
-                
-                # 统计数据
-                total_requests = query.count()
-                successful_requests = query.filter(PhoneRequest.status.in_(['used', 'completed'])).count()
-                
-                # 计算成功率
-                success_rate = 0
-                if total_requests > 0:
-                    success_rate = (successful_requests / total_requests) * 100
-                
-                # 计算消费
-                cost = db.session.query(func.sum(Transaction.amount)).filter(
-                    Transaction.user_id == current_user_id,
-                    Transaction.type == 'consume',
-                    Transaction.created_at.between(current_date, next_day - timedelta(seconds=1))
-                ).scalar() or 0
-                
-                daily_stats.append({
-                    'date': current_date.strftime('%Y-%m-%d'),
-                    'total_requests': total_requests,
-                    'successful_requests': successful_requests,
-                    'success_rate': round(success_rate, 2),
-                    'cost': abs(cost)
-                })
-                
-                current_date = next_day
-            
-            data = daily_stats
-            
-        elif report_type == 'project':
-            # 按项目统计
-            project_stats = db.session.query(
-                Project.id, Project.name, Project.code, func.count(PhoneRequest.id)
-            ).join(
-                PhoneRequest, Project.id == PhoneRequest.project_id
-            ).filter(
-                PhoneRequest.user_id == current_user_id,
-                PhoneRequest.created_at.between(start_date, end_date)
-            ).group_by(
-                Project.id
-            ).all()
-            
-            for project_id, name, code, count in project_stats:
-                # 计算成功率
-                successful = PhoneRequest.query.filter(
-                    PhoneRequest.user_id == current_user_id,
-                    PhoneRequest.project_id == project_id,
-                    PhoneRequest.status.in_(['used', 'completed']),
-                    PhoneRequest.created_at.between(start_date, end_date)
-                ).count()
-                
-                success_rate = 0
-                if count > 0:
-                    success_rate = (successful / count) * 100
-                
-                # 计算平均响应时间
-                avg_time = db.session.query(
-                    func.avg(func.extract('epoch', SMS.received_at - PhoneRequest.created_at))
-                ).join(
-                    PhoneRequest, SMS.phone_request_id == PhoneRequest.id
-                ).filter(
-                    PhoneRequest.user_id == current_user_id,
-                    PhoneRequest.project_id == project_id,
-                    PhoneRequest.created_at.between(start_date, end_date)
-                ).scalar() or 0
-                
-                data.append({
-                    'project_name': name,
-                    'project_code': code,
-                    'total_requests': count,
-                    'successful_requests': successful,
-                    'success_rate': round(success_rate, 2),
-                    'avg_response_time': round(avg_time, 2)
-                })
-            
-        else:  # summary
-            # 汇总统计
-            # 总请求数
-            total_requests = PhoneRequest.query.filter(
-                PhoneRequest.user_id == current_user_id,
-                PhoneRequest.created_at.between(start_date, end_date)
-            )
-            
-            if project_code:
-                project = Project.query.filter_by(code=project_code).first()
-                if project:
-                    total_requests = total_requests.filter(PhoneRequest.project_id == project.id)
-            
-            request_count = total_requests.count()
-            
-            # 成功请求数
-            successful_count = total_requests.filter(
-                PhoneRequest.status.in_(['used', 'completed'])
-            ).count()
-            
-            # 成功率
-            success_rate = 0
-            if request_count > 0:
-                success_rate = (successful_count / request_count) * 100
-            
-            # 总消费
-            total_cost = db.session.query(func.sum(Transaction.amount)).filter(
-                Transaction.user_id == current_user_id,
-                Transaction.type == 'consume',
-                Transaction.created_at.between(start_date, end_date)
-            ).scalar() or 0
-            
-            # 使用的项目数
-            project_count = db.session.query(func.count(func.distinct(PhoneRequest.project_id))).filter(
-                PhoneRequest.user_id == current_user_id,
-                PhoneRequest.created_at.between(start_date, end_date)
-            ).scalar() or 0
-            
-            # 每日平均请求数
-            daily_avg = request_count / (date_range + 1) if date_range > 0 else request_count
-            
-            data = [{
-                'period_start': start_date.strftime('%Y-%m-%d'),
-                'period_end': end_date.strftime('%Y-%m-%d'),
-                'total_days': date_range + 1,
-                'total_requests': request_count,
-                'successful_requests': successful_count,
-                'success_rate': round(success_rate, 2),
-                'total_cost': abs(total_cost),
-                'daily_average_requests': round(daily_avg, 2),
-                'project_count': project_count
-            }]
+        data = build_statistics_report(current_user_id, start_date, end_date, report_type, project_code)
         
         # 生成文件名
         filename = f"statistics_{report_type}_{start_date_str}_to_{end_date_str}"
         
-        # 根据格式导出
-        if export_format == 'json':
-            # 导出为JSON
-            json_data = json.dumps(data, ensure_ascii=False, indent=2)
-            response = make_response(json_data)
-            response.headers['Content-Disposition'] = f'attachment; filename={filename}.json'
-            response.headers['Content-Type'] = 'application/json'
-            return response
-            
-        elif export_format == 'csv':
-            # 导出为CSV
-            if not data:
-                return jsonify({
-                    'status': 'error',
-                    'message': '没有数据可导出'
-                }), 404
-                
-            # 创建CSV
-            output = StringIO()
-            writer = csv.DictWriter(output, fieldnames=data[0].keys())
-            writer.writeheader()
-            writer.writerows(data)
-            
-            response = make_response(output.getvalue())
-            response.headers['Content-Disposition'] = f'attachment; filename={filename}.csv'
-            response.headers['Content-Type'] = 'text/csv'
-            return response
-            
-        else:  # excel
-            # 导出为Excel
-            if not data:
-                return jsonify({
-                    'status': 'error',
-                    'message': '没有数据可导出'
-                }), 404
-                
-            # 创建Excel
-            df = pd.DataFrame(data)
-            output = BytesIO()
-            
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False, sheet_name=report_type.capitalize())
-                
-                # 调整列宽
-                worksheet = writer.sheets[report_type.capitalize()]
-                for i, col in enumerate(df.columns):
-                    max_len = max(df[col].astype(str).map(len).max(), len(col)) + 2
-                    worksheet.column_dimensions[get_column_letter(i + 1)].width = max_len
-            
-            output.seek(0)
-            
-            response = make_response(output.getvalue())
-            response.headers['Content-Disposition'] = f'attachment; filename={filename}.xlsx'
-            response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            return response
+        content = render_statistics_report(data, export_format, report_type)
+        if content is None:
+            return jsonify({
+                'status': 'error',
+                'message': '没有数据可导出'
+            }), 404
+        
+        extension, content_type = REPORT_FORMATS[export_format]
+        response = make_response(content)
+        response.headers['Content-Disposition'] = f'attachment; filename={filename}.{extension}'
+        response.headers['Content-Type'] = content_type
+        return response
             
     except ValueError as e:
         return jsonify({
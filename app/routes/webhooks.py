@@ -0,0 +1,90 @@
+from flask import Blueprint, request, jsonify, current_app
+from app.services.sms_ingest import sms_ingest, parse_delivery, IngestQueueFull
+import hmac
+import hashlib
+
+# 创建蓝图
+webhooks_bp = Blueprint('webhooks', __name__)
+
+# 注册到应用时启动写库线程，数据库不可用时在启动阶段报错
+webhooks_bp.record_once(lambda state: sms_ingest.init_app(state.app))
+
+
+def verify_signature(provider, body, signature):
+    """
+    校验上游推送签名
+
+    签名为 HMAC-SHA256(平台密钥, 原始请求体) 的十六进制，
+    通过 X-Signature 请求头传递，可带 "sha256=" 前缀。
+    """
+    secret = (current_app.config.get('SMS_WEBHOOK_SECRETS') or {}).get(provider)
+    if not secret or not signature:
+        return False
+    if signature.startswith('sha256='):
+        signature = signature[len('sha256='):]
+    expected = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+@webhooks_bp.route('/sms', methods=['POST'])
+def receive_sms():
+    """
+    接收上游推送的短信
+
+    请求头:
+        X-Provider: 上游平台名称（默认 default）
+        X-Signature: HMAC-SHA256签名
+
+    请求体:
+        单条推送 {"request_id": ..., "number": ..., "sender": ..., "content": ..., "received_at": ...}，
+        或批量推送 {"messages": [...]} / [...]，request_id和number至少提供一个
+
+    返回:
+        成功: {'message': '已接收', 'accepted': 入队数, 'duplicates': 重复数, 'rejected': 校验失败列表}, 202
+        失败: {'message': '错误信息'}, 错误状态码
+    """
+    provider = request.headers.get('X-Provider', 'default')
+    body = request.get_data(cache=True)
+    if not verify_signature(provider, body, request.headers.get('X-Signature', '')):
+        return jsonify({'message': '签名校验失败'}), 401
+
+    payload = request.get_json(silent=True)
+    if payload is None:
+        return jsonify({'message': '请求体必须是JSON'}), 400
+
+    if isinstance(payload, dict) and 'messages' in payload:
+        items = payload['messages']
+    elif isinstance(payload, list):
+        items = payload
+    else:
+        items = [payload]
+
+    max_batch = current_app.config.get('SMS_WEBHOOK_MAX_BATCH', 1000)
+    if not isinstance(items, list) or not items:
+        return jsonify({'message': '推送内容为空'}), 400
+    if len(items) > max_batch:
+        return jsonify({'message': f'单次最多推送{max_batch}条'}), 413
+
+    deliveries = []
+    rejected = []
+    for index, item in enumerate(items):
+        delivery, error = parse_delivery(provider, item)
+        if error:
+            rejected.append({'index': index, 'reason': error})
+        else:
+            deliveries.append(delivery)
+
+    try:
+        accepted = sms_ingest.submit(deliveries) if deliveries else 0
+    except IngestQueueFull:
+        response = jsonify({'message': '服务繁忙，请稍后重试'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
+
+    return jsonify({
+        'message': '已接收',
+        'accepted': accepted,
+        'duplicates': len(deliveries) - accepted,
+        'rejected': rejected
+    }), 202
@@ -44,6 +44,10 @@ class AsyncTask:
         self.progress = 0
         self.total = 100
     
+    def start(self):
+        """标记任务开始执行"""
+        self.status = "running"
+    
     def update_progress(self, progress, total=100):
         """更新任务进度"""
         self.progress = progress
@@ -62,6 +66,11 @@ class AsyncTask:
         self.error = error
         self.end_time = time.time()
     
+    def cancel(self):
+        """标记任务已取消"""
+        self.status = "cancelled"
+        self.end_time = time.time()
+    
     def to_dict(self):
         """将任务转换为字典"""
         duration = None
@@ -127,6 +136,7 @@ class AsyncTaskManager:
         
         @run_async
         def _task_wrapper():
+            task.start()
             try:
                 result = func(*args, **kwargs)
                 task.complete(result)
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+接码平台API的asyncio客户端
+
+与 app.utils.SMSApiClient 提供相同的方法，适合批量接口和后台轮询在
+单个线程内并发发起大量上游请求。依赖aiohttp（可选依赖）。
+
+与同步客户端共用 app.services.resilience 中按上游和操作命名的熔断器、
+重试预算，并遵守当前上下文中的截止时间（deadline），两种客户端看到的
+上游健康状态是一致的。
+
+用法:
+    async with AsyncSMSApiClient() as client:
+        results = await client.get_phone_numbers('wechat_login', 50)
+"""
+
+import time
+import asyncio
+import logging
+from app.config import get_config
+from app.services.resilience import (
+    CircuitOpenError, get_breaker, get_retry_budget, remaining_time, backoff_delay
+)
+from app.services.monitoring import metrics_collector
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+class AsyncSMSApiClient:
+    """接码平台API异步客户端"""
+
+    def __init__(self, base_url=None, api_key=None, use_mock=None, max_connections=None,
+                 max_in_flight=None, connect_timeout=None, read_timeout=None):
+        """
+        初始化异步API客户端
+
+        参数:
+            base_url (str, optional): API基础URL
+            api_key (str, optional): API密钥
+            use_mock (bool, optional): 是否使用模拟API
+            max_connections (int, optional): 连接池最大连接数
+            max_in_flight (int, optional): call_many的最大并发数
+            connect_timeout (float, optional): 连接超时（秒）
+            read_timeout (float, optional): 读取超时（秒）
+        """
+        config = get_config()
+        self.base_url = base_url or getattr(config, 'SMS_API_BASE_URL', '')
+        self.api_key = api_key if api_key is not None else getattr(config, 'SMS_API_KEY', '')
+        self.max_connections = max_connections or getattr(config, 'SMS_API_POOL_MAXSIZE', 32)
+        self.max_in_flight = max_in_flight or getattr(config, 'SMS_API_MAX_IN_FLIGHT', 8)
+        self.connect_timeout = connect_timeout or getattr(config, 'SMS_API_CONNECT_TIMEOUT', 3)
+        self.read_timeout = read_timeout or getattr(config, 'SMS_API_READ_TIMEOUT', 10)
+        self._session = None
+
+        # 容错配置与同步客户端相同
+        self.deadlines = getattr(config, 'SMS_API_DEADLINES', {})
+        self.default_deadline = getattr(config, 'SMS_API_DEFAULT_DEADLINE', 10)
+        self.max_retries = getattr(config, 'SMS_API_MAX_RETRIES', 2)
+        self.retryable_ops = getattr(config, 'SMS_API_RETRYABLE_OPS', ())
+        self.retry_budget_ratio = getattr(config, 'SMS_API_RETRY_BUDGET_RATIO', 0.1)
+        self.breaker_threshold = getattr(config, 'SMS_API_BREAKER_FAILURE_THRESHOLD', 5)
+        self.breaker_reset_timeout = getattr(config, 'SMS_API_BREAKER_RESET_TIMEOUT', 30)
+
+        self.use_mock = getattr(config, 'USE_MOCK_API', True) if use_mock is None else use_mock
+        if self.use_mock:
+            from app.mock_api import mock_api
+            self.mock_api = mock_api
+        elif aiohttp is None:
+            raise RuntimeError("AsyncSMSApiClient需要安装aiohttp")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _get_session(self):
+        """获取当前事件循环内共享的会话（懒加载）"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                keepalive_timeout=30
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={
+                    'Authorization': f'Bearer {self.api_key}',
+                    'Content-Type': 'application/json'
+                },
+                timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+            )
+        return self._session
+
+    async def close(self):
+        """关闭连接池"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _send(self, method, url, timeout, **kwargs):
+        """
+        发送一次请求
+
+        返回:
+            tuple: (结果, 是否上游故障, 是否可安全重试)
+        """
+        try:
+            async with self._get_session().request(method, url, timeout=timeout, **kwargs) as response:
+                try:
+                    data = await response.json(content_type=None)
+                except ValueError:
+                    text = await response.text()
+                    logger.error(f"API响应不是有效的JSON: {text}")
+                    return ({'success': False, 'message': '无法解析API响应', 'status_code': response.status},
+                            response.status >= 500, False)
+                if response.status >= 400:
+                    logger.error(f"HTTP错误: {response.status}, API错误: {data}")
+                return data, response.status >= 500, False
+        except aiohttp.ClientConnectionError as e:
+            if isinstance(e, aiohttp.ServerDisconnectedError):
+                # 请求可能已经到达上游
+                logger.error(f"请求异常: {method} {url}: {e}")
+                return {'success': False, 'message': f'请求异常: {str(e)}'}, True, False
+            # 请求未到达上游，任何操作都可以安全重试
+            logger.error(f"连接上游失败: {method} {url}: {e}")
+            return {'success': False, 'message': f'请求异常: {str(e)}'}, True, True
+        except asyncio.TimeoutError:
+            logger.error(f"请求超时: {method} {url}")
+            return {'success': False, 'message': '请求超时'}, True, False
+        except aiohttp.ClientError as e:
+            logger.error(f"请求异常: {method} {url}: {e}")
+            return {'success': False, 'message': f'请求异常: {str(e)}'}, True, False
+
+    async def _request(self, op, method, path, **kwargs):
+        """
+        带容错的上游请求，规则与 SMSApiClient._request 相同
+
+        - 熔断器打开时直接抛出 CircuitOpenError
+        - 超时时间不超过操作截止时间和当前上下文截止时间中较早的一个
+        - 在重试预算内对可重试的失败做带抖动的退避重试
+        """
+        name = f"{self.base_url}:{op}"
+        url = f"{self.base_url}{path}"
+        budget_seconds = self.deadlines.get(op, self.default_deadline)
+        context_remaining = remaining_time()
+        if context_remaining is not None:
+            budget_seconds = min(budget_seconds, context_remaining)
+        if budget_seconds <= 0:
+            # 截止时间已过，不占用熔断器的半开试探名额
+            metrics_collector.record_upstream_event(name, 'deadline_exceeded')
+            return {'success': False, 'message': '上游请求超过截止时间'}
+        expires_at = time.monotonic() + budget_seconds
+
+        breaker = get_breaker(name, self.breaker_threshold, self.breaker_reset_timeout)
+        budget = get_retry_budget(self.base_url, self.retry_budget_ratio)
+        breaker.allow()
+        budget.deposit()
+
+        attempt = 0
+        while True:
+            remaining = expires_at - time.monotonic()
+            timeout = aiohttp.ClientTimeout(
+                total=remaining,
+                sock_connect=min(self.connect_timeout, remaining),
+                sock_read=min(self.read_timeout, remaining)
+            )
+            result, failed, safe_to_retry = await self._send(method, url, timeout, **kwargs)
+            if not failed:
+                breaker.record_success()
+                return result
+
+            breaker.record_failure()
+            if attempt >= self.max_retries or not (safe_to_retry or op in self.retryable_ops):
+                return result
+            if not budget.try_withdraw():
+                metrics_collector.record_upstream_event(name, 'retry_budget_exhausted')
+                return result
+
+            delay = backoff_delay(attempt)
+            if time.monotonic() + delay >= expires_at:
+                metrics_collector.record_upstream_event(name, 'deadline_exceeded')
+                return result
+            await asyncio.sleep(delay)
+            attempt += 1
+            metrics_collector.record_upstream_event(name, 'retry')
+            # 重试期间熔断器可能已经打开
+            breaker.allow()
+
+    async def call_many(self, func, calls):
+        """
+        并发调用上游接口，最多 max_in_flight 个请求同时在途
+
+        参数:
+            func (coroutine function): 要调用的客户端方法，例如 self.get_phone_number
+            calls (list): 每次调用的参数元组列表
+
+        返回:
+            list: 与calls顺序一致的结果列表，异常会被转换为失败结果
+        """
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        async def _call(args):
+            async with semaphore:
+                try:
+                    return await func(*args)
+                except CircuitOpenError as e:
+                    return {'success': False, 'message': str(e), 'retry_after': e.retry_after}
+                except Exception as e:
+                    logger.error(f"并发调用上游接口异常: {e}")
+                    return {'success': False, 'message': f'请求异常: {str(e)}'}
+
+        return await asyncio.gather(*[_call(args) for args in calls])
+
+    async def get_phone_numbers(self, project_code, count):
+        """并发获取多个手机号码"""
+        return await self.call_many(self.get_phone_number, [(project_code,)] * count)
+
+    async def get_projects(self):
+        """获取所有可用项目"""
+        if self.use_mock:
+            return self.mock_api.get_projects()
+        return await self._request('get_projects', 'GET', '/projects')
+
+    async def search_projects(self, keyword):
+        """搜索项目"""
+        if self.use_mock:
+            return self.mock_api.search_projects(keyword)
+        return await self._request('search_projects', 'GET', '/projects/search', params={'keyword': keyword})
+
+    async def get_phone_number(self, project_code):
+        """获取手机号码"""
+        if self.use_mock:
+            return self.mock_api.get_phone_number(project_code)
+        return await self._request('get_phone_number', 'POST', '/numbers', json={'project_code': project_code})
+
+    async def get_specific_phone_number(self, project_code, number):
+        """获取指定手机号码"""
+        if self.use_mock:
+            return self.mock_api.get_specific_phone_number(project_code, number)
+        data = {
+            'project_code': project_code,
+            'number': number
+        }
+        return await self._request('get_specific_phone_number', 'POST', '/numbers/specific', json=data)
+
+    async def release_phone_number(self, request_id):
+        """释放手机号码"""
+        if self.use_mock:
+            return self.mock_api.release_phone_number(request_id)
+        return await self._request('release_phone_number', 'POST', f'/numbers/{request_id}/release')
+
+    async def blacklist_phone_number(self, number, reason=None):
+        """拉黑手机号码"""
+        if self.use_mock:
+            return self.mock_api.blacklist_phone_number(number, reason)
+        data = {
+            'number': number,
+            'reason': reason
+        }
+        return await self._request('blacklist_phone_number', 'POST', '/numbers/blacklist', json=data)
+
+    async def get_sms_code(self, request_id):
+        """获取短信验证码"""
+        if self.use_mock:
+            return self.mock_api.get_sms_code(request_id)
+        return await self._request('get_sms_code', 'GET', f'/sms/{request_id}')
+
+    async def check_balance(self):
+        """查询账户余额"""
+        if self.use_mock:
+            return self.mock_api.check_balance()
+        return await self._request('check_balance', 'GET', '/account/balance')
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+余额扣费服务
+
+扣费使用单条条件UPDATE完成“检查余额 + 扣减”，不在Python中读取后再写回，
+并发请求不会丢失更新，也不会把余额扣成负数。
+"""
+
+import logging
+from sqlalchemy import update, select
+from app.services import rollups
+from app.services.stats_cache import stats_cache
+
+logger = logging.getLogger(__name__)
+
+class InsufficientBalanceError(Exception):
+    """余额不足异常"""
+    def __init__(self, user_id, amount):
+        self.user_id = user_id
+        self.amount = amount
+        super().__init__(f"用户 {user_id} 余额不足，需要: {amount}")
+
+def conditional_debit(session, users_table, user_id, amount):
+    """
+    原子扣减余额
+
+    执行 UPDATE users SET balance = balance - :p WHERE id = :id AND balance >= :p，
+    支持RETURNING的数据库直接返回新余额，否则在同一事务内回读。
+
+    参数:
+        session: 数据库会话
+        users_table (Table): 用户表
+        user_id (int): 用户ID
+        amount (float): 扣减金额
+
+    返回:
+        float: 扣减后的余额
+
+    异常:
+        InsufficientBalanceError: 余额不足或用户不存在
+    """
+    stmt = (update(users_table)
+        .where(users_table.c.id == user_id, users_table.c.balance >= amount)
+        .values(balance=users_table.c.balance - amount))
+
+    dialect = session.get_bind().dialect
+    if getattr(dialect, 'update_returning', False):
+        row = session.execute(stmt.returning(users_table.c.balance)).first()
+        if row is None:
+            raise InsufficientBalanceError(user_id, amount)
+        return row[0]
+
+    result = session.execute(stmt)
+    if result.rowcount != 1:
+        raise InsufficientBalanceError(user_id, amount)
+    # 该行已被本事务锁定，回读的就是本次扣减后的余额
+    return session.execute(select(users_table.c.balance).where(users_table.c.id == user_id)).scalar()
+
+def conditional_credit(session, users_table, user_id, amount):
+    """原子增加余额（退款），返回增加后的余额"""
+    stmt = (update(users_table)
+        .where(users_table.c.id == user_id)
+        .values(balance=users_table.c.balance + amount))
+
+    dialect = session.get_bind().dialect
+    if getattr(dialect, 'update_returning', False):
+        row = session.execute(stmt.returning(users_table.c.balance)).first()
+        return row[0] if row else None
+
+    session.execute(stmt)
+    return session.execute(select(users_table.c.balance).where(users_table.c.id == user_id)).scalar()
+
+def debit_balance(user_id, amount, description='', reference_id=None, tx_type='consume',
+                  project_id=None, quantity=0, at=None):
+    """
+    扣费并写入交易记录
+
+    扣费和交易记录在当前事务中一起写入，由调用方与业务数据一起提交或回滚。
+    给出 project_id 时同时把取号数 quantity 和消费金额计入统计汇总表，
+    at 为号码的取号时间。
+
+    返回:
+        float: 扣减后的余额
+    """
+    from app.models import db, User, Transaction
+
+    new_balance = conditional_debit(db.session, User.__table__, user_id, amount)
+    db.session.add(Transaction(
+        user_id=user_id,
+        amount=-amount,
+        balance=new_balance,
+        type=tx_type,
+        description=description,
+        reference_id=reference_id
+    ))
+    if project_id is not None:
+        rollups.record(user_id, project_id, at=at, numbers=quantity, spend=amount)
+    stats_cache.invalidate_user(user_id)
+    return new_balance
+
+def credit_balance(user_id, amount, description='', reference_id=None, tx_type='refund',
+                   project_id=None, at=None):
+    """
+    退款并写入交易记录
+
+    给出 project_id 时把退款计入统计汇总表中取号时间 at 所在的桶。
+
+    返回:
+        float: 增加后的余额
+    """
+    from app.models import db, User, Transaction
+
+    new_balance = conditional_credit(db.session, User.__table__, user_id, amount)
+    db.session.add(Transaction(
+        user_id=user_id,
+        amount=amount,
+        balance=new_balance,
+        type=tx_type,
+        description=description,
+        reference_id=reference_id
+    ))
+    if project_id is not None:
+        rollups.record(user_id, project_id, at=at, refunds=amount)
+    stats_cache.invalidate_user(user_id)
+    return new_balance
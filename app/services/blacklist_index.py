@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+黑名单号码索引
+
+黑名单号码按数值排序后连同一个布隆过滤器写入一个文件，各工作进程只读
+mmap 同一个文件：先查布隆过滤器，大多数不在黑名单中的号码在这里就返回，
+其余再在排序数组上二分查找，整个过程不访问数据库。
+
+文件格式（本机字节序，只在同一台机器的进程间共享）:
+    头部: 魔数、水位（已收录的最大黑名单ID）、号码数、过滤器位数、哈希次数
+    布隆过滤器位数组
+    排序后的号码数组（uint64，高5位为号码位数，其余为号码数值）
+
+新增黑名单后由写入的进程增量合并新号码，写临时文件后原子替换；其他进程
+定期检查文件是否被替换并重新映射。
+"""
+
+import os
+import mmap
+import time
+import heapq
+import struct
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+from flask import current_app
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，只能单进程使用
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b'BLIDX002'
+_HEADER = struct.Struct('=8sQQQQ')  # 魔数、水位、号码数、过滤器位数、哈希次数
+_MASK = (1 << 64) - 1
+# 号码位数存放在高5位，低59位最多容纳17位数字
+_LENGTH_SHIFT = 59
+_MAX_DIGITS = 17
+
+# 每个号码占用的过滤器位数和哈希次数，误判率约1%
+_BITS_PER_ENTRY = 10
+_HASHES = 7
+_MIN_CAPACITY = 1024
+
+# 增量合并时回看的ID范围：并发事务提交顺序和ID分配顺序不一定一致，
+# 重复读到的号码合并时会去重
+_REWIND = 1000
+
+def normalize_number(number):
+    """
+    把号码转换为索引中使用的整数
+
+    数字位数和数值一起编码，带前导零的号码（如 0123）不会与去掉零的号码（123）相同。
+
+    返回:
+        int: 号码中的数字位数和数值组成的整数，无法转换时为None
+    """
+    if number is None:
+        return None
+    digits = str(number)
+    if not digits.isdigit():
+        digits = ''.join(char for char in digits if char.isdigit())
+    if not digits or len(digits) > _MAX_DIGITS:
+        return None
+    return (len(digits) << _LENGTH_SHIFT) | int(digits)
+
+def _hash(value):
+    """号码的两个哈希值，布隆过滤器中第i个位置为 (h1 + i * h2) % 位数"""
+    h = (value * 0x9E3779B97F4A7C15) & _MASK
+    h ^= h >> 31
+    h = (h * 0xBF58476D1CE4E5B9) & _MASK
+    h ^= h >> 29
+    return h & 0xFFFFFFFF, (h >> 32) | 1
+
+class _View:
+    """一次映射的索引文件"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.watermark, self.count, self.bits, self.hashes = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"黑名单索引文件格式不正确: {path}")
+        self._bloom_offset = _HEADER.size
+        bloom_size = self.bits // 8
+        offset = self._bloom_offset + bloom_size
+        self.numbers = memoryview(self._mm)[offset:offset + self.count * 8].cast('Q')
+        self.bloom = memoryview(self._mm)[self._bloom_offset:self._bloom_offset + bloom_size]
+
+    def __contains__(self, value):
+        bloom = self.bloom
+        bits = self.bits
+        h1, h2 = _hash(value)
+        for i in range(self.hashes):
+            position = (h1 + i * h2) % bits
+            if not bloom[position >> 3] & (1 << (position & 7)):
+                return False
+        return self.has(value)
+
+    def has(self, value):
+        """只在排序数组上二分查找，不经过布隆过滤器"""
+        numbers = self.numbers
+        index = bisect_left(numbers, value)
+        return index < self.count and numbers[index] == value
+
+class BlacklistIndex:
+    """多进程共享的黑名单号码索引"""
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(BlacklistIndex, cls).__new__(cls)
+                cls._instance._initialized = False
+            return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        self._app = None
+        self._view = None
+        self._checked_at = float('-inf')
+        self._refresh_lock = threading.Lock()
+        # 本进程新增但还没写进索引文件的号码（写文件失败时兜底）
+        self._pending = set()
+
+        self.stats = {
+            "lookups": 0,  # 查询次数
+            "hits": 0,  # 命中黑名单次数
+            "fallbacks": 0,  # 索引不可用时回退到数据库查询的次数
+            "remaps": 0,  # 重新映射索引文件的次数
+            "rebuilds": 0,  # 本进程写索引文件的次数
+            "last_build_seconds": 0.0,  # 上一次写索引文件耗时（秒）
+        }
+
+        self._initialized = True
+
+    def init_app(self, app):
+        """绑定应用实例，映射索引文件，文件不存在或落后于数据库时先重建"""
+        with self._lock:
+            if self._app is not None:
+                return
+            self._app = app
+
+        try:
+            with app.app_context():
+                self.refresh()
+        except Exception as e:
+            logger.error(f"加载黑名单索引失败，暂时回退到数据库查询: {str(e)}")
+
+    def _config(self, key, default=None):
+        app = self._app or current_app
+        return app.config.get(key, default)
+
+    def _path(self):
+        return self._config('BLACKLIST_INDEX_PATH', 'instance/blacklist.idx')
+
+    def _maybe_remap(self):
+        """定期检查索引文件是否被其他进程替换"""
+        now = time.monotonic()
+        if now - self._checked_at < self._config('BLACKLIST_INDEX_CHECK_INTERVAL', 1):
+            return self._view
+        self._checked_at = now
+
+        path = self._path()
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return self._view
+        view = self._view
+        if view is None or view.identity != (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+            try:
+                view = _View(path)
+            except (OSError, ValueError) as e:
+                logger.error(f"映射黑名单索引失败: {str(e)}")
+                return self._view
+            self._view = view
+            self._pending = {value for value in self._pending if value not in view}
+            self.stats["remaps"] += 1
+        return view
+
+    def contains(self, number):
+        """
+        号码是否在黑名单中
+
+        索引不可用时回退到数据库查询。
+        """
+        self.stats["lookups"] += 1
+        value = normalize_number(number)
+        view = self._maybe_remap()
+        if view is None or value is None:
+            from app.models import BlacklistedNumber
+
+            self.stats["fallbacks"] += 1
+            found = BlacklistedNumber.query.filter_by(number=number).first() is not None
+        else:
+            found = value in view or value in self._pending
+        if found:
+            self.stats["hits"] += 1
+        return found
+
+    def missing(self, numbers):
+        """
+        过滤出不在黑名单中的号码（批量导入用）
+
+        索引不可用时按批查询数据库。
+
+        返回:
+            list: 不在黑名单中的号码，保持原有顺序
+        """
+        view = self._maybe_remap()
+        if view is not None:
+            result = []
+            for number in numbers:
+                value = normalize_number(number)
+                if value is None or (value not in view and value not in self._pending):
+                    result.append(number)
+            return result
+
+        from app.models import db, BlacklistedNumber
+
+        self.stats["fallbacks"] += 1
+        existing = set()
+        for i in range(0, len(numbers), 500):
+            existing.update(number for number, in db.session.query(BlacklistedNumber.number).filter(
+                BlacklistedNumber.number.in_(numbers[i:i + 500])
+            ))
+        return [number for number in numbers if number not in existing]
+
+    def refresh(self):
+        """
+        把数据库中新增的黑名单号码合并进索引文件
+
+        多进程之间用文件锁串行，拿到锁后以文件中的水位为准，其他进程刚合并过的不会重复处理。
+
+        返回:
+            int: 新合并的号码数
+        """
+        from app.models import db, BlacklistedNumber
+
+        path = self._path()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        with self._refresh_lock, open(path + '.lock', 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                current = None
+                if os.path.exists(path):
+                    try:
+                        current = _View(path)
+                    except (OSError, ValueError) as e:
+                        logger.warning(f"黑名单索引文件损坏或格式已过期，将全量重建: {str(e)}")
+
+                watermark = current.watermark if current else 0
+                rows = db.session.query(BlacklistedNumber.id, BlacklistedNumber.number).filter(
+                    BlacklistedNumber.id > max(watermark - _REWIND, 0)
+                ).all()
+                if current is not None and not rows:
+                    self._view = current
+                    return 0
+
+                started = time.monotonic()
+                # 新号码大多不在索引中，直接二分查找比先查布隆过滤器更快
+                added = sorted({
+                    value for value in (normalize_number(number) for _, number in rows)
+                    if value is not None and (current is None or not current.has(value))
+                })
+                watermark = max([watermark] + [row_id for row_id, _ in rows])
+                self._write(path, current, added, watermark)
+                self._view = _View(path)
+                self._checked_at = time.monotonic()
+                self.stats["rebuilds"] += 1
+                self.stats["last_build_seconds"] = round(time.monotonic() - started, 3)
+                if added:
+                    logger.info(f"黑名单索引合并 {len(added)} 个号码，共 {self._view.count} 个，"
+                                f"耗时 {self.stats['last_build_seconds']} 秒")
+                return len(added)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write(self, path, current, added, watermark):
+        """合并排序数组和布隆过滤器，写入临时文件后原子替换"""
+        count = (current.count if current else 0) + len(added)
+        if current is not None and count <= current.bits // _BITS_PER_ENTRY:
+            # 容量够用时沿用原有的过滤器，只补上新号码的位
+            bits, hashes = current.bits, current.hashes
+            bloom = bytearray(current.bloom)
+            new_values = added
+        else:
+            # 容量翻倍后全量重建过滤器
+            capacity = max(_MIN_CAPACITY, count * 2)
+            bits, hashes = capacity * _BITS_PER_ENTRY, _HASHES
+            bits += -bits % 64
+            bloom = bytearray(bits // 8)
+            new_values = None
+
+        if current is not None and current.count:
+            numbers = array('Q', heapq.merge(current.numbers, added))
+        else:
+            numbers = array('Q', added)
+
+        for value in (numbers if new_values is None else new_values):
+            h1, h2 = _hash(value)
+            for i in range(hashes):
+                position = (h1 + i * h2) % bits
+                bloom[position >> 3] |= 1 << (position & 7)
+
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, watermark, len(numbers), bits, hashes))
+            f.write(bloom)
+            numbers.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+    def added(self, numbers):
+        """
+        新增黑名单号码已提交后调用：立即对本进程可见，并合并进索引文件
+
+        参数:
+            numbers: 新增的号码
+        """
+        values = {normalize_number(number) for number in numbers}
+        values.discard(None)
+        self._pending |= values
+        try:
+            self.refresh()
+            self._pending -= values
+        except Exception as e:
+            logger.error(f"更新黑名单索引失败: {str(e)}")
+
+    def snapshot(self):
+        """获取索引状态"""
+        view = self._view
+        return {
+            "path": self._path() if self._app else None,
+            "loaded": view is not None,
+            "count": view.count if view else 0,
+            "watermark": view.watermark if view else 0,
+            "bloom_bits": view.bits if view else 0,
+            "pending": len(self._pending),
+            "stats": dict(self.stats)
+        }
+
+def mark_blacklisted(condition):
+    """
+    一条UPDATE把匹配的号码记录标记为拉黑（在调用方的事务中执行，不提交）
+
+    参数:
+        condition: phone_numbers 表上的过滤条件
+
+    返回:
+        list: 被修改的号码行（request_id, user_id, project_id, number, status）
+    """
+    from datetime import datetime
+    from sqlalchemy import update, select
+    from app.models import db, PhoneNumber
+
+    phones = PhoneNumber.__table__
+    where = (condition, phones.c.status != 'blacklisted')
+    columns = (phones.c.request_id, phones.c.user_id, phones.c.project_id, phones.c.number)
+    stmt = update(phones).where(*where).values(status='blacklisted', updated_at=datetime.utcnow())
+
+    if getattr(db.session.get_bind().dialect, 'update_returning', False):
+        rows = db.session.execute(stmt.returning(*columns)).all()
+    else:
+        rows = db.session.execute(select(*columns).where(*where)).all()
+        db.session.execute(stmt)
+    return [
+        {'request_id': request_id, 'user_id': user_id, 'project_id': project_id,
+         'number': number, 'status': 'blacklisted'}
+        for request_id, user_id, project_id, number in rows
+    ]
+
+# 创建黑名单索引实例
+blacklist_index = BlacklistIndex()
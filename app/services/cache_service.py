@@ -1,14 +1,22 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import sys
 import time
 import json
 import logging
 import threading
 import hashlib
-import pickle
+import zlib
+import uuid
+import math
+import random
+import datetime
+from decimal import Decimal
+from collections import OrderedDict
 from functools import wraps
 from app.config import get_config
+from app.services.local_redis import redis_from_url
 
 logger = logging.getLogger(__name__)
 
@@ -26,64 +34,269 @@ class CacheBackend:
     def flush(self):
         raise NotImplementedError
 
+class _Stripe:
+    """缓存分段：一把锁保护一个按访问顺序排列的 OrderedDict（队首最久未用）"""
+    __slots__ = ('lock', 'entries', 'capacity', 'bytes', 'hits', 'misses', 'evictions', 'expired')
+
+    def __init__(self, capacity):
+        self.lock = threading.Lock()
+        # key -> (value, 过期时间, 估算字节数)
+        self.entries = OrderedDict()
+        self.capacity = capacity
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def remove(self, key):
+        entry = self.entries.pop(key)
+        self.bytes -= entry[2]
+        return entry
+
+_NEVER = float('inf')
+
 class MemoryCache(CacheBackend):
-    """内存缓存后端"""
-    _instance = None
-    _lock = threading.Lock()
-    
-    def __new__(cls):
-        with cls._lock:
-            if cls._instance is None:
-                cls._instance = super(MemoryCache, cls).__new__(cls)
-                cls._instance._cache = {}
-                cls._instance._expires = {}
-            return cls._instance
-    
+    """
+    内存缓存后端：容量固定的分段LRU + TTL
+
+    - 按键的哈希分到若干分段，每段一把锁，threaded=True 下多个线程并发读写
+      不同分段互不阻塞；每段各自按LRU淘汰，容量为总容量/分段数
+    - 过期键除了读取时删除，写入时顺带检查队首最久未用的两个条目，后台线程
+      再定期分批扫描清理，长期不再访问的令牌等不会一直占着内存
+    - stats() 返回命中、未命中、淘汰、过期清理次数和估算的字节数，
+      后台线程同时上报给 MetricsCollector
+    """
+
+    def __init__(self, max_entries=100000, stripes=16, sweep_interval=30, name='memory'):
+        # 分段数取2的幂，用位运算定位分段
+        count = 1
+        while count < stripes:
+            count <<= 1
+        self._mask = count - 1
+        self._stripes = [_Stripe(max(1, max_entries // count)) for _ in range(count)]
+        self.max_entries = max_entries
+        self.name = name
+
+        self._sweep_interval = sweep_interval
+        self._stop_event = threading.Event()
+        self._thread = None
+        if sweep_interval:
+            self._thread = threading.Thread(target=self._sweep_loop, daemon=True)
+            self._thread.start()
+
     def get(self, key):
         """获取缓存值"""
-        # 检查过期
-        if key in self._expires and self._expires[key] < time.time():
-            self.delete(key)
-            return None
-            
-        # 返回值
-        return self._cache.get(key)
-    
+        stripe = self._stripes[hash(key) & self._mask]
+        with stripe.lock:
+            entry = stripe.entries.get(key)
+            if entry is None:
+                stripe.misses += 1
+                return None
+            if entry[1] <= time.time():
+                stripe.remove(key)
+                stripe.expired += 1
+                stripe.misses += 1
+                return None
+            stripe.entries.move_to_end(key)
+            stripe.hits += 1
+            return entry[0]
+
     def set(self, key, value, ttl=None):
-        """设置缓存值"""
-        self._cache[key] = value
-        
-        # 设置过期时间
-        if ttl is not None:
-            self._expires[key] = time.time() + ttl
-    
+        """设置缓存值，容量已满时淘汰最久未用的条目"""
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else _NEVER
+        # 估算的浅层大小，容器内的元素不计入
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+        stripe = self._stripes[hash(key) & self._mask]
+        with stripe.lock:
+            entries = stripe.entries
+            old = entries.pop(key, None)
+            if old is not None:
+                stripe.bytes -= old[2]
+            entries[key] = (value, expires_at, size)
+            stripe.bytes += size
+            # 顺带检查最久未用的条目，过期的直接删除，均摊到每次写入
+            for _ in range(2):
+                oldest = next(iter(entries), None)
+                if oldest is None or entries[oldest][1] > now:
+                    break
+                stripe.remove(oldest)
+                stripe.expired += 1
+            while len(entries) > stripe.capacity:
+                stripe.remove(next(iter(entries)))
+                stripe.evictions += 1
+
     def delete(self, key):
         """删除缓存值"""
-        if key in self._cache:
-            del self._cache[key]
-        if key in self._expires:
-            del self._expires[key]
-    
+        stripe = self._stripes[hash(key) & self._mask]
+        with stripe.lock:
+            if key in stripe.entries:
+                stripe.remove(key)
+
     def flush(self):
         """清空缓存"""
-        self._cache.clear()
-        self._expires.clear()
+        for stripe in self._stripes:
+            with stripe.lock:
+                stripe.entries.clear()
+                stripe.bytes = 0
+
+    def sweep(self, batch=1000):
+        """
+        清理所有分段中已过期的条目
+
+        先在锁内复制分段的键列表，再每次持锁检查batch个键，检查完释放锁再继续，
+        不会长时间阻塞读写。
+
+        返回:
+            int: 清理的条目数
+        """
+        removed = 0
+        now = time.time()
+        for stripe in self._stripes:
+            with stripe.lock:
+                keys = list(stripe.entries)
+            for i in range(0, len(keys), batch):
+                with stripe.lock:
+                    entries = stripe.entries
+                    for key in keys[i:i + batch]:
+                        entry = entries.get(key)
+                        if entry is not None and entry[1] <= now:
+                            stripe.remove(key)
+                            stripe.expired += 1
+                            removed += 1
+        return removed
+
+    def stats(self):
+        """获取缓存统计"""
+        totals = {"entries": 0, "bytes": 0, "hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+        for stripe in self._stripes:
+            with stripe.lock:
+                totals["entries"] += len(stripe.entries)
+                totals["bytes"] += stripe.bytes
+                totals["hits"] += stripe.hits
+                totals["misses"] += stripe.misses
+                totals["evictions"] += stripe.evictions
+                totals["expired"] += stripe.expired
+        lookups = totals["hits"] + totals["misses"]
+        totals["capacity"] = self.max_entries
+        totals["stripes"] = len(self._stripes)
+        totals["hit_rate"] = round(totals["hits"] / lookups, 4) if lookups else 0.0
+        return totals
+
+    def _sweep_loop(self):
+        """后台清理线程：定期清理过期条目并上报统计"""
+        from app.services.monitoring import metrics_collector
+
+        while not self._stop_event.wait(self._sweep_interval):
+            try:
+                removed = self.sweep()
+                if removed:
+                    logger.debug(f"缓存 {self.name} 清理过期条目 {removed} 个")
+                metrics_collector.record_cache(self.name, self.stats())
+            except Exception as e:
+                logger.error(f"清理缓存 {self.name} 时发生错误: {str(e)}")
+
+    def stop(self):
+        """停止后台清理线程"""
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=5)
+
+# 序列化格式不直接支持的类型编码为 {"__t": 类型, "v": 值}
+_EXTRA_TYPE_KEY = '__t'
+
+def _encode_extra(value):
+    if isinstance(value, datetime.datetime):
+        return {_EXTRA_TYPE_KEY: 'datetime', 'v': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {_EXTRA_TYPE_KEY: 'date', 'v': value.isoformat()}
+    if isinstance(value, Decimal):
+        return {_EXTRA_TYPE_KEY: 'decimal', 'v': str(value)}
+    raise TypeError(f"不支持缓存的类型: {type(value).__name__}")
+
+def _decode_extra(obj):
+    kind = obj.get(_EXTRA_TYPE_KEY)
+    if kind is None or len(obj) != 2:
+        return obj
+    if kind == 'datetime':
+        return datetime.datetime.fromisoformat(obj['v'])
+    if kind == 'date':
+        return datetime.date.fromisoformat(obj['v'])
+    if kind == 'decimal':
+        return Decimal(obj['v'])
+    return obj
+
+class CacheSerializer:
+    """
+    缓存值序列化
+
+    不使用pickle：Redis中的数据一旦被篡改，pickle.loads 可以执行任意代码。
+    安装了 msgpack 时用 msgpack（比pickle更快），否则用紧凑JSON；支持
+    dict/list/str/int/float/bool/None 以及 datetime/date/Decimal（tuple读回为list）。
+    超过阈值的内容用zlib压缩。
+
+    格式: 1字节头 + 内容。头为 M/J（msgpack/JSON），小写 m/j 表示内容经过压缩。
+    """
+
+    def __init__(self, compress_threshold=1024, compress_level=1):
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+        try:
+            import msgpack
+            self._msgpack = msgpack
+            self.format = 'msgpack'
+        except ImportError:
+            self._msgpack = None
+            self.format = 'json'
+        self._json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_encode_extra)
+
+    def dumps(self, value):
+        """序列化，不支持的类型抛出 TypeError"""
+        if self._msgpack is not None:
+            header, body = b'M', self._msgpack.packb(value, use_bin_type=True, default=_encode_extra)
+        else:
+            header, body = b'J', self._json_encoder.encode(value).encode('utf-8')
+        if self.compress_threshold is not None and len(body) > self.compress_threshold:
+            compressed = zlib.compress(body, self.compress_level)
+            if len(compressed) < len(body):
+                return header.lower() + compressed
+        return header + body
+
+    def loads(self, raw):
+        """反序列化，格式不认识（如旧版本写入的pickle数据）时抛出 ValueError"""
+        header, body = raw[:1], raw[1:]
+        if header in (b'm', b'j'):
+            body = zlib.decompress(body)
+            header = header.upper()
+        if header == b'M':
+            if self._msgpack is None:
+                raise ValueError('缓存数据为msgpack格式，但没有安装msgpack')
+            return self._msgpack.unpackb(body, raw=False, strict_map_key=False, object_hook=_decode_extra)
+        if header == b'J':
+            return json.loads(body, object_hook=_decode_extra)
+        raise ValueError('无法识别的缓存数据格式')
 
 class RedisCache(CacheBackend):
     """Redis缓存后端"""
-    def __init__(self, redis_client):
+    def __init__(self, redis_client, serializer=None):
         self.redis = redis_client
+        self.serializer = serializer or CacheSerializer()
     
     def get(self, key):
         """获取缓存值"""
         value = self.redis.get(key)
         if value:
-            return pickle.loads(value)
+            try:
+                return self.serializer.loads(value)
+            except Exception as e:
+                # 格式不对的数据按未命中处理，随后会被覆盖
+                logger.debug(f"缓存数据无法解析，按未命中处理: {key}, {str(e)}")
         return None
     
     def set(self, key, value, ttl=None):
         """设置缓存值"""
-        value_bytes = pickle.dumps(value)
+        value_bytes = self.serializer.dumps(value)
         if ttl is not None:
             self.redis.setex(key, ttl, value_bytes)
         else:
@@ -97,6 +310,155 @@ class RedisCache(CacheBackend):
         """清空缓存"""
         self.redis.flushdb()
 
+class TieredCache(CacheBackend):
+    """
+    两级缓存：进程内L1（小容量、短TTL的MemoryCache）在前，Redis共享L2在后
+
+    - 读：先查L1，未命中再查L2，查到后回填L1
+    - 写/删除：先写L2再更新本进程L1，同时在失效频道广播键名，其他进程的
+      订阅线程收到后立即删除各自L1中的旧值
+    - 广播可能丢失（订阅连接断开期间），L1的TTL（CACHE_L1_TTL）限制了
+      最长的陈旧时间；订阅重连后清空整个L1
+    - 读L2期间若收到了失效消息，读到的值不回填L1，避免旧值在失效之后
+      又被放回L1
+    """
+
+    def __init__(self, redis_client, l1, l1_ttl=30, channel='cache:invalidate', serializer=None):
+        self.l2 = RedisCache(redis_client, serializer)
+        self.redis = redis_client
+        self.l1 = l1
+        self.l1_ttl = l1_ttl
+        self.channel = channel
+        self.node_id = uuid.uuid4().hex
+        # 每收到一条失效消息加一，用于判断读L2期间是否发生过失效
+        self._generation = 0
+
+        self.stats_counters = {
+            "l1_hits": 0,
+            "l2_hits": 0,
+            "misses": 0,
+            "invalidations_sent": 0,
+            "invalidations_received": 0,
+            "subscriber_reconnects": 0,
+        }
+
+        self._stop_event = threading.Event()
+        self._subscribed = threading.Event()
+        self._thread = threading.Thread(target=self._listen, daemon=True)
+        self._thread.start()
+
+    def _l1_ttl(self, ttl):
+        return self.l1_ttl if ttl is None else min(ttl, self.l1_ttl)
+
+    def get(self, key):
+        """获取缓存值"""
+        value = self.l1.get(key)
+        if value is not None:
+            self.stats_counters["l1_hits"] += 1
+            return value
+
+        generation = self._generation
+        value = self.l2.get(key)
+        if value is None:
+            self.stats_counters["misses"] += 1
+            return None
+        self.stats_counters["l2_hits"] += 1
+        if generation == self._generation:
+            self.l1.set(key, value, self.l1_ttl)
+        return value
+
+    def set(self, key, value, ttl=None):
+        """设置缓存值并通知其他进程丢弃旧值"""
+        self.l2.set(key, value, ttl)
+        self.l1.set(key, value, self._l1_ttl(ttl))
+        self._broadcast([key])
+
+    def delete(self, key):
+        """删除缓存值并通知其他进程"""
+        self.l2.delete(key)
+        self.l1.delete(key)
+        self._broadcast([key])
+
+    def flush(self):
+        """清空缓存并通知其他进程清空L1"""
+        self.l2.flush()
+        self.l1.flush()
+        self._broadcast(None)
+
+    def _broadcast(self, keys):
+        """广播失效消息，keys为None表示清空"""
+        message = json.dumps({'node': self.node_id, 'keys': keys}, ensure_ascii=False)
+        try:
+            self.redis.publish(self.channel, message)
+            self.stats_counters["invalidations_sent"] += 1
+        except Exception as e:
+            logger.warning(f"广播缓存失效消息失败: {str(e)}")
+
+    def _handle(self, data):
+        message = json.loads(data)
+        if message.get('node') == self.node_id:
+            return
+        self._generation += 1
+        self.stats_counters["invalidations_received"] += 1
+        keys = message.get('keys')
+        if keys is None:
+            self.l1.flush()
+        else:
+            for key in keys:
+                self.l1.delete(key)
+
+    def _listen(self):
+        """订阅失效频道的后台线程，连接断开后重连并清空L1"""
+        backoff = 0.5
+        while not self._stop_event.is_set():
+            pubsub = None
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                self._subscribed.set()
+                backoff = 0.5
+                while not self._stop_event.is_set():
+                    message = pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message and message.get('type') == 'message':
+                        try:
+                            self._handle(message['data'])
+                        except ValueError:
+                            logger.warning("无法解析的缓存失效消息")
+            except Exception as e:
+                logger.warning(f"缓存失效订阅中断，{backoff} 秒后重连: {str(e)}")
+                self._subscribed.clear()
+                # 断开期间可能错过失效消息
+                self._generation += 1
+                self.l1.flush()
+                self.stats_counters["subscriber_reconnects"] += 1
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+    def wait_subscribed(self, timeout=None):
+        """等待订阅建立，返回是否已订阅"""
+        return self._subscribed.wait(timeout)
+
+    def stats(self):
+        """获取两级缓存统计"""
+        stats = dict(self.stats_counters)
+        stats["l1"] = self.l1.stats()
+        stats["serializer"] = self.l2.serializer.format
+        stats["subscribed"] = self._subscribed.is_set()
+        return stats
+
+    def stop(self):
+        """停止订阅线程和L1清理线程"""
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=5)
+        self.l1.stop()
+
 class CacheService:
     """缓存服务，提供统一的缓存接口"""
     _instance = None
@@ -116,23 +478,46 @@ class CacheService:
         config = get_config()
         cache_type = getattr(config, 'CACHE_TYPE', 'SimpleCache')
         
-        if cache_type == 'RedisCache':
+        if cache_type in ('RedisCache', 'TieredCache'):
             try:
-                import redis
                 redis_url = getattr(config, 'CACHE_REDIS_URL', 'redis://localhost:6379/0')
-                redis_client = redis.from_url(redis_url)
-                self.backend = RedisCache(redis_client)
-                logger.info(f"使用Redis缓存后端: {redis_url}")
+                redis_client = redis_from_url(redis_url)
+                serializer = CacheSerializer(getattr(config, 'CACHE_COMPRESS_THRESHOLD', 1024))
+                if cache_type == 'TieredCache':
+                    l1 = MemoryCache(
+                        max_entries=getattr(config, 'CACHE_L1_MAX_ENTRIES', 10000),
+                        stripes=getattr(config, 'CACHE_STRIPES', 16),
+                        sweep_interval=getattr(config, 'CACHE_SWEEP_INTERVAL', 30),
+                        name='l1'
+                    )
+                    self.backend = TieredCache(
+                        redis_client, l1,
+                        l1_ttl=getattr(config, 'CACHE_L1_TTL', 30),
+                        channel=getattr(config, 'CACHE_INVALIDATION_CHANNEL', 'cache:invalidate'),
+                        serializer=serializer
+                    )
+                    logger.info(f"使用两级缓存: 进程内L1 + {redis_url}")
+                else:
+                    self.backend = RedisCache(redis_client, serializer)
+                    logger.info(f"使用Redis缓存后端: {redis_url}")
             except ImportError:
                 logger.warning("找不到redis库，回退到内存缓存")
-                self.backend = MemoryCache()
+                self.backend = self._memory_backend(config)
         else:
-            self.backend = MemoryCache()
+            self.backend = self._memory_backend(config)
             logger.info("使用内存缓存后端")
         
         self.default_ttl = getattr(config, 'CACHE_DEFAULT_TIMEOUT', 300)
         self._initialized = True
     
+    @staticmethod
+    def _memory_backend(config):
+        return MemoryCache(
+            max_entries=getattr(config, 'CACHE_MAX_ENTRIES', 100000),
+            stripes=getattr(config, 'CACHE_STRIPES', 16),
+            sweep_interval=getattr(config, 'CACHE_SWEEP_INTERVAL', 30)
+        )
+    
     def get(self, key):
         """获取缓存值"""
         return self.backend.get(key)
@@ -141,7 +526,12 @@ class CacheService:
         """设置缓存值"""
         if ttl is None:
             ttl = self.default_ttl
-        return self.backend.set(key, value, ttl)
+        try:
+            return self.backend.set(key, value, ttl)
+        except (TypeError, ValueError) as e:
+            # 值不能序列化时不缓存，调用方照常使用计算结果
+            logger.warning(f"缓存值无法序列化，跳过缓存: {key}, {str(e)}")
+            return None
     
     def delete(self, key):
         """删除缓存值"""
@@ -150,6 +540,11 @@ class CacheService:
     def flush(self):
         """清空缓存"""
         return self.backend.flush()
+    
+    def stats(self):
+        """获取缓存统计，后端不支持时返回空字典"""
+        stats = getattr(self.backend, 'stats', None)
+        return stats() if stats else {}
 
     def cache_key(self, *args, **kwargs):
         """生成缓存键"""
@@ -164,27 +559,157 @@ class CacheService:
 # 创建缓存实例
 cache = CacheService()
 
-def cached(ttl=None):
-    """缓存装饰器，用于缓存函数返回值"""
+# 装饰器缓存条目的格式: [格式标记, 返回值, 刷新时间(UNIX秒), 上次计算耗时(秒)]
+_ENTRY_MARK = 'c1'
+
+class _Flight:
+    """一次进行中的计算，同一个键的并发调用等待它的结果"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.ok = False
+        self.result = None
+
+# 缓存键 -> 进行中的计算
+_flights = {}
+_flights_lock = threading.Lock()
+
+# 函数名 -> 命中统计
+_function_stats = {}
+
+def _join_flight(key):
+    """加入键对应的计算，返回 (计算, 是否由自己负责计算)"""
+    with _flights_lock:
+        flight = _flights.get(key)
+        if flight is not None:
+            return flight, False
+        flight = _flights[key] = _Flight()
+        return flight, True
+
+def _land_flight(key, flight):
+    with _flights_lock:
+        _flights.pop(key, None)
+    flight.done.set()
+
+def _default_key(args, kwargs):
+    """按参数生成键：参数JSON化后取SHA1，参数顺序和类型不同的调用不会撞键"""
+    raw = json.dumps([args, kwargs], sort_keys=True, default=repr, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def cached_function_stats():
+    """获取各个被 @cached 装饰的函数的命中统计"""
+    result = {}
+    for name, counters in list(_function_stats.items()):
+        served = counters["hits"] + counters["stale_hits"] + counters["coalesced"]
+        calls = served + counters["misses"] + counters["refreshes"]
+        result[name] = dict(counters, hit_rate=round(served / calls, 4) if calls else 0.0)
+    return result
+
+def cached(ttl=None, key=None, negative_ttl=None, stale_ttl=0, early_refresh=1.0, wait_timeout=10):
+    """
+    缓存装饰器，用于缓存函数返回值
+
+    参数:
+        ttl: 返回值的有效期（秒），默认 CACHE_DEFAULT_TIMEOUT
+        key: 键函数，接收与被装饰函数相同的参数并返回字符串；默认按全部参数生成
+        negative_ttl: 返回None时的缓存时间（秒），默认不缓存None
+        stale_ttl: 过期后还可以返回旧值的时间（秒）。这段时间内只有一个调用方
+                   重新计算，其余调用直接返回旧值
+        early_refresh: 提前刷新系数（XFetch），临近过期时按上次计算耗时随机地
+                       让某次调用提前重新计算，0 表示不提前刷新
+        wait_timeout: 未命中时等待其他调用计算结果的最长时间（秒）
+
+    同一进程内同一个键同时只计算一次，其余调用等待结果（single-flight）。
+    被装饰的函数带有 invalidate(*args, **kwargs) 和 cache_key(*args, **kwargs)。
+    """
     def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            # 生成缓存键
-            cache_key = f"cache:{func.__module__}:{func.__name__}:{cache.cache_key(*args, **kwargs)}"
-            
-            # 尝试从缓存获取
-            cached_result = cache.get(cache_key)
-            if cached_result is not None:
-                logger.debug(f"缓存命中: {cache_key}")
-                return cached_result
-            
-            # 调用原始函数
+        name = f"{func.__module__}.{func.__qualname__}"
+        prefix = f"cache:{func.__module__}:{func.__name__}:"
+        counters = _function_stats.setdefault(name, {
+            "hits": 0,  # 命中（含缓存的None）
+            "negative_hits": 0,  # 命中缓存的None
+            "stale_hits": 0,  # 其他调用正在刷新时返回的旧值
+            "misses": 0,  # 未命中并计算
+            "coalesced": 0,  # 等待其他调用计算结果
+            "refreshes": 0,  # 过期后或提前刷新的计算
+            "errors": 0,  # 计算出错
+        })
+
+        def cache_key(*args, **kwargs):
+            part = key(*args, **kwargs) if key is not None else _default_key(args, kwargs)
+            return prefix + str(part)
+
+        def compute(cache_key_, args, kwargs):
+            started = time.time()
             result = func(*args, **kwargs)
-            
-            # 存入缓存
-            cache.set(cache_key, result, ttl)
-            logger.debug(f"缓存设置: {cache_key}")
-            
+            finished = time.time()
+            if result is None:
+                if negative_ttl is None:
+                    return result
+                entry_ttl = negative_ttl
+            else:
+                entry_ttl = ttl if ttl is not None else cache.default_ttl
+            entry = [_ENTRY_MARK, result, finished + entry_ttl, finished - started]
+            cache.set(cache_key_, entry, entry_ttl + stale_ttl)
             return result
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key_ = cache_key(*args, **kwargs)
+
+            entry = cache.get(cache_key_)
+            if isinstance(entry, list) and len(entry) == 4 and entry[0] == _ENTRY_MARK:
+                _, value, refresh_at, delta = entry
+                now = time.time()
+                due = now >= refresh_at or (
+                    early_refresh > 0 and now - delta * early_refresh * math.log(1.0 - random.random()) >= refresh_at
+                )
+                if not due:
+                    counters["hits"] += 1
+                    if value is None:
+                        counters["negative_hits"] += 1
+                    return value
+
+                # 已过期（在旧值可用期内）或抽中提前刷新：只有一个调用方重新计算
+                flight, leader = _join_flight(cache_key_)
+                if not leader:
+                    counters["stale_hits"] += 1
+                    return value
+                counters["refreshes"] += 1
+                try:
+                    return compute(cache_key_, args, kwargs)
+                except Exception as e:
+                    counters["errors"] += 1
+                    logger.warning(f"刷新缓存失败，返回旧值: {cache_key_}, {str(e)}")
+                    return value
+                finally:
+                    _land_flight(cache_key_, flight)
+
+            flight, leader = _join_flight(cache_key_)
+            if not leader:
+                counters["coalesced"] += 1
+                if flight.done.wait(wait_timeout) and flight.ok:
+                    return flight.result
+                # 负责计算的调用出错或超时，自己计算
+                return func(*args, **kwargs)
+
+            counters["misses"] += 1
+            try:
+                result = compute(cache_key_, args, kwargs)
+                flight.result, flight.ok = result, True
+                logger.debug(f"缓存设置: {cache_key_}")
+                return result
+            except Exception:
+                counters["errors"] += 1
+                raise
+            finally:
+                _land_flight(cache_key_, flight)
+
+        def invalidate(*args, **kwargs):
+            """删除指定参数对应的缓存"""
+            cache.delete(cache_key(*args, **kwargs))
+
+        wrapper.cache_key = cache_key
+        wrapper.invalidate = invalidate
         return wrapper
-    return decorator 
\ No newline at end of file
+    return decorator
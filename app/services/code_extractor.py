@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+验证码提取引擎
+
+所有规则预编译成一个组合正则，每条短信只扫描一遍：组合正则的每个分支
+包在零宽前瞻中，扫描时在每个可能开始匹配的位置按优先级尝试各规则，
+取优先级最高、位置最靠前的匹配；关键词在前的规则命中后立即结束扫描。
+批量提取时把多条短信用分隔符拼接后连续扫描，避免逐条调用的开销。
+
+组合正则在每个候选位置都要尝试全部分支，单独使用时并不比逐条 re.search 快。
+大部分短信是“验证码：123456”的写法，所以优先级最高的规则是决定性规则时，
+先用它单独搜索一次（以关键词开头，正则引擎按字面量快速定位），命中位置之前
+没有其他决定性规则命中时即为结果，否则与未命中的短信一样走组合扫描。
+
+用法:
+    code = extract_code('您的验证码是123456，5分钟内有效')
+    codes = extract_codes(contents)
+"""
+
+import re
+from bisect import bisect_right
+
+# 批量提取时的短信分隔符，所有规则都不会跨越它
+SEPARATOR = '\x00'
+
+# 验证码前后的关键词
+_CN_KEYWORDS = r'(?:验证码|校验码|确认码|动态码|激活码|安全码|识别码|动态密码|短信密码|授权码|取件码)'
+_EN_KEYWORDS = r'(?:verification\s+code|security\s+code|login\s+code|confirmation\s+code|one[-\s]time\s+(?:pass)?code|otp|passcode|code|pin)'
+
+# 验证码本身：4-8位数字，或包含数字的4-8位字母数字组合
+_DIGITS = r'\d{4,8}'
+_ALNUM = r'(?=[A-Za-z]*\d)[A-Za-z0-9]{4,8}'
+
+# 关键词与验证码之间允许出现的字符（冒号、空格、“是/为”、引号括号等）
+_GAP = r'[\s:：是为"\'“”「」【】\[\]()（）]{0,6}'
+
+# 独立数字后面不能是单位（年份、金额、时间等）
+_NOT_QUANTITY = r'(?!\s*[年月日号元块点时分秒%])'
+
+# (规则名, 正则)，按优先级从高到低排列，每条规则有且只有一个捕获组
+DEFAULT_RULES = [
+    # 验证码是123456 / 验证码：123456 / 验证码为 A1B2C3
+    ('cn_keyword_before', _CN_KEYWORDS + _GAP + r'(' + _ALNUM + r')(?![A-Za-z0-9])'),
+    # 123456是您的验证码 / 123456（验证码）
+    ('cn_keyword_after', r'(?<![A-Za-z0-9])(' + _DIGITS + r')(?!\d)' + _GAP + r'(?:是|为)?(?:您|你)?(?:的|本次)?(?:登录|注册|身份)?' + _CN_KEYWORDS),
+    # Your verification code is 123456 / code: 123456 / OTP 123456
+    ('en_keyword_before', r'(?i:\b' + _EN_KEYWORDS + r')(?:(?:\s*(?:is|[:：=-])\s*)+|\s+)(' + _ALNUM + r')(?![A-Za-z0-9])'),
+    # 123456 is your verification code
+    ('en_keyword_after', r'(?<![A-Za-z0-9])(' + _DIGITS + r')(?!\d)\s+(?i:is\s+your\s+(?:[a-z]+\s+)?' + _EN_KEYWORDS + r')'),
+    # G-123456
+    ('prefixed', r'\b[A-Z]-(' + _DIGITS + r')(?!\d)'),
+    # 【123456】 / [123456]，短信开头的【12306】是签名
+    ('bracketed', r'(?<=[^\x00])[\[【(（]\s*(' + _DIGITS + r')\s*[\]】)）]'),
+    # 码123456 / 密码：123456
+    ('cn_short_keyword', r'码' + _GAP + r'(' + _DIGITS + r')(?!\d)'),
+    # 独立的6位数字
+    ('standalone_6', r'(?<![\dA-Za-z.,:/-])(?<!尾号)(?<!账户)(?<!卡号)(\d{6})(?![\d.,:/-]\d|[\dA-Za-z])' + _NOT_QUANTITY),
+    # 独立的4位数字
+    ('standalone_4', r'(?<![\dA-Za-z.,:/-])(?<!尾号)(?<!账户)(?<!卡号)(\d{4})(?![\d.,:/-]\d|[\dA-Za-z])' + _NOT_QUANTITY),
+]
+
+# 默认规则可能开始匹配的位置：数字、中文关键词首字、括号，以及英文关键词
+# 或大写前缀所在的单词开头。其他位置直接跳过，不再逐条尝试规则
+DEFAULT_STARTS = r'[\d验校确动激安识短授取码\[【(（]|\b(?:[vsclopVSCLOP]|[A-Z]-)'
+
+# 关键词在前的规则命中后，后面的内容不可能给出更可信的验证码，直接结束扫描
+DEFAULT_DECISIVE = ('cn_keyword_before', 'en_keyword_before')
+
+class CodeExtractor:
+    """预编译的验证码提取器"""
+
+    def __init__(self, rules=None, starts=None, decisive=None):
+        """
+        参数:
+            rules: (规则名, 正则) 列表，按优先级从高到低，每条规则有且只有一个捕获组
+            starts: 所有规则可能开始匹配的位置（正则），用于快速跳过不可能命中的位置；
+                    使用自定义规则且未提供时不做预过滤
+            decisive: 命中后立即结束扫描的规则名
+        """
+        if rules is None:
+            rules = DEFAULT_RULES
+            starts = DEFAULT_STARTS if starts is None else starts
+            decisive = DEFAULT_DECISIVE if decisive is None else decisive
+        self.rules = list(rules)
+        self._names = [name for name, _ in self.rules]
+        self._decisive = {self._names.index(name) for name in (decisive or ()) if name in self._names}
+
+        # 每个分支包在零宽前瞻里，扫描时在每个位置按优先级尝试所有规则
+        self._pattern = re.compile((f'(?=(?:{starts}))' if starts else '') + '(?=' + '|'.join(
+            f'(?:{self._rename_group(pattern, index)})' for index, (_, pattern) in enumerate(self.rules)
+        ) + ')')
+        self._group_index = {f'r{index}': index for index in range(len(self.rules))}
+        # 最高优先级规则命中的位置上组合扫描也会选中它并结束；只要更前面没有其他决定性
+        # 规则命中（组合扫描会在那里提前结束），单独搜索的结果就与组合扫描相同
+        self._leading = re.compile(self.rules[0][1]) if 0 in self._decisive else None
+        others = [self._rename_group(self.rules[index][1], index) for index in sorted(self._decisive) if index]
+        self._other_decisive = re.compile('|'.join(f'(?:{pattern})' for pattern in others)) if others else None
+
+    @staticmethod
+    def _rename_group(pattern, index):
+        """把规则中唯一的捕获组改为命名组 r{index}"""
+        compiled = re.compile(pattern)
+        if compiled.groups != 1:
+            raise ValueError(f"验证码规则必须有且只有一个捕获组: {pattern}")
+        result = []
+        i = 0
+        renamed = False
+        while i < len(pattern):
+            char = pattern[i]
+            if char == '\\':
+                result.append(pattern[i:i + 2])
+                i += 2
+                continue
+            if char == '[':
+                # 跳过字符类
+                end = i + 1
+                if end < len(pattern) and pattern[end] == '^':
+                    end += 1
+                if end < len(pattern) and pattern[end] == ']':
+                    end += 1
+                while end < len(pattern) and pattern[end] != ']':
+                    end += 2 if pattern[end] == '\\' else 1
+                result.append(pattern[i:end + 1])
+                i = end + 1
+                continue
+            if char == '(' and not renamed and not pattern.startswith('(?', i):
+                result.append(f'(?P<r{index}>')
+                renamed = True
+                i += 1
+                continue
+            if char == '(' and not renamed and pattern.startswith('(?P<', i):
+                # 规则自带的命名组同样改名，组合正则中按 r{index} 找到规则
+                result.append(f'(?P<r{index}>')
+                renamed = True
+                i = pattern.index('>', i) + 1
+                continue
+            result.append(char)
+            i += 1
+        return ''.join(result)
+
+    def _leading_code(self, content):
+        """用最高优先级规则单独搜索，结果可能与组合扫描不同时返回None"""
+        match = self._leading.search(content)
+        if match is None:
+            return None
+        if self._other_decisive is not None:
+            other = self._other_decisive.search(content)
+            if other is not None and other.start() < match.start():
+                return None
+        return match.group(1)
+
+    def _scan(self, content):
+        """
+        扫描一条短信
+
+        返回:
+            tuple: (验证码, 规则序号)，未找到时为 ('', None)
+        """
+        if self._leading is not None:
+            code = self._leading_code(content)
+            if code is not None:
+                return code, 0
+
+        best_rule = None
+        best_code = ''
+        for match in self._pattern.finditer(content):
+            rule = self._group_index[match.lastgroup]
+            if best_rule is None or rule < best_rule:
+                best_rule = rule
+                best_code = match.group(match.lastgroup)
+            if rule in self._decisive:
+                break
+        return best_code, best_rule
+
+    def match(self, content):
+        """
+        提取验证码并返回命中的规则
+
+        返回:
+            tuple: (验证码, 规则名)，未找到时为 ('', None)
+        """
+        if not content:
+            return '', None
+        code, rule = self._scan(content)
+        return code, (self._names[rule] if rule is not None else None)
+
+    def extract(self, content):
+        """提取验证码，未找到时返回空字符串"""
+        if not content:
+            return ''
+        return self._scan(content)[0]
+
+    def extract_many(self, contents):
+        """
+        批量提取验证码
+
+        先逐条用最高优先级规则搜索，其余短信用分隔符拼接成一个字符串连续扫描，
+        再按位置把匹配分回各条短信；某条短信命中决定性规则后直接跳到下一条短信开头继续扫描。
+
+        返回:
+            list: 与contents顺序一致的验证码列表，未找到的为空字符串
+        """
+        contents = [content.replace(SEPARATOR, ' ') if content else '' for content in contents]
+        if not contents:
+            return []
+
+        if self._leading is None:
+            return self._scan_joined(contents)
+
+        codes = [''] * len(contents)
+        remaining = []
+        for index, content in enumerate(contents):
+            code = self._leading_code(content)
+            if code is not None:
+                codes[index] = code
+            else:
+                remaining.append(index)
+        for index, code in zip(remaining, self._scan_joined([contents[i] for i in remaining])):
+            codes[index] = code
+        return codes
+
+    def _scan_joined(self, contents):
+        """把短信拼接后连续扫描"""
+        if not contents:
+            return []
+
+        starts = []
+        offset = 0
+        for content in contents:
+            starts.append(offset)
+            offset += len(content) + 1
+        starts.append(offset)
+        text = SEPARATOR.join(contents)
+
+        best_rules = [None] * len(contents)
+        codes = [''] * len(contents)
+        search = self._pattern.search
+        pos = 0
+        match = search(text, pos)
+        while match is not None:
+            position = match.start()
+            index = bisect_right(starts, position) - 1
+            rule = self._group_index[match.lastgroup]
+            current = best_rules[index]
+            if current is None or rule < current:
+                best_rules[index] = rule
+                codes[index] = match.group(match.lastgroup)
+            pos = starts[index + 1] if rule in self._decisive else position + 1
+            match = search(text, pos)
+        return codes
+
+# 默认提取器
+code_extractor = CodeExtractor()
+
+def extract_code(content):
+    """从短信内容中提取验证码，未找到时返回空字符串"""
+    return code_extractor.extract(content)
+
+def extract_codes(contents):
+    """批量提取验证码"""
+    return code_extractor.extract_many(contents)
@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+按项目和发送方的验证码提取规则
+
+管理员按项目、发送方号码前缀（如 106、95588）配置的规则，以及从已确认的
+验证码自动学习到的模板，按 (项目, 发送方前缀) 分组保存在内存索引中。
+提取时按 (项目, 发送方) 直接查到对应的提取器做一次锚定匹配，未命中再交给
+通用提取引擎。规则变更后按 updated_at 增量加载，只重建受影响的范围。
+"""
+
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+from flask import current_app
+from app.services.code_extractor import CodeExtractor, code_extractor
+
+logger = logging.getLogger(__name__)
+
+def validate_pattern(pattern):
+    """
+    校验规则正则
+
+    返回:
+        str: 错误信息，合法时返回None
+    """
+    if not pattern or not isinstance(pattern, str):
+        return '规则不能为空'
+    try:
+        compiled = re.compile(pattern)
+    except re.error as e:
+        return f'正则表达式错误: {str(e)}'
+    if compiled.groups != 1:
+        return '规则必须有且只有一个捕获组'
+    # 按提取引擎的方式组合编译并试跑一次，组合后不能用的规则（如命名反向引用）在保存前拒绝
+    try:
+        CodeExtractor([('candidate', pattern)]).extract('您的验证码是123456')
+    except (re.error, ValueError, KeyError, IndexError) as e:
+        return f'规则无法用于提取: {str(e)}'
+    return None
+
+def _generalize(text):
+    """转义上下文，数字串泛化为\\d+，空白泛化为\\s+"""
+    parts = []
+    for part in re.split(r'(\d+|\s+)', text):
+        if not part:
+            continue
+        if part[0].isdigit():
+            parts.append(r'\d+')
+        elif part[0].isspace():
+            parts.append(r'\s+')
+        else:
+            parts.append(re.escape(part))
+    return ''.join(parts)
+
+def build_template(content, code, context=6):
+    """
+    从已确认验证码的短信生成模板
+
+    取验证码前面的几个字符作为锚点（验证码在开头时取后面的），
+    验证码替换为同样长度和字符类型的捕获组。例如
+    "您的验证码是123456，5分钟内有效" 生成 "您的验证码是(\\d{6})(?![A-Za-z0-9])，\\d+"
+
+    返回:
+        str: 模板正则，验证码不在短信中或找不到锚点时返回None
+    """
+    if not content or not code:
+        return None
+
+    start = end = None
+    for match in re.finditer(re.escape(code), content):
+        before = content[match.start() - 1] if match.start() else ''
+        after = content[match.end()] if match.end() < len(content) else ''
+        # 跳过嵌在更长的数字或单词里的位置
+        if (before.isascii() and before.isalnum()) or (after.isascii() and after.isalnum()):
+            continue
+        start, end = match.span()
+        break
+    if start is None:
+        return None
+
+    before = content[max(0, start - context):start]
+    after = content[end:end + 2]
+    if len(before.strip()) < 2:
+        after = content[end:end + context]
+        if len(after.strip()) < 2:
+            return None
+
+    group = rf'(\d{{{len(code)}}})' if code.isdigit() else rf'([A-Za-z0-9]{{{len(code)}}})'
+    template = (_generalize(before) if before.strip() else r'(?<![A-Za-z0-9])') + group \
+        + r'(?![A-Za-z0-9])' + _generalize(after)
+
+    # 模板必须能从原短信中提取出同一个验证码
+    match = re.search(template, content)
+    if not match or match.group(1) != code:
+        return None
+    return template
+
+class CodeRuleIndex:
+    """验证码提取规则索引"""
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(CodeRuleIndex, cls).__new__(cls)
+                cls._instance._initialized = False
+            return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        # 规则id -> (范围, 排序键, 规则名, 正则, updated_at)，范围为 (项目id, 发送方前缀)
+        self._rules = {}
+        # 范围 -> [(规则名, 正则)]，按优先级排序
+        self._scopes = {}
+        # 已配置的发送方前缀长度，从长到短
+        self._prefix_lengths = []
+        # (项目id, 发送方) -> 适用的范围元组，只在第一次遇到时查找
+        self._resolved = {}
+        self._resolved_size = 50000
+        # 范围元组 -> 编译好的提取器
+        self._chains = {}
+        # 已加载规则的最大updated_at
+        self._watermark = None
+        self._checked_at = float('-inf')
+        self._reload_lock = threading.Lock()
+
+        # (项目id, 发送方前缀, 模板) -> 确认次数
+        self._candidates = OrderedDict()
+        self._candidates_size = 10000
+        self._candidates_lock = threading.Lock()
+
+        self.stats = {
+            "reloads": 0,  # 加载次数
+            "scoped_hits": 0,  # 项目/发送方规则命中数
+            "fallbacks": 0,  # 交给通用提取引擎的次数
+            "learned": 0,  # 自动学习生成的规则数
+        }
+
+        self._initialized = True
+
+    def _config(self, key, default=None):
+        try:
+            return current_app.config.get(key, default)
+        except RuntimeError:
+            return default
+
+    def reload(self, full=False):
+        """
+        加载规则变更
+
+        参数:
+            full: 是否全量重建，默认只加载updated_at不早于上次加载的规则
+
+        返回:
+            int: 重建的范围数
+        """
+        from app.models import CodeRule
+
+        with self._reload_lock:
+            query = CodeRule.query
+            if self._watermark is not None and not full:
+                # 用>=避免漏掉同一时刻写入的规则，未变化的按updated_at跳过
+                query = query.filter(CodeRule.updated_at >= self._watermark)
+            changed = query.all()
+
+            if full:
+                affected = set(self._scopes)
+                self._rules = {}
+            else:
+                affected = set()
+
+            for rule in changed:
+                old = self._rules.get(rule.id)
+                if old is not None and old[4] == rule.updated_at:
+                    continue
+                if old is not None:
+                    affected.add(old[0])
+                    del self._rules[rule.id]
+                if rule.updated_at and (self._watermark is None or rule.updated_at > self._watermark):
+                    self._watermark = rule.updated_at
+                if not rule.enabled:
+                    continue
+                error = validate_pattern(rule.pattern)
+                if error:
+                    logger.warning(f"验证码提取规则 {rule.id} 无效，已跳过: {error}")
+                    continue
+                scope = (rule.project_id, rule.sender_prefix or None)
+                self._rules[rule.id] = (
+                    scope, (rule.priority or 0, rule.id), f"{rule.source or 'manual'}:{rule.id}",
+                    rule.pattern, rule.updated_at
+                )
+                affected.add(scope)
+
+            if affected:
+                self._rebuild(affected)
+            self._checked_at = time.monotonic()
+            self.stats["reloads"] += 1
+
+        if affected:
+            logger.info(f"验证码提取规则已加载，重建 {len(affected)} 个范围")
+        return len(affected)
+
+    def _rebuild(self, affected):
+        """重建受影响的范围，新索引整体替换，查找时不需要加锁"""
+        grouped = {}
+        for scope, order, name, pattern, _ in self._rules.values():
+            if scope in affected:
+                grouped.setdefault(scope, []).append((order, name, pattern))
+
+        scopes = dict(self._scopes)
+        for scope in affected:
+            rules = sorted(grouped.get(scope, []))
+            if rules:
+                scopes[scope] = [(name, pattern) for _, name, pattern in rules]
+            else:
+                scopes.pop(scope, None)
+
+        self._prefix_lengths = sorted({len(prefix) for _, prefix in scopes if prefix}, reverse=True)
+        self._scopes = scopes
+        self._resolved = {}
+        self._chains = {}
+
+    def _maybe_reload(self):
+        """距上次检查超过CODE_RULES_RELOAD_INTERVAL时加载规则变更（其他进程的修改）"""
+        if time.monotonic() - self._checked_at < self._config('CODE_RULES_RELOAD_INTERVAL', 10):
+            return
+        self._checked_at = time.monotonic()
+        try:
+            self.reload()
+        except Exception as e:
+            logger.debug(f"加载验证码提取规则失败: {str(e)}")
+
+    def _resolve(self, project_id, sender):
+        """查找适用的范围：项目+发送方前缀、项目、发送方前缀，各取最长的前缀"""
+        scopes = []
+        owners = (project_id, None) if project_id is not None else (None,)
+        for owner in owners:
+            if sender:
+                for length in self._prefix_lengths:
+                    if len(sender) >= length and (owner, sender[:length]) in self._scopes:
+                        scopes.append((owner, sender[:length]))
+                        break
+            if owner is not None and (owner, None) in self._scopes:
+                scopes.append((owner, None))
+        return tuple(scopes)
+
+    def extractor_for(self, project_id=None, sender=None):
+        """
+        获取 (项目, 发送方) 适用的规则提取器
+
+        返回:
+            CodeExtractor: 没有适用的规则时返回None
+        """
+        key = (project_id, sender)
+        chain = self._resolved.get(key)
+        if chain is None:
+            chain = self._resolve(project_id, sender)
+            if len(self._resolved) >= self._resolved_size:
+                self._resolved = {}
+            self._resolved[key] = chain
+        if not chain:
+            return None
+
+        extractor = self._chains.get(chain)
+        if extractor is None:
+            rules = [rule for scope in chain for rule in self._scopes.get(scope, ())]
+            if not rules:
+                return None
+            extractor = CodeExtractor(rules)
+            self._chains[chain] = extractor
+        return extractor
+
+    def match(self, content, project_id=None, sender=None):
+        """
+        提取验证码并返回命中的规则
+
+        返回:
+            tuple: (验证码, 规则名)，通用提取引擎命中时规则名为引擎的规则名
+        """
+        self._maybe_reload()
+        extractor = self.extractor_for(project_id, sender)
+        if extractor is not None:
+            code, rule = extractor.match(content)
+            if code:
+                self.stats["scoped_hits"] += 1
+                return code, rule
+        self.stats["fallbacks"] += 1
+        return code_extractor.match(content)
+
+    def extract(self, content, project_id=None, sender=None):
+        """提取验证码，未找到时返回空字符串"""
+        if not content:
+            return ''
+        self._maybe_reload()
+        extractor = self.extractor_for(project_id, sender)
+        if extractor is not None:
+            code = extractor.extract(content)
+            if code:
+                self.stats["scoped_hits"] += 1
+                return code
+        self.stats["fallbacks"] += 1
+        return code_extractor.extract(content)
+
+    def extract_many(self, items):
+        """
+        批量提取验证码
+
+        参数:
+            items: (短信内容, 项目id, 发送方) 列表
+
+        返回:
+            list: 与items顺序一致的验证码列表，未找到的为空字符串
+        """
+        self._maybe_reload()
+        codes = [''] * len(items)
+        groups = {}
+        fallback = []
+        for index, (content, project_id, sender) in enumerate(items):
+            extractor = self.extractor_for(project_id, sender)
+            if extractor is None:
+                fallback.append(index)
+            else:
+                groups.setdefault(extractor, []).append(index)
+
+        for extractor, indexes in groups.items():
+            for index, code in zip(indexes, extractor.extract_many([items[i][0] for i in indexes])):
+                if code:
+                    codes[index] = code
+                else:
+                    fallback.append(index)
+        self.stats["scoped_hits"] += len(items) - len(fallback)
+        self.stats["fallbacks"] += len(fallback)
+
+        if fallback:
+            for index, code in zip(fallback, code_extractor.extract_many([items[i][0] for i in fallback])):
+                codes[index] = code
+        return codes
+
+    def learn(self, samples):
+        """
+        从已确认的验证码学习模板
+
+        同一 (项目, 发送方前缀) 下同一模板被确认CODE_RULES_LEARN_MIN_SUPPORT次后
+        保存为自动学习的规则，现有规则已经能提取正确的短信不再学习。
+
+        参数:
+            samples: (短信内容, 验证码, 项目id, 发送方) 列表，验证码必须来自上游而不是本地提取
+
+        返回:
+            int: 新增的规则数
+        """
+        min_support = self._config('CODE_RULES_LEARN_MIN_SUPPORT', 3)
+        prefix_length = self._config('CODE_RULES_SENDER_PREFIX_LEN', 5)
+
+        promoted = []
+        for content, code, project_id, sender in samples:
+            if not content or not code:
+                continue
+            extractor = self.extractor_for(project_id, sender)
+            if extractor is not None and extractor.extract(content) == code:
+                continue
+            template = build_template(content, code)
+            if template is None:
+                continue
+            key = (project_id, sender[:prefix_length] if sender else None, template)
+            with self._candidates_lock:
+                support = self._candidates.pop(key, 0) + 1
+                if support >= min_support:
+                    promoted.append(key + (support,))
+                    continue
+                self._candidates[key] = support
+                while len(self._candidates) > self._candidates_size:
+                    self._candidates.popitem(last=False)
+
+        if not promoted:
+            return 0
+        return self._save_learned(promoted)
+
+    def _save_learned(self, promoted):
+        """保存自动学习的规则并重新加载"""
+        from app.models import db, CodeRule
+
+        max_learned = self._config('CODE_RULES_MAX_LEARNED', 20)
+        added = 0
+        for project_id, prefix, template, support in promoted:
+            query = CodeRule.query.filter_by(
+                project_id=project_id, sender_prefix=prefix, source='learned', enabled=True
+            )
+            # 其他进程可能已经学到同一模板
+            if query.filter_by(pattern=template).first() or query.count() >= max_learned:
+                continue
+            db.session.add(CodeRule(
+                project_id=project_id,
+                sender_prefix=prefix,
+                pattern=template,
+                priority=100,  # 排在手工配置的规则之后
+                source='learned',
+                support=support
+            ))
+            added += 1
+
+        if added:
+            db.session.commit()
+            self.stats["learned"] += added
+            logger.info(f"自动学习到 {added} 条验证码模板")
+            self.reload()
+        return added
+
+    def snapshot(self):
+        """获取规则索引状态"""
+        return {
+            "rules": len(self._rules),
+            "scopes": len(self._scopes),
+            "candidates": len(self._candidates),
+            "stats": dict(self.stats)
+        }
+
+# 创建规则索引实例
+code_rules = CodeRuleIndex()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+进程内按用户分发的事件总线
+
+号码收到验证码、状态变化（释放、过期、拉黑）时按用户发布事件，
+只推送给该用户的订阅者，发布代价是 O(该用户的订阅者数)。
+每个用户保留最近的事件用于断线重连时按 Last-Event-ID 补发；
+每个订阅者的缓冲区有上限，消费过慢时断开并要求客户端重新同步。
+事件ID形如 <进程纪元>-<序号>，进程重启或重连到另一个进程时纪元不同，
+无法判断漏掉了哪些事件，要求客户端重新同步。
+"""
+
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+class Event:
+    """一个推送事件"""
+    __slots__ = ('id', 'seq', 'type', 'data', 'created_at')
+
+    def __init__(self, event_id, seq, event_type, data):
+        self.id = event_id
+        self.seq = seq
+        self.type = event_type
+        self.data = data
+        self.created_at = time.time()
+
+class Subscription:
+    """一个订阅连接"""
+
+    def __init__(self, user_id, max_buffer=100):
+        self.user_id = user_id
+        self.max_buffer = max_buffer
+        self.closed = False
+        self.close_reason = None
+        self._buffer = deque()
+        self._cond = threading.Condition()
+
+    def push(self, event):
+        """放入事件，缓冲区已满时关闭订阅，返回是否成功"""
+        with self._cond:
+            if self.closed:
+                return False
+            if len(self._buffer) >= self.max_buffer:
+                self.closed = True
+                self.close_reason = 'overflow'
+                self._cond.notify_all()
+                return False
+            self._buffer.append(event)
+            self._cond.notify()
+            return True
+
+    def get(self, timeout):
+        """取出一个事件，超时返回None"""
+        with self._cond:
+            if not self._buffer and not self.closed:
+                self._cond.wait(timeout)
+            if self._buffer:
+                return self._buffer.popleft()
+            return None
+
+    def close(self, reason='closed'):
+        with self._cond:
+            if not self.closed:
+                self.closed = True
+                self.close_reason = reason
+            self._cond.notify_all()
+
+class EventBus:
+    """事件总线"""
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(EventBus, cls).__new__(cls)
+                cls._instance._initialized = False
+            return cls._instance
+
+    def __init__(self, history_size=200):
+        if self._initialized:
+            return
+
+        self.history_size = history_size
+        # 每个进程（每个实例）的纪元，区分不同进程发出的事件ID
+        self.epoch = uuid.uuid4().hex[:8]
+        self._seq = 0
+        # 用户ID -> set[Subscription]
+        self._subscribers = {}
+        # 用户ID -> deque[Event]，用于断线补发
+        self._history = {}
+        # 用户ID -> 已被挤出历史的最大事件序号
+        self._evicted = {}
+        self._bus_lock = threading.Lock()
+
+        self.stats = {
+            "published": 0,
+            "delivered": 0,
+            "overflows": 0,
+        }
+
+        self._initialized = True
+
+    def publish(self, user_id, event_type, data):
+        """发布事件给指定用户"""
+        with self._bus_lock:
+            self._seq += 1
+            event = Event(f'{self.epoch}-{self._seq}', self._seq, event_type, data)
+            history = self._history.get(user_id)
+            if history is None:
+                history = self._history[user_id] = deque(maxlen=self.history_size)
+            if len(history) == self.history_size:
+                self._evicted[user_id] = history[0].seq
+            history.append(event)
+            subscribers = list(self._subscribers.get(user_id, ()))
+        self.stats["published"] += 1
+
+        for subscription in subscribers:
+            if subscription.push(event):
+                self.stats["delivered"] += 1
+            elif subscription.close_reason == 'overflow':
+                self.stats["overflows"] += 1
+                self.unsubscribe(subscription)
+                logger.warning(f"用户 {user_id} 的事件订阅消费过慢，已断开")
+        return event
+
+    def subscribe(self, user_id, last_event_id=None, max_buffer=100):
+        """
+        订阅用户事件
+
+        参数:
+            user_id (int): 用户ID
+            last_event_id (str, optional): 客户端收到的最后一个事件ID，之后的历史事件会先补发；
+                其他进程发出的或无法识别的ID要求客户端重新同步
+            max_buffer (int): 订阅缓冲区上限
+
+        返回:
+            tuple: (Subscription, 是否需要客户端重新同步)
+        """
+        subscription = Subscription(user_id, max_buffer)
+        resync = False
+        with self._bus_lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+            last_seq = self._parse_id(last_event_id)
+            if last_event_id is not None and last_seq is None:
+                resync = True
+            elif last_seq is not None:
+                missed = [event for event in self._history.get(user_id, ()) if event.seq > last_seq]
+                # 客户端之后的部分事件已经被挤出历史
+                if last_seq < self._evicted.get(user_id, 0):
+                    resync = True
+                if len(missed) > max_buffer:
+                    resync = True
+                    missed = missed[-max_buffer:]
+                for event in missed:
+                    subscription.push(event)
+        return subscription, resync
+
+    def _parse_id(self, event_id):
+        """解析本进程发出的事件ID，返回序号；其他进程的、还没发出的或格式不对的ID返回None"""
+        if event_id is None:
+            return None
+        epoch, _, seq = str(event_id).strip().partition('-')
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self._seq:
+            return None
+        return int(seq)
+
+    def unsubscribe(self, subscription):
+        """取消订阅"""
+        subscription.close()
+        with self._bus_lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    def snapshot(self):
+        """获取事件总线状态"""
+        with self._bus_lock:
+            users = len(self._subscribers)
+            connections = sum(len(subscribers) for subscribers in self._subscribers.values())
+        return {
+            "users": users,
+            "connections": connections,
+            "stats": dict(self.stats)
+        }
+
+def publish_number_event(phone, event_type, **extra):
+    """
+    发布号码事件
+
+    参数:
+        phone: PhoneNumber 或 PhoneRequest 对象
+        event_type (str): 事件类型，例如 sms、released、expired、blacklisted
+        extra: 附加字段，例如 code、sms
+    """
+    data = {
+        'request_id': phone.request_id,
+        'number': getattr(phone, 'number', None) or getattr(phone, 'phone_number', None),
+        'status': phone.status,
+        'project_id': phone.project_id,
+    }
+    data.update(extra)
+    return event_bus.publish(phone.user_id, event_type, data)
+
+# 创建事件总线实例
+event_bus = EventBus()
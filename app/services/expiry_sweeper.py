@@ -0,0 +1,394 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+号码超时清理
+
+超过 SYSTEM_SETTINGS['sms_timeout'] 仍未收到验证码的号码由后台线程分批清理：
+按 (status, created_at) 索引取出一批，一条带状态条件的UPDATE把整批标记为
+expired，按用户汇总退款并批量写入退款交易记录，提交后再并发向上游释放。多进程部署时通过数据库租约
+保证同一时刻只有一个进程在清理。
+"""
+
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import update, insert, select, func, and_, or_, bindparam
+from app.services.lease import lease_owner, acquire_lease, release_lease
+from app.services.event_bus import event_bus
+from app.services import rollups
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = 'expiry_sweeper'
+
+class ExpirySweeper:
+    """超时号码清理器"""
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(ExpirySweeper, cls).__new__(cls)
+                cls._instance._initialized = False
+            return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        self._owner = lease_owner()
+        self._holding = False
+        # request_id -> (号码, 上游释放失败次数)
+        self._release_failures = {}
+
+        self._app = None
+        self._thread = None
+        self._running = False
+        self._stop_event = threading.Event()
+
+        self.stats = {
+            "sweeps": 0,  # 清理轮数
+            "expired": 0,  # 标记为超时的号码数
+            "refunds": 0,  # 退款笔数
+            "refunded_amount": 0.0,  # 退款总额
+            "release_failures": 0,  # 上游释放失败次数
+            "lag_seconds": 0.0,  # 本轮开始时最早的超时号码已超时多久
+            "last_duration": 0.0,  # 上一轮耗时（秒）
+            "last_sweep_at": None,  # 上一轮完成时间
+        }
+
+        self._initialized = True
+
+    def init_app(self, app):
+        """绑定应用实例并启动清理线程"""
+        with self._lock:
+            if self._app is not None:
+                return
+            self._app = app
+
+        if not app.config.get('EXPIRY_SWEEPER_ENABLED', True):
+            logger.info("号码超时清理未启用")
+            return
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        logger.info("号码超时清理线程已启动")
+
+    def _config(self, key, default=None):
+        app = self._app or current_app
+        return app.config.get(key, default)
+
+    def timeout(self):
+        """号码等待验证码的超时时间（秒），管理员可在系统设置中修改"""
+        from app.routes.system import SYSTEM_SETTINGS
+
+        return float(SYSTEM_SETTINGS.get('sms_timeout') or 120)
+
+    def _lease_ttl(self):
+        return max(self._config('EXPIRY_SWEEP_INTERVAL', 15) * 3, 60)
+
+    def _release_upstream(self, rows):
+        """
+        并发向上游释放一批已在本地标记超时的号码
+
+        释放失败的号码记在 _release_failures 中，下一轮清理时重试，
+        失败次数达到上限后不再重试，上游到期后会自行回收。
+        """
+        from app.services.provider_router import provider_router
+
+        api_client = provider_router.client()
+        if api_client.use_mock:
+            return
+
+        try:
+            results = api_client.release_phone_numbers(
+                [(row.upstream_request_id or row.request_id, row.provider) for row in rows]
+            )
+        except Exception as e:
+            logger.warning(f"上游释放超时号码失败: {str(e)}")
+            results = [{'success': False}] * len(rows)
+        max_attempts = self._config('EXPIRY_MAX_RELEASE_ATTEMPTS', 3)
+
+        for row, result in zip(rows, results):
+            if result.get('success'):
+                self._release_failures.pop(row.request_id, None)
+                continue
+            self.stats["release_failures"] += 1
+            failures = self._release_failures.get(row.request_id, (row, 0))[1] + 1
+            if failures >= max_attempts:
+                logger.warning(f"号码 {row.request_id} 上游释放失败 {failures} 次，不再重试")
+                self._release_failures.pop(row.request_id, None)
+            else:
+                self._release_failures[row.request_id] = (row, failures)
+
+    def _retry_releases(self):
+        """重试上一轮上游释放失败的号码"""
+        rows = [row for row, _ in list(self._release_failures.values())]
+        if rows:
+            self._release_upstream(rows)
+
+    def _mark_expired(self, rows, now):
+        """
+        一条UPDATE把整批号码标记为超时（不支持 RETURNING 时逐个标记）
+
+        返回:
+            set: 实际标记成功的号码ID（期间收到验证码或被释放的不会被标记）
+        """
+        from app.models import db, PhoneNumber
+
+        phones = PhoneNumber.__table__
+        waiting = (phones.c.status == 'available', phones.c.sms_code.is_(None))
+        values = dict(status='expired', released_at=now, updated_at=now)
+
+        dialect = db.session.get_bind().dialect
+        if getattr(dialect, 'update_returning', False):
+            stmt = update(phones).where(phones.c.id.in_([row.id for row in rows]), *waiting).values(**values)
+            return {row[0] for row in db.session.execute(stmt.returning(phones.c.id))}
+
+        # 不支持 RETURNING 时逐个条件更新，按影响行数判断是否标记成功
+        expired = set()
+        for row in rows:
+            result = db.session.execute(update(phones).where(phones.c.id == row.id, *waiting).values(**values))
+            if result.rowcount:
+                expired.add(row.id)
+        return expired
+
+    def _refund(self, expired, now):
+        """
+        按消费记录批量退款
+
+        参数:
+            expired: 已标记超时的号码
+
+        返回:
+            dict: request_id -> 退款金额
+        """
+        from app.models import db, User, Transaction
+
+        by_request_id = {row.request_id: row for row in expired}
+        request_ids = list(by_request_id)
+
+        # request_id -> (用户ID, 消费金额)
+        charges = {}
+        for reference_id, user_id, amount in db.session.query(
+            Transaction.reference_id, Transaction.user_id, func.sum(Transaction.amount)
+        ).filter(
+            Transaction.reference_id.in_(request_ids), Transaction.type == 'consume'
+        ).group_by(Transaction.reference_id, Transaction.user_id):
+            charges[reference_id] = (user_id, -amount if amount else 0)
+
+        # 批量取号的一笔消费记录引用逗号拼接的所有请求ID，按号码数平分到每个号码
+        for reference_id, user_id, amount in db.session.query(
+            Transaction.reference_id, Transaction.user_id, Transaction.amount
+        ).filter(
+            Transaction.user_id.in_({row.user_id for row in expired}),
+            Transaction.type == 'consume',
+            Transaction.created_at >= min(row.created_at for row in expired),
+            Transaction.reference_id.like('%,%')
+        ):
+            batch_ids = reference_id.split(',')
+            for request_id in batch_ids:
+                if request_id in by_request_id and request_id not in charges:
+                    charges[request_id] = (user_id, -amount / len(batch_ids))
+
+        # 退款记录按单个号码的request_id写入，已经退过款的不再重复退
+        refunded = {
+            reference_id for reference_id, in db.session.query(Transaction.reference_id).filter(
+                Transaction.reference_id.in_(request_ids), Transaction.type == 'refund'
+            )
+        }
+        refunds = [
+            (request_id, user_id, round(amount, 2))
+            for request_id, (user_id, amount) in charges.items()
+            if request_id not in refunded and amount > 0
+        ]
+        if not refunds:
+            return {}
+
+        totals = {}
+        for _, user_id, amount in refunds:
+            totals[user_id] = totals.get(user_id, 0) + amount
+
+        users = User.__table__
+        db.session.execute(
+            update(users)
+            .where(users.c.id == bindparam('b_id'))
+            .values(balance=users.c.balance + bindparam('b_amount')),
+            [{'b_id': user_id, 'b_amount': amount} for user_id, amount in totals.items()]
+        )
+        # 行已被本事务锁定，回读的就是退款后的余额，再倒推每笔交易后的余额
+        balances = dict(db.session.execute(
+            select(users.c.id, users.c.balance).where(users.c.id.in_(list(totals)))
+        ).all())
+        running = {user_id: balances[user_id] - total for user_id, total in totals.items()}
+
+        rows = []
+        for reference_id, user_id, amount in refunds:
+            running[user_id] += amount
+            rows.append({
+                'user_id': user_id,
+                'amount': amount,
+                'balance': round(running[user_id], 2),
+                'type': 'refund',
+                'description': '号码超时未收到短信，自动退款',
+                'reference_id': reference_id,
+                'created_at': now
+            })
+        db.session.execute(insert(Transaction), rows)
+
+        # 退款计入统计汇总表中号码取号时间所在的桶
+        rollups.record_many([
+            {
+                'user_id': user_id,
+                'project_id': by_request_id[reference_id].project_id,
+                'at': by_request_id[reference_id].created_at,
+                'refunds': amount
+            }
+            for reference_id, user_id, amount in refunds
+        ])
+
+        self.stats["refunds"] += len(rows)
+        self.stats["refunded_amount"] = round(self.stats["refunded_amount"] + sum(totals.values()), 2)
+        return {reference_id: amount for reference_id, _, amount in refunds}
+
+    def expire_batch(self, rows):
+        """
+        清理一批超时号码
+
+        先用带状态条件的UPDATE标记超时并退款、提交，再向上游释放实际标记成功的号码，
+        期间收到验证码或被用户释放的号码不会被释放或退款。
+
+        返回:
+            int: 标记为超时的号码数
+        """
+        from app.models import db, PhoneRequest
+        from app.services.sms_poller import sms_poller
+
+        now = datetime.utcnow()
+        try:
+            expired_ids = self._mark_expired(rows, now)
+            expired = [row for row in rows if row.id in expired_ids]
+            refunds = {}
+            if expired:
+                requests = PhoneRequest.__table__
+                db.session.execute(
+                    update(requests)
+                    .where(requests.c.request_id.in_([row.request_id for row in expired]),
+                           requests.c.status == 'active')
+                    .values(status='expired', updated_at=now)
+                )
+                refunds = self._refund(expired, now)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        if not expired:
+            return 0
+        self._release_upstream(expired)
+        for row in expired:
+            sms_poller.untrack(row.request_id)
+            event_bus.publish(row.user_id, 'expired', {
+                'request_id': row.request_id,
+                'number': row.number,
+                'status': 'expired',
+                'project_id': row.project_id,
+                'refund': refunds.get(row.request_id, 0)
+            })
+        self.stats["expired"] += len(expired)
+        return len(expired)
+
+    def sweep(self):
+        """
+        清理一轮：按 (created_at, id) 分批扫描超时号码
+
+        返回:
+            int: 本轮标记为超时的号码数
+        """
+        from app.models import db, PhoneNumber
+
+        started = time.monotonic()
+        self._retry_releases()
+        cutoff = datetime.utcnow() - timedelta(seconds=self.timeout())
+        overdue = and_(
+            PhoneNumber.status == 'available',
+            PhoneNumber.sms_code.is_(None),
+            PhoneNumber.created_at < cutoff
+        )
+
+        oldest = db.session.query(func.min(PhoneNumber.created_at)).filter(overdue).scalar()
+        self.stats["lag_seconds"] = round((cutoff - oldest).total_seconds(), 3) if oldest else 0.0
+
+        batch_size = self._config('EXPIRY_SWEEP_BATCH_SIZE', 200)
+        max_batches = self._config('EXPIRY_SWEEP_MAX_BATCHES', 50)
+        total = 0
+        last_key = None
+        for _ in range(max_batches):
+            query = db.session.query(
+                PhoneNumber.id, PhoneNumber.request_id, PhoneNumber.upstream_request_id, PhoneNumber.user_id,
+                PhoneNumber.project_id, PhoneNumber.number, PhoneNumber.provider, PhoneNumber.created_at
+            ).filter(overdue)
+            if last_key is not None:
+                # 按键集翻页，期间收到验证码等没有标记成功的号码不会挡住后面的批次
+                query = query.filter(or_(
+                    PhoneNumber.created_at > last_key[0],
+                    and_(PhoneNumber.created_at == last_key[0], PhoneNumber.id > last_key[1])
+                ))
+            rows = query.order_by(PhoneNumber.created_at, PhoneNumber.id).limit(batch_size).all()
+            if not rows:
+                break
+            last_key = (rows[-1].created_at, rows[-1].id)
+            total += self.expire_batch(rows)
+            if len(rows) < batch_size:
+                break
+            # 长时间的清理中途续约
+            if not acquire_lease(LEASE_NAME, self._owner, self._lease_ttl()):
+                self._holding = False
+                break
+
+        self.stats["sweeps"] += 1
+        self.stats["last_duration"] = round(time.monotonic() - started, 3)
+        self.stats["last_sweep_at"] = datetime.utcnow().isoformat()
+        if total:
+            logger.info(f"超时清理完成，标记 {total} 个号码，耗时 {self.stats['last_duration']} 秒")
+        return total
+
+    def _run(self):
+        """清理线程"""
+        while self._running:
+            try:
+                with self._app.app_context():
+                    self._holding = acquire_lease(LEASE_NAME, self._owner, self._lease_ttl())
+                    if self._holding:
+                        self.sweep()
+            except Exception as e:
+                logger.error(f"超时清理时发生错误: {str(e)}")
+            self._stop_event.wait(self._config('EXPIRY_SWEEP_INTERVAL', 15))
+
+    def snapshot(self):
+        """获取清理器状态"""
+        return {
+            "enabled": self._running,
+            "holding_lease": self._holding,
+            "pending_release_retries": len(self._release_failures),
+            "stats": dict(self.stats)
+        }
+
+    def stop(self):
+        """停止清理线程并释放租约"""
+        self._running = False
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=5)
+        if self._holding and self._app is not None:
+            with self._app.app_context():
+                release_lease(LEASE_NAME, self._owner)
+            self._holding = False
+
+# 创建清理器实例
+expiry_sweeper = ExpirySweeper()
@@ -0,0 +1,567 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+后台导出任务
+
+大数据量的号码导出和统计报表导出提交为后台任务，立即返回任务ID：
+任务在有界的进程池中执行，输出写入磁盘上的临时目录，按行上报进度到
+AsyncTaskManager 中的 AsyncTask；完成后通过下载地址取回文件（支持Range断点续传）。
+
+任务状态同时写在导出目录下的 <job_id>.json 中，多个工作进程部署时任何一个进程
+都能查询状态、取消和下载。取消通过 <job_id>.cancel 标记文件通知执行任务的子进程。
+完成超过 EXPORT_JOB_TTL 的文件由清理线程删除。
+
+用法:
+    job = export_jobs.submit(user_id, 'numbers', params, 'csv', compress=True)
+    job = export_jobs.get(job['job_id'])
+"""
+
+import os
+import json
+import time
+import uuid
+import pickle
+import logging
+import threading
+import multiprocessing
+import queue as queue_module
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from flask import current_app
+from app.services.async_service import task_manager
+
+logger = logging.getLogger(__name__)
+
+# 每导出多少行上报一次进度（同时检查是否被取消）
+PROGRESS_EVERY = 1000
+
+ACTIVE_STATUSES = ('pending', 'running')
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled')
+
+class ExportJobLimitError(Exception):
+    """用户同时进行的导出任务过多"""
+    pass
+
+class ExportCancelled(Exception):
+    """导出任务被取消"""
+    pass
+
+# ---- 以下在执行任务的子进程（或线程池模式下的线程）中运行 ----
+
+_worker_config = None
+_worker_app = None
+_worker_queue = None
+
+def _init_worker(config, progress_queue, app=None):
+    """进程池初始化：保存配置和进度队列，应用实例在第一次执行任务时创建"""
+    global _worker_config, _worker_app, _worker_queue
+    _worker_config = config
+    _worker_app = app
+    _worker_queue = progress_queue
+
+def _get_worker_app():
+    global _worker_app
+    if _worker_app is None:
+        from flask import Flask
+        from app.models import db
+
+        app = Flask('export_worker')
+        app.config.update(_worker_config or {})
+        db.init_app(app)
+        _worker_app = app
+    return _worker_app
+
+def _parse_date(value, end=False):
+    date = datetime.strptime(value, '%Y-%m-%d')
+    return date + timedelta(days=1) - timedelta(seconds=1) if end else date
+
+def _export_numbers(user_id, params, export_format, compress, output, report):
+    """号码记录导出，返回导出行数"""
+    from app.services.number_export import number_export_query, iter_number_rows, encode_rows
+
+    query = number_export_query(
+        user_id, _parse_date(params['start_date']), _parse_date(params['end_date'], end=True), params.get('status')
+    )
+    total = query.order_by(None).count()
+    report(0, total)
+
+    exported = 0
+
+    def counted(rows):
+        nonlocal exported
+        for row in rows:
+            yield row
+            exported += 1
+            if exported % PROGRESS_EVERY == 0:
+                report(exported, total)
+
+    for chunk in encode_rows(counted(iter_number_rows(query)), export_format, compress):
+        output.write(chunk)
+    report(exported, total)
+    return exported
+
+def _export_statistics(user_id, params, export_format, compress, output, report):
+    """统计报表导出，返回报表行数"""
+    from app.routes.statistics import build_statistics_report, render_statistics_report
+    from app.services.number_export import gzip_chunks
+
+    data = build_statistics_report(
+        user_id, _parse_date(params['start_date']), _parse_date(params['end_date'], end=True),
+        params['type'], params.get('project_code'), progress=report
+    )
+    content = render_statistics_report(data, export_format, params['type'])
+    if content is None:
+        raise ValueError('没有数据可导出')
+    for chunk in (gzip_chunks([content]) if compress else [content]):
+        output.write(chunk)
+    report(len(data), len(data))
+    return len(data)
+
+# 导出类型 -> 执行函数
+EXPORT_KINDS = {
+    'numbers': _export_numbers,
+    'statistics': _export_statistics,
+}
+
+def _run_job(job_id, user_id, kind, params, export_format, compress, spool_dir):
+    """
+    执行导出任务，输出先写 <job_id>.part，完成后改名为 <job_id>.data
+
+    返回:
+        dict: rows, size
+    """
+    part_path = os.path.join(spool_dir, f'{job_id}.part')
+    data_path = os.path.join(spool_dir, f'{job_id}.data')
+    cancel_path = os.path.join(spool_dir, f'{job_id}.cancel')
+
+    def report(done, total):
+        if os.path.exists(cancel_path):
+            raise ExportCancelled(job_id)
+        _worker_queue.put((job_id, done, total))
+
+    report(0, 0)
+    app = _get_worker_app()
+    try:
+        with app.app_context(), open(part_path, 'wb') as output:
+            rows = EXPORT_KINDS[kind](user_id, params, export_format, compress, output, report)
+        os.replace(part_path, data_path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    return {'rows': rows, 'size': os.path.getsize(data_path)}
+
+# ---- 以下在Web进程中运行 ----
+
+class ExportJobManager:
+    """后台导出任务管理器"""
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(ExportJobManager, cls).__new__(cls)
+                cls._instance._initialized = False
+            return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        self._app = None
+        self._executor = None
+        self._queue = None
+        # 本进程提交的任务: job_id -> 任务状态
+        self._jobs = {}
+        self._futures = {}
+        self._jobs_lock = threading.Lock()
+        self._written_at = {}
+
+        self._running = False
+        self._stop_event = threading.Event()
+        self._drain_thread = None
+        self._cleanup_thread = None
+
+        self.stats = {
+            "submitted": 0,  # 提交的任务数
+            "completed": 0,  # 完成的任务数
+            "failed": 0,  # 失败的任务数
+            "cancelled": 0,  # 取消的任务数
+            "rejected": 0,  # 因超出并发限制被拒绝的任务数
+            "cleaned_files": 0,  # 清理的过期文件数
+        }
+
+        self._initialized = True
+
+    def init_app(self, app):
+        """绑定应用实例，创建导出目录并启动清理线程"""
+        with self._lock:
+            if self._app is not None:
+                return
+            self._app = app
+
+        os.makedirs(self._spool_dir(), exist_ok=True)
+        self._running = True
+        self._stop_event.clear()
+        self._cleanup_thread = threading.Thread(target=self._cleanup_loop, daemon=True)
+        self._cleanup_thread.start()
+
+    def _config(self, key, default=None):
+        app = self._app or current_app
+        return app.config.get(key, default)
+
+    def _spool_dir(self):
+        return os.path.abspath(self._config('EXPORT_SPOOL_DIR', 'instance/exports'))
+
+    def _path(self, job_id, suffix):
+        return os.path.join(self._spool_dir(), f'{job_id}.{suffix}')
+
+    def _ensure_executor(self):
+        """第一次提交任务时创建进程池和进度队列"""
+        with self._jobs_lock:
+            if self._executor is not None:
+                return self._executor
+            workers = self._config('EXPORT_JOB_WORKERS', 2)
+            if self._config('EXPORT_JOB_USE_PROCESSES', True):
+                context = multiprocessing.get_context(self._config('EXPORT_JOB_START_METHOD', 'spawn'))
+                self._queue = context.Queue()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=workers, mp_context=context,
+                    initializer=_init_worker, initargs=(self._worker_config(), self._queue)
+                )
+            else:
+                self._queue = queue_module.Queue()
+                self._executor = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix='export',
+                    initializer=_init_worker, initargs=(None, self._queue, self._app)
+                )
+            self._drain_thread = threading.Thread(target=self._drain_loop, args=(self._queue,), daemon=True)
+            self._drain_thread.start()
+            return self._executor
+
+    def _worker_config(self):
+        """传给子进程的配置（只保留可以序列化的项）"""
+        config = {}
+        for key, value in self._app.config.items():
+            if not key.isupper():
+                continue
+            try:
+                pickle.dumps(value)
+            except Exception:
+                continue
+            config[key] = value
+        return config
+
+    def _write_meta(self, meta):
+        """原子写入任务状态文件"""
+        meta['updated_at'] = time.time()
+        path = self._path(meta['job_id'], 'json')
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+        self._written_at[meta['job_id']] = time.monotonic()
+
+    def _read_meta(self, job_id):
+        try:
+            with open(self._path(job_id, 'json'), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # 执行任务的进程已退出，状态不会再更新
+        stale = self._config('EXPORT_JOB_STALE_SECONDS', 300)
+        if meta['status'] in ACTIVE_STATUSES and time.time() - meta.get('updated_at', 0) > stale:
+            meta['status'] = 'failed'
+            meta['error'] = '执行导出任务的进程已退出'
+        return meta
+
+    def _user_jobs(self, user_id):
+        """从导出目录读取用户的所有任务"""
+        jobs = []
+        try:
+            names = os.listdir(self._spool_dir())
+        except OSError:
+            return jobs
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            job_id = name[:-5]
+            meta = self._jobs.get(job_id) or self._read_meta(job_id)
+            if meta and meta['user_id'] == user_id:
+                jobs.append(self._public(meta))
+        jobs.sort(key=lambda meta: meta['created_at'], reverse=True)
+        return jobs
+
+    def submit(self, user_id, kind, params, export_format, compress=False, filename=None, mimetype=None):
+        """
+        提交导出任务
+
+        参数:
+            user_id: 用户ID
+            kind (str): 导出类型(numbers, statistics)
+            params (dict): 导出参数，日期为 YYYY-MM-DD 字符串
+            export_format (str): 导出格式
+            compress (bool): 是否gzip压缩
+            filename (str): 下载时的文件名
+            mimetype (str): 下载时的MIME类型
+
+        返回:
+            dict: 任务状态
+
+        异常:
+            ExportJobLimitError: 用户同时进行的任务数已达上限
+        """
+        if self._app is None:
+            self.init_app(current_app._get_current_object())
+
+        limit = self._config('EXPORT_JOB_MAX_PER_USER', 2)
+        with self._lock:
+            active = sum(1 for meta in self._user_jobs(user_id) if meta['status'] in ACTIVE_STATUSES)
+            if active >= limit:
+                self.stats["rejected"] += 1
+                raise ExportJobLimitError(f'同时进行的导出任务不能超过 {limit} 个，请等待之前的任务完成')
+
+            job_id = f"exp_{uuid.uuid4().hex[:12]}"
+            now = time.time()
+            meta = {
+                'job_id': job_id,
+                'user_id': user_id,
+                'kind': kind,
+                'params': params,
+                'format': export_format,
+                'compress': compress,
+                'filename': filename or f"{kind}_export_{job_id}",
+                'mimetype': mimetype or 'application/octet-stream',
+                'status': 'pending',
+                'progress': 0,
+                'total': 0,
+                'rows': None,
+                'size': None,
+                'error': None,
+                'created_at': now,
+                'started_at': None,
+                'finished_at': None,
+            }
+            self._jobs[job_id] = meta
+            self._write_meta(meta)
+
+        task_manager.create_task(job_id, f"导出{kind}({export_format})")
+        args = (job_id, user_id, kind, params, export_format, compress, self._spool_dir())
+        try:
+            future = self._ensure_executor().submit(_run_job, *args)
+        except BrokenProcessPool:
+            # 子进程异常退出后进程池不可再用，重建一次
+            logger.warning("导出进程池已损坏，重新创建")
+            with self._jobs_lock:
+                self._executor = None
+            future = self._ensure_executor().submit(_run_job, *args)
+        self._futures[job_id] = future
+        future.add_done_callback(lambda done: self._finished(job_id, done))
+
+        self.stats["submitted"] += 1
+        logger.info(f"用户 {user_id} 提交导出任务 {job_id}: {kind} {export_format}")
+        return self._public(meta)
+
+    def _finished(self, job_id, future):
+        """任务结束（完成、失败或取消）"""
+        meta = self._jobs.get(job_id)
+        self._futures.pop(job_id, None)
+        if meta is None:
+            return
+        task = task_manager.get_task(job_id)
+
+        error = None if future.cancelled() else future.exception()
+        if future.cancelled() or isinstance(error, ExportCancelled):
+            meta['status'] = 'cancelled'
+            if task:
+                task.cancel()
+        elif error is not None:
+            meta['status'] = 'failed'
+            meta['error'] = str(error)
+            if task:
+                task.fail(error)
+            logger.error(f"导出任务 {job_id} 失败: {str(error)}")
+        else:
+            result = future.result()
+            meta.update(status='completed', rows=result['rows'], size=result['size'], progress=meta['total'] or result['rows'])
+            if task:
+                task.complete(result)
+        meta['finished_at'] = time.time()
+        self.stats[meta['status']] += 1
+
+        cancel_path = self._path(job_id, 'cancel')
+        if os.path.exists(cancel_path):
+            os.remove(cancel_path)
+        try:
+            self._write_meta(meta)
+        except OSError as e:
+            logger.error(f"写入导出任务状态失败: {str(e)}")
+
+    def _drain_loop(self, progress_queue):
+        """接收子进程上报的进度，更新 AsyncTask 并定期写入状态文件"""
+        heartbeat = max(self._config('EXPORT_JOB_STALE_SECONDS', 300) / 10, 1)
+        last_heartbeat = time.monotonic()
+        while self._running:
+            try:
+                job_id, done, total = progress_queue.get(timeout=1)
+            except queue_module.Empty:
+                job_id = None
+            except (EOFError, OSError):
+                break
+
+            if job_id is not None:
+                meta = self._jobs.get(job_id)
+                if meta is not None and meta['status'] in ACTIVE_STATUSES:
+                    task = task_manager.get_task(job_id)
+                    if meta['status'] == 'pending':
+                        meta['status'] = 'running'
+                        meta['started_at'] = time.time()
+                        if task:
+                            task.start()
+                    meta['progress'] = done
+                    meta['total'] = total
+                    if task:
+                        task.update_progress(done, total)
+                    if time.monotonic() - self._written_at.get(job_id, 0) >= 1:
+                        self._safe_write(meta)
+
+            # 长时间没有进度（如写Excel文件时）也要刷新状态文件，避免被其他进程判定为已退出
+            if time.monotonic() - last_heartbeat >= heartbeat:
+                last_heartbeat = time.monotonic()
+                for meta in list(self._jobs.values()):
+                    if meta['status'] in ACTIVE_STATUSES:
+                        self._safe_write(meta)
+
+    def _safe_write(self, meta):
+        try:
+            self._write_meta(meta)
+        except OSError as e:
+            logger.error(f"写入导出任务状态失败: {str(e)}")
+
+    def get(self, job_id):
+        """
+        查询任务状态
+
+        返回:
+            dict: 任务状态，不存在时为None
+        """
+        meta = self._jobs.get(job_id) or self._read_meta(job_id)
+        return self._public(meta) if meta is not None else None
+
+    @staticmethod
+    def _public(meta):
+        meta = dict(meta)
+        meta['progress_percent'] = int(meta['progress'] / meta['total'] * 100) if meta['total'] else 0
+        return meta
+
+    def list(self, user_id):
+        """列出用户的所有导出任务，按提交时间倒序"""
+        return self._user_jobs(user_id)
+
+    def cancel(self, job_id):
+        """
+        取消任务：还没开始的直接从队列中撤销，执行中的由子进程在下次上报进度时停止
+
+        返回:
+            dict: 任务状态，不存在时为None
+        """
+        meta = self.get(job_id)
+        if meta is None or meta['status'] in FINISHED_STATUSES:
+            return meta
+
+        future = self._futures.get(job_id)
+        if future is not None and future.cancel():
+            return self.get(job_id)
+
+        # 任务可能由其他进程执行，写标记文件通知
+        with open(self._path(job_id, 'cancel'), 'w'):
+            pass
+        meta['cancel_requested'] = True
+        return meta
+
+    def file_path(self, job_id):
+        """已完成任务的导出文件路径"""
+        return self._path(job_id, 'data')
+
+    def cleanup(self):
+        """
+        删除过期的导出文件和任务状态
+
+        返回:
+            int: 删除的文件数
+        """
+        ttl = self._config('EXPORT_JOB_TTL', 86400)
+        spool_dir = self._spool_dir()
+        now = time.time()
+        removed = 0
+        try:
+            names = os.listdir(spool_dir)
+        except OSError:
+            return 0
+
+        for name in names:
+            path = os.path.join(spool_dir, name)
+            job_id, _, suffix = name.partition('.')
+            if suffix == 'json':
+                meta = self._read_meta(job_id)
+                if meta is None:
+                    continue
+                finished_at = meta.get('finished_at') or (meta.get('updated_at') if meta['status'] == 'failed' else None)
+                if not finished_at or now - finished_at <= ttl:
+                    continue
+                for suffix_ in ('data', 'part', 'cancel', 'json'):
+                    target = self._path(job_id, suffix_)
+                    if os.path.exists(target):
+                        os.remove(target)
+                        removed += 1
+                self._jobs.pop(job_id, None)
+                self._written_at.pop(job_id, None)
+            elif suffix in ('part', 'cancel') or suffix.endswith('.tmp'):
+                # 进程异常退出留下的临时文件
+                try:
+                    if now - os.path.getmtime(path) > ttl and not os.path.exists(self._path(job_id, 'json')):
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+
+        if removed:
+            self.stats["cleaned_files"] += removed
+            logger.info(f"已清理 {removed} 个过期导出文件")
+        return removed
+
+    def _cleanup_loop(self):
+        """清理线程"""
+        while self._running:
+            try:
+                self.cleanup()
+            except Exception as e:
+                logger.error(f"清理导出文件时发生错误: {str(e)}")
+            self._stop_event.wait(self._config('EXPORT_JOB_CLEANUP_INTERVAL', 600))
+
+    def snapshot(self):
+        """获取导出任务状态"""
+        jobs = list(self._jobs.values())
+        return {
+            "pending": sum(1 for meta in jobs if meta['status'] == 'pending'),
+            "running": sum(1 for meta in jobs if meta['status'] == 'running'),
+            "workers": self._config('EXPORT_JOB_WORKERS', 2) if self._app else 0,
+            "stats": dict(self.stats)
+        }
+
+    def stop(self):
+        """停止清理线程和进程池"""
+        self._running = False
+        self._stop_event.set()
+        with self._jobs_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if self._cleanup_thread is not None and self._cleanup_thread.is_alive():
+            self._cleanup_thread.join(timeout=5)
+
+# 创建导出任务管理器实例
+export_jobs = ExportJobManager()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+后台任务租约
+
+用数据库中的一行作为租约：持有者在到期前续约，到期后其他进程可以接管。
+获取和续约都是单条条件UPDATE，没有这一行时插入，插入冲突说明被其他进程抢先。
+"""
+
+import os
+import uuid
+import socket
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import update, insert, delete
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+def lease_owner():
+    """生成本进程的租约持有者标识"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+def acquire_lease(name, owner, ttl):
+    """
+    获取或续约租约
+
+    参数:
+        name (str): 任务名称
+        owner (str): 持有者标识
+        ttl (float): 租约有效期（秒）
+
+    返回:
+        bool: 是否持有租约
+    """
+    from app.models import db, JobLease
+
+    leases = JobLease.__table__
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=ttl)
+    try:
+        result = db.session.execute(
+            update(leases)
+            .where(leases.c.name == name, (leases.c.owner == owner) | (leases.c.expires_at < now))
+            .values(owner=owner, expires_at=expires_at, updated_at=now)
+        )
+        if result.rowcount == 1:
+            db.session.commit()
+            return True
+
+        db.session.execute(insert(leases).values(name=name, owner=owner, expires_at=expires_at, updated_at=now))
+        db.session.commit()
+        return True
+    except IntegrityError:
+        # 租约已被其他进程持有
+        db.session.rollback()
+        return False
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"获取任务租约 {name} 时发生错误: {str(e)}")
+        return False
+
+def release_lease(name, owner):
+    """主动释放租约（停机时调用），其他进程不必等待到期"""
+    from app.models import db, JobLease
+
+    leases = JobLease.__table__
+    try:
+        db.session.execute(delete(leases).where(leases.c.name == name, leases.c.owner == owner))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"释放任务租约 {name} 时发生错误: {str(e)}")
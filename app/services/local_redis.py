@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+进程内的Redis替身
+
+实现缓存用到的那部分 redis-py 接口（get/set/setex/mget/delete/incr/flushdb/
+scan_iter/pipeline/publish/pubsub），数据和订阅都在当前进程内。
+URL 配置为 memory:// 时使用，同一个URL在进程内得到同一个实例，
+开发和测试环境不需要启动Redis也能走完整的L1/L2和失效广播流程。
+
+用法:
+    client = redis_from_url('memory://')        # 进程内替身
+    client = redis_from_url('redis://host:6379/0')  # 真正的Redis
+"""
+
+import time
+import queue
+import fnmatch
+import threading
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+def _to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    if isinstance(value, (int, float)):
+        return str(value).encode('utf-8')
+    raise TypeError(f"不支持的值类型: {type(value).__name__}")
+
+class LocalPubSub:
+    """订阅对象，接口与 redis-py 的 PubSub 相同"""
+
+    def __init__(self, server):
+        self._server = server
+        self._queue = queue.Queue()
+        self.channels = set()
+
+    def subscribe(self, *channels):
+        for channel in channels:
+            channel = _to_bytes(channel)
+            self.channels.add(channel)
+            self._server._subscribe(channel, self)
+            self._queue.put({'type': 'subscribe', 'pattern': None, 'channel': channel, 'data': len(self.channels)})
+
+    def unsubscribe(self, *channels):
+        for channel in [_to_bytes(c) for c in channels] or list(self.channels):
+            self.channels.discard(channel)
+            self._server._unsubscribe(channel, self)
+
+    def get_message(self, ignore_subscribe_messages=False, timeout=0.0):
+        deadline = time.monotonic() + (timeout or 0)
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                message = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                return None
+            if ignore_subscribe_messages and message['type'] != 'message':
+                continue
+            return message
+
+    def close(self):
+        self.unsubscribe()
+
+class LocalPipeline:
+    """管道：缓存命令，execute 时依次执行"""
+
+    def __init__(self, server):
+        self._server = server
+        self._commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self._server, name)
+
+        def queued(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queued
+
+    def execute(self):
+        commands, self._commands = self._commands, []
+        return [method(*args, **kwargs) for method, args, kwargs in commands]
+
+class LocalRedis:
+    """进程内的Redis替身，线程安全"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> (value bytes, 过期时间 monotonic 或 None)
+        self._data = {}
+        # channel -> 订阅对象集合
+        self._subscribers = {}
+
+    def _live(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(_to_bytes(key))
+            return entry[0] if entry else None
+
+    def mget(self, keys):
+        with self._lock:
+            return [(entry[0] if entry else None) for entry in (self._live(_to_bytes(key)) for key in keys)]
+
+    def set(self, key, value, ex=None, px=None, nx=False):
+        key = _to_bytes(key)
+        expires_at = None
+        if ex is not None:
+            expires_at = time.monotonic() + ex
+        elif px is not None:
+            expires_at = time.monotonic() + px / 1000
+        with self._lock:
+            if nx and self._live(key) is not None:
+                return None
+            self._data[key] = (_to_bytes(value), expires_at)
+            return True
+
+    def setex(self, key, ttl, value):
+        return self.set(key, value, ex=ttl)
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(1 for key in keys if self._data.pop(_to_bytes(key), None) is not None)
+
+    def incr(self, key, amount=1):
+        key = _to_bytes(key)
+        with self._lock:
+            entry = self._live(key)
+            value = int(entry[0]) + amount if entry else amount
+            self._data[key] = (_to_bytes(value), entry[1] if entry else None)
+            return value
+
+    def flushdb(self):
+        with self._lock:
+            self._data.clear()
+        return True
+
+    def scan_iter(self, match=None):
+        with self._lock:
+            keys = [key for key in self._data if self._live(key) is not None]
+        pattern = _to_bytes(match).decode('utf-8') if match else None
+        for key in keys:
+            if pattern is None or fnmatch.fnmatchcase(key.decode('utf-8', 'replace'), pattern):
+                yield key
+
+    def pipeline(self, transaction=True):
+        return LocalPipeline(self)
+
+    def publish(self, channel, message):
+        channel = _to_bytes(channel)
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for pubsub in subscribers:
+            pubsub._queue.put({'type': 'message', 'pattern': None, 'channel': channel, 'data': _to_bytes(message)})
+        return len(subscribers)
+
+    def pubsub(self, **kwargs):
+        return LocalPubSub(self)
+
+    def _subscribe(self, channel, pubsub):
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(pubsub)
+
+    def _unsubscribe(self, channel, pubsub):
+        with self._lock:
+            self._subscribers.get(channel, set()).discard(pubsub)
+
+    def ping(self):
+        return True
+
+def redis_from_url(url):
+    """
+    按URL创建Redis客户端
+
+    memory:// 开头时返回进程内替身（同一URL共享一个实例），否则使用 redis-py。
+    """
+    if url.startswith('memory://'):
+        with _instances_lock:
+            if url not in _instances:
+                _instances[url] = LocalRedis()
+            return _instances[url]
+
+    import redis
+    return redis.from_url(url)
@@ -34,6 +34,9 @@ class MetricsCollector:
             "api_calls": {},  # API调用计数
             "response_times": {},  # 响应时间
             "errors": {},  # 错误计数
+            "circuit_breakers": {},  # 上游熔断器状态
+            "upstream": {},  # 上游重试/对冲等事件计数
+            "caches": {},  # 进程内缓存的大小和命中统计
             "system": {
                 "cpu": 0,
                 "memory": 0,
@@ -151,6 +154,39 @@ class MetricsCollector:
             self.metrics["errors"][endpoint][error_type]["last_message"] = error_message
             self.metrics["errors"][endpoint][error_type]["last_time"] = time.time()
     
+    def record_circuit_breaker(self, name, state, trips, rejected=False):
+        """记录熔断器状态"""
+        with self.metrics_lock:
+            if name not in self.metrics["circuit_breakers"]:
+                self.metrics["circuit_breakers"][name] = {
+                    "state": state,
+                    "trips": 0,
+                    "rejected": 0,
+                    "last_change": time.time()
+                }
+            
+            breaker = self.metrics["circuit_breakers"][name]
+            if breaker["state"] != state:
+                breaker["last_change"] = time.time()
+            breaker["state"] = state
+            breaker["trips"] = trips
+            if rejected:
+                breaker["rejected"] += 1
+    
+    def record_upstream_event(self, name, event):
+        """记录上游调用事件（retry, hedge, deadline_exceeded等）"""
+        with self.metrics_lock:
+            if name not in self.metrics["upstream"]:
+                self.metrics["upstream"][name] = {}
+            
+            events = self.metrics["upstream"][name]
+            events[event] = events.get(event, 0) + 1
+    
+    def record_cache(self, name, stats):
+        """记录缓存的大小和命中统计（由缓存的后台清理线程定期上报）"""
+        with self.metrics_lock:
+            self.metrics["caches"][name] = dict(stats, last_update=time.time())
+    
     def get_metrics(self):
         """获取所有指标"""
         with self.metrics_lock:
@@ -186,6 +222,28 @@ class MetricsCollector:
                     "last_update": datetime.datetime.fromtimestamp(data["last_update"]).strftime('%Y-%m-%d %H:%M:%S')
                 }
             
+            # 格式化熔断器指标
+            formatted_metrics["circuit_breakers"] = {}
+            for name, data in self.metrics["circuit_breakers"].items():
+                formatted_metrics["circuit_breakers"][name] = {
+                    "state": data["state"],
+                    "trips": data["trips"],
+                    "rejected": data["rejected"],
+                    "last_change": datetime.datetime.fromtimestamp(data["last_change"]).strftime('%Y-%m-%d %H:%M:%S')
+                }
+            
+            # 格式化上游事件指标
+            formatted_metrics["upstream"] = {
+                name: events.copy() for name, events in self.metrics["upstream"].items()
+            }
+            
+            # 格式化缓存指标
+            formatted_metrics["caches"] = {}
+            for name, data in self.metrics["caches"].items():
+                formatted_metrics["caches"][name] = dict(
+                    data, last_update=datetime.datetime.fromtimestamp(data["last_update"]).strftime('%Y-%m-%d %H:%M:%S')
+                )
+            
             # 格式化错误指标
             for endpoint, errors in self.metrics["errors"].items():
                 formatted_metrics["errors"][endpoint] = {}
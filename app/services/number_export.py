@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+号码记录流式导出
+
+按 yield_per 分批迭代查询结果（与项目表一次JOIN），逐行编码成 CSV / NDJSON /
+JSON 数组 / Excel，按块产出字节，可选gzip压缩。无论导出多少行，内存中只保留
+当前一批记录和一个输出缓冲区。
+
+用法:
+    rows = iter_number_rows(query)
+    chunks = encode_rows(rows, 'csv', compress=True)
+"""
+
+import io
+import csv
+import json
+import zlib
+import tempfile
+from sqlalchemy import desc
+
+# 导出字段，顺序即CSV/Excel的列顺序
+EXPORT_FIELDS = [
+    'id', 'number', 'status', 'project_name', 'project_code', 'request_id',
+    'created_at', 'updated_at', 'sms_code', 'released_at'
+]
+
+# 支持的导出格式: 格式 -> (文件扩展名, MIME类型)
+EXPORT_FORMATS = {
+    'csv': ('csv', 'text/csv; charset=utf-8'),
+    'ndjson': ('ndjson', 'application/x-ndjson'),
+    'json': ('json', 'application/json'),
+    'excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+# 每批从数据库取出的行数
+YIELD_PER = 1000
+# 输出缓冲区达到该字节数后产出一块
+CHUNK_SIZE = 64 * 1024
+
+def number_export_query(user_id, start_date, end_date, status=None):
+    """
+    构造导出查询：号码记录与项目表一次JOIN，只取导出需要的列
+
+    返回:
+        Query: 按创建时间倒序的查询
+    """
+    from app.models import db, PhoneNumber, Project
+
+    query = db.session.query(
+        PhoneNumber.id, PhoneNumber.number, PhoneNumber.status,
+        Project.name, Project.code, PhoneNumber.request_id,
+        PhoneNumber.created_at, PhoneNumber.updated_at,
+        PhoneNumber.sms_code, PhoneNumber.released_at
+    ).outerjoin(
+        Project, Project.id == PhoneNumber.project_id
+    ).filter(
+        PhoneNumber.user_id == user_id,
+        PhoneNumber.created_at.between(start_date, end_date)
+    )
+    if status:
+        query = query.filter(PhoneNumber.status == status)
+    return query.order_by(desc(PhoneNumber.created_at), desc(PhoneNumber.id))
+
+def iter_number_rows(query, yield_per=YIELD_PER):
+    """
+    分批迭代查询结果，产出按 EXPORT_FIELDS 排列的元组
+
+    时间格式为 YYYY-MM-DD HH:MM:SS，用 isoformat 生成，比 strftime 快数倍。
+    """
+    for (phone_id, number, status, project_name, project_code, request_id,
+         created_at, updated_at, sms_code, released_at) in query.yield_per(yield_per):
+        yield (
+            phone_id,
+            number,
+            status,
+            project_name or '未知项目',
+            project_code or '未知代码',
+            request_id,
+            created_at.isoformat(' ', 'seconds') if created_at else '',
+            updated_at.isoformat(' ', 'seconds') if updated_at else '',
+            sms_code or '',
+            released_at.isoformat(' ', 'seconds') if released_at else ''
+        )
+
+def _iter_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # 带BOM，Excel直接打开CSV时中文不会乱码
+    buffer.write('\ufeff')
+    writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+def _iter_json_lines(rows, separator, prefix='', suffix=''):
+    parts = [prefix]
+    size = len(prefix)
+    first = True
+    for row in rows:
+        line = json.dumps(dict(zip(EXPORT_FIELDS, row)), ensure_ascii=False)
+        if not first:
+            parts.append(separator)
+        parts.append(line)
+        first = False
+        size += len(line) + 1
+        if size >= CHUNK_SIZE:
+            yield ''.join(parts).encode('utf-8')
+            parts = []
+            size = 0
+    parts.append(suffix)
+    yield ''.join(parts).encode('utf-8')
+
+def _iter_ndjson(rows):
+    # 每行一个JSON对象，最后一行也以换行结尾
+    for chunk in _iter_json_lines(rows, '\n', suffix='\n'):
+        yield chunk
+
+def _iter_json(rows):
+    for chunk in _iter_json_lines(rows, ',\n', prefix='[\n', suffix='\n]\n'):
+        yield chunk
+
+def _iter_excel(rows):
+    """
+    用 openpyxl 只写模式逐行写入临时文件，写完后分块读出
+
+    xlsx 是zip格式，必须整个文件写完才能产出第一块，但内存占用与行数无关。
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('numbers')
+    sheet.append(EXPORT_FIELDS)
+    for row in rows:
+        sheet.append(row)
+
+    with tempfile.TemporaryFile() as output:
+        workbook.save(output)
+        output.seek(0)
+        while True:
+            chunk = output.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+_ENCODERS = {
+    'csv': _iter_csv,
+    'ndjson': _iter_ndjson,
+    'json': _iter_json,
+    'excel': _iter_excel,
+}
+
+def gzip_chunks(chunks, level=6):
+    """逐块gzip压缩"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def encode_rows(rows, export_format, compress=False):
+    """
+    把行编码为指定格式的字节块
+
+    参数:
+        rows: iter_number_rows 产出的元组
+        export_format (str): csv, ndjson, json, excel
+        compress (bool): 是否gzip压缩
+
+    返回:
+        generator: 字节块
+    """
+    chunks = _ENCODERS[export_format](rows)
+    return gzip_chunks(chunks) if compress else chunks
+
+def export_filename(base, export_format, compress=False):
+    """导出文件名，如 numbers_export_20240101.csv.gz"""
+    extension = EXPORT_FORMATS[export_format][0]
+    return f"{base}.{extension}.gz" if compress else f"{base}.{extension}"
+
+def export_mimetype(export_format, compress=False):
+    """导出文件的MIME类型"""
+    return 'application/gzip' if compress else EXPORT_FORMATS[export_format][1]
@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+class PooledNumber:
+    """号码池中的一个上游号码"""
+    __slots__ = ('project_code', 'payload', 'pooled_at')
+
+    def __init__(self, project_code, payload):
+        self.project_code = project_code
+        self.payload = payload  # 上游get_phone_number的原始返回结果
+        self.pooled_at = time.time()
+
+    @property
+    def provider(self):
+        """提供该号码的上游平台"""
+        return self.payload.get('provider')
+
+    @property
+    def upstream_request_id(self):
+        """上游平台的请求ID，释放号码时使用"""
+        phone_data = self.payload.get('phone_number') or {}
+        return phone_data.get('request_id')
+
+    def is_expired(self, ttl, now=None):
+        """判断号码是否闲置超时"""
+        return ((now or time.time()) - self.pooled_at) > ttl
+
+class NumberPool:
+    """按项目预热的号码池，后台线程维持库存，取号时O(1)出池"""
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(NumberPool, cls).__new__(cls)
+                cls._instance._initialized = False
+            return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        # 项目代码 -> deque[PooledNumber]，左端为最早入池的号码
+        self._pools = {}
+        self._pool_lock = threading.Lock()
+
+        # 项目代码 -> 每小时需求的EWMA
+        self._demand = {}
+        self._demand_updated_at = 0
+
+        self._app = None
+        self._thread = None
+        self._running = False
+
+        # 取号在请求线程、补货在后台线程，计数需要加锁
+        self._stats_lock = threading.Lock()
+
+        self.stats = {
+            "hits": 0,  # 直接从池中取到号码
+            "misses": 0,  # 池为空，回退到上游
+            "refilled": 0,  # 后台补货的号码数
+            "expired": 0,  # 超时释放的号码数
+        }
+
+        self._initialized = True
+
+    def init_app(self, app):
+        """绑定应用实例并启动补货线程"""
+        with self._pool_lock:
+            if self._app is not None:
+                return
+            self._app = app
+
+        if not app.config.get('NUMBER_POOL_ENABLED', True):
+            logger.info("号码池未启用")
+            return
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        logger.info("号码池补货线程已启动")
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def _config(self, key, default=None):
+        app = self._app or current_app
+        return app.config.get(key, default)
+
+    @property
+    def enabled(self):
+        return self._running
+
+    def watermarks(self, project_code):
+        """
+        计算项目当前的低/高水位
+
+        配置的水位是下限，根据最近每小时需求的EWMA放大，
+        保证池中库存能覆盖 NUMBER_POOL_COVERAGE_MINUTES 分钟的取号量。
+        """
+        overrides = self._config('NUMBER_POOL_WATERMARKS', {}) or {}
+        low, high = overrides.get(project_code, (
+            self._config('NUMBER_POOL_LOW_WATERMARK', 2),
+            self._config('NUMBER_POOL_HIGH_WATERMARK', 10)
+        ))
+        max_size = self._config('NUMBER_POOL_MAX_SIZE', 200)
+
+        hourly_demand = self._demand.get(project_code, 0.0)
+        coverage = self._config('NUMBER_POOL_COVERAGE_MINUTES', 10) / 60.0
+        target = math.ceil(hourly_demand * coverage)
+
+        if high > 0 and target > high:
+            scale = target / high
+            low = math.ceil(low * scale)
+            high = target
+
+        high = min(high, max_size)
+        low = min(low, high)
+        return low, high
+
+    def size(self, project_code):
+        pool = self._pools.get(project_code)
+        return len(pool) if pool else 0
+
+    def _pool_for(self, project_code):
+        pool = self._pools.get(project_code)
+        if pool is None:
+            with self._pool_lock:
+                pool = self._pools.setdefault(project_code, deque())
+        return pool
+
+    def _pop(self, project_code):
+        """从池中取出一个未过期的号码，过期号码交给调用方释放"""
+        pool = self._pools.get(project_code)
+        if not pool:
+            return None, []
+
+        ttl = self._config('NUMBER_POOL_TTL', 600)
+        now = time.time()
+        expired = []
+        while True:
+            try:
+                item = pool.popleft()
+            except IndexError:
+                return None, expired
+            if item.is_expired(ttl, now):
+                expired.append(item)
+                continue
+            return item, expired
+
+    def acquire(self, project_code, api_client=None):
+        """
+        获取一个号码
+
+        优先从号码池出池，池为空时回退到上游同步取号。
+
+        返回:
+            dict: 与 SMSApiClient.get_phone_number 相同格式的结果
+        """
+        if self._app is None:
+            try:
+                self.init_app(current_app._get_current_object())
+            except RuntimeError:
+                pass
+
+        item, expired = self._pop(project_code)
+        if api_client is None:
+            from app.services.provider_router import provider_router
+            api_client = provider_router.client()
+        if expired:
+            self._release(expired, api_client)
+
+        if item is not None:
+            self._count("hits")
+            return item.payload
+
+        self._count("misses")
+        # 记录出现需求的项目，让补货线程开始维护该项目
+        self._pool_for(project_code)
+        return api_client.get_phone_number(project_code)
+
+    def acquire_many(self, project_code, count, api_client=None):
+        """
+        批量获取号码
+
+        先从号码池取出尽可能多的号码，不足部分并发向上游获取。
+
+        返回:
+            list: 与 SMSApiClient.get_phone_number 相同格式的结果列表
+        """
+        if api_client is None:
+            from app.services.provider_router import provider_router
+            api_client = provider_router.client()
+
+        results = []
+        expired_all = []
+        while len(results) < count:
+            item, expired = self._pop(project_code)
+            expired_all.extend(expired)
+            if item is None:
+                break
+            results.append(item.payload)
+        if expired_all:
+            self._release(expired_all, api_client)
+
+        self._count("hits", len(results))
+        remaining = count - len(results)
+        if remaining > 0:
+            self._count("misses", remaining)
+            self._pool_for(project_code)
+            results.extend(api_client.get_phone_numbers(project_code, remaining))
+        return results
+
+    def restock(self, project_code, payloads):
+        """把已取出但未能售出的号码放回池中（例如扣费失败时）"""
+        pool = self._pool_for(project_code)
+        for payload in payloads:
+            if payload and payload.get('success', False):
+                pool.appendleft(PooledNumber(project_code, payload))
+
+    def release(self, project_code, payloads, api_client=None):
+        """把已取出但不能使用的号码还给上游"""
+        if api_client is None:
+            from app.services.provider_router import provider_router
+            api_client = provider_router.client()
+        self._release([PooledNumber(project_code, payload) for payload in payloads if payload], api_client)
+
+    def refill(self, project_code, api_client):
+        """把项目号码池补到高水位"""
+        low, high = self.watermarks(project_code)
+        pool = self._pool_for(project_code)
+        if len(pool) >= low or high <= 0:
+            return 0
+
+        added = 0
+        for result in api_client.get_phone_numbers(project_code, high - len(pool)):
+            if not result.get('success', False):
+                logger.warning(f"号码池补货失败，项目: {project_code}，原因: {result.get('message', '未知错误')}")
+                continue
+            pool.append(PooledNumber(project_code, result))
+            added += 1
+
+        self._count("refilled", added)
+        if added:
+            logger.debug(f"号码池补货 {added} 个，项目: {project_code}，当前库存: {len(pool)}")
+        return added
+
+    def recycle_expired(self, api_client):
+        """释放闲置超时的号码"""
+        ttl = self._config('NUMBER_POOL_TTL', 600)
+        now = time.time()
+        expired = []
+        for pool in list(self._pools.values()):
+            # 左端是最早入池的号码，遇到未过期的即可停止
+            while pool:
+                try:
+                    item = pool[0]
+                except IndexError:
+                    break
+                if not item.is_expired(ttl, now):
+                    break
+                try:
+                    expired.append(pool.popleft())
+                except IndexError:
+                    break
+
+        if expired:
+            self._release(expired, api_client)
+        return len(expired)
+
+    def _release(self, items, api_client):
+        """把号码还给上游"""
+        for item in items:
+            request_id = item.upstream_request_id
+            if not request_id:
+                continue
+            try:
+                api_client.release_phone_number(request_id, provider=item.provider)
+            except Exception as e:
+                logger.warning(f"释放池中号码失败，上游请求ID: {request_id}，错误: {str(e)}")
+        self._count("expired", len(items))
+
+    def update_demand(self):
+        """根据 PhoneNumber.created_at 统计每小时取号量，更新各项目需求的EWMA"""
+        from sqlalchemy import func
+        from app.database import db
+        from app.models.number import PhoneNumber
+        from app.models.project import Project
+        from app.services.sql_dialect import stats_dialect
+
+        window_hours = self._config('NUMBER_POOL_DEMAND_WINDOW_HOURS', 24)
+        alpha = self._config('NUMBER_POOL_DEMAND_ALPHA', 0.3)
+        now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        since = now - timedelta(hours=window_hours)
+
+        session = db.get_session()
+        try:
+            # 按 日期 + 小时 分组，各数据库的写法由方言层生成
+            dialect = stats_dialect(session)
+            day = dialect.day_bucket(PhoneNumber.created_at)
+            hour = dialect.hour_of_day(PhoneNumber.created_at)
+            rows = (session.query(
+                    Project.code,
+                    day.label('day'),
+                    hour.label('hour'),
+                    func.count(PhoneNumber.id).label('count')
+                )
+                .join(Project, PhoneNumber.project_id == Project.id)
+                .filter(PhoneNumber.created_at >= since)
+                .group_by(Project.code, day, hour)
+                .all())
+        finally:
+            db.close_session()
+
+        hourly = {}
+        for code, day_value, hour_value, count in rows:
+            # SQLite 的 date() 返回字符串，其他数据库返回 date
+            bucket = f"{str(day_value)[:10]} {int(hour_value):02d}"
+            hourly.setdefault(code, {})[bucket] = count
+
+        # 按时间顺序折叠，没有取号的小时按0计入
+        buckets = [(since + timedelta(hours=i)).strftime('%Y-%m-%d %H') for i in range(window_hours + 1)]
+        demand = {}
+        for code, counts in hourly.items():
+            ewma = 0.0
+            for bucket in buckets:
+                ewma = alpha * counts.get(bucket, 0) + (1 - alpha) * ewma
+            demand[code] = ewma
+            self._pool_for(code)
+
+        self._demand = demand
+        self._demand_updated_at = time.time()
+        return demand
+
+    def _run(self):
+        """后台补货线程"""
+        from app.services.provider_router import provider_router
+
+        while self._running:
+            interval = self._config('NUMBER_POOL_REFILL_INTERVAL', 5)
+            try:
+                with self._app.app_context():
+                    if time.time() - self._demand_updated_at > self._config('NUMBER_POOL_DEMAND_INTERVAL', 300):
+                        try:
+                            self.update_demand()
+                        except Exception as e:
+                            self._demand_updated_at = time.time()
+                            logger.error(f"更新号码需求时发生错误: {str(e)}")
+
+                    api_client = provider_router.client()
+                    self.recycle_expired(api_client)
+
+                    overrides = self._config('NUMBER_POOL_WATERMARKS', {}) or {}
+                    for project_code in set(self._pools.keys()) | set(overrides.keys()):
+                        self.refill(project_code, api_client)
+            except Exception as e:
+                logger.error(f"号码池补货时发生错误: {str(e)}")
+
+            time.sleep(interval)
+
+    def _stats_copy(self):
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def snapshot(self):
+        """获取号码池状态"""
+        projects = {}
+        for project_code, pool in list(self._pools.items()):
+            low, high = self.watermarks(project_code)
+            projects[project_code] = {
+                "size": len(pool),
+                "low_watermark": low,
+                "high_watermark": high,
+                "hourly_demand": round(self._demand.get(project_code, 0.0), 2)
+            }
+        return {
+            "enabled": self._running,
+            "stats": self._stats_copy(),
+            "projects": projects
+        }
+
+    def stop(self):
+        """停止补货线程"""
+        self._running = False
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=5)
+
+# 创建号码池实例
+number_pool = NumberPool()
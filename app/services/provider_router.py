@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+多上游接码平台路由
+
+SMS_API_PROVIDERS 中可以配置多个上游平台，每个平台有自己的项目映射、
+成本价和权重。取号时按各平台在该项目上最近的成功率和延迟（滑动窗口）
+打分，依次尝试得分最高的平台，失败或熔断时自动切换到下一个。
+未配置 SMS_API_PROVIDERS 时只有一个由 SMS_API_BASE_URL 构成的默认平台。
+
+用法:
+    api_client = provider_router.client()
+    result = api_client.get_phone_number('wechat_login')
+    api_client.get_sms_code(request_id, provider=result.get('provider'))
+"""
+
+import time
+import random
+import logging
+import threading
+import weakref
+from collections import deque
+from flask import current_app
+from app.services.monitoring import metrics_collector
+from app.services.resilience import CircuitOpenError, CircuitBreaker, get_breaker
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROVIDER = 'default'
+
+class Provider:
+    """一个上游接码平台"""
+
+    def __init__(self, name, base_url, api_key='', weight=1.0, projects=None, prices=None):
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self.weight = weight
+        self.projects = projects  # 本地项目代码 -> 上游项目代码，None表示支持所有项目且代码相同
+        self.prices = prices or {}  # 本地项目代码 -> 上游成本价
+
+    @classmethod
+    def from_config(cls, item):
+        return cls(
+            name=item['name'],
+            base_url=item['base_url'],
+            api_key=item.get('api_key', ''),
+            weight=item.get('weight', 1.0),
+            projects=item.get('projects'),
+            prices=item.get('prices')
+        )
+
+    def supports(self, project_code):
+        return self.projects is None or project_code in self.projects
+
+    def upstream_code(self, project_code):
+        """本地项目代码对应的上游项目代码"""
+        if self.projects is None:
+            return project_code
+        return self.projects.get(project_code) or project_code
+
+    def price(self, project_code):
+        return self.prices.get(project_code)
+
+class RollingWindow:
+    """最近一段时间内的调用结果（成功与否、耗时）"""
+
+    def __init__(self, window_seconds=300, max_samples=100):
+        self.window_seconds = window_seconds
+        self._samples = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def record(self, ok, latency):
+        with self._lock:
+            self._samples.append((time.monotonic(), ok, latency))
+
+    def summary(self):
+        """
+        返回 (样本数, 成功率, 平均耗时)
+
+        成功率使用拉普拉斯平滑，样本少时不会出现0或1的极端值；
+        没有成功样本时平均耗时返回None。
+        """
+        cutoff = time.monotonic() - self.window_seconds
+        with self._lock:
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            samples = list(self._samples)
+
+        total = len(samples)
+        successes = [latency for _, ok, latency in samples if ok]
+        success_rate = (len(successes) + 1) / (total + 2)
+        latency = sum(successes) / len(successes) if successes else None
+        return total, success_rate, latency
+
+class ProviderRouter:
+    """按项目为每次取号选择上游平台"""
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(ProviderRouter, cls).__new__(cls)
+                cls._instance._initialized = False
+            return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        # (平台名, 项目代码) -> RollingWindow
+        self._windows = {}
+        self._windows_lock = threading.Lock()
+        # 应用 -> {(平台名, 地址, 密钥): SMSApiClient}，每个平台的客户端只创建一次
+        self._clients = weakref.WeakKeyDictionary()
+        self._clients_lock = threading.Lock()
+
+        self._initialized = True
+
+    def providers(self):
+        """当前配置的所有上游平台"""
+        config = current_app.config
+        items = config.get('SMS_API_PROVIDERS') or []
+        if not items:
+            return [Provider(DEFAULT_PROVIDER, config['SMS_API_BASE_URL'], config['SMS_API_KEY'])]
+        return [Provider.from_config(item) for item in items]
+
+    def _window(self, provider_name, project_code):
+        key = (provider_name, project_code)
+        window = self._windows.get(key)
+        if window is None:
+            with self._windows_lock:
+                window = self._windows.get(key)
+                if window is None:
+                    window = RollingWindow(
+                        current_app.config.get('SMS_PROVIDER_WINDOW_SECONDS', 300),
+                        current_app.config.get('SMS_PROVIDER_WINDOW_SIZE', 100)
+                    )
+                    self._windows[key] = window
+        return window
+
+    def record(self, provider_name, project_code, ok, latency):
+        """记录一次取号结果"""
+        window = self._windows.get((provider_name, project_code))
+        if window is not None:
+            window.record(ok, latency)
+
+    def score(self, provider, project_code):
+        """
+        平台得分：权重 × 成功率 / 平均耗时
+
+        还没有成功样本的平台按 SMS_PROVIDER_DEFAULT_LATENCY 估计耗时，
+        让新平台有机会被选中。
+        """
+        _, success_rate, latency = self._window(provider.name, project_code).summary()
+        if latency is None:
+            latency = current_app.config.get('SMS_PROVIDER_DEFAULT_LATENCY', 0.5)
+        return provider.weight * success_rate / (latency + 0.01)
+
+    def rank(self, project_code, max_cost=None):
+        """
+        按得分从高到低排列支持该项目的平台
+
+        成本价高于 max_cost 的平台不参与；熔断中的平台排在最后。
+        以 SMS_PROVIDER_EXPLORE_RATE 的概率把一个随机平台提到最前，
+        保证得分低的平台恢复后能重新积累样本。
+        """
+        candidates = []
+        for provider in self.providers():
+            if not provider.supports(project_code):
+                continue
+            price = provider.price(project_code)
+            if max_cost is not None and price is not None and price > max_cost:
+                continue
+            breaker = get_breaker(f"{provider.base_url}:get_phone_number")
+            is_open = breaker.state == CircuitBreaker.OPEN
+            candidates.append((is_open, -self.score(provider, project_code), provider))
+
+        candidates.sort(key=lambda item: (item[0], item[1]))
+        ranked = [provider for _, _, provider in candidates]
+
+        explore_rate = current_app.config.get('SMS_PROVIDER_EXPLORE_RATE', 0.05)
+        if len(ranked) > 1 and random.random() < explore_rate:
+            ranked.insert(0, ranked.pop(random.randrange(1, len(ranked))))
+        return ranked
+
+    def client(self, max_cost=None):
+        """创建一个按平台路由的API客户端，需要在应用上下文中调用"""
+        return RoutedSMSApiClient(self, max_cost)
+
+    def provider_client(self, provider):
+        """
+        某个平台的 SMSApiClient，按应用缓存
+
+        客户端创建时读取应用配置，之后只读，可以在请求和线程之间共享。
+        平台地址或密钥修改后会创建新的客户端。
+        """
+        from app.utils import SMSApiClient
+
+        app = current_app._get_current_object()
+        key = (provider.name, provider.base_url, provider.api_key)
+        clients = self._clients.get(app)
+        client = clients.get(key) if clients is not None else None
+        if client is None:
+            with self._clients_lock:
+                clients = self._clients.setdefault(app, {})
+                client = clients.get(key)
+                if client is None:
+                    client = SMSApiClient(provider.base_url, provider.api_key)
+                    clients[key] = client
+        return client
+
+    def snapshot(self):
+        """各平台在各项目上的滑动窗口统计"""
+        result = {}
+        for (provider_name, project_code), window in list(self._windows.items()):
+            total, success_rate, latency = window.summary()
+            result.setdefault(provider_name, {})[project_code] = {
+                "samples": total,
+                "success_rate": round(success_rate, 3),
+                "avg_latency_ms": round(latency * 1000, 1) if latency is not None else None
+            }
+        return result
+
+class RoutedSMSApiClient:
+    """
+    多平台API客户端
+
+    与 SMSApiClient 方法相同。取号类方法按得分选择平台并自动切换，
+    返回结果中带 provider 字段；针对已有号码的操作需要传入该号码所属的平台。
+    """
+
+    def __init__(self, router, max_cost=None):
+        self.router = router
+        self.max_cost = max_cost
+        self.use_mock = current_app.config.get('USE_MOCK_API', True)
+        self.providers = {provider.name: provider for provider in router.providers()}
+        # 在调用方线程中取出各平台客户端，工作线程中不需要应用上下文
+        self.clients = {
+            name: router.provider_client(provider)
+            for name, provider in self.providers.items()
+        }
+        self.default_provider = next(iter(self.providers))
+        self.base_url = ','.join(provider.base_url for provider in self.providers.values())
+        self._ranked = {}
+
+    def _ranked_providers(self, project_code):
+        ranked = self._ranked.get(project_code)
+        if ranked is None:
+            ranked = self.router.rank(project_code, self.max_cost)
+            # 预先创建滑动窗口，工作线程中只做记录
+            for provider in ranked:
+                self.router._window(provider.name, project_code)
+            self._ranked[project_code] = ranked
+        return ranked
+
+    def client_for(self, provider=None):
+        """号码所属平台的客户端，平台未知或已下线时使用默认平台"""
+        return self.clients.get(provider) or self.clients[self.default_provider]
+
+    def _in_flight_limit(self, provider_name):
+        """平台的在途请求数限制信号量"""
+        from app.utils import get_in_flight_limit
+
+        client = self.clients[provider_name]
+        return get_in_flight_limit(client.base_url, client.max_in_flight)
+
+    def _acquire(self, project_code, ranked, call, held=None):
+        """
+        按顺序尝试各平台，直到有一个成功
+
+        参数:
+            held: 调用方已占用在途名额的平台；传入时切换到其他平台前先占用该平台的名额，
+                名额已满的平台跳过（工作线程中不等待名额，以免占住共享线程池）
+        """
+        result = None
+        circuit_error = None
+        for index, provider in enumerate(ranked):
+            slot = None
+            if held is not None and provider.name != held:
+                slot = self._in_flight_limit(provider.name)
+                if not slot.acquire(blocking=False):
+                    metrics_collector.record_upstream_event(provider.name, 'in_flight_full')
+                    continue
+            if index > 0:
+                metrics_collector.record_upstream_event(provider.name, 'failover')
+            started = time.monotonic()
+            try:
+                result = call(self.clients[provider.name], provider.upstream_code(project_code))
+            except CircuitOpenError as e:
+                circuit_error = e
+                continue
+            finally:
+                if slot is not None:
+                    slot.release()
+            ok = bool(result.get('success', False))
+            self.router.record(provider.name, project_code, ok, time.monotonic() - started)
+            if ok:
+                return dict(result, provider=provider.name)
+            logger.warning(f"上游平台 {provider.name} 取号失败，项目: {project_code}，原因: {result.get('message', '未知错误')}")
+
+        if result is None:
+            if circuit_error is not None:
+                raise circuit_error
+            return {'success': False, 'message': f'没有支持项目 {project_code} 的上游平台'}
+        return result
+
+    def get_phone_number(self, project_code):
+        """获取手机号码"""
+        ranked = self._ranked_providers(project_code)
+        return self._acquire(project_code, ranked, lambda client, code: client.get_phone_number(code))
+
+    def get_phone_numbers(self, project_code, count):
+        """并发获取多个手机号码，每个号码独立选择平台"""
+        from app.utils import submit_upstream, gather_upstream
+
+        ranked = self._ranked_providers(project_code)
+        if not ranked:
+            # 每个位置一个独立的失败结果，调用方可能会修改其中某一个
+            return [{'success': False, 'message': f'没有支持项目 {project_code} 的上游平台'} for _ in range(count)]
+
+        # 提交前占用首选平台的在途名额，切换到其他平台时再占用该平台的名额
+        first = ranked[0].name
+        semaphore = self._in_flight_limit(first)
+
+        def _call():
+            try:
+                return self._acquire(project_code, ranked, lambda client, code: client.get_phone_number(code),
+                                     held=first)
+            except CircuitOpenError as e:
+                return {'success': False, 'message': str(e), 'retry_after': e.retry_after}
+            except Exception as e:
+                logger.error(f"并发调用上游接口异常: {e}")
+                return {'success': False, 'message': f'请求异常: {str(e)}'}
+
+        return gather_upstream([submit_upstream(semaphore, _call) for _ in range(count)])
+
+    def get_specific_phone_number(self, project_code, number):
+        """获取指定手机号码"""
+        ranked = self._ranked_providers(project_code)
+        return self._acquire(project_code, ranked, lambda client, code: client.get_specific_phone_number(code, number))
+
+    def release_phone_number(self, request_id, provider=None):
+        """释放手机号码"""
+        return self.client_for(provider).release_phone_number(request_id)
+
+    def release_phone_numbers(self, items):
+        """
+        并发释放多个手机号码
+
+        参数:
+            items: (请求ID, 平台) 列表
+
+        返回:
+            list: 与items顺序一致的结果列表，异常会被转换为失败结果
+        """
+        from app.utils import get_in_flight_limit, submit_upstream, gather_upstream
+
+        def _call(client, request_id):
+            try:
+                return client.release_phone_number(request_id)
+            except CircuitOpenError as e:
+                return {'success': False, 'message': str(e), 'retry_after': e.retry_after}
+            except Exception as e:
+                logger.error(f"并发调用上游接口异常: {e}")
+                return {'success': False, 'message': f'请求异常: {str(e)}'}
+
+        futures = []
+        for request_id, provider in items:
+            client = self.client_for(provider)
+            # 在途并发按号码所属平台分别限制
+            semaphore = get_in_flight_limit(client.base_url, client.max_in_flight)
+            futures.append(submit_upstream(semaphore, _call, client, request_id))
+        return gather_upstream(futures)
+
+    def blacklist_phone_number(self, number, reason=None, provider=None):
+        """拉黑手机号码"""
+        return self.client_for(provider).blacklist_phone_number(number, reason)
+
+    def get_sms_code(self, request_id, provider=None):
+        """获取短信验证码"""
+        return self.client_for(provider).get_sms_code(request_id)
+
+    def get_projects(self):
+        """获取默认平台的项目列表"""
+        return self.client_for().get_projects()
+
+    def check_balance(self, provider=None):
+        """查询平台账户余额"""
+        return self.client_for(provider).check_balance()
+
+# 创建路由实例
+provider_router = ProviderRouter()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+上游调用的容错组件：熔断器、截止时间、重试预算
+
+上游变慢时，熔断器让请求快速失败（503 + Retry-After），避免工作线程
+全部阻塞在上游调用上；截止时间限制一次请求内所有上游调用的总耗时；
+重试预算限制重试占总请求量的比例，防止重试放大故障。
+"""
+
+import math
+import time
+import random
+import logging
+import threading
+import contextvars
+from functools import wraps
+from contextlib import contextmanager
+from flask import jsonify, request, current_app
+from app.services.monitoring import metrics_collector
+
+logger = logging.getLogger(__name__)
+
+class CircuitOpenError(Exception):
+    """熔断器打开时抛出的异常"""
+    def __init__(self, name, retry_after):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(f"上游服务 {name} 已熔断，请{math.ceil(retry_after)}秒后重试")
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    连续失败达到阈值后打开，打开期间直接拒绝调用；
+    冷却时间过后进入半开状态，放行一个试探请求，成功则关闭，失败则重新打开。
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """检查是否允许调用，不允许时抛出 CircuitOpenError"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            retry_after = self.opened_at + self.reset_timeout - time.monotonic()
+            if self.state == self.OPEN and retry_after <= 0:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+        metrics_collector.record_circuit_breaker(self.name, self.state, self.trips, rejected=True)
+        raise CircuitOpenError(self.name, max(retry_after, 1))
+
+    def record_success(self):
+        """记录一次成功调用"""
+        with self._lock:
+            self.failures = 0
+            self._trial_in_flight = False
+            if self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        """记录一次失败调用"""
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self.trips += 1
+                self._set_state(self.OPEN)
+                logger.warning(f"上游 {self.name} 熔断，连续失败 {self.failures} 次，累计熔断 {self.trips} 次")
+
+    def _set_state(self, state):
+        self.state = state
+        metrics_collector.record_circuit_breaker(self.name, state, self.trips)
+
+class RetryBudget:
+    """
+    重试预算（令牌桶）
+
+    每次正常请求存入 ratio 个令牌，每次重试或对冲请求消耗一个令牌，
+    另外每秒保底补充 min_per_sec 个令牌，保证低流量时也能重试。
+    """
+
+    def __init__(self, ratio=0.1, min_per_sec=1.0, max_tokens=10.0):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self._updated_at) * self.min_per_sec)
+        self._updated_at = now
+
+    def deposit(self):
+        """记录一次正常请求"""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_withdraw(self):
+        """尝试消耗一个令牌，预算不足时返回False"""
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+def backoff_delay(attempt, base=0.1, cap=1.0):
+    """带完全抖动的指数退避时间"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+# 当前请求的截止时间（time.monotonic()时间点），线程和协程各自独立
+_current_deadline = contextvars.ContextVar('upstream_deadline', default=None)
+
+@contextmanager
+def deadline(seconds):
+    """
+    为代码块设置截止时间
+
+    块内所有上游调用共享这一时间预算，嵌套时取更早的截止时间。
+
+    用法:
+        with deadline(5):
+            api_client.get_phone_number(project_code)
+    """
+    expires_at = time.monotonic() + seconds
+    current = _current_deadline.get()
+    if current is not None:
+        expires_at = min(expires_at, current)
+    token = _current_deadline.set(expires_at)
+    try:
+        yield
+    finally:
+        _current_deadline.reset(token)
+
+def upstream_deadline(func):
+    """
+    视图装饰器：整个请求内的上游调用共享 UPSTREAM_REQUEST_DEADLINE 秒的截止时间
+
+    带 wait 参数的长轮询请求，截止时间再加上等待的秒数。
+    """
+    @wraps(func)
+    def decorated(*args, **kwargs):
+        seconds = current_app.config.get('UPSTREAM_REQUEST_DEADLINE', 15)
+        try:
+            wait = float(request.args.get('wait', 0))
+        except ValueError:
+            wait = 0
+        seconds += min(max(wait, 0), current_app.config.get('SMS_WAIT_MAX_SECONDS', 30))
+        with deadline(seconds):
+            return func(*args, **kwargs)
+    return decorated
+
+def remaining_time():
+    """当前截止时间剩余的秒数，未设置截止时间时返回None"""
+    expires_at = _current_deadline.get()
+    if expires_at is None:
+        return None
+    return expires_at - time.monotonic()
+
+# 按名称共享的熔断器和重试预算
+_breakers = {}
+_budgets = {}
+_registry_lock = threading.Lock()
+
+def get_breaker(name, failure_threshold=5, reset_timeout=30):
+    """获取（或创建）指定名称的熔断器"""
+    with _registry_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+            _breakers[name] = breaker
+        return breaker
+
+def get_retry_budget(name, ratio=0.1, min_per_sec=1.0):
+    """获取（或创建）指定名称的重试预算"""
+    with _registry_lock:
+        budget = _budgets.get(name)
+        if budget is None:
+            budget = RetryBudget(ratio, min_per_sec)
+            _budgets[name] = budget
+        return budget
+
+def circuit_open_response(error):
+    """把 CircuitOpenError 转换为 503 响应"""
+    retry_after = int(math.ceil(error.retry_after))
+    response = jsonify({
+        'message': f'上游服务暂时不可用，请{retry_after}秒后重试',
+        'code': 503,
+        'retry_after': retry_after
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
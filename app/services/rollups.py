@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+统计汇总表维护
+
+stats_hourly / stats_daily 按 (用户, 项目, 时间桶) 保存取号数、收码数、消费和
+退款金额。取号扣费、收到验证码、超时退款时在同一事务里对相应的桶做增量
+UPSERT，与业务数据一起提交或回滚；/api/statistics 只读汇总表。
+
+所有指标都记在号码的取号时间所在的桶里（退款、收码也按取号时间归桶），
+这样同一个桶的成功率、净消费可以直接计算。
+
+历史数据用根目录的 backfill_rollups.py 重建。
+"""
+
+import logging
+from datetime import datetime
+from sqlalchemy import update, insert, select, bindparam
+from sqlalchemy.exc import IntegrityError
+from app.services.stats_cache import stats_cache
+
+logger = logging.getLogger(__name__)
+
+# 累加的指标列
+METRICS = ('numbers', 'successes', 'spend', 'refunds')
+
+def hour_bucket(at):
+    """小时桶：整点时间"""
+    return at.replace(minute=0, second=0, microsecond=0)
+
+def day_bucket(at):
+    """天桶：日期"""
+    return at.date()
+
+def _merge(events):
+    """
+    把事件合并为每张表的增量行
+
+    同一批里落在同一个桶的事件先在内存中相加，一个桶只UPSERT一次；
+    按主键排序，多个事务并发更新同一组桶时加锁顺序一致，不会死锁。
+    """
+    hourly = {}
+    daily = {}
+    for event in events:
+        at = event.get('at') or datetime.utcnow()
+        for buckets, bucket in ((hourly, hour_bucket(at)), (daily, day_bucket(at))):
+            key = (event['user_id'], event['project_id'], bucket)
+            row = buckets.get(key)
+            if row is None:
+                row = buckets[key] = dict.fromkeys(METRICS, 0)
+            for metric in METRICS:
+                row[metric] += event.get(metric) or 0
+    return [
+        [dict(values, user_id=key[0], project_id=key[1], bucket=key[2]) for key, values in sorted(buckets.items())]
+        for buckets in (hourly, daily)
+    ]
+
+def _upsert(session, table, rows):
+    """
+    按主键累加一批行
+
+    SQLite / PostgreSQL 用 INSERT ... ON CONFLICT DO UPDATE，MySQL 用
+    ON DUPLICATE KEY UPDATE，都是一条语句完成；其他数据库先UPDATE，
+    没有命中的再INSERT，并发插入冲突时改为UPDATE。
+    """
+    dialect = session.get_bind().dialect.name
+
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.project_id, table.c.bucket],
+            set_={metric: table.c[metric] + stmt.excluded[metric] for metric in METRICS}
+        )
+        session.execute(stmt, rows)
+        return
+
+    if dialect in ('mysql', 'mariadb'):
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+        stmt = dialect_insert(table)
+        stmt = stmt.on_duplicate_key_update({metric: table.c[metric] + stmt.inserted[metric] for metric in METRICS})
+        session.execute(stmt, rows)
+        return
+
+    stmt = (update(table)
+        .where(table.c.user_id == bindparam('b_user_id'), table.c.project_id == bindparam('b_project_id'),
+               table.c.bucket == bindparam('b_bucket'))
+        .values({metric: table.c[metric] + bindparam(f"b_{metric}") for metric in METRICS}))
+    for row in rows:
+        params = {f"b_{name}": value for name, value in row.items()}
+        if session.execute(stmt, params).rowcount:
+            continue
+        try:
+            with session.begin_nested():
+                session.execute(insert(table).values(**row))
+        except IntegrityError:
+            # 并发事务刚插入了同一个桶
+            session.execute(stmt, params)
+
+def record_many(events, session=None):
+    """
+    在当前事务中累加一批统计事件
+
+    参数:
+        events: 字典列表，包含 user_id、project_id，可选 at（取号时间，默认当前时间）
+                以及 numbers、successes、spend、refunds 增量
+        session: 数据库会话，默认 db.session
+    """
+    from app.models import db, StatsHourly, StatsDaily
+
+    events = [event for event in events if event.get('project_id') is not None]
+    if not events:
+        return
+    session = session or db.session
+    hourly, daily = _merge(events)
+    _upsert(session, StatsHourly.__table__, hourly)
+    _upsert(session, StatsDaily.__table__, daily)
+    # 事务提交后相关用户已缓存的统计失效
+    for user_id in {event['user_id'] for event in events}:
+        stats_cache.invalidate_user(user_id, session)
+
+def record(user_id, project_id, at=None, numbers=0, successes=0, spend=0.0, refunds=0.0):
+    """在当前事务中累加一条统计事件，参数见 record_many"""
+    record_many([{
+        'user_id': user_id,
+        'project_id': project_id,
+        'at': at,
+        'numbers': numbers,
+        'successes': successes,
+        'spend': spend,
+        'refunds': refunds
+    }])
+
+def record_codes(phone_ids, written=False):
+    """
+    号码写入第一条验证码时调用，计入收码数
+
+    默认在写验证码的UPDATE之前调用：加行锁取出其中还没有验证码的号码，按取号时间
+    计入 successes。调用方随后的UPDATE同样以 sms_code IS NULL 为条件，两者命中
+    的是同一批号码。
+
+    批量写入时调用方先执行带条件的UPDATE、回读实际写入的号码，再以 written=True
+    调用，直接按这些号码计数。
+
+    返回:
+        int: 计入的号码数
+    """
+    from app.models import db, PhoneNumber
+
+    phone_ids = list(set(phone_ids))
+    if not phone_ids:
+        return 0
+    phones = PhoneNumber.__table__
+    query = select(phones.c.user_id, phones.c.project_id, phones.c.created_at).where(phones.c.id.in_(phone_ids))
+    if not written:
+        query = query.where(phones.c.sms_code.is_(None)).with_for_update()
+    rows = db.session.execute(query).all()
+    record_many([
+        {'user_id': user_id, 'project_id': project_id, 'at': created_at, 'successes': 1}
+        for user_id, project_id, created_at in rows
+    ])
+    return len(rows)
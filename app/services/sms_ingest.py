@@ -0,0 +1,536 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+上游推送短信的写后批处理
+
+回调接口只做校验、入队和应答，写库由后台线程批量完成：
+一批推送按内容哈希去重后，在一个事务中写入推送记录、更新号码验证码、
+写入短信表，然后唤醒长轮询等待者并推送事件。
+
+已应答202的推送不会丢弃：重试后仍写库失败的批次和停机时队列中剩余的推送
+写入 SMS_INGEST_SPOOL_DIR 下的NDJSON文件，写库线程定期重放，成功后删除文件。
+"""
+
+import os
+import json
+import time
+import uuid
+import queue
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from flask import current_app
+from app.services.sms_waiter import sms_waiter
+from app.services.event_bus import event_bus
+from app.services.code_rules import code_rules
+
+logger = logging.getLogger(__name__)
+
+class IngestQueueFull(Exception):
+    """写入队列已满"""
+    pass
+
+def delivery_hash(provider, delivery):
+    """推送内容哈希，同一条短信重复推送时相同"""
+    parts = [
+        provider or '',
+        delivery.get('request_id') or '',
+        delivery.get('number') or '',
+        delivery.get('sender') or '',
+        delivery.get('content') or '',
+        delivery.get('received_at') or ''
+    ]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+def parse_delivery(provider, item):
+    """
+    校验并规范化一条推送
+
+    返回:
+        tuple: (规范化后的推送, 错误信息)
+    """
+    if not isinstance(item, dict):
+        return None, '推送格式错误'
+    request_id = item.get('request_id')
+    number = item.get('number')
+    content = item.get('content')
+    if not request_id and not number:
+        return None, '缺少request_id或number'
+    if not content or not isinstance(content, str):
+        return None, '缺少短信内容'
+
+    received_at = item.get('received_at')
+    if received_at:
+        try:
+            datetime.fromisoformat(received_at)
+        except (TypeError, ValueError):
+            return None, 'received_at格式错误'
+
+    delivery = {
+        'request_id': str(request_id) if request_id else None,
+        'number': str(number) if number else None,
+        'sender': item.get('sender'),
+        'content': content,
+        'code': item.get('code'),
+        'received_at': received_at
+    }
+    delivery['hash'] = delivery_hash(provider, delivery)
+    delivery['provider'] = provider
+    return delivery, None
+
+class SmsIngestBatcher:
+    """推送短信写后批处理器"""
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(SmsIngestBatcher, cls).__new__(cls)
+                cls._instance._initialized = False
+            return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        self._queue = None
+        # 最近处理过的内容哈希，拦截大部分重复推送而不查库
+        self._recent = OrderedDict()
+        self._recent_size = 100000
+
+        self._app = None
+        self._thread = None
+        self._running = False
+        self._replayed_at = float('-inf')
+
+        self.stats = {
+            "received": 0,  # 入队的推送数
+            "duplicates": 0,  # 重复推送数
+            "persisted": 0,  # 写入的推送数
+            "matched": 0,  # 匹配到号码的推送数
+            "unmatched": 0,  # 未匹配到号码的推送数
+            "batches": 0,  # 写库批次数
+            "rejected": 0,  # 队列已满被拒绝的推送数
+            "spooled": 0,  # 写库失败转存到文件的推送数
+            "replayed": 0,  # 从文件重放写入的推送数
+        }
+
+        self._initialized = True
+
+    def init_app(self, app):
+        """
+        绑定应用实例并启动写库线程
+
+        在注册回调蓝图时调用。应用没有初始化 app/models.py 的数据库时直接报错，
+        不能先应答202再在写库时失败，推送只会一直留在转存文件里。
+        """
+        from app.models import db, SmsDelivery  # noqa: F401  找不到模型时启动即失败
+        if 'sqlalchemy' not in app.extensions:
+            raise RuntimeError('短信推送写库需要先在应用上初始化 app.models.db')
+
+        with self._lock:
+            if self._app is not None:
+                return
+            self._app = app
+            self._queue = queue.Queue(maxsize=app.config.get('SMS_INGEST_QUEUE_SIZE', 50000))
+
+        os.makedirs(self._spool_dir(), exist_ok=True)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        logger.info("短信推送写库线程已启动")
+
+    def _config(self, key, default=None):
+        app = self._app or current_app
+        return app.config.get(key, default)
+
+    def _spool_dir(self):
+        return self._config('SMS_INGEST_SPOOL_DIR', 'instance/sms_ingest')
+
+    def spool(self, batch):
+        """把写库失败的推送写入一个新的转存文件，文件名带进程号，多进程不会写同一个文件"""
+        path = os.path.join(self._spool_dir(), f"{os.getpid()}-{uuid.uuid4().hex[:8]}.ndjson")
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for delivery in batch:
+                f.write(json.dumps(delivery, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        # 写完再改名，重放时不会读到写了一半的文件
+        os.replace(tmp_path, path)
+        self.stats["spooled"] += len(batch)
+        return path
+
+    def replay_spool(self):
+        """
+        重放转存文件中的推送
+
+        先把文件改名认领，其他进程不会同时重放同一个文件；写库成功后删除，
+        失败时改回原名等下次重放。
+
+        返回:
+            int: 重放写入的推送数
+        """
+        directory = self._spool_dir()
+        try:
+            names = sorted(name for name in os.listdir(directory) if name.endswith('.ndjson'))
+        except FileNotFoundError:
+            return 0
+
+        replayed = 0
+        for name in names:
+            path = os.path.join(directory, name)
+            claimed = f"{path}.{os.getpid()}.replaying"
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            try:
+                with open(claimed, encoding='utf-8') as f:
+                    batch = [json.loads(line) for line in f if line.strip()]
+                arrived = self._persist_with_retry(batch, attempts=1)
+            except Exception as e:
+                logger.error(f"读取推送转存文件 {name} 失败: {str(e)}")
+                arrived = None
+            if arrived is None:
+                os.rename(claimed, path)
+                break
+            os.remove(claimed)
+            replayed += len(batch)
+            self.stats["replayed"] += len(batch)
+            self._safe_notify(arrived)
+        if replayed:
+            logger.info(f"已重放 {replayed} 条转存的推送短信")
+        return replayed
+
+    def submit(self, deliveries):
+        """
+        推送入队
+
+        异常:
+            IngestQueueFull: 队列剩余空间不足，整批拒绝，上游应稍后重试
+        """
+        if self._app is None:
+            self.init_app(current_app._get_current_object())
+
+        fresh = [delivery for delivery in deliveries if delivery['hash'] not in self._recent]
+        self.stats["duplicates"] += len(deliveries) - len(fresh)
+
+        if self._queue.maxsize and self._queue.qsize() + len(fresh) > self._queue.maxsize:
+            self.stats["rejected"] += len(fresh)
+            raise IngestQueueFull()
+        for delivery in fresh:
+            self._queue.put_nowait(delivery)
+        self.stats["received"] += len(fresh)
+        return len(fresh)
+
+    def _remember(self, hashes):
+        for content_hash in hashes:
+            self._recent[content_hash] = True
+            self._recent.move_to_end(content_hash)
+        while len(self._recent) > self._recent_size:
+            self._recent.popitem(last=False)
+
+    def _drain(self, batch_size, flush_interval):
+        """取出一批推送，最多等待flush_interval秒凑批"""
+        try:
+            batch = [self._queue.get(timeout=1.0)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + flush_interval
+        while len(batch) < batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def persist(self, batch):
+        """
+        在一个事务中写入一批推送
+
+        返回:
+            list: 匹配到号码并写入了验证码的 (推送, 号码信息) 列表
+        """
+        from app.models import db, PhoneNumber, PhoneRequest, SMS, SmsDelivery
+        from sqlalchemy import update, insert, case, and_, or_
+        from app.services.rollups import record_codes
+
+        # 批内去重，再排除已经入库的
+        unique = {}
+        for delivery in batch:
+            unique.setdefault(delivery['hash'], delivery)
+        existing = {
+            content_hash for content_hash, in db.session.query(SmsDelivery.content_hash)
+            .filter(SmsDelivery.content_hash.in_(list(unique)))
+        }
+        deliveries = [delivery for content_hash, delivery in unique.items() if content_hash not in existing]
+        self.stats["duplicates"] += len(batch) - len(deliveries)
+        if not deliveries:
+            self._remember(unique)
+            return []
+
+        # 按上游请求ID或号码匹配等待验证码的号码
+        request_ids = {d['request_id'] for d in deliveries if d['request_id']}
+        numbers = {d['number'] for d in deliveries if d['number']}
+        by_request_id = {}
+        by_number = {}
+        if request_ids:
+            # 已释放、已超时的号码不再匹配，推送只记录不写回号码；
+            # 迁移前取的号码没有记录上游请求ID，仍按 request_id 匹配
+            for phone in PhoneNumber.query.filter(
+                    or_(PhoneNumber.upstream_request_id.in_(request_ids),
+                        and_(PhoneNumber.upstream_request_id.is_(None), PhoneNumber.request_id.in_(request_ids))),
+                    PhoneNumber.status.in_(['available', 'used'])):
+                by_request_id[phone.upstream_id] = phone
+        if numbers:
+            for phone in (PhoneNumber.query
+                    .filter(PhoneNumber.number.in_(numbers), PhoneNumber.status.in_(['available', 'used']))
+                    .order_by(PhoneNumber.created_at)):
+                # 同一号码取最近一次的记录
+                by_number[phone.number] = phone
+
+        now = datetime.utcnow()
+        phones = [by_request_id.get(d['request_id']) or by_number.get(d['number']) for d in deliveries]
+        # 上游没有给出验证码的，整批按项目和发送方的规则提取
+        pending = [index for index, delivery in enumerate(deliveries) if not delivery['code']]
+        extracted = dict(zip(pending, code_rules.extract_many([
+            (deliveries[index]['content'], phones[index].project_id if phones[index] else None,
+             deliveries[index]['sender'])
+            for index in pending
+        ])))
+
+        rows = []
+        matched = []
+        for index, (delivery, phone) in enumerate(zip(deliveries, phones)):
+            code = delivery['code'] or extracted.get(index) or None
+            received_at = datetime.fromisoformat(delivery['received_at']) if delivery['received_at'] else now
+            rows.append({
+                'content_hash': delivery['hash'],
+                'provider': delivery['provider'],
+                'request_id': delivery['request_id'] or (phone.request_id if phone else None),
+                'number': delivery['number'] or (phone.number if phone else None),
+                'sender': delivery['sender'],
+                'content': delivery['content'],
+                'code': code,
+                'phone_number_id': phone.id if phone else None,
+                'received_at': received_at,
+                'created_at': now
+            })
+            if phone is not None:
+                matched.append((dict(delivery, code=code, received_at=received_at), phone))
+
+        db.session.execute(insert(SmsDelivery), rows)
+
+        with_code = [(delivery, phone) for delivery, phone in matched if delivery['code']]
+        if with_code:
+            phone_table = PhoneNumber.__table__
+            # 同一号码的多条推送只写入第一条
+            firsts = {}
+            for delivery, phone in with_code:
+                firsts.setdefault(phone.id, (delivery, phone))
+            with_code = list(firsts.values())
+            codes = {phone.id: delivery['code'] for delivery, phone in with_code}
+            # 只写入仍在等待验证码的号码，查询之后被释放、超时的号码不会被改回used
+            waiting = (phone_table.c.status == 'available', phone_table.c.sms_code.is_(None))
+            if getattr(db.session.get_bind().dialect, 'update_returning', False):
+                # 一条UPDATE写入整批验证码，RETURNING 得到实际写入的号码
+                written = {
+                    phone_id for phone_id, in db.session.execute(
+                        update(phone_table)
+                        .where(phone_table.c.id.in_(list(codes)), *waiting)
+                        .values(sms_code=case(codes, value=phone_table.c.id), status='used', updated_at=now)
+                        .returning(phone_table.c.id)
+                    )
+                }
+            else:
+                # 不支持 RETURNING 时逐个条件更新，按影响行数判断是否写入
+                written = set()
+                for phone_id, code in codes.items():
+                    result = db.session.execute(
+                        update(phone_table)
+                        .where(phone_table.c.id == phone_id, *waiting)
+                        .values(sms_code=code, status='used', updated_at=now)
+                    )
+                    if result.rowcount:
+                        written.add(phone_id)
+            with_code = [(delivery, phone) for delivery, phone in with_code if phone.id in written]
+            if with_code:
+                record_codes([phone.id for _, phone in with_code], written=True)
+
+        if matched:
+            phone_requests = {
+                request_id: pk for pk, request_id in db.session.query(PhoneRequest.id, PhoneRequest.request_id)
+                .filter(PhoneRequest.request_id.in_({phone.request_id for _, phone in matched}))
+            }
+            sms_rows = [
+                {
+                    'phone_request_id': phone_requests[phone.request_id],
+                    'sender': delivery['sender'],
+                    'content': delivery['content'],
+                    'code': delivery['code'] or '',
+                    'received_at': delivery['received_at']
+                }
+                for delivery, phone in matched if phone.request_id in phone_requests
+            ]
+            if sms_rows:
+                db.session.execute(insert(SMS), sms_rows)
+                db.session.execute(
+                    update(PhoneRequest.__table__)
+                    .where(PhoneRequest.__table__.c.id.in_(list(phone_requests.values())))
+                    .values(status='used', updated_at=now)
+                )
+
+        # 上游给出验证码的推送用于学习提取模板
+        confirmed = [
+            (delivery['content'], delivery['code'], phone.project_id, delivery['sender'])
+            for delivery, phone in zip(deliveries, phones) if delivery['code'] and phone is not None
+        ]
+
+        db.session.commit()
+        self._remember(unique)
+        if confirmed:
+            try:
+                code_rules.learn(confirmed)
+            except Exception as e:
+                db.session.rollback()
+                logger.warning(f"学习验证码模板时发生错误: {str(e)}")
+
+        self.stats["persisted"] += len(rows)
+        self.stats["matched"] += len(matched)
+        self.stats["unmatched"] += len(rows) - len(matched)
+        self.stats["batches"] += 1
+
+        return [
+            (delivery, {
+                'request_id': phone.request_id,
+                'number': phone.number,
+                'user_id': phone.user_id,
+                'project_id': phone.project_id
+            })
+            for delivery, phone in with_code
+        ]
+
+    def _notify(self, arrived):
+        """唤醒长轮询等待者、推送事件，并停止后台轮询"""
+        from app.services.sms_poller import sms_poller
+
+        for delivery, phone in arrived:
+            sms_poller.untrack(phone['request_id'])
+            sms_waiter.publish(phone['request_id'], {
+                'success': True,
+                'message': '获取验证码成功',
+                'code': delivery['code']
+            })
+            event_bus.publish(phone['user_id'], 'sms', {
+                'request_id': phone['request_id'],
+                'number': phone['number'],
+                'status': 'used',
+                'project_id': phone['project_id'],
+                'code': delivery['code'],
+                'sms': {
+                    'sender': delivery['sender'],
+                    'content': delivery['content'],
+                    'received_at': delivery['received_at'].isoformat()
+                }
+            })
+
+    def _persist_with_retry(self, batch, attempts):
+        """
+        写入一批推送，失败时退避重试
+
+        返回:
+            list: persist 的结果；重试后仍失败时返回None
+        """
+        from sqlalchemy.exc import IntegrityError
+        from app.models import db
+
+        for attempt in range(attempts):
+            with self._app.app_context():
+                try:
+                    return self.persist(batch)
+                except IntegrityError:
+                    # 其他进程同时写入了相同的推送，重试时会按已入库的哈希过滤
+                    db.session.rollback()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"写入推送短信时发生错误（第{attempt + 1}次）: {str(e)}")
+            if attempt + 1 < attempts:
+                time.sleep(min(0.5 * (2 ** attempt), 5))
+        return None
+
+    def _safe_notify(self, arrived):
+        try:
+            self._notify(arrived)
+        except Exception as e:
+            logger.error(f"推送短信通知时发生错误: {str(e)}")
+
+    def _run(self):
+        """写库线程"""
+        while self._running:
+            if time.monotonic() - self._replayed_at >= self._config('SMS_INGEST_REPLAY_INTERVAL', 30):
+                self._replayed_at = time.monotonic()
+                try:
+                    self.replay_spool()
+                except Exception as e:
+                    logger.error(f"重放推送转存文件时发生错误: {str(e)}")
+
+            batch = self._drain(
+                self._config('SMS_INGEST_BATCH_SIZE', 500),
+                self._config('SMS_INGEST_FLUSH_INTERVAL', 0.2)
+            )
+            if not batch:
+                continue
+
+            arrived = self._persist_with_retry(batch, self._config('SMS_INGEST_MAX_ATTEMPTS', 3))
+            if arrived is None:
+                try:
+                    path = self.spool(batch)
+                    logger.error(f"写入推送短信失败，{len(batch)} 条已转存到 {path} 等待重放")
+                except OSError as e:
+                    logger.critical(f"写入推送短信失败且无法转存，丢失 {len(batch)} 条: {str(e)}")
+            for _ in batch:
+                self._queue.task_done()
+            if arrived is not None:
+                self._safe_notify(arrived)
+
+    def flush(self, timeout=5):
+        """等待队列中的推送全部写入（用于测试和停机）"""
+        deadline = time.monotonic() + timeout
+        while self._queue is not None and self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def snapshot(self):
+        """获取写入队列状态"""
+        return {
+            "queue_size": self._queue.qsize() if self._queue is not None else 0,
+            "stats": dict(self.stats)
+        }
+
+    def stop(self):
+        """停止写库线程，队列中剩余的推送转存到文件，下次启动时重放"""
+        self._running = False
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=5)
+        if self._queue is None:
+            return
+        remaining = []
+        while True:
+            try:
+                remaining.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            self._queue.task_done()
+        if remaining:
+            self.spool(remaining)
+            logger.info(f"停机时 {len(remaining)} 条推送短信已转存等待重放")
+
+# 创建写后批处理实例
+sms_ingest = SmsIngestBatcher()
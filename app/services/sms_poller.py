@@ -0,0 +1,450 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+后台验证码轮询器
+
+跟踪所有等待验证码的号码，由一个调度线程按到期时间分批向上游查询，
+每个号码的轮询间隔按指数退避自适应调整。收到的验证码批量写入
+PhoneNumber.sms_code 和 SMS 表，然后唤醒长轮询等待者并推送事件。
+上游请求量只与活跃号码数有关，与客户端的轮询频率无关；
+客户端读取 /api/numbers/sms/<request_id> 变成纯本地查询。
+
+每个进程轮询自己取出的号码。进程重启后遗留的号码由持有数据库租约的一个进程
+恢复跟踪，多进程部署时不会每个进程都把所有等待中的号码加载一遍。
+"""
+
+import heapq
+import time
+import random
+import string
+import logging
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from app.services.resilience import CircuitOpenError
+from app.services.sms_waiter import sms_waiter, has_code
+from app.services.event_bus import event_bus
+from app.services.code_rules import code_rules
+from app.services.lease import lease_owner, acquire_lease, release_lease
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = 'sms_poller'
+
+class TrackedNumber:
+    """轮询器跟踪的一个号码"""
+    __slots__ = ('request_id', 'upstream_request_id', 'phone_id', 'user_id', 'project_id', 'number', 'provider',
+                 'interval', 'next_poll_at', 'expires_at')
+
+    def __init__(self, request_id, upstream_request_id, phone_id, user_id, project_id, number, provider,
+                 interval, expires_at):
+        self.request_id = request_id
+        self.upstream_request_id = upstream_request_id
+        self.phone_id = phone_id
+        self.user_id = user_id
+        self.project_id = project_id
+        self.number = number
+        self.provider = provider
+        self.interval = interval
+        self.next_poll_at = time.monotonic() + interval
+        self.expires_at = expires_at
+
+class SmsPoller:
+    """验证码轮询调度器"""
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(SmsPoller, cls).__new__(cls)
+                cls._instance._initialized = False
+            return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        # request_id -> TrackedNumber
+        self._tracked = {}
+        # (next_poll_at, 序号, request_id) 小顶堆，重新调度后旧的堆项按时间不一致跳过
+        self._schedule = []
+        self._seq = 0
+        self._tracked_lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+        # 恢复遗留号码的租约
+        self._owner = lease_owner()
+        self._holding = False
+        self._lease_checked_at = float('-inf')
+
+        self._app = None
+        self._thread = None
+        self._running = False
+
+        self.stats = {
+            "tracked": 0,  # 累计跟踪的号码数
+            "polls": 0,  # 上游查询次数
+            "batches": 0,  # 轮询批次数
+            "codes": 0,  # 收到的验证码数
+            "expired": 0,  # 超过跟踪时长仍未收到验证码的号码数
+            "recovered": 0,  # 取得租约后恢复跟踪的号码数
+        }
+
+        self._initialized = True
+
+    def init_app(self, app):
+        """绑定应用实例并启动调度线程，遗留号码由调度线程取得租约后加载"""
+        with self._tracked_lock:
+            if self._app is not None:
+                return
+            self._app = app
+
+        if not app.config.get('SMS_POLLER_ENABLED', True):
+            logger.info("验证码轮询器未启用")
+            return
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        logger.info("验证码轮询线程已启动")
+
+    def _ensure_started(self):
+        if self._app is None:
+            try:
+                self.init_app(current_app._get_current_object())
+            except RuntimeError:
+                pass
+
+    def _config(self, key, default=None):
+        app = self._app or current_app
+        return app.config.get(key, default)
+
+    @property
+    def enabled(self):
+        return self._running
+
+    def is_tracking(self, request_id):
+        return request_id in self._tracked
+
+    def track(self, phone):
+        """
+        开始跟踪号码
+
+        参数:
+            phone: PhoneNumber 对象（需要已提交，带id）
+        """
+        self._ensure_started()
+        if not self._running:
+            return False
+
+        created_at = phone.created_at or datetime.utcnow()
+        max_age = self._config('SMS_POLLER_MAX_AGE', 1200)
+        remaining = max_age - (datetime.utcnow() - created_at).total_seconds()
+        if remaining <= 0:
+            return False
+
+        entry = TrackedNumber(
+            request_id=phone.request_id,
+            upstream_request_id=phone.upstream_id,
+            phone_id=phone.id,
+            user_id=phone.user_id,
+            project_id=phone.project_id,
+            number=phone.number,
+            provider=phone.provider,
+            interval=self._config('SMS_POLLER_INITIAL_INTERVAL', 2),
+            expires_at=time.monotonic() + remaining
+        )
+        with self._tracked_lock:
+            if entry.request_id not in self._tracked:
+                self.stats["tracked"] += 1
+            self._tracked[entry.request_id] = entry
+            self._push(entry)
+        self._wakeup.set()
+        return True
+
+    def track_many(self, phones):
+        for phone in phones:
+            self.track(phone)
+
+    def untrack(self, request_id):
+        """停止跟踪号码（已释放、已拉黑等）"""
+        with self._tracked_lock:
+            return self._tracked.pop(request_id, None) is not None
+
+    def _push(self, entry):
+        self._seq += 1
+        heapq.heappush(self._schedule, (entry.next_poll_at, self._seq, entry.request_id))
+
+    def _lease_ttl(self):
+        return max(self._config('SMS_POLLER_LEASE_RENEW_INTERVAL', 20) * 3, 60)
+
+    def _check_lease(self):
+        """
+        定期获取或续约恢复租约，刚取得租约时加载遗留的号码
+
+        持有者退出后租约到期，由其他进程接管并恢复跟踪。接管时会加载所有等待中的号码，
+        其中仍被其他进程跟踪的号码会被重复轮询到收码或超时为止，写库有条件保护不会重复写入。
+        """
+        now = time.monotonic()
+        if now - self._lease_checked_at < self._config('SMS_POLLER_LEASE_RENEW_INTERVAL', 20):
+            return
+        self._lease_checked_at = now
+
+        with self._app.app_context():
+            holding = acquire_lease(LEASE_NAME, self._owner, self._lease_ttl())
+            if holding and not self._holding:
+                try:
+                    self.load_active()
+                except Exception as e:
+                    logger.error(f"加载等待验证码的号码时发生错误: {str(e)}")
+        self._holding = holding
+
+    def load_active(self):
+        """加载数据库中等待验证码的号码（进程重启后恢复跟踪）"""
+        from app.models import PhoneNumber
+
+        since = datetime.utcnow() - timedelta(seconds=self._config('SMS_POLLER_MAX_AGE', 1200))
+        phones = PhoneNumber.query.filter(
+            PhoneNumber.status == 'available',
+            PhoneNumber.sms_code.is_(None),
+            PhoneNumber.created_at >= since
+        ).all()
+        for phone in phones:
+            self.track(phone)
+        self.stats["recovered"] += len(phones)
+        if phones:
+            logger.info(f"验证码轮询器恢复跟踪 {len(phones)} 个号码")
+        return len(phones)
+
+    def _due(self, limit):
+        """取出到期需要轮询的号码，最多limit个"""
+        now = time.monotonic()
+        due = []
+        with self._tracked_lock:
+            while self._schedule and len(due) < limit:
+                next_poll_at, _, request_id = self._schedule[0]
+                if next_poll_at > now:
+                    break
+                heapq.heappop(self._schedule)
+                entry = self._tracked.get(request_id)
+                # 已停止跟踪或已经重新调度
+                if entry is None or entry.next_poll_at != next_poll_at:
+                    continue
+                if now >= entry.expires_at:
+                    del self._tracked[request_id]
+                    self.stats["expired"] += 1
+                    continue
+                due.append(entry)
+            next_at = self._schedule[0][0] if self._schedule else None
+        return due, next_at
+
+    def _reschedule(self, entry, delay=None):
+        """按退避后的间隔重新调度"""
+        if delay is None:
+            entry.interval = min(
+                entry.interval * self._config('SMS_POLLER_BACKOFF', 1.5),
+                self._config('SMS_POLLER_MAX_INTERVAL', 15)
+            )
+            delay = entry.interval
+        with self._tracked_lock:
+            if self._tracked.get(entry.request_id) is not entry:
+                return
+            entry.next_poll_at = time.monotonic() + delay
+            self._push(entry)
+
+    def poll_batch(self, entries, api_client):
+        """
+        并发查询一批号码，收到验证码的批量写库并通知
+
+        返回:
+            int: 收到验证码的号码数
+        """
+        from app.utils import get_in_flight_limit, submit_upstream
+
+        def _in_flight_limit(entry):
+            # 在途并发按号码所属平台分别限制
+            client = api_client.client_for(entry.provider)
+            return get_in_flight_limit(client.base_url, client.max_in_flight)
+
+        def _check(entry):
+            try:
+                return api_client.get_sms_code(entry.upstream_request_id, provider=entry.provider)
+            except CircuitOpenError as e:
+                return {'success': False, 'message': str(e), 'retry_after': e.retry_after}
+            except Exception as e:
+                logger.warning(f"轮询验证码失败，请求ID: {entry.request_id}，错误: {str(e)}")
+                return None
+
+        futures = [submit_upstream(_in_flight_limit(entry), _check, entry) for entry in entries]
+        results = [future.result() if future is not None else None for future in futures]
+        self.stats["polls"] += len(entries)
+        self.stats["batches"] += 1
+
+        arrived = []
+        for entry, result in zip(entries, results):
+            if api_client.use_mock and not has_code(result):
+                # 模拟API没有返回验证码时，与接口一样直接生成验证码
+                result = {'success': True, 'code': ''.join(random.choices(string.digits, k=6))}
+            if has_code(result):
+                arrived.append((entry, result))
+            elif result and result.get('retry_after'):
+                self._reschedule(entry, result['retry_after'])
+            else:
+                self._reschedule(entry)
+
+        if arrived:
+            try:
+                stored = self._store(arrived)
+            except Exception as e:
+                logger.error(f"保存验证码时发生错误: {str(e)}")
+                for entry, _ in arrived:
+                    self._reschedule(entry, entry.interval)
+                return 0
+            self._notify(arrived, stored)
+            return len(stored)
+        return 0
+
+    def _store(self, arrived):
+        """
+        在一个事务中批量写入验证码和短信记录
+
+        返回:
+            list: 实际写入的 (entry, result)；期间已释放、已超时或已有验证码的号码不写入
+        """
+        from app.models import db, PhoneNumber, PhoneRequest, SMS
+        from sqlalchemy import update, insert, case
+        from app.services.rollups import record_codes
+
+        now = datetime.utcnow()
+        phones = PhoneNumber.__table__
+        codes = {entry.phone_id: result['code'] for entry, result in arrived}
+        # 只更新仍在等待验证码的号码，客户端或回调可能已经写入，号码也可能已被释放
+        waiting = (phones.c.status == 'available', phones.c.sms_code.is_(None))
+        if getattr(db.session.get_bind().dialect, 'update_returning', False):
+            # 一条UPDATE写入整批验证码，RETURNING 得到实际写入的号码
+            written = {
+                phone_id for phone_id, in db.session.execute(
+                    update(phones)
+                    .where(phones.c.id.in_(list(codes)), *waiting)
+                    .values(sms_code=case(codes, value=phones.c.id), status='used', updated_at=now)
+                    .returning(phones.c.id)
+                )
+            }
+        else:
+            # 不支持 RETURNING 时逐个条件更新，按影响行数判断是否写入
+            written = set()
+            for phone_id, code in codes.items():
+                result = db.session.execute(
+                    update(phones)
+                    .where(phones.c.id == phone_id, *waiting)
+                    .values(sms_code=code, status='used', updated_at=now)
+                )
+                if result.rowcount:
+                    written.add(phone_id)
+        arrived = [(entry, result) for entry, result in arrived if entry.phone_id in written]
+        if not arrived:
+            db.session.commit()
+            return []
+        record_codes([entry.phone_id for entry, _ in arrived], written=True)
+
+        # 有号码请求记录的同时写入短信内容
+        by_request_id = {entry.request_id: result for entry, result in arrived}
+        requests = db.session.query(PhoneRequest.id, PhoneRequest.request_id).filter(
+            PhoneRequest.request_id.in_(list(by_request_id))
+        ).all()
+        if requests:
+            db.session.execute(insert(SMS), [
+                {
+                    'phone_request_id': request_pk,
+                    'sender': by_request_id[request_id].get('sender'),
+                    'content': by_request_id[request_id].get('content') or by_request_id[request_id]['code'],
+                    'code': by_request_id[request_id]['code'],
+                    'received_at': now
+                }
+                for request_pk, request_id in requests
+            ])
+            db.session.execute(
+                update(PhoneRequest.__table__)
+                .where(PhoneRequest.__table__.c.id.in_([request_pk for request_pk, _ in requests]))
+                .values(status='used', updated_at=now)
+            )
+        db.session.commit()
+
+        # 上游返回了短信内容的用于学习提取模板
+        confirmed = [
+            (result.get('content'), result['code'], entry.project_id, result.get('sender'))
+            for entry, result in arrived if result.get('content')
+        ]
+        if confirmed:
+            try:
+                code_rules.learn(confirmed)
+            except Exception as e:
+                db.session.rollback()
+                logger.warning(f"学习验证码模板时发生错误: {str(e)}")
+        return arrived
+
+    def _notify(self, arrived, stored):
+        """停止跟踪收到验证码的号码，只为本次写入的号码唤醒等待者并推送事件"""
+        with self._tracked_lock:
+            for entry, _ in arrived:
+                self._tracked.pop(entry.request_id, None)
+        for entry, result in stored:
+            sms_waiter.publish(entry.request_id, result)
+            event_bus.publish(entry.user_id, 'sms', {
+                'request_id': entry.request_id,
+                'number': entry.number,
+                'status': 'used',
+                'project_id': entry.project_id,
+                'code': result['code']
+            })
+        self.stats["codes"] += len(stored)
+
+    def _run(self):
+        """调度线程"""
+        from app.services.provider_router import provider_router
+
+        while self._running:
+            try:
+                self._check_lease()
+            except Exception as e:
+                logger.error(f"检查验证码轮询租约时发生错误: {str(e)}")
+
+            due, next_at = self._due(self._config('SMS_POLLER_BATCH_SIZE', 100))
+            if not due:
+                timeout = 1.0 if next_at is None else min(max(next_at - time.monotonic(), 0.01), 1.0)
+                self._wakeup.wait(timeout)
+                self._wakeup.clear()
+                continue
+
+            try:
+                with self._app.app_context():
+                    self.poll_batch(due, provider_router.client())
+            except Exception as e:
+                logger.error(f"轮询验证码时发生错误: {str(e)}")
+                for entry in due:
+                    self._reschedule(entry)
+
+    def snapshot(self):
+        """获取轮询器状态"""
+        return {
+            "enabled": self._running,
+            "holding_lease": self._holding,
+            "tracking": len(self._tracked),
+            "stats": dict(self.stats)
+        }
+
+    def stop(self):
+        """停止调度线程并释放恢复租约"""
+        self._running = False
+        self._wakeup.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=5)
+        if self._holding and self._app is not None:
+            with self._app.app_context():
+                release_lease(LEASE_NAME, self._owner)
+            self._holding = False
+
+# 创建轮询器实例
+sms_poller = SmsPoller()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+验证码长轮询
+
+客户端带 wait 参数请求验证码时，请求挂在按 request_id 分组的等待者上，
+验证码到达或等待超时后立即返回。同一个 request_id 的所有等待者共享一个
+上游轮询线程，不会因为多个客户端同时等待而放大上游请求量。
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class _WaitEntry:
+    """同一个 request_id 的等待状态"""
+    __slots__ = ('request_id', 'event', 'result', 'last_result', 'error', 'waiters', 'expires_at', 'polling')
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.event = threading.Event()
+        self.result = None  # 收到验证码时的上游结果
+        self.last_result = None  # 最近一次未收到验证码的上游结果
+        self.error = None  # 最近一次上游调用抛出的异常
+        self.waiters = 0
+        self.expires_at = 0
+        self.polling = False
+
+def has_code(result):
+    """上游结果中是否已经包含验证码"""
+    return bool(result) and result.get('success', False) and bool(result.get('code'))
+
+class SmsWaiterHub:
+    """验证码等待者管理"""
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(SmsWaiterHub, cls).__new__(cls)
+                cls._instance._initialized = False
+            return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        # request_id -> _WaitEntry
+        self._entries = {}
+        self._entries_lock = threading.Lock()
+        # 最近推送的验证码，避免推送发生在等待者加入之前时白等一整轮
+        self._recent = OrderedDict()
+        self._recent_size = 1000
+
+        self.stats = {
+            "waits": 0,  # 长轮询请求数
+            "delivered": 0,  # 等待期间收到验证码的请求数
+            "timeouts": 0,  # 等待超时的请求数
+            "upstream_polls": 0,  # 共享轮询线程发起的上游请求数
+        }
+
+        self._initialized = True
+
+    def wait(self, request_id, fetch, timeout, poll_interval=2):
+        """
+        等待验证码
+
+        参数:
+            request_id (str): 请求ID
+            fetch (callable): 无参函数，返回上游 get_sms_code 的结果，在轮询线程中调用；
+                为None时不发起轮询，只等待 publish()（例如号码已由后台轮询器跟踪）
+            timeout (float): 最长等待秒数
+            poll_interval (float): 上游轮询间隔（秒）
+
+        返回:
+            dict: 收到验证码时为包含验证码的上游结果，超时时为最近一次上游结果
+        """
+        start_poller = False
+        with self._entries_lock:
+            recent = self._recent.get(request_id)
+            if recent is not None:
+                self.stats["waits"] += 1
+                self.stats["delivered"] += 1
+                return recent
+            entry = self._entries.get(request_id)
+            if entry is None:
+                entry = _WaitEntry(request_id)
+                self._entries[request_id] = entry
+            if fetch is not None and not entry.polling:
+                entry.polling = True
+                start_poller = True
+            entry.waiters += 1
+            entry.expires_at = max(entry.expires_at, time.monotonic() + timeout)
+        self.stats["waits"] += 1
+
+        if start_poller:
+            threading.Thread(target=self._poll, args=(entry, fetch, poll_interval), daemon=True).start()
+
+        try:
+            delivered = entry.event.wait(timeout)
+        finally:
+            with self._entries_lock:
+                entry.waiters -= 1
+                if entry.waiters == 0 and not entry.polling and self._entries.get(request_id) is entry:
+                    del self._entries[request_id]
+
+        if delivered and entry.result is not None:
+            self.stats["delivered"] += 1
+            return entry.result
+
+        self.stats["timeouts"] += 1
+        if entry.last_result is None and entry.error is not None:
+            raise entry.error
+        return entry.last_result or {'success': False, 'message': '等待验证码超时'}
+
+    def publish(self, request_id, result):
+        """
+        推送收到的验证码（例如来自上游回调），唤醒该 request_id 的所有等待者
+
+        返回:
+            bool: 是否有等待者
+        """
+        if not has_code(result):
+            return False
+        with self._entries_lock:
+            self._recent[request_id] = result
+            self._recent.move_to_end(request_id)
+            while len(self._recent) > self._recent_size:
+                self._recent.popitem(last=False)
+            entry = self._entries.get(request_id)
+        if entry is None:
+            return False
+        entry.result = result
+        entry.event.set()
+        return True
+
+    def _poll(self, entry, fetch, poll_interval):
+        """共享轮询线程，直到收到验证码或没有等待者"""
+        while not entry.event.is_set():
+            try:
+                result = fetch()
+                entry.error = None
+            except Exception as e:
+                result = None
+                entry.error = e
+                logger.warning(f"轮询验证码失败，请求ID: {entry.request_id}，错误: {str(e)}")
+            self.stats["upstream_polls"] += 1
+
+            if has_code(result):
+                entry.result = result
+                entry.event.set()
+                break
+            if result is not None:
+                entry.last_result = result
+
+            with self._entries_lock:
+                # 在锁内判断，新加入的等待者要么延长了期限，要么会创建新的轮询
+                if time.monotonic() >= entry.expires_at:
+                    entry.polling = False
+                    self._entries.pop(entry.request_id, None)
+                    return
+                wait_for = min(poll_interval, entry.expires_at - time.monotonic())
+            # publish() 会提前唤醒
+            entry.event.wait(max(wait_for, 0))
+
+        with self._entries_lock:
+            entry.polling = False
+            if self._entries.get(entry.request_id) is entry:
+                self._entries.pop(entry.request_id, None)
+
+    def snapshot(self):
+        """获取等待者状态"""
+        with self._entries_lock:
+            active = len(self._entries)
+            waiters = sum(entry.waiters for entry in self._entries.values())
+        return {
+            "active_requests": active,
+            "waiters": waiters,
+            "stats": dict(self.stats)
+        }
+
+# 创建等待者管理实例
+sms_waiter = SmsWaiterHub()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+统计查询的数据库方言适配
+
+统计接口需要的时间表达式在各数据库上写法不同：PostgreSQL 的
+extract('epoch', ...) 在 SQLite 上不可用，strftime 只有 SQLite 有。
+这里按当前连接的数据库生成可移植的表达式：
+
+    dialect = stats_dialect()
+    query.filter(dialect.time_range(PhoneRequest.created_at, start, end))
+    dialect.hour_of_day(PhoneRequest.created_at)
+    dialect.seconds_between(PhoneRequest.created_at, SMS.received_at)
+
+时间范围一律生成 column >= start AND column < end，不在列上套函数，
+(user_id, created_at) 之类的索引可以直接做范围扫描。
+"""
+
+from sqlalchemy import func, cast, and_, Integer, Date, Float
+
+class StatsDialect:
+    """默认实现（MySQL 语义）"""
+    name = 'default'
+
+    def time_range(self, column, start, end):
+        """半开区间 [start, end) 的范围条件"""
+        return and_(column >= start, column < end)
+
+    def hour_of_day(self, column):
+        """小时（0-23）"""
+        return func.hour(column)
+
+    def day_bucket(self, column):
+        """日期"""
+        return func.date(column)
+
+    def epoch_seconds(self, column):
+        """UNIX时间戳（秒）"""
+        return func.unix_timestamp(column)
+
+    def seconds_between(self, start, end):
+        """两个时间列相差的秒数"""
+        return self.epoch_seconds(end) - self.epoch_seconds(start)
+
+class SQLiteStatsDialect(StatsDialect):
+    """SQLite：时间以文本存储，用 strftime / julianday 计算"""
+    name = 'sqlite'
+
+    def hour_of_day(self, column):
+        return cast(func.strftime('%H', column), Integer)
+
+    def epoch_seconds(self, column):
+        # julianday 带小数，能保留秒以下的精度；2440587.5 是 1970-01-01 的儒略日
+        return (func.julianday(column) - 2440587.5) * 86400.0
+
+class PostgresStatsDialect(StatsDialect):
+    """PostgreSQL"""
+    name = 'postgresql'
+
+    def hour_of_day(self, column):
+        return cast(func.extract('hour', column), Integer)
+
+    def day_bucket(self, column):
+        return cast(column, Date)
+
+    def epoch_seconds(self, column):
+        return cast(func.extract('epoch', column), Float)
+
+_DIALECTS = {
+    'sqlite': SQLiteStatsDialect(),
+    'postgresql': PostgresStatsDialect(),
+}
+_DEFAULT = StatsDialect()
+
+def stats_dialect(session=None):
+    """
+    获取当前数据库对应的方言适配
+
+    参数:
+        session: 数据库会话，默认 db.session
+    """
+    if session is None:
+        from app.models import db
+        session = db.session
+    return _DIALECTS.get(session.get_bind().dialect.name, _DEFAULT)
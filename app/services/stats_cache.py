@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+统计接口响应缓存
+
+缓存序列化后的响应体（bytes），不缓存Flask响应对象：
+
+- 本地存储按条目数和字节数双重限制，LRU淘汰，每条带TTL
+- 按标签失效：每条缓存记录计算前各标签（user:<id> / global）的版本号，
+  读取时版本号不一致即视为失效。取号、收码、退款、充值等写操作在事务
+  提交后提升相关用户的版本号，已缓存的统计立即作废
+- 同一进程内相同请求并发到达时只计算一次，其余请求等待结果（single-flight）
+- 配置 STATS_CACHE_REDIS_URL 后条目和标签版本存放在Redis中，所有工作进程共享
+
+用法:
+    payload, hit = stats_cache.get_or_compute(key, [user_tag(user_id)], compute)
+    stats_cache.invalidate_user(user_id)  # 在写事务中调用，提交后生效
+"""
+
+import time
+import json
+import logging
+import threading
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# 管理员看到的全局统计使用的标签，任何用户的数据变化都会使其失效
+GLOBAL_TAG = 'global'
+# session.info 中待失效用户集合的键
+_PENDING_KEY = 'stats_cache_invalidate'
+
+def user_tag(user_id):
+    """用户统计的标签"""
+    return f'user:{user_id}'
+
+class _LocalStore:
+    """
+    进程内LRU存储，按条目数和字节数限制
+
+    标签版本号取自单调递增的计数器，只为有缓存条目的标签保存；没有记录的
+    标签版本号为 _floor。删除标签记录时把 _floor 提升到它的版本号，这样
+    失效之前取得的版本号不会再与当前版本号相等，旧结果不会被写回后命中。
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> (过期时间, 标签, 标签版本, 内容)
+        self._entries = OrderedDict()
+        # tag -> 版本号
+        self._versions = {}
+        # tag -> 引用该标签的条目数
+        self._tag_entries = {}
+        self._clock = 0
+        self._floor = 0
+        self._prune_at = 2 * max_entries
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _current(self, tags):
+        return tuple(self._versions.get(tag, self._floor) for tag in tags)
+
+    def get(self, key, tags):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, _, versions, payload = entry
+            if expires_at <= time.time() or versions != self._current(tags):
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return payload
+
+    def set(self, key, tags, versions, payload, ttl):
+        size = len(payload)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            for tag in tags:
+                # 有条目的标签固定下当前版本号，之后提升 _floor 不影响它
+                self._versions.setdefault(tag, self._floor)
+                self._tag_entries[tag] = self._tag_entries.get(tag, 0) + 1
+            self._entries[key] = (time.time() + ttl, tuple(tags), versions, payload)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, tags, _, payload = self._entries.pop(key)
+        self._bytes -= len(payload)
+        for tag in tags:
+            count = self._tag_entries[tag] - 1
+            if count:
+                self._tag_entries[tag] = count
+            else:
+                del self._tag_entries[tag]
+
+    def _prune(self):
+        """删除没有条目的标签版本号"""
+        for tag in [tag for tag in self._versions if tag not in self._tag_entries]:
+            self._floor = max(self._floor, self._versions.pop(tag))
+        self._prune_at = max(2 * self.max_entries, 2 * len(self._versions))
+
+    def versions(self, tags):
+        with self._lock:
+            return self._current(tags)
+
+    def bump(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._clock += 1
+                self._versions[tag] = self._clock
+            if len(self._versions) >= self._prune_at:
+                self._prune()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tag_entries.clear()
+            self._bytes = 0
+            self._prune()
+
+    def size(self):
+        return {'entries': len(self._entries), 'bytes': self._bytes, 'tags': len(self._versions)}
+
+class _RedisStore:
+    """
+    Redis共享存储
+
+    条目和标签版本一次MGET取回；条目内容为 版本号JSON + 换行 + 响应体。
+    标签版本键不设过期时间，版本号只增不减，旧条目不会因为版本号回绕而复活。
+    """
+
+    def __init__(self, client, prefix):
+        self.redis = client
+        self.prefix = prefix
+        self.evictions = 0
+
+    def _tag_key(self, tag):
+        return f'{self.prefix}tag:{tag}'
+
+    def get(self, key, tags):
+        values = self.redis.mget([self.prefix + key] + [self._tag_key(tag) for tag in tags])
+        raw = values[0]
+        if raw is None:
+            return None
+        header, _, payload = raw.partition(b'\n')
+        if tuple(json.loads(header)) != tuple(int(value or 0) for value in values[1:]):
+            return None
+        return payload
+
+    def set(self, key, tags, versions, payload, ttl):
+        self.redis.setex(self.prefix + key, int(ttl), json.dumps(list(versions)).encode() + b'\n' + payload)
+
+    def versions(self, tags):
+        return tuple(int(value or 0) for value in self.redis.mget([self._tag_key(tag) for tag in tags]))
+
+    def bump(self, tags):
+        pipe = self.redis.pipeline(transaction=False)
+        for tag in tags:
+            pipe.incr(self._tag_key(tag))
+        pipe.execute()
+
+    def clear(self):
+        for key in self.redis.scan_iter(match=f'{self.prefix}*'):
+            if not key.startswith(self._tag_key('').encode()):
+                self.redis.delete(key)
+
+    def size(self):
+        return {}
+
+class _Flight:
+    """一次进行中的计算"""
+
+    def __init__(self):
+        self.done = threading.Event()
+
+class StatsCache:
+    """统计响应缓存"""
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(StatsCache, cls).__new__(cls)
+                cls._instance._initialized = False
+            return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        self.enabled = True
+        self.ttl = 300
+        self.wait_timeout = 30
+        self._store = _LocalStore(1000, 16 * 1024 * 1024)
+        self._backend = 'memory'
+        self._app = None
+        # key -> 进行中的计算
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+
+        self.stats = {
+            "hits": 0,  # 命中次数
+            "misses": 0,  # 未命中次数
+            "sets": 0,  # 写入次数
+            "coalesced": 0,  # 等待其他请求计算结果的次数
+            "invalidations": 0,  # 失效的用户数
+            "errors": 0,  # 共享存储出错次数（出错时按未命中处理）
+        }
+
+        self._initialized = True
+
+    def init_app(self, app):
+        """按应用配置初始化缓存存储"""
+        with self._lock:
+            if self._app is not None:
+                return
+            self._app = app
+
+        self.enabled = app.config.get('STATS_CACHE_ENABLED', True)
+        self.ttl = app.config.get('STATS_CACHE_TTL', 300)
+        self.wait_timeout = app.config.get('STATS_CACHE_WAIT_TIMEOUT', 30)
+
+        redis_url = app.config.get('STATS_CACHE_REDIS_URL')
+        if redis_url:
+            try:
+                from app.services.local_redis import redis_from_url
+                self._store = _RedisStore(redis_from_url(redis_url), app.config.get('STATS_CACHE_PREFIX', 'stats:'))
+                self._backend = 'redis'
+                logger.info(f"统计缓存使用Redis共享存储: {redis_url}")
+                return
+            except ImportError:
+                logger.warning("找不到redis库，统计缓存回退到进程内存储")
+
+        self._store = _LocalStore(
+            app.config.get('STATS_CACHE_MAX_ENTRIES', 1000),
+            app.config.get('STATS_CACHE_MAX_BYTES', 16 * 1024 * 1024)
+        )
+
+    def versions(self, tags):
+        """取标签当前的版本号，在计算之前调用"""
+        try:
+            return self._store.versions(tags)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"读取统计缓存标签版本失败: {str(e)}")
+            return None
+
+    def get(self, key, tags):
+        """
+        读取缓存
+
+        返回:
+            bytes: 缓存的响应体，未命中或已失效时返回None
+        """
+        if not self.enabled:
+            return None
+        try:
+            payload = self._store.get(key, tags)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"读取统计缓存失败: {str(e)}")
+            payload = None
+        if payload is None:
+            self.stats["misses"] += 1
+        else:
+            self.stats["hits"] += 1
+        return payload
+
+    def set(self, key, tags, versions, payload):
+        """
+        写入缓存
+
+        参数:
+            tags: 条目的标签
+            versions: 计算之前由 versions() 取得的标签版本号，期间若有失效，
+                      写入的条目在下次读取时即被视为过期
+        """
+        if not self.enabled or versions is None:
+            return
+        try:
+            self._store.set(key, tags, versions, payload, self.ttl)
+            self.stats["sets"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"写入统计缓存失败: {str(e)}")
+
+    def get_or_compute(self, key, tags, compute):
+        """
+        读取缓存，未命中时计算并写入；同一进程内同一个键同时只计算一次
+
+        参数:
+            compute: 无参函数，返回 (响应体bytes, 是否可以缓存)
+
+        返回:
+            tuple: (响应体, 是否来自缓存)
+        """
+        payload = self.get(key, tags)
+        if payload is not None:
+            return payload, True
+        if not self.enabled:
+            return compute()[0], False
+
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            self.stats["coalesced"] += 1
+            if flight.done.wait(self.wait_timeout):
+                payload = self.get(key, tags)
+                if payload is not None:
+                    return payload, True
+            # 领头的请求失败或结果不可缓存，自己计算
+            return compute()[0], False
+
+        try:
+            versions = self.versions(tags)
+            payload, cacheable = compute()
+            if cacheable:
+                self.set(key, tags, versions, payload)
+            return payload, False
+        finally:
+            with self._flights_lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def invalidate_user(self, user_id, session=None):
+        """
+        标记用户的统计需要失效
+
+        在写事务中调用，事务提交后才提升版本号，避免并发请求在提交前
+        读到旧数据又写回缓存；事务回滚则不失效。
+        """
+        if session is None:
+            from app.models import db
+            session = db.session
+        session.info.setdefault(_PENDING_KEY, set()).add(user_id)
+
+    def invalidate_now(self, user_ids):
+        """立即提升用户及全局标签的版本号"""
+        if not user_ids:
+            return
+        tags = [user_tag(user_id) for user_id in user_ids] + [GLOBAL_TAG]
+        try:
+            self._store.bump(tags)
+            self.stats["invalidations"] += len(user_ids)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"统计缓存失效失败: {str(e)}")
+
+    def clear(self):
+        """清空缓存条目"""
+        self._store.clear()
+
+    def snapshot(self):
+        """获取缓存状态"""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "enabled": self.enabled,
+            "backend": self._backend,
+            "ttl": self.ttl,
+            "evictions": self._store.evictions,
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            "inflight": len(self._flights),
+            **self._store.size(),
+            "stats": dict(self.stats)
+        }
+
+# 创建缓存实例
+stats_cache = StatsCache()
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending:
+        stats_cache.invalidate_now(pending)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_after_rollback(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop(_PENDING_KEY, None)
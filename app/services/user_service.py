@@ -104,7 +104,8 @@ class UserService:
             db.close_session()
     
     @staticmethod
-    @cached(ttl=60)  # 缓存1分钟
+    # 缓存1分钟，过期后30秒内由一个请求刷新、其余请求返回旧值；不存在的用户缓存10秒
+    @cached(ttl=60, key=lambda user_id: str(user_id), negative_ttl=10, stale_ttl=30)
     def get_user(user_id):
         """获取用户信息"""
         session = db.get_session()
@@ -117,8 +118,9 @@ class UserService:
             return user.to_dict()
         
         except Exception as e:
+            # 抛出而不是返回None：None会被当作用户不存在缓存起来
             logger.error(f"获取用户信息时发生错误: {str(e)}")
-            return None
+            raise
         finally:
             db.close_session()
     
@@ -146,6 +148,7 @@ class UserService:
             
             # 提交更改
             session.commit()
+            UserService.get_user.invalidate(user_id)
             
             return True, {
                 "message": "个人资料已更新",
@@ -216,6 +219,7 @@ class UserService:
             
             # 提交更改
             session.commit()
+            UserService.get_user.invalidate(user_id)
             
             # 记录交易（可以在这里添加交易记录）
             
@@ -4,10 +4,9 @@
 from app.tasks import celery
 from app.database import db
 from app.models.number import PhoneNumber, Message, NumberStatus
+from app.services.code_rules import code_rules
 import logging
-import time
 import random
-import re
 from datetime import datetime
 from sqlalchemy.exc import SQLAlchemyError
 
@@ -31,9 +30,7 @@ def fetch_sms(self, request_id):
             logger.warning(f"号码 {phone_number.number} 状态不是活跃状态，当前状态: {phone_number.status}")
             return {'status': 'error', 'message': f"号码状态不是活跃状态，当前状态: {phone_number.status}"}
         
-        # 模拟从外部API获取短信的过程
-        time.sleep(2)  # 模拟网络延迟
-        
+        # 不在工作进程中sleep等待，未收到短信时由调用方稍后重新调度
         # 随机生成一条短信（在实际应用中，这里应该调用外部API）
         if random.random() < 0.8:  # 80%的概率收到短信
             senders = ["10010", "10086", "10000", "95588", "106"]
@@ -135,24 +132,12 @@ def extract_code_from_sms(message_id):
         if not message or not message.content:
             return None
         
-        # 使用正则表达式提取数字验证码
-        patterns = [
-            r'验证码[是为：:\s]+(\d{4,6})',
-            r'码[是为：:\s]+(\d{4,6})',
-            r'[code|CODE|Code][是为：:\s]+(\d{4,6})',
-            r'[\[【](\d{4,6})[\]】]',
-            r'(\d{4,6})'  # 最后尝试提取4-6位数字
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, message.content)
-            if match:
-                code = match.group(1)
-                if code:
-                    # 更新消息记录中的验证码字段
-                    message.code = code
-                    session.commit()
-                    return code
+        code = code_rules.extract(message.content, sender=message.sender)
+        if code:
+            # 更新消息记录中的验证码字段
+            message.code = code
+            session.commit()
+            return code
         
         return None
     except Exception as e:
@@ -1,13 +1,148 @@
 import jwt
+import time
 import requests
 import logging
+import threading
+import contextvars
+import concurrent.futures
 from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
 from functools import wraps
 from flask import request, jsonify, current_app
+from app.services.resilience import (
+    CircuitOpenError, get_breaker, get_retry_budget, remaining_time, backoff_delay
+)
+from app.services.monitoring import metrics_collector
+from app.services.code_rules import code_rules
 
 # 设置日志
 logger = logging.getLogger(__name__)
 
+# 上游并发调用使用的线程池，实际并发度由每个上游的信号量限制
+upstream_executor = concurrent.futures.ThreadPoolExecutor(max_workers=64, thread_name_prefix='upstream')
+
+# 对冲请求使用单独的线程池：对冲可能在 upstream_executor 的工作线程中发起，
+# 再提交回同一个线程池时，线程池占满后工作线程会互相等待
+hedge_executor = concurrent.futures.ThreadPoolExecutor(max_workers=32, thread_name_prefix='upstream-hedge')
+
+# 上游地址 -> (在途上限, 信号量)
+_in_flight_limits = {}
+_in_flight_lock = threading.Lock()
+
+
+# (上游地址, 密钥) -> 进程级共享的HTTP会话，复用keep-alive连接
+_upstream_sessions = {}
+_upstream_sessions_lock = threading.Lock()
+
+# 当前上游请求等待空闲连接的最长时间（秒），由 SMSApiClient._send 按截止时间设置
+_pool_wait = contextvars.ContextVar('upstream_pool_wait', default=None)
+
+
+class _DeadlineHTTPConnectionPool(HTTPConnectionPool):
+    def _get_conn(self, timeout=None):
+        return super()._get_conn(timeout if timeout is not None else _pool_wait.get())
+
+
+class _DeadlineHTTPSConnectionPool(HTTPSConnectionPool):
+    def _get_conn(self, timeout=None):
+        return super()._get_conn(timeout if timeout is not None else _pool_wait.get())
+
+
+class _UpstreamAdapter(HTTPAdapter):
+    """连接池满时等待空闲连接，最多等到本次请求的截止时间，而不是无限期阻塞"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _DeadlineHTTPConnectionPool,
+            'https': _DeadlineHTTPSConnectionPool
+        }
+
+
+def get_upstream_session(base_url, api_key, pool_maxsize=32):
+    """
+    获取进程级共享的上游HTTP会话
+    
+    同一上游的所有请求复用同一个连接池，避免每次请求重新建立TCP/TLS连接。
+    连接池满时请求会等待空闲连接，而不是临时创建用完即丢的连接；等待时间不超过
+    本次请求的截止时间，超过后按失败返回。
+    """
+    key = (base_url, api_key)
+    with _upstream_sessions_lock:
+        session = _upstream_sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = _UpstreamAdapter(pool_connections=4, pool_maxsize=pool_maxsize, pool_block=True, max_retries=0)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({
+                'Authorization': f'Bearer {api_key}',
+                'Content-Type': 'application/json',
+                'Connection': 'keep-alive'
+            })
+            # 禁用代理设置
+            session.proxies = {
+                'http': None,
+                'https': None
+            }
+            _upstream_sessions[key] = session
+        return session
+
+
+def get_in_flight_limit(base_url, max_in_flight):
+    """
+    获取某个上游的在途请求数限制信号量
+
+    配置的上限变化后换用新的信号量，已在途的请求仍然归还到旧的信号量。
+    """
+    with _in_flight_lock:
+        entry = _in_flight_limits.get(base_url)
+        if entry is None or entry[0] != max_in_flight:
+            entry = (max_in_flight, threading.BoundedSemaphore(max_in_flight))
+            _in_flight_limits[base_url] = entry
+        return entry[1]
+
+
+def submit_upstream(semaphore, func, *args):
+    """
+    占用在途名额后把调用提交到 upstream_executor
+
+    名额在调用方线程中获取，名额不足时阻塞的是调用方而不是线程池的工作线程，
+    某个上游变慢不会占满所有调用方共享的线程池。当前请求有截止时间时最多等到
+    截止时间。
+
+    返回:
+        Future: 调用结果；截止时间前没有等到名额时返回None
+    """
+    remaining = remaining_time()
+    if remaining is None:
+        semaphore.acquire()
+    elif not semaphore.acquire(timeout=max(remaining, 0)):
+        return None
+
+    def _run():
+        try:
+            return func(*args)
+        finally:
+            semaphore.release()
+
+    try:
+        # 工作线程继承调用方的上下文（包括请求截止时间）
+        return upstream_executor.submit(contextvars.copy_context().run, _run)
+    except Exception:
+        semaphore.release()
+        raise
+
+
+def gather_upstream(futures):
+    """按顺序取出 submit_upstream 的结果，没有等到名额的调用返回失败结果"""
+    return [
+        future.result() if future is not None else {'success': False, 'message': '等待上游并发名额超过截止时间'}
+        for future in futures
+    ]
+
 
 def generate_token(user_id, username, is_admin=False, expires_delta=None):
     """
@@ -192,16 +327,30 @@ class SMSApiClient:
         """
         self.base_url = base_url or current_app.config['SMS_API_BASE_URL']
         self.api_key = api_key or current_app.config['SMS_API_KEY']
-        self.session = requests.Session()
-        self.session.headers.update({
-            'Authorization': f'Bearer {self.api_key}',
-            'Content-Type': 'application/json'
-        })
-        # 禁用代理设置
-        self.session.proxies = {
-            'http': None,
-            'https': None
-        }
+        # 使用进程级共享的连接池
+        self.session = get_upstream_session(
+            self.base_url,
+            self.api_key,
+            current_app.config.get('SMS_API_POOL_MAXSIZE', 32)
+        )
+        # (连接超时, 读取超时)
+        self.timeout = (
+            current_app.config.get('SMS_API_CONNECT_TIMEOUT', 3),
+            current_app.config.get('SMS_API_READ_TIMEOUT', 10)
+        )
+        
+        # 每个上游允许的最大在途请求数
+        self.max_in_flight = current_app.config.get('SMS_API_MAX_IN_FLIGHT', 8)
+        
+        # 容错配置：单次操作截止时间、重试、熔断、对冲
+        self.deadlines = current_app.config.get('SMS_API_DEADLINES', {})
+        self.default_deadline = current_app.config.get('SMS_API_DEFAULT_DEADLINE', 10)
+        self.max_retries = current_app.config.get('SMS_API_MAX_RETRIES', 2)
+        self.retryable_ops = current_app.config.get('SMS_API_RETRYABLE_OPS', ())
+        self.retry_budget_ratio = current_app.config.get('SMS_API_RETRY_BUDGET_RATIO', 0.1)
+        self.breaker_threshold = current_app.config.get('SMS_API_BREAKER_FAILURE_THRESHOLD', 5)
+        self.breaker_reset_timeout = current_app.config.get('SMS_API_BREAKER_RESET_TIMEOUT', 30)
+        self.hedge_delay = current_app.config.get('SMS_API_HEDGE_DELAY')
         
         # 使用模拟API进行本地测试
         self.use_mock = current_app.config.get('USE_MOCK_API', True)
@@ -236,87 +385,207 @@ class SMSApiClient:
             logger.error(f"JSON解析错误: {e}, 响应内容: {response.text}")
             return {'success': False, 'message': '无法解析API响应'}
     
+    def _send(self, method, url, timeout, **kwargs):
+        """
+        发送一次请求
+        
+        返回:
+            tuple: (结果, 是否上游故障, 是否可安全重试)
+        """
+        # 连接池满时等待空闲连接的时间与连接超时相同（已按截止时间截短）
+        token = _pool_wait.set(timeout[0])
+        try:
+            response = self.session.request(method, url, timeout=timeout, **kwargs)
+        except EmptyPoolError as e:
+            # 连接都被占用说明上游响应变慢，按上游故障计入熔断，截止时间内不再重试
+            logger.error(f"等待上游连接超时: {method} {url}: {e}")
+            metrics_collector.record_upstream_event(self.base_url, 'pool_exhausted')
+            return {'success': False, 'message': '等待上游连接超过截止时间'}, True, False
+        except (requests.exceptions.ConnectTimeout, requests.exceptions.ConnectionError) as e:
+            # 请求未到达上游，任何操作都可以安全重试
+            logger.error(f"连接上游失败: {method} {url}: {e}")
+            return {'success': False, 'message': f'请求异常: {str(e)}'}, True, True
+        except requests.exceptions.Timeout as e:
+            logger.error(f"请求超时: {method} {url}: {e}")
+            return {'success': False, 'message': f'请求超时: {str(e)}'}, True, False
+        except requests.exceptions.RequestException as e:
+            logger.error(f"请求异常: {method} {url}: {e}")
+            return {'success': False, 'message': f'请求异常: {str(e)}'}, True, False
+        finally:
+            _pool_wait.reset(token)
+        return self._handle_response(response), response.status_code >= 500, False
+    
+    def _request(self, op, method, path, **kwargs):
+        """
+        带容错的上游请求
+        
+        - 熔断器打开时直接抛出 CircuitOpenError
+        - 超时时间不超过操作截止时间和当前请求截止时间中较早的一个
+        - 在重试预算内对可重试的失败做带抖动的退避重试
+        """
+        name = f"{self.base_url}:{op}"
+        breaker = get_breaker(name, self.breaker_threshold, self.breaker_reset_timeout)
+        budget = get_retry_budget(self.base_url, self.retry_budget_ratio)
+        
+        url = f"{self.base_url}{path}"
+        budget_seconds = self.deadlines.get(op, self.default_deadline)
+        context_remaining = remaining_time()
+        if context_remaining is not None:
+            budget_seconds = min(budget_seconds, context_remaining)
+        expires_at = time.monotonic() + budget_seconds
+        
+        attempt = 0
+        while True:
+            # 先检查截止时间再向熔断器申请：申请到半开试探名额后必须记录成功或失败
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                metrics_collector.record_upstream_event(name, 'deadline_exceeded')
+                return {'success': False, 'message': '上游请求超过截止时间'}
+            
+            breaker.allow()
+            if attempt == 0:
+                budget.deposit()
+            
+            timeout = (min(self.timeout[0], remaining), min(self.timeout[1], remaining))
+            result, failed, safe_to_retry = self._send(method, url, timeout, **kwargs)
+            if not failed:
+                breaker.record_success()
+                return result
+            
+            breaker.record_failure()
+            if attempt >= self.max_retries or not (safe_to_retry or op in self.retryable_ops):
+                return result
+            if not budget.try_withdraw():
+                metrics_collector.record_upstream_event(name, 'retry_budget_exhausted')
+                return result
+            
+            delay = min(backoff_delay(attempt), max(expires_at - time.monotonic(), 0))
+            time.sleep(delay)
+            attempt += 1
+            metrics_collector.record_upstream_event(name, 'retry')
+    
+    def _hedged_request(self, op, method, path, **kwargs):
+        """
+        对冲请求
+        
+        首个请求在 hedge_delay 秒内没有返回时，再发一个相同请求，取先成功的结果。
+        对冲请求同样消耗重试预算。
+        """
+        first = hedge_executor.submit(contextvars.copy_context().run, self._request, op, method, path, **kwargs)
+        done, _ = concurrent.futures.wait([first], timeout=self.hedge_delay)
+        if done or not get_retry_budget(self.base_url, self.retry_budget_ratio).try_withdraw():
+            return first.result()
+        
+        metrics_collector.record_upstream_event(f"{self.base_url}:{op}", 'hedge')
+        second = hedge_executor.submit(contextvars.copy_context().run, self._request, op, method, path, **kwargs)
+        result = None
+        for future in concurrent.futures.as_completed([first, second]):
+            try:
+                result = future.result()
+            except CircuitOpenError:
+                continue
+            if result.get('success', False):
+                return result
+        if result is None:
+            # 两个请求都被熔断拒绝
+            return first.result()
+        return result
+    
+    def call_many(self, func, calls):
+        """
+        并发调用上游接口
+        
+        参数:
+            func (callable): 要调用的客户端方法，例如 self.get_phone_number
+            calls (list): 每次调用的参数元组列表
+            
+        返回:
+            list: 与calls顺序一致的结果列表，异常会被转换为失败结果
+        """
+        semaphore = get_in_flight_limit(self.base_url, self.max_in_flight)
+        
+        def _call(args):
+            try:
+                return func(*args)
+            except CircuitOpenError as e:
+                return {'success': False, 'message': str(e), 'retry_after': e.retry_after}
+            except Exception as e:
+                logger.error(f"并发调用上游接口异常: {e}")
+                return {'success': False, 'message': f'请求异常: {str(e)}'}
+        
+        return gather_upstream([submit_upstream(semaphore, _call, args) for args in calls])
+    
+    def get_phone_numbers(self, project_code, count):
+        """并发获取多个手机号码"""
+        return self.call_many(self.get_phone_number, [(project_code,)] * count)
+    
     def get_projects(self):
         """获取所有可用项目"""
         if self.use_mock:
             return self.mock_api.get_projects()
             
-        url = f"{self.base_url}/projects"
-        response = self.session.get(url)
-        return self._handle_response(response)
+        return self._request('get_projects', 'GET', '/projects')
     
     def search_projects(self, keyword):
         """搜索项目"""
         if self.use_mock:
             return self.mock_api.search_projects(keyword)
             
-        url = f"{self.base_url}/projects/search"
         params = {'keyword': keyword}
-        response = self.session.get(url, params=params)
-        return self._handle_response(response)
+        return self._request('search_projects', 'GET', '/projects/search', params=params)
     
     def get_phone_number(self, project_code):
         """获取手机号码"""
         if self.use_mock:
             return self.mock_api.get_phone_number(project_code)
             
-        url = f"{self.base_url}/numbers"
         data = {'project_code': project_code}
-        response = self.session.post(url, json=data)
-        return self._handle_response(response)
+        return self._request('get_phone_number', 'POST', '/numbers', json=data)
     
     def get_specific_phone_number(self, project_code, number):
         """获取指定手机号码"""
         if self.use_mock:
             return self.mock_api.get_specific_phone_number(project_code, number)
             
-        url = f"{self.base_url}/numbers/specific"
         data = {
             'project_code': project_code,
             'number': number
         }
-        response = self.session.post(url, json=data)
-        return self._handle_response(response)
+        return self._request('get_specific_phone_number', 'POST', '/numbers/specific', json=data)
     
     def release_phone_number(self, request_id):
         """释放手机号码"""
         if self.use_mock:
             return self.mock_api.release_phone_number(request_id)
             
-        url = f"{self.base_url}/numbers/{request_id}/release"
-        response = self.session.post(url)
-        return self._handle_response(response)
+        return self._request('release_phone_number', 'POST', f'/numbers/{request_id}/release')
     
     def blacklist_phone_number(self, number, reason=None):
         """拉黑手机号码"""
         if self.use_mock:
             return self.mock_api.blacklist_phone_number(number, reason)
             
-        url = f"{self.base_url}/numbers/blacklist"
         data = {
             'number': number,
             'reason': reason
         }
-        response = self.session.post(url, json=data)
-        return self._handle_response(response)
+        return self._request('blacklist_phone_number', 'POST', '/numbers/blacklist', json=data)
     
     def get_sms_code(self, request_id):
         """获取短信验证码"""
         if self.use_mock:
             return self.mock_api.get_sms_code(request_id)
             
-        url = f"{self.base_url}/sms/{request_id}"
-        response = self.session.get(url)
-        return self._handle_response(response)
+        if self.hedge_delay:
+            return self._hedged_request('get_sms_code', 'GET', f'/sms/{request_id}')
+        return self._request('get_sms_code', 'GET', f'/sms/{request_id}')
     
     def check_balance(self):
         """查询账户余额"""
         if self.use_mock:
             return self.mock_api.check_balance()
             
-        url = f"{self.base_url}/account/balance"
-        response = self.session.get(url)
-        return self._handle_response(response)
+        return self._request('check_balance', 'GET', '/account/balance')
 
 
 def calculate_price(project, count=1):
@@ -358,4 +627,19 @@ def validate_pagination_params(page, per_page, max_per_page=100):
     # 确保per_page在合理范围内
     per_page = max(1, min(per_page, max_per_page))
     
-    return page, per_page 
\ No newline at end of file
+    return page, per_page 
+
+
+def extract_verification_code(content, project_id=None, sender=None):
+    """
+    从短信内容中提取验证码
+    
+    参数:
+        content: 短信内容
+        project_id: 项目ID，用于匹配项目专属的提取规则
+        sender: 发送方号码，用于匹配按发送方前缀配置的提取规则
+        
+    返回:
+        提取出的验证码，如果未找到则返回空字符串
+    """
+    return code_rules.extract(content, project_id=project_id, sender=sender)
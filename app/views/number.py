@@ -6,8 +6,13 @@ from app.middlewares.auth_middleware import auth_required
 from app.services.monitoring import monitor_api
 from app.database import db
 from app.models.project import Project
+from app.models.user import User
 from app.models.number import PhoneNumber, Message, NumberStatus
 from app.services.async_service import task_manager
+from app.services.number_pool import number_pool
+from app.services.provider_router import provider_router
+from app.services.billing import conditional_debit, InsufficientBalanceError
+from app.services.resilience import CircuitOpenError, upstream_deadline
 import uuid
 import random
 import time
@@ -22,6 +27,7 @@ number_bp = Blueprint('number', __name__)
 @number_bp.route('/get', methods=['GET'])
 @auth_required
 @monitor_api(endpoint="/api/numbers/get")
+@upstream_deadline
 def get_number():
     """获取手机号码"""
     try:
@@ -36,6 +42,8 @@ def get_number():
             return jsonify({"error": "项目ID必须为整数", "code": 400}), 400
         
         session = db.get_session()
+        project_code = None
+        api_result = None
         try:
             # 查询项目
             project = session.query(Project).get(project_id)
@@ -46,7 +54,7 @@ def get_number():
             if not project.available:
                 return jsonify({"error": "项目不可用", "code": 403}), 403
             
-            # 检查用户余额
+            # 预检查用户余额（快速失败，实际扣费由条件UPDATE原子完成）
             user = g.current_user
             if user.balance < project.price:
                 return jsonify({"error": "余额不足", "code": 403}), 403
@@ -54,12 +62,24 @@ def get_number():
             # 生成请求ID
             request_id = f"req_{user.id}_{int(time.time())}_{uuid.uuid4().hex[:8]}"
             
-            # 生成随机手机号
-            number = f"1{random.randint(3, 9)}{random.randint(100000000, 999999999)}"
+            # 从号码池取号，池为空时回退到上游
+            project_code = project.code
+            api_result = number_pool.acquire(project_code)
+            if not api_result.get('success', False):
+                return jsonify({"error": f"获取号码失败: {api_result.get('message', '未知错误')}", "code": 503}), 503
             
-            # 创建号码记录
+            phone_data = api_result.get('phone_number') or {}
+            number = phone_data.get('number')
+            if not number:
+                number_pool.release(project_code, [api_result])
+                api_result = None
+                return jsonify({"error": "获取号码失败: 上游未返回号码", "code": 503}), 503
+            
+            # 创建号码记录，保留上游请求ID和平台，之后查询短信、释放号码时使用
             phone_number = PhoneNumber(
                 request_id=request_id,
+                upstream_request_id=phone_data.get('request_id'),
+                provider=api_result.get('provider'),
                 number=number,
                 project_id=project.id,
                 user_id=user.id,
@@ -68,12 +88,17 @@ def get_number():
                 message_count=0
             )
             
-            # 扣除用户余额
-            user.balance -= project.price
+            # 原子扣除用户余额（g.current_user是已分离的对象，不能直接修改）
+            try:
+                conditional_debit(session, User.__table__, user.id, project.price)
+            except InsufficientBalanceError:
+                session.rollback()
+                return jsonify({"error": "余额不足", "code": 403}), 403
             
             # 保存到数据库
             session.add(phone_number)
             session.commit()
+            api_result = None
             
             # 返回号码信息
             return jsonify({
@@ -94,8 +119,15 @@ def get_number():
             return jsonify({"error": f"获取号码失败: {str(e)}", "code": 500}), 500
         
         finally:
+            # 已取到号码但没有写入数据库时放回号码池，不浪费已付费的上游号码
+            if api_result is not None and api_result.get('success', False):
+                number_pool.restock(project_code, [api_result])
             db.close_session()
     
+    except CircuitOpenError as e:
+        # 交给全局错误处理器返回503
+        logger.warning(f"获取号码失败，上游已熔断: {str(e)}")
+        raise
     except Exception as e:
         logger.exception("获取号码时发生异常")
         return jsonify({"error": f"获取号码失败: {str(e)}", "code": 500}), 500
@@ -235,6 +267,7 @@ def get_messages(request_id):
 @number_bp.route('/<string:request_id>/release', methods=['GET'])
 @auth_required
 @monitor_api(endpoint="/api/numbers/{id}/release")
+@upstream_deadline
 def release_number(request_id):
     """释放号码"""
     try:
@@ -260,6 +293,17 @@ def release_number(request_id):
             # 保存到数据库
             session.commit()
             
+            # 通知上游释放号码，失败不影响本地释放结果
+            if phone_number.upstream_request_id:
+                try:
+                    result = provider_router.client().release_phone_number(
+                        phone_number.upstream_request_id, provider=phone_number.provider
+                    )
+                    if not result.get('success', False):
+                        logger.warning(f"上游释放号码失败，请求ID: {request_id}，原因: {result.get('message', '未知错误')}")
+                except Exception as e:
+                    logger.warning(f"上游释放号码失败，请求ID: {request_id}，错误: {str(e)}")
+            
             return jsonify({
                 "message": "号码已释放成功",
                 "number": phone_number.number
@@ -4,6 +4,18 @@
 from flask import Blueprint, jsonify, request
 from app.middlewares.auth_middleware import admin_required
 from app.services.monitoring import metrics_collector, monitor_api
+from app.services.number_pool import number_pool
+from app.services.provider_router import provider_router
+from app.services.sms_waiter import sms_waiter
+from app.services.event_bus import event_bus
+from app.services.sms_poller import sms_poller
+from app.services.sms_ingest import sms_ingest
+from app.services.code_rules import code_rules
+from app.services.expiry_sweeper import expiry_sweeper
+from app.services.blacklist_index import blacklist_index
+from app.services.export_jobs import export_jobs
+from app.services.stats_cache import stats_cache
+from app.services.cache_service import cached_function_stats
 import time
 import random
 import platform
@@ -55,6 +67,18 @@ def system_metrics():
         
         # 添加一些附加信息
         metrics["timestamp"] = int(time.time())
+        metrics["number_pool"] = number_pool.snapshot()
+        metrics["providers"] = provider_router.snapshot()
+        metrics["sms_waiters"] = sms_waiter.snapshot()
+        metrics["event_stream"] = event_bus.snapshot()
+        metrics["sms_poller"] = sms_poller.snapshot()
+        metrics["sms_ingest"] = sms_ingest.snapshot()
+        metrics["code_rules"] = code_rules.snapshot()
+        metrics["expiry_sweeper"] = expiry_sweeper.snapshot()
+        metrics["blacklist_index"] = blacklist_index.snapshot()
+        metrics["export_jobs"] = export_jobs.snapshot()
+        metrics["stats_cache"] = stats_cache.snapshot()
+        metrics["cached_functions"] = cached_function_stats()
         
         return jsonify(metrics)
     
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+重建统计汇总表（stats_hourly / stats_daily）
+
+按天从号码记录和交易记录重新计算汇总行：先删除当天的桶，再按号码的取号时间
+累加取号数、收码数、消费（批量取号的一笔消费按号码数平均分摊）和退款，
+每天一个事务提交，可以重复执行。
+
+上线汇总表后执行一次补齐历史数据；也可以指定日期范围修复某几天的数据。
+默认不重建今天，今天的桶由业务事务实时维护；重建今天（--until 包含今天）
+时请在低峰期执行，重建期间新写入的增量会被覆盖。
+
+用法:
+    python backfill_rollups.py
+    python backfill_rollups.py --since 2024-01-01 --until 2024-02-01
+"""
+
+import os
+import sys
+import argparse
+import logging
+from datetime import datetime, timedelta
+
+# 设置日志记录
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from app import create_app
+
+# 按 reference_id 查询退款时每批的数量
+CHUNK_SIZE = 500
+# 扣费与号码写入在同一事务，但时间戳分别取值，按这个余量放宽消费记录的时间窗口
+CONSUME_WINDOW = timedelta(minutes=1)
+
+def rebuild_day(day):
+    """
+    重建一天的汇总行
+
+    返回:
+        int: 当天的号码数
+    """
+    from app.models import db, PhoneNumber, Transaction, StatsHourly, StatsDaily
+    from app.services import rollups
+
+    start = datetime.combine(day, datetime.min.time())
+    end = start + timedelta(days=1)
+
+    db.session.query(StatsHourly).filter(
+        StatsHourly.bucket >= start, StatsHourly.bucket < end
+    ).delete(synchronize_session=False)
+    db.session.query(StatsDaily).filter(StatsDaily.bucket == day).delete(synchronize_session=False)
+
+    events = []
+    # request_id -> (user_id, project_id, 取号时间)
+    phones = {}
+    query = db.session.query(
+        PhoneNumber.request_id, PhoneNumber.user_id, PhoneNumber.project_id,
+        PhoneNumber.created_at, PhoneNumber.sms_code
+    ).filter(PhoneNumber.created_at >= start, PhoneNumber.created_at < end)
+    for request_id, user_id, project_id, created_at, sms_code in query.yield_per(5000):
+        phones[request_id] = (user_id, project_id, created_at)
+        events.append({
+            'user_id': user_id,
+            'project_id': project_id,
+            'at': created_at,
+            'numbers': 1,
+            'successes': 1 if sms_code else 0
+        })
+
+    if phones:
+        # 消费：单个取号的 reference_id 是 request_id，批量取号是逗号分隔的多个 request_id
+        consumes = db.session.query(Transaction.reference_id, Transaction.amount).filter(
+            Transaction.type == 'consume',
+            Transaction.created_at >= start - CONSUME_WINDOW,
+            Transaction.created_at < end + CONSUME_WINDOW
+        )
+        for reference_id, amount in consumes.yield_per(5000):
+            request_ids = (reference_id or '').split(',')
+            share = -(amount or 0) / len(request_ids)
+            for request_id in request_ids:
+                phone = phones.get(request_id)
+                if phone is not None:
+                    events.append({'user_id': phone[0], 'project_id': phone[1], 'at': phone[2], 'spend': share})
+
+        # 退款可能发生在之后任意时间，按 request_id 查
+        request_ids = list(phones)
+        for i in range(0, len(request_ids), CHUNK_SIZE):
+            refunds = db.session.query(Transaction.reference_id, Transaction.amount).filter(
+                Transaction.type == 'refund', Transaction.reference_id.in_(request_ids[i:i + CHUNK_SIZE])
+            )
+            for reference_id, amount in refunds:
+                phone = phones[reference_id]
+                events.append({'user_id': phone[0], 'project_id': phone[1], 'at': phone[2], 'refunds': amount or 0})
+
+    rollups.record_many(events)
+    db.session.commit()
+    return len(phones)
+
+def backfill(since=None, until=None):
+    """重建 [since, until) 范围内每天的汇总行"""
+    from app.models import db, PhoneNumber
+
+    if since is None:
+        earliest = db.session.query(db.func.min(PhoneNumber.created_at)).scalar()
+        if earliest is None:
+            logger.info("没有号码记录，无需重建")
+            return
+        since = earliest.date()
+    if until is None:
+        until = datetime.utcnow().date()
+
+    day = since
+    total = 0
+    while day < until:
+        try:
+            count = rebuild_day(day)
+        except Exception:
+            db.session.rollback()
+            logger.exception(f"重建 {day} 的汇总数据失败")
+            raise
+        total += count
+        logger.info(f"已重建 {day}，号码 {count} 个")
+        day += timedelta(days=1)
+    logger.info(f"重建完成，共 {total} 个号码")
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+def main():
+    parser = argparse.ArgumentParser(description='重建统计汇总表')
+    parser.add_argument('--since', type=parse_date, help='开始日期(YYYY-MM-DD)，默认最早的号码记录')
+    parser.add_argument('--until', type=parse_date, help='结束日期(YYYY-MM-DD，不含)，默认今天（UTC）')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        backfill(args.since, args.until)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+验证码提取基准测试
+
+对比旧的逐条正则提取和预编译提取引擎的吞吐（条/秒）与准确率。
+
+默认用 benchmarks/data/sms_corpus.json 中的短信模板生成带标准答案的语料
+（含不应提取出验证码的负样本）。这些模板和提取规则是一起编写的，在模板语料上的
+准确率只能说明规则覆盖了这些写法，不能代表线上短信。评估规则和吞吐请用 --samples
+指定真实短信：每行一个 {"content": ..., "code": ...}，例如从 sms_deliveries 表
+导出上游给出了验证码的推送（code 为空表示不应提取出验证码）。
+
+在模板语料上提取引擎与旧版逐条正则的吞吐基本持平，没有明显的速度优势。
+
+用法:
+    python benchmarks/bench_code_extraction.py --messages 50000 --repeat 3
+    python benchmarks/bench_code_extraction.py --samples deliveries.ndjson
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import string
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app.services.code_extractor import CodeExtractor  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'sms_corpus.json')
+
+def legacy_extract(content):
+    """原 app.utils.extract_verification_code 的实现"""
+    patterns = [
+        r'验证码[是为:]?\s*([0-9]{4,6})',
+        r'code[: ]([0-9]{4,6})',
+        r'码[是为:]?\s*([0-9]{4,6})',
+        r'[验证认证校验].*?([0-9]{4,6})',
+        r'([0-9]{4,6})[^0-9]*验证',
+        r'([0-9]{6})',
+        r'([0-9]{4})'
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, content)
+        if match:
+            return match.group(1)
+    return ""
+
+def legacy_task_extract(content):
+    """原 tasks.extract_code_from_sms 的实现"""
+    patterns = [
+        r'验证码[是为：:\s]+(\d{4,6})',
+        r'码[是为：:\s]+(\d{4,6})',
+        r'[code|CODE|Code][是为：:\s]+(\d{4,6})',
+        r'[\[【](\d{4,6})[\]】]',
+        r'(\d{4,6})'
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, content)
+        if match:
+            return match.group(1)
+    return ""
+
+def make_code(kind, rng):
+    """按格式生成验证码，如 digits6 / alnum6"""
+    length = int(kind.lstrip(string.ascii_letters))
+    if kind.startswith('alnum'):
+        # 字母数字混合，至少含一位数字
+        chars = [rng.choice(string.ascii_uppercase + string.digits) for _ in range(length - 1)]
+        chars.insert(rng.randrange(length), rng.choice(string.digits))
+        return ''.join(chars)
+    return ''.join(rng.choice(string.digits) for _ in range(length))
+
+def build_corpus(path, count, negative_ratio, seed):
+    """生成 (短信内容, 期望验证码) 列表"""
+    with open(path, encoding='utf-8') as f:
+        corpus = json.load(f)
+    rng = random.Random(seed)
+    samples = []
+    for _ in range(count):
+        if rng.random() < negative_ratio:
+            samples.append((rng.choice(corpus['negatives']), ''))
+            continue
+        template = rng.choice(corpus['templates'])
+        code = make_code(template['code'], rng)
+        samples.append((template['text'].replace('{code}', code), code))
+    return samples
+
+def load_samples(path):
+    """读取真实短信 (短信内容, 期望验证码) 列表"""
+    samples = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                samples.append((item['content'], item.get('code') or ''))
+    return samples
+
+def run(name, func, contents, expected, repeat, batch):
+    """多次运行取最快的一次，返回统计"""
+    best = None
+    results = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        if batch:
+            results = []
+            for i in range(0, len(contents), batch):
+                results.extend(func(contents[i:i + batch]))
+        else:
+            results = [func(content) for content in contents]
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    correct = sum(1 for got, want in zip(results, expected) if got == want)
+    positives = [(got, want) for got, want in zip(results, expected) if want]
+    negatives = [got for got, want in zip(results, expected) if not want]
+    return {
+        'name': name,
+        'seconds': best,
+        'rate': len(contents) / best if best else 0,
+        'accuracy': correct / len(contents) if contents else 0,
+        'recall': sum(1 for got, want in positives if got == want) / len(positives) if positives else 0,
+        'false_positive': sum(1 for got in negatives if got) / len(negatives) if negatives else 0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='验证码提取基准测试')
+    parser.add_argument('--corpus', default=CORPUS, help='短信模板语料文件')
+    parser.add_argument('--samples', help='真实短信NDJSON文件，指定后不再用模板生成语料')
+    parser.add_argument('--messages', type=int, default=50000, help='生成的短信条数')
+    parser.add_argument('--negative-ratio', type=float, default=0.1, help='负样本（无验证码）比例')
+    parser.add_argument('--batch', type=int, default=500, help='批量提取时每批条数')
+    parser.add_argument('--repeat', type=int, default=3, help='每种实现的运行次数')
+    parser.add_argument('--seed', type=int, default=42, help='随机种子')
+    parser.add_argument('--show-errors', type=int, default=0, help='列出提取引擎前N条错误')
+    args = parser.parse_args()
+
+    if args.samples:
+        samples = load_samples(args.samples)
+    else:
+        samples = build_corpus(args.corpus, args.messages, args.negative_ratio, args.seed)
+    contents = [content for content, _ in samples]
+    expected = [code for _, code in samples]
+    extractor = CodeExtractor()
+
+    rows = [
+        run('旧版逐条正则(utils)', legacy_extract, contents, expected, args.repeat, 0),
+        run('旧版逐条正则(tasks)', legacy_task_extract, contents, expected, args.repeat, 0),
+        run('提取引擎 extract', extractor.extract, contents, expected, args.repeat, 0),
+        run(f'提取引擎 extract_many({args.batch})', extractor.extract_many, contents, expected, args.repeat, args.batch),
+    ]
+
+    if args.samples:
+        negatives = sum(1 for code in expected if not code)
+        print(f"真实短信: {args.samples}，短信数: {len(contents)}，负样本: {negatives}，运行次数: {args.repeat}")
+    else:
+        print(f"模板语料（与规则一起编写，准确率不代表线上短信）短信数: {len(contents)}，"
+              f"负样本比例: {args.negative_ratio:.0%}，运行次数: {args.repeat}")
+    print(f"{'实现':<30}{'耗时(s)':<10}{'条/秒':<12}{'准确率':<10}{'召回率':<10}{'误提取率':<10}")
+    for row in rows:
+        print(f"{row['name']:<30}{row['seconds']:<10.3f}{row['rate']:<12.0f}"
+              f"{row['accuracy']:<10.2%}{row['recall']:<10.2%}{row['false_positive']:<10.2%}")
+
+    if args.show_errors:
+        shown = 0
+        for content, want in samples:
+            got, rule = extractor.match(content)
+            if got != want:
+                print(f"期望 {want or '(无)'}，得到 {got or '(无)'}（{rule}）: {content}")
+                shown += 1
+                if shown >= args.show_errors:
+                    break
+
+if __name__ == '__main__':
+    sys.exit(main())
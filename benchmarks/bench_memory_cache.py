@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+内存缓存压测
+
+对比旧的 MemoryCache（无容量上限、无锁、只在读取时删除过期键）与新的分段
+LRU+TTL 实现在100万个键下的写入/读取吞吐量、多线程读写吞吐量和内存占用。
+
+用法:
+    python benchmarks/bench_memory_cache.py
+    python benchmarks/bench_memory_cache.py --keys 1000000 --capacity 200000 --threads 8
+"""
+
+import os
+import sys
+import gc
+import time
+import random
+import argparse
+import threading
+
+import psutil
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.cache_service import MemoryCache
+
+class LegacyMemoryCache:
+    """旧实现：两个dict，无锁，过期键只在读取时删除"""
+
+    def __init__(self):
+        self._cache = {}
+        self._expires = {}
+
+    def get(self, key):
+        if key in self._expires and self._expires[key] < time.time():
+            self.delete(key)
+            return None
+        return self._cache.get(key)
+
+    def set(self, key, value, ttl=None):
+        self._cache[key] = value
+        if ttl is not None:
+            self._expires[key] = time.time() + ttl
+
+    def delete(self, key):
+        if key in self._cache:
+            del self._cache[key]
+        if key in self._expires:
+            del self._expires[key]
+
+def rss_mb():
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+def timed(label, func, count):
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    print(f"  {label:<28} {elapsed:8.3f}s  {count / elapsed / 1000:10.1f} k ops/s")
+    return elapsed
+
+def run(name, cache, keys, threads, ttl):
+    """执行一轮压测"""
+    print(f"{name}:")
+    gc.collect()
+    base = rss_mb()
+
+    timed('set', lambda: [cache.set(key, key, ttl) for key in keys], len(keys))
+    timed('get (顺序)', lambda: [cache.get(key) for key in keys], len(keys))
+    sample = random.sample(keys, min(len(keys), 200000))
+    timed('get (随机)', lambda: [cache.get(key) for key in sample], len(sample))
+
+    # 多线程 90% 读 10% 写
+    per_thread = 200000 // threads
+    errors = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        try:
+            for _ in range(per_thread):
+                key = keys[rng.randrange(len(keys))]
+                if rng.random() < 0.9:
+                    cache.get(key)
+                else:
+                    cache.set(key, key, ttl)
+        except Exception as e:
+            errors.append(e)
+
+    def concurrent():
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+
+    timed(f'{threads} 线程 90%读/10%写', concurrent, per_thread * threads)
+    if errors:
+        print(f"  线程出错: {errors[0]!r}")
+
+    gc.collect()
+    print(f"  内存增长 {rss_mb() - base:8.1f} MB")
+    if hasattr(cache, 'stats'):
+        print(f"  统计 {cache.stats()}")
+
+    # 用短TTL覆盖全部键，过期后看条目和内存是否回收
+    timed('set (TTL 1秒)', lambda: [cache.set(key, key, 1) for key in keys], len(keys))
+    time.sleep(1.1)
+    if hasattr(cache, 'sweep'):
+        started = time.perf_counter()
+        removed = cache.sweep()
+        print(f"  后台清理 {removed} 个过期键，耗时 {time.perf_counter() - started:.3f}s")
+    remaining = len(cache._cache) if hasattr(cache, '_cache') else cache.stats()['entries']
+    gc.collect()
+    print(f"  过期后剩余条目 {remaining}，内存增长 {rss_mb() - base:8.1f} MB")
+    print()
+
+def main():
+    parser = argparse.ArgumentParser(description='内存缓存压测')
+    parser.add_argument('--keys', type=int, default=1000000, help='键的数量')
+    parser.add_argument('--capacity', type=int, default=None, help='新实现的容量，默认等于键的数量')
+    parser.add_argument('--stripes', type=int, default=16, help='新实现的分段数')
+    parser.add_argument('--threads', type=int, default=8, help='并发线程数')
+    parser.add_argument('--ttl', type=float, default=300, help='键的过期时间（秒）')
+    args = parser.parse_args()
+
+    keys = [f"cache:app.middlewares.auth_middleware:validate_token:{i:032x}" for i in range(args.keys)]
+    run('旧实现 LegacyMemoryCache', LegacyMemoryCache(), keys, args.threads, args.ttl)
+    run('新实现 MemoryCache', MemoryCache(max_entries=args.capacity or args.keys, stripes=args.stripes,
+                                        sweep_interval=0), keys, args.threads, args.ttl)
+    if args.capacity is None:
+        capacity = args.keys // 10
+        run(f'新实现 MemoryCache（容量 {capacity}）', MemoryCache(max_entries=capacity, stripes=args.stripes,
+                                                          sweep_interval=0), keys, args.threads, args.ttl)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+上游客户端压测
+
+启动本地模拟上游（可配置延迟），对比三种取号方式：
+    legacy  每次请求新建requests.Session（旧实现）
+    pooled  共享连接池的SMSApiClient + 线程并发
+    async   AsyncSMSApiClient，单线程asyncio并发
+
+用法:
+    python benchmarks/bench_upstream_client.py --requests 500 --latency 0.02 --concurrency 32
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import concurrent.futures
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from flask import Flask
+from app.mock_api import MockUpstreamServer
+from app.utils import SMSApiClient
+from app.services.async_sms_client import AsyncSMSApiClient
+
+PROJECT_CODE = 'wechat_login'
+
+def bench_legacy(base_url, total, concurrency):
+    """旧实现：每次请求新建会话，没有超时"""
+    def call(_):
+        session = requests.Session()
+        response = session.post(f"{base_url}/numbers", json={'project_code': PROJECT_CODE})
+        return response.json()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(call, range(total)))
+
+def bench_pooled(app, base_url, total, concurrency):
+    """共享连接池的同步客户端"""
+    with app.app_context():
+        app.config['SMS_API_MAX_IN_FLIGHT'] = concurrency
+        app.config['SMS_API_POOL_MAXSIZE'] = concurrency
+        client = SMSApiClient(base_url=base_url, api_key='bench')
+        return client.get_phone_numbers(PROJECT_CODE, total)
+
+def bench_async(base_url, total, concurrency):
+    """asyncio客户端"""
+    async def run():
+        async with AsyncSMSApiClient(base_url=base_url, api_key='bench', use_mock=False,
+                                     max_connections=concurrency, max_in_flight=concurrency) as client:
+            return await client.get_phone_numbers(PROJECT_CODE, total)
+    return asyncio.run(run())
+
+def main():
+    parser = argparse.ArgumentParser(description='上游客户端压测')
+    parser.add_argument('--requests', type=int, default=500, help='取号请求总数')
+    parser.add_argument('--latency', type=float, default=0.02, help='模拟上游延迟（秒）')
+    parser.add_argument('--concurrency', type=int, default=32, help='最大并发数')
+    args = parser.parse_args()
+
+    app = Flask('bench')
+    app.config.update(USE_MOCK_API=False, SMS_API_BASE_URL='', SMS_API_KEY='')
+
+    print(f"请求数: {args.requests}，上游延迟: {args.latency * 1000:.0f}ms，并发: {args.concurrency}")
+    print(f"{'方式':<10}{'耗时(s)':>10}{'吞吐(次/s)':>14}{'成功':>8}{'上游连接':>10}")
+    cases = (
+        ('legacy', lambda url: bench_legacy(url, args.requests, args.concurrency)),
+        ('pooled', lambda url: bench_pooled(app, url, args.requests, args.concurrency)),
+        ('async', lambda url: bench_async(url, args.requests, args.concurrency)),
+    )
+    for name, func in cases:
+        server = MockUpstreamServer(latency=args.latency).start()
+        try:
+            started = time.perf_counter()
+            results = func(server.base_url)
+            elapsed = time.perf_counter() - started
+        finally:
+            server.stop()
+        succeeded = sum(1 for r in results if r.get('success'))
+        print(f"{name:<10}{elapsed:>10.2f}{args.requests / elapsed:>14.1f}{succeeded:>8}{server.connection_count:>10}")
+
+if __name__ == '__main__':
+    main()
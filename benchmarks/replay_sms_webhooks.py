@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+回放上游短信推送
+
+把录制的推送（NDJSON，每行一条）按批次签名后并发POST到回调接口，
+统计吞吐、延迟以及接口返回的入队/重复/拒绝数量。
+没有录制文件时可以用 --generate 生成模拟推送（含一定比例的重复推送）。
+
+用法:
+    python benchmarks/replay_sms_webhooks.py --generate 20000 --file /tmp/deliveries.ndjson
+    python benchmarks/replay_sms_webhooks.py --url http://localhost:5000/api/webhooks/sms \
+        --file /tmp/deliveries.ndjson --secret 密钥 --batch 200 --concurrency 16
+"""
+
+import os
+import sys
+import hmac
+import json
+import time
+import random
+import hashlib
+import argparse
+import concurrent.futures
+from datetime import datetime, timedelta
+
+import requests
+
+TEMPLATES = [
+    "您的验证码是{code}，5分钟内有效，请勿泄露给他人。",
+    "【微信】验证码{code}，用于登录，请勿转发。",
+    "Your verification code is {code}.",
+    "{code}是您的验证码，10分钟内有效。",
+]
+
+def generate(path, count, duplicate_ratio):
+    """生成模拟推送记录"""
+    start = datetime.utcnow() - timedelta(minutes=10)
+    records = []
+    for i in range(count):
+        if records and random.random() < duplicate_ratio:
+            # 上游重复推送同一条短信
+            records.append(random.choice(records))
+            continue
+        code = ''.join(random.choices('0123456789', k=6))
+        record = {
+            'sender': '106' + ''.join(random.choices('0123456789', k=5)),
+            'content': random.choice(TEMPLATES).format(code=code),
+            'received_at': (start + timedelta(milliseconds=i * 10)).isoformat()
+        }
+        if random.random() < 0.7:
+            record['request_id'] = f"req_{random.getrandbits(32):08x}"
+        else:
+            record['number'] = '138' + ''.join(random.choices('0123456789', k=8))
+        records.append(record)
+
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    print(f"已生成 {len(records)} 条推送: {path}")
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def sign(secret, body):
+    return 'sha256=' + hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+def replay(url, records, secret, provider, batch_size, concurrency):
+    """按批次并发回放，返回统计"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    batches = [records[i:i + batch_size] for i in range(0, len(records), batch_size)]
+
+    def send(batch):
+        body = json.dumps({'messages': batch}, ensure_ascii=False).encode('utf-8')
+        headers = {
+            'Content-Type': 'application/json',
+            'X-Provider': provider,
+            'X-Signature': sign(secret, body)
+        }
+        started = time.perf_counter()
+        # 队列已满时按Retry-After退避重发
+        while True:
+            response = session.post(url, data=body, headers=headers, timeout=30)
+            if response.status_code != 503:
+                break
+            time.sleep(float(response.headers.get('Retry-After', 1)))
+        elapsed = time.perf_counter() - started
+        try:
+            data = response.json()
+        except ValueError:
+            data = {}
+        return response.status_code, elapsed, data
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, batches))
+    total_time = time.perf_counter() - started
+
+    latencies = sorted(elapsed for _, elapsed, _ in results)
+    stats = {
+        'messages': len(records),
+        'batches': len(batches),
+        'errors': sum(1 for status, _, _ in results if status != 202),
+        'accepted': sum(data.get('accepted', 0) for _, _, data in results),
+        'duplicates': sum(data.get('duplicates', 0) for _, _, data in results),
+        'rejected': sum(len(data.get('rejected', [])) for _, _, data in results),
+        'seconds': total_time,
+        'p50_ms': latencies[len(latencies) // 2] * 1000 if latencies else 0,
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000 if latencies else 0,
+    }
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description='回放上游短信推送')
+    parser.add_argument('--url', help='回调接口地址，例如 http://localhost:5000/api/webhooks/sms')
+    parser.add_argument('--file', default='deliveries.ndjson', help='录制的推送文件（NDJSON）')
+    parser.add_argument('--generate', type=int, default=0, help='生成指定数量的模拟推送到 --file')
+    parser.add_argument('--duplicate-ratio', type=float, default=0.05, help='生成时重复推送的比例')
+    parser.add_argument('--secret', default=os.environ.get('SMS_WEBHOOK_SECRET', ''), help='签名密钥')
+    parser.add_argument('--provider', default='default', help='上游平台名称')
+    parser.add_argument('--batch', type=int, default=200, help='每次请求的推送条数')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发请求数')
+    args = parser.parse_args()
+
+    if args.generate:
+        generate(args.file, args.generate, args.duplicate_ratio)
+    if not args.url:
+        if not args.generate:
+            parser.error('需要 --url 或 --generate')
+        return
+
+    records = load(args.file)
+    stats = replay(args.url, records, args.secret, args.provider, args.batch, args.concurrency)
+
+    print(f"{'推送数':<10}{'批次':<8}{'入队':<10}{'重复':<8}{'拒绝':<8}{'错误':<8}{'耗时(s)':<10}{'条/秒':<10}{'P50(ms)':<10}{'P99(ms)':<10}")
+    print(f"{stats['messages']:<10}{stats['batches']:<8}{stats['accepted']:<10}{stats['duplicates']:<8}"
+          f"{stats['rejected']:<8}{stats['errors']:<8}{stats['seconds']:<10.2f}"
+          f"{stats['messages'] / stats['seconds']:<10.0f}{stats['p50_ms']:<10.1f}{stats['p99_ms']:<10.1f}")
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试公共夹具
+
+项目中有两套模型：
+- app/models/ 包（SQLAlchemy声明式，配合 app.database.db），由 create_app 注册的 app/views/* 使用
+- app/models.py（Flask-SQLAlchemy），由 app/routes/* 和大部分服务使用，代码中写作 from app.models import db
+
+两者同名时导入的是包。这里把 app/models.py 加载为 app.models 模块，并把包目录设为它的
+__path__，两套代码在同一个测试进程中都能导入（app.models.user 等子模块仍然来自包）。
+
+夹具:
+    app / client: create_app() 创建的应用（app/views/*），每个测试前重建表
+    make_routes_app: 创建使用 app/models.py 的应用并注册指定的 app/routes/* 蓝图
+"""
+
+import os
+import sys
+import tempfile
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['FLASK_ENV'] = 'testing'
+
+_TMP_DIR = tempfile.mkdtemp(prefix='sms_platform_tests_')
+
+import app as app_package
+
+_spec = importlib.util.spec_from_file_location('app.models', os.path.join(ROOT, 'app', 'models.py'))
+route_models = importlib.util.module_from_spec(_spec)
+route_models.__path__ = [os.path.join(ROOT, 'app', 'models')]
+sys.modules['app.models'] = route_models
+app_package.models = route_models
+_spec.loader.exec_module(route_models)
+
+# 内存SQLite配合连接池时每个连接都是一个新库，测试改用临时文件
+from app.config import TestingConfig
+TestingConfig.DATABASE_URI = f"sqlite:///{os.path.join(_TMP_DIR, 'views.db')}"
+TestingConfig.EXPORT_SPOOL_DIR = os.path.join(_TMP_DIR, 'views_exports')
+TestingConfig.SMS_INGEST_SPOOL_DIR = os.path.join(_TMP_DIR, 'views_ingest')
+
+import jwt
+import pytest
+from flask import Flask
+
+@pytest.fixture(scope='session')
+def _live_app():
+    from app import create_app
+    return create_app('testing')
+
+@pytest.fixture
+def app(_live_app):
+    """create_app() 创建的应用，每个测试使用空表"""
+    from app.database import db
+    db.close_session()
+    db.drop_all()
+    db.create_all()
+    yield _live_app
+    db.close_session()
+
+@pytest.fixture
+def make_token(app):
+    """为 create_app() 应用生成JWT"""
+    def _make(user_id, username='user', is_admin=False):
+        return jwt.encode(
+            {'user_id': user_id, 'username': username, 'is_admin': is_admin, 'exp': 9999999999},
+            app.config['JWT_SECRET_KEY'], algorithm='HS256'
+        )
+    return _make
+
+@pytest.fixture
+def make_routes_app():
+    """
+    创建使用 app/models.py 的应用
+
+    用法:
+        routes_app = make_routes_app({numbers_bp: '/api/numbers'}, SOME_CONFIG=1)
+    """
+    from app.services.blacklist_index import blacklist_index
+    from app.services.expiry_sweeper import expiry_sweeper
+    from app.services.stats_cache import stats_cache
+    from app.services.sms_ingest import sms_ingest
+    from app.services.export_jobs import export_jobs
+
+    def stop_services():
+        for service in (sms_ingest, export_jobs):
+            service.stop()
+            service._app = None
+
+    created = []
+
+    def _make(blueprints=None, **config):
+        # 蓝图注册时单例服务绑定到新应用，不沿用上一个测试的应用
+        stop_services()
+        for service in (blacklist_index, expiry_sweeper, stats_cache):
+            service._app = None
+        blacklist_index._view = None
+        blacklist_index._pending = set()
+
+        routes_app = Flask('routes_test')
+        routes_app.config.from_object(TestingConfig)
+        routes_app.config.update(SQLALCHEMY_DATABASE_URI='sqlite://', SQLALCHEMY_TRACK_MODIFICATIONS=False)
+        routes_app.config.update(
+            BLACKLIST_INDEX_PATH=tempfile.mktemp(suffix='.idx', dir=_TMP_DIR),
+            EXPORT_SPOOL_DIR=tempfile.mkdtemp(prefix='exports_', dir=_TMP_DIR),
+            SMS_INGEST_SPOOL_DIR=tempfile.mkdtemp(prefix='ingest_', dir=_TMP_DIR)
+        )
+        routes_app.config.update(config)
+        route_models.db.init_app(routes_app)
+        # 先建表，蓝图注册时启动的服务可能会查库
+        with routes_app.app_context():
+            route_models.db.create_all()
+        for blueprint, prefix in (blueprints or {}).items():
+            routes_app.register_blueprint(blueprint, url_prefix=prefix)
+        created.append(routes_app)
+        return routes_app
+
+    yield _make
+
+    stop_services()
+    for routes_app in created:
+        with routes_app.app_context():
+            route_models.db.session.remove()
+            route_models.db.drop_all()
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""测试数据构造（app/models.py 的库，需要在应用上下文中调用）"""
+
+import jwt
+from app.models import db, User, Project
+
+def routes_token(routes_app, user_id, is_admin=False):
+    """为 app/routes/* 应用生成JWT"""
+    return jwt.encode(
+        {'user_id': user_id, 'username': f'user{user_id}', 'is_admin': is_admin, 'exp': 9999999999},
+        routes_app.config['JWT_SECRET_KEY'], algorithm='HS256'
+    )
+
+def add_user(balance=100.0, username=None, is_admin=False):
+    """在 app/models.py 的库中创建用户（需要应用上下文）"""
+    count = User.query.count()
+    user = User(username=username or f'user{count + 1}', email=f'user{count + 1}@example.com',
+                password='secret', is_admin=is_admin)
+    db.session.add(user)
+    db.session.flush()
+    user.balance = balance
+    db.session.commit()
+    return user
+
+def add_project(code='wechat', price=1.0, name=None):
+    """在 app/models.py 的库中创建项目（需要应用上下文）"""
+    project = Project(name=name or code, code=code, price=price)
+    db.session.add(project)
+    db.session.commit()
+    return project
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+from datetime import datetime
+
+import pytest
+
+from app.models import db, PhoneNumber
+import app.routes.numbers as numbers_routes
+from app.routes.numbers import numbers_bp
+from app.services.provider_router import provider_router, RoutedSMSApiClient
+from tests.factories import add_user, add_project, routes_token
+
+class FakeRoutedClient:
+    """按请求ID返回释放结果的上游客户端"""
+    use_mock = False
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.calls = []
+
+    def release_phone_numbers(self, items):
+        self.calls.append(list(items))
+        return [{'success': False, 'message': '上游拒绝'} if request_id in self.failing else {'success': True}
+                for request_id, _ in items]
+
+@pytest.fixture
+def routes_app(make_routes_app):
+    return make_routes_app({numbers_bp: '/api/numbers'}, BATCH_RELEASE_QUERY_MAX_COUNT=3)
+
+@pytest.fixture
+def owner(routes_app):
+    with routes_app.app_context():
+        user = add_user()
+        other = add_user()
+        project = add_project()
+        for request_id, user_id, status in (('req_ok', user.id, 'available'), ('req_used', user.id, 'used'),
+                                            ('req_refused', user.id, 'available'), ('req_gone', user.id, 'released'),
+                                            ('req_other', other.id, 'available')):
+            db.session.add(PhoneNumber(number='13800000000', status=status, project_id=project.id,
+                                       user_id=user_id, request_id=request_id, provider='alpha'))
+        db.session.commit()
+        return routes_token(routes_app, user.id)
+
+def statuses(routes_app):
+    with routes_app.app_context():
+        return dict(db.session.query(PhoneNumber.request_id, PhoneNumber.status))
+
+def test_each_id_gets_its_own_outcome(routes_app, owner, monkeypatch):
+    fake = FakeRoutedClient(failing={'req_refused'})
+    monkeypatch.setattr(provider_router, 'client', lambda max_cost=None: fake)
+    request_ids = ['req_ok', 'req_used', 'req_refused', 'req_gone', 'req_other', 'req_missing']
+
+    response = routes_app.test_client().post('/api/numbers/batch-release',
+                                             json={'token': owner, 'request_ids': request_ids})
+
+    body = response.get_json()
+    assert (body['released'], body['failed']) == (2, 1)
+    assert [item['status'] for item in body['details']] == \
+        ['success', 'success', 'failed', 'not_found', 'not_found', 'not_found']
+    assert body['details'][2]['reason'] == '上游拒绝'
+    # 上游只调用一次，只包含本人可释放的号码
+    assert sorted(request_id for request_id, _ in fake.calls[0]) == ['req_ok', 'req_refused', 'req_used']
+    assert statuses(routes_app) == {'req_ok': 'released', 'req_used': 'released', 'req_refused': 'available',
+                                    'req_gone': 'released', 'req_other': 'available'}
+
+def test_state_changed_during_upstream_release(routes_app, owner, monkeypatch):
+    class ExpiringClient(FakeRoutedClient):
+        def release_phone_numbers(self, items):
+            # 上游释放期间号码被超时清理
+            db.session.execute(PhoneNumber.__table__.update()
+                               .where(PhoneNumber.__table__.c.request_id == 'req_ok').values(status='expired'))
+            return super().release_phone_numbers(items)
+
+    monkeypatch.setattr(provider_router, 'client', lambda max_cost=None: ExpiringClient())
+
+    response = routes_app.test_client().post('/api/numbers/batch-release',
+                                             json={'token': owner, 'request_ids': ['req_ok', 'req_used']})
+
+    details = {item['request_id']: item for item in response.get_json()['details']}
+    assert details['req_ok']['reason'] == '号码状态已变化'
+    assert details['req_used']['status'] == 'success'
+    assert statuses(routes_app)['req_ok'] == 'expired'
+
+@pytest.mark.parametrize('returning', [True, False])
+def test_number_released_by_another_request_in_same_instant_is_not_claimed(routes_app, owner, monkeypatch,
+                                                                          returning):
+    now = datetime.utcnow()
+
+    class FrozenDatetime(datetime):
+        @classmethod
+        def utcnow(cls):
+            return now
+
+    class ConcurrentClient(FakeRoutedClient):
+        def release_phone_numbers(self, items):
+            # 上游释放期间另一个请求在同一时刻释放了号码
+            db.session.execute(PhoneNumber.__table__.update()
+                               .where(PhoneNumber.__table__.c.request_id == 'req_ok')
+                               .values(status='released', released_at=now))
+            return super().release_phone_numbers(items)
+
+    monkeypatch.setattr(numbers_routes, 'datetime', FrozenDatetime)
+    monkeypatch.setattr(provider_router, 'client', lambda max_cost=None: ConcurrentClient())
+    with routes_app.app_context():
+        monkeypatch.setattr(db.engine.dialect, 'update_returning', returning)
+
+    response = routes_app.test_client().post('/api/numbers/batch-release',
+                                             json={'token': owner, 'request_ids': ['req_ok', 'req_used']})
+
+    body = response.get_json()
+    details = {item['request_id']: item for item in body['details']}
+    assert body['released'] == 1
+    assert details['req_ok']['reason'] == '号码状态已变化'
+    assert details['req_used']['status'] == 'success'
+
+def test_upstream_is_called_with_upstream_request_id(routes_app, owner, monkeypatch):
+    fake = FakeRoutedClient()
+    monkeypatch.setattr(provider_router, 'client', lambda max_cost=None: fake)
+    with routes_app.app_context():
+        PhoneNumber.query.filter_by(request_id='req_ok').update({'upstream_request_id': 'up_ok'})
+        db.session.commit()
+
+    routes_app.test_client().post('/api/numbers/batch-release',
+                                  json={'token': owner, 'request_ids': ['req_ok', 'req_used']})
+
+    # 迁移前的号码没有上游请求ID，沿用本地请求ID
+    assert sorted(fake.calls[0]) == [('req_used', 'alpha'), ('up_ok', 'alpha')]
+    assert statuses(routes_app)['req_ok'] == 'released'
+
+def test_acquired_numbers_are_released_with_upstream_request_id(routes_app, monkeypatch):
+    class AcquiringClient(FakeRoutedClient):
+        issued = 0
+
+        def get_phone_number(self, project_code):
+            self.issued += 1
+            return {'success': True, 'provider': 'alpha',
+                    'phone_number': {'number': f'1380000000{self.issued}', 'request_id': f'up_{self.issued}'}}
+
+        def get_phone_numbers(self, project_code, count):
+            return [self.get_phone_number(project_code) for _ in range(count)]
+
+    fake = AcquiringClient()
+    monkeypatch.setattr(provider_router, 'client', lambda max_cost=None: fake)
+    with routes_app.app_context():
+        user = add_user()
+        add_project()
+        token = routes_token(routes_app, user.id)
+    client = routes_app.test_client()
+
+    single = client.get(f'/api/numbers/get?project_code=wechat&token={token}').get_json()
+    batch = client.get(f'/api/numbers/batch-get?project_code=wechat&count=2&token={token}').get_json()
+    request_ids = [single['phone_number']['request_id']] + [item['request_id'] for item in batch['phone_numbers']]
+    client.post('/api/numbers/batch-release', json={'token': token, 'request_ids': request_ids})
+
+    assert sorted(request_id for request_id, _ in fake.calls[0]) == ['up_1', 'up_2', 'up_3']
+
+def test_query_string_form_is_capped(routes_app, owner):
+    response = routes_app.test_client().get(f'/api/numbers/batch-release?request_ids=a,b,c,d&token={owner}')
+
+    assert response.status_code == 400
+
+def test_release_phone_numbers_runs_concurrently(routes_app):
+    class SlowClient:
+        base_url = 'http://slow-release.test'
+        max_in_flight = 8
+
+        def __init__(self):
+            self.active = 0
+            self.peak = 0
+            self.lock = threading.Lock()
+
+        def release_phone_number(self, request_id):
+            with self.lock:
+                self.active += 1
+                self.peak = max(self.peak, self.active)
+            time.sleep(0.05)
+            with self.lock:
+                self.active -= 1
+            return {'success': True}
+
+    slow = SlowClient()
+    routed = RoutedSMSApiClient.__new__(RoutedSMSApiClient)
+    routed.client_for = lambda provider=None: slow
+
+    with routes_app.app_context():
+        results = routed.release_phone_numbers([(f'req_{n}', 'alpha') for n in range(16)])
+
+    assert all(result['success'] for result in results)
+    assert 1 < slow.peak <= 8
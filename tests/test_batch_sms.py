@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app.models import db, PhoneRequest, SMS
+from app.routes.numbers import numbers_bp
+from tests.factories import add_user, add_project, routes_token
+
+@pytest.fixture
+def routes_app(make_routes_app):
+    return make_routes_app({numbers_bp: '/api/numbers'}, BATCH_SMS_MAX_COUNT=200)
+
+def add_requests(user_id, project_id, count, prefix='req'):
+    """每个号码请求两条短信，较新的一条没有保存验证码"""
+    now = datetime.utcnow()
+    for n in range(count):
+        phone_request = PhoneRequest(request_id=f'{prefix}_{n}', user_id=user_id, project_id=project_id,
+                                     phone_number='13800000000', status='active')
+        db.session.add(phone_request)
+        db.session.flush()
+        db.session.add_all([
+            SMS(phone_request_id=phone_request.id, content='旧短信', code='', received_at=now - timedelta(minutes=1)),
+            SMS(phone_request_id=phone_request.id, content=f'您的验证码是{100000 + n}', received_at=now),
+        ])
+    db.session.commit()
+
+def count_sms_queries(routes_app, call):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if 'sms_messages' in statement and statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            statements.append(statement)
+
+    with routes_app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        response = call()
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return response, len(statements)
+
+def test_one_query_regardless_of_batch_size(routes_app):
+    with routes_app.app_context():
+        user = add_user()
+        project = add_project()
+        add_requests(user.id, project.id, 150)
+        token = routes_token(routes_app, user.id)
+    client = routes_app.test_client()
+
+    small, small_queries = count_sms_queries(routes_app, lambda: client.post(
+        '/api/numbers/batch-sms', json={'token': token, 'request_ids': [f'req_{n}' for n in range(5)]}))
+    large, large_queries = count_sms_queries(routes_app, lambda: client.post(
+        '/api/numbers/batch-sms', json={'token': token, 'request_ids': [f'req_{n}' for n in range(150)]}))
+
+    assert small.status_code == large.status_code == 200
+    assert small_queries == large_queries == 1
+    results = large.get_json()['results']
+    assert len(results) == 150
+    assert results['req_42']['sms']['code'] == '100042'
+
+def test_extracted_codes_are_written_back(routes_app):
+    with routes_app.app_context():
+        user = add_user()
+        project = add_project()
+        add_requests(user.id, project.id, 3)
+        token = routes_token(routes_app, user.id)
+
+    routes_app.test_client().get(f'/api/numbers/batch-sms?request_ids=req_0,req_1,req_2&token={token}')
+
+    with routes_app.app_context():
+        codes = [code for code, in db.session.query(SMS.code).order_by(SMS.id)]
+        assert codes == ['', '100000', '', '100001', '', '100002']
+
+def test_other_users_and_unknown_ids(routes_app):
+    with routes_app.app_context():
+        owner = add_user()
+        other = add_user()
+        project = add_project()
+        add_requests(owner.id, project.id, 1)
+        token = routes_token(routes_app, other.id)
+
+    response = routes_app.test_client().get(f'/api/numbers/batch-sms?request_ids=req_0,missing&token={token}')
+
+    results = response.get_json()['results']
+    assert results['req_0']['message'] == '无权查询此请求ID'
+    assert results['missing']['message'] == '请求ID不存在'
+    with routes_app.app_context():
+        # 别人的短信不会被提取写回
+        assert SMS.query.filter(SMS.code.is_(None)).count() == 1
+
+def test_rejects_more_than_max_count(routes_app):
+    with routes_app.app_context():
+        token = routes_token(routes_app, add_user().id)
+
+    response = routes_app.test_client().post('/api/numbers/batch-sms',
+                                             json={'token': token, 'request_ids': [str(n) for n in range(201)]})
+
+    assert response.status_code == 400
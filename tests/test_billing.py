@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from app.models import db, User, Transaction, PhoneNumber
+from app.routes.numbers import numbers_bp
+from app.services.billing import conditional_debit, debit_balance, credit_balance, InsufficientBalanceError
+from tests.factories import add_user, add_project, routes_token
+
+@pytest.fixture
+def routes_app(make_routes_app):
+    return make_routes_app({numbers_bp: '/api/numbers'})
+
+def balance(user_id):
+    db.session.expire_all()
+    return db.session.get(User, user_id).balance
+
+def test_conditional_debit_refuses_to_go_negative(routes_app):
+    with routes_app.app_context():
+        user = add_user(balance=1.5)
+
+        assert conditional_debit(db.session, User.__table__, user.id, 1.0) == pytest.approx(0.5)
+        with pytest.raises(InsufficientBalanceError):
+            conditional_debit(db.session, User.__table__, user.id, 1.0)
+        db.session.commit()
+
+        assert balance(user.id) == pytest.approx(0.5)
+
+def test_debit_and_credit_write_transactions(routes_app):
+    with routes_app.app_context():
+        user = add_user(balance=10.0)
+
+        debit_balance(user.id, 3.0, '取号', 'req_1')
+        credit_balance(user.id, 1.0, '退款', 'req_1')
+        db.session.commit()
+
+        rows = Transaction.query.order_by(Transaction.id).all()
+        assert [(row.type, row.amount, row.balance) for row in rows] == [('consume', -3.0, 7.0), ('refund', 1.0, 8.0)]
+        assert balance(user.id) == pytest.approx(8.0)
+
+def test_debit_reads_balance_from_database_not_stale_object(routes_app):
+    with routes_app.app_context():
+        user = add_user(balance=2.0)
+        stale = db.session.get(User, user.id)
+        stale_balance = stale.balance
+        # 其他请求已经扣过费，本会话中的对象还是旧余额
+        db.session.execute(User.__table__.update().values(balance=0.5))
+        db.session.commit()
+
+        assert stale_balance == pytest.approx(2.0)
+        with pytest.raises(InsufficientBalanceError):
+            debit_balance(stale.id, 1.0)
+        db.session.rollback()
+
+        assert balance(user.id) == pytest.approx(0.5)
+
+def test_get_number_charges_once_and_rolls_back_on_insufficient_balance(routes_app, monkeypatch):
+    import app.routes.numbers as numbers_routes
+
+    with routes_app.app_context():
+        user = add_user(balance=1.0)
+        add_project(price=1.0)
+        token = routes_token(routes_app, user.id)
+    client = routes_app.test_client()
+
+    first = client.get(f'/api/numbers/get?project_code=wechat&token={token}')
+    assert first.status_code == 200
+
+    # 预检查通过后余额被并发请求扣完
+    def drained(*args, **kwargs):
+        raise InsufficientBalanceError(user.id, 1.0)
+    monkeypatch.setattr(numbers_routes, 'debit_balance', drained)
+    with routes_app.app_context():
+        db.session.execute(User.__table__.update().values(balance=1.0))
+        db.session.commit()
+    second = client.get(f'/api/numbers/get?project_code=wechat&token={token}')
+
+    assert second.status_code == 400
+    with routes_app.app_context():
+        assert PhoneNumber.query.count() == 1
+        assert balance(user.id) == pytest.approx(1.0)
+        assert Transaction.query.count() == 1
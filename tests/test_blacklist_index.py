@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from app.models import db, BlacklistedNumber, PhoneNumber
+from app.routes.admin import admin_bp
+from app.services.blacklist_index import BlacklistIndex, normalize_number
+from tests.factories import add_user, add_project, routes_token
+
+def new_index(app):
+    """独立的索引实例（blacklist_index 是单例），模拟另一个工作进程"""
+    index = object.__new__(BlacklistIndex)
+    index._initialized = False
+    index.__init__()
+    index._app = app
+    return index
+
+def add_blacklisted(*numbers):
+    db.session.add_all([BlacklistedNumber(number=number) for number in numbers])
+    db.session.commit()
+
+@pytest.fixture
+def routes_app(make_routes_app):
+    return make_routes_app(BLACKLIST_INDEX_CHECK_INTERVAL=0)
+
+def test_normalize_number():
+    assert normalize_number('+86 138-0000-0000') == normalize_number('8613800000000')
+    assert normalize_number('abc') is None
+    assert normalize_number('1' * 18) is None
+
+def test_leading_zeros_are_significant(routes_app):
+    assert normalize_number('0123') != normalize_number('123')
+
+    index = new_index(routes_app)
+    with routes_app.app_context():
+        add_blacklisted('013800000001')
+        index.refresh()
+
+        assert index.contains('013800000001')
+        assert not index.contains('13800000001')
+        assert index.missing(['13800000001', '013800000001']) == ['13800000001']
+
+def test_lookups_come_from_the_index_file(routes_app):
+    index = new_index(routes_app)
+    with routes_app.app_context():
+        add_blacklisted('13800000001', '13800000003')
+        assert index.refresh() == 2
+
+        assert index.contains('13800000001')
+        assert not index.contains('13800000002')
+        assert index.missing(['13800000002', '13800000003']) == ['13800000002']
+    assert index.stats['fallbacks'] == 0
+
+def test_other_process_sees_merged_numbers(routes_app):
+    writer, reader = new_index(routes_app), new_index(routes_app)
+    with routes_app.app_context():
+        writer.refresh()
+        assert not reader.contains('13800000009')
+
+        add_blacklisted('13800000009')
+        writer.added(['13800000009'])
+
+        assert reader.contains('13800000009')
+    assert reader.stats['remaps'] == 2
+
+def test_filter_is_rebuilt_when_capacity_is_exceeded(routes_app):
+    index = new_index(routes_app)
+    with routes_app.app_context():
+        add_blacklisted('13800000000')
+        index.refresh()
+        small = index._view.bits
+
+        add_blacklisted(*[str(15000000000 + n) for n in range(3000)])
+        index.refresh()
+
+        assert index._view.bits > small
+        assert index._view.count == 3001
+        assert all(index.contains(str(15000000000 + n)) for n in range(0, 3000, 97))
+
+def test_falls_back_to_database_without_index(routes_app):
+    index = new_index(routes_app)
+    with routes_app.app_context():
+        add_blacklisted('13800000001')
+
+        assert index.contains('13800000001')
+    assert index.stats['fallbacks'] == 1
+
+def test_admin_import_skips_existing_and_flips_numbers(make_routes_app):
+    routes_app = make_routes_app({admin_bp: '/api/admin'})
+    with routes_app.app_context():
+        admin = add_user(is_admin=True)
+        project = add_project()
+        add_blacklisted('13800000001')
+        db.session.add(PhoneNumber(number='13800000002', status='available', project_id=project.id,
+                                   user_id=admin.id, request_id='req_flip'))
+        db.session.commit()
+        token = routes_token(routes_app, admin.id, is_admin=True)
+
+    response = routes_app.test_client().post('/api/admin/blacklist/import', json={
+        'token': token, 'numbers': ['13800000001', '13800000002', '13800000002', 'bad'], 'reason': '导入'
+    })
+
+    body = response.get_json()
+    assert (body['imported'], body['existing']) == (1, 1)
+    with routes_app.app_context():
+        assert BlacklistedNumber.query.count() == 2
+        assert PhoneNumber.query.filter_by(request_id='req_flip').one().status == 'blacklisted'
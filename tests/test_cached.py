@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from app.services.cache_service import cached, cache, cached_function_stats
+
+def test_none_is_cached_for_negative_ttl_only():
+    calls = []
+
+    @cached(ttl=60, negative_ttl=60)
+    def lookup_missing(user_id):
+        calls.append(user_id)
+        return None
+
+    @cached(ttl=60)
+    def lookup_uncached(user_id):
+        calls.append(user_id)
+        return None
+
+    assert lookup_missing(1) is None and lookup_missing(1) is None
+    assert lookup_uncached(2) is None and lookup_uncached(2) is None
+    assert calls == [1, 2, 2]
+
+def test_explicit_key_and_invalidate():
+    calls = []
+
+    @cached(ttl=60, key=lambda user_id, verbose=False: str(user_id))
+    def lookup_keyed(user_id, verbose=False):
+        calls.append(user_id)
+        return {'id': user_id}
+
+    lookup_keyed(1)
+    lookup_keyed(1, verbose=True)
+    lookup_keyed.invalidate(1)
+    lookup_keyed(1)
+
+    assert calls == [1, 1]
+    assert lookup_keyed.cache_key(1).endswith(':lookup_keyed:1')
+
+def test_concurrent_misses_compute_once():
+    calls = []
+    started = threading.Event()
+
+    @cached(ttl=60)
+    def slow_lookup(user_id):
+        calls.append(user_id)
+        started.set()
+        time.sleep(0.1)
+        return {'id': user_id}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(slow_lookup(1))) for _ in range(5)]
+    threads[0].start()
+    started.wait(1)
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert results == [{'id': 1}] * 5
+    assert cached_function_stats()[f'{__name__}.{slow_lookup.__qualname__}']['coalesced'] == 4
+
+def test_failed_refresh_serves_stale_value(monkeypatch):
+    values = iter([{'v': 1}, RuntimeError('数据库不可用'), {'v': 2}])
+
+    @cached(ttl=10, stale_ttl=60, early_refresh=0)
+    def flaky_lookup(user_id):
+        value = next(values)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    now = time.time()
+    assert flaky_lookup(1) == {'v': 1}
+    monkeypatch.setattr(time, 'time', lambda: now + 11)
+
+    assert flaky_lookup(1) == {'v': 1}
+    assert flaky_lookup(1) == {'v': 2}
+
+def test_errors_are_not_cached():
+    outcomes = [OperationalError('SELECT', {}, Exception('down')), {'id': 1}]
+
+    @cached(ttl=60, negative_ttl=60)
+    def failing_lookup(user_id):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    with pytest.raises(OperationalError):
+        failing_lookup(1)
+    assert failing_lookup(1) == {'id': 1}
+
+@pytest.fixture
+def user_id(app):
+    from app.database import db
+    from app.models.user import User
+    from app.services.user_service import UserService
+
+    session = db.get_session()
+    user = User(username='carol', email='carol@example.com', balance=5.0)
+    user.password = 'secret'
+    session.add(user)
+    session.commit()
+    user_id = user.id
+    db.close_session()
+    UserService.get_user.invalidate(user_id)
+    yield user_id
+    UserService.get_user.invalidate(user_id)
+
+def test_get_user_outage_is_not_cached_as_missing(user_id, monkeypatch):
+    from app.database import db
+    from app.services.user_service import UserService
+
+    class BrokenSession:
+        def query(self, *args):
+            raise OperationalError('SELECT', {}, Exception('数据库不可用'))
+
+    real_get_session = db.get_session
+    monkeypatch.setattr(db, 'get_session', lambda: BrokenSession())
+    with pytest.raises(OperationalError):
+        UserService.get_user(user_id)
+
+    monkeypatch.setattr(db, 'get_session', real_get_session)
+    assert UserService.get_user(user_id)['username'] == 'carol'
+    assert cache.get(UserService.get_user.cache_key(user_id)) is not None
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+import pytest
+
+from app.services.code_extractor import CodeExtractor, extract_code, extract_codes
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from bench_code_extraction import CORPUS, build_corpus  # noqa: E402
+
+@pytest.mark.parametrize('content, code', [
+    ('【12306】您的验证码是 583920，请在5分钟内输入', '583920'),
+    ('Your verification code is A7K2Q9. It expires in 10 minutes.', 'A7K2Q9'),
+    ('384756 is your login code', '384756'),
+    ('G-482913 是你的验证码', '482913'),
+    ('您尾号6621的卡于5月3日消费1200元', ''),
+])
+def test_extracts_codes_and_skips_quantities(content, code):
+    assert extract_code(content) == code
+
+def test_leading_rule_shortcut_matches_full_scan():
+    samples = build_corpus(CORPUS, 2000, 0.1, seed=7)
+    contents = [content for content, _ in samples]
+    full_scan = CodeExtractor()
+    full_scan._leading = None
+
+    expected = [full_scan.extract(content) for content in contents]
+
+    assert [extract_code(content) for content in contents] == expected
+    assert extract_codes(contents) == expected
+    assert full_scan.extract_many(contents) == expected
+
+@pytest.mark.parametrize('content', [
+    '订单号123456，验证码是7890',
+    '123456是您的验证码，验证码：7890',
+    'code: 1234，验证码是567890',
+    'Your code is 4321. 您的验证码为8765',
+    'OTP 98765 验证码为 123456',
+    '【12306】验证码是A1B2C3，订单123456',
+    '验证码123，验证码是482913',
+])
+def test_leading_rule_shortcut_agrees_on_adversarial_content(content):
+    full_scan = CodeExtractor()
+    full_scan._leading = None
+
+    assert extract_code(content) == full_scan.extract(content)
+    assert extract_codes([content, content]) == full_scan.extract_many([content, content])
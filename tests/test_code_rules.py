@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+
+import pytest
+
+from app.models import db, CodeRule
+from app.services.code_rules import CodeRuleIndex, build_template, validate_pattern
+from app.services.code_extractor import CodeExtractor
+from tests.factories import add_project
+
+def new_index():
+    """独立的规则索引实例（code_rules 是单例）"""
+    index = object.__new__(CodeRuleIndex)
+    index._initialized = False
+    index.__init__()
+    return index
+
+@pytest.fixture
+def routes_app(make_routes_app):
+    return make_routes_app(CODE_RULES_LEARN_MIN_SUPPORT=2)
+
+def test_build_template_extracts_same_code_from_similar_messages():
+    template = build_template('【银行】动态口令 482913，请勿泄露', '482913')
+
+    assert re.search(template, '【银行】动态口令 775102，请勿泄露').group(1) == '775102'
+    assert validate_pattern(template) is None
+
+def test_validate_pattern_requires_one_group():
+    assert validate_pattern(r'\d{6}') == '规则必须有且只有一个捕获组'
+    assert validate_pattern(r'(').startswith('正则表达式错误')
+
+def test_named_group_rule_is_accepted_and_extracts():
+    pattern = r'验证码(?P<code>\d{6})'
+
+    assert validate_pattern(pattern) is None
+    extractor = CodeExtractor([('manual', pattern), ('fallback', r'(\d{4})')])
+    assert extractor.match('订单1234 验证码482913') == ('482913', 'manual')
+
+def test_rule_unusable_in_combined_pattern_is_rejected():
+    assert validate_pattern(r'(?P<code>\d)(?P=code)\d{4}').startswith('规则无法用于提取')
+
+def test_scoped_rule_wins_and_disabling_reloads(routes_app):
+    index = new_index()
+    content = '订单1234 口令 5678'
+    with routes_app.app_context():
+        project = add_project()
+        rule = CodeRule(project_id=project.id, sender_prefix='106', pattern=r'口令\s*(\d{4})')
+        db.session.add(rule)
+        db.session.commit()
+        index.reload()
+
+        assert index.match(content, project_id=project.id, sender='10690001') == ('5678', f'manual:{rule.id}')
+        # 其他发送方不适用这条规则，交给通用提取引擎
+        assert index.extract(content, project_id=project.id, sender='95588') == '1234'
+
+        rule.enabled = False
+        db.session.commit()
+        assert index.reload() == 1
+        assert index.extract(content, project_id=project.id, sender='10690001') == '1234'
+
+def test_learns_template_after_min_support(routes_app):
+    index = new_index()
+    with routes_app.app_context():
+        project = add_project()
+        samples = [(f'编号{n}{n}{n}{n} 口令 {code}', code, project.id, '1069000')
+                   for n, code in ((1, '4821'), (2, '9930'))]
+
+        assert index.learn(samples[:1]) == 0
+        assert index.learn(samples[1:]) == 1
+
+        rule = CodeRule.query.one()
+        assert (rule.source, rule.sender_prefix, rule.support) == ('learned', '10690', 2)
+        assert index.extract('编号3333 口令 7070', project_id=project.id, sender='10690001') == '7070'
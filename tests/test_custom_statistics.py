@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import literal, select
+
+from app.models import db, PhoneRequest, SMS, Transaction
+from app.routes.statistics import statistics_bp
+from app.services.sql_dialect import stats_dialect, SQLiteStatsDialect
+from tests.factories import add_user, add_project, routes_token
+
+START = datetime(2024, 3, 1)
+
+@pytest.fixture
+def routes_app(make_routes_app):
+    return make_routes_app({statistics_bp: '/api/statistics'})
+
+@pytest.fixture
+def token(routes_app):
+    """两个项目的请求分布在 9 点和 14 点，3月3日的请求在区间之外"""
+    with routes_app.app_context():
+        user = add_user()
+        wechat = add_project(code='wechat', name='微信')
+        qq = add_project(code='qq', name='QQ')
+        for request_id, project, status, created_at, responses in (
+                ('r1', wechat, 'used', START + timedelta(hours=9), [30, 90]),
+                ('r2', wechat, 'expired', START + timedelta(hours=9, minutes=5), []),
+                ('r3', qq, 'completed', START + timedelta(hours=14), [60]),
+                ('r4', wechat, 'used', START + timedelta(days=2, hours=9), [10])):
+            phone_request = PhoneRequest(request_id=request_id, user_id=user.id, project_id=project.id,
+                                         phone_number='13800000000', status=status, created_at=created_at)
+            db.session.add(phone_request)
+            db.session.flush()
+            db.session.add_all([SMS(phone_request_id=phone_request.id, content='验证码',
+                                    received_at=created_at + timedelta(seconds=seconds)) for seconds in responses])
+        db.session.add_all([
+            Transaction(user_id=user.id, amount=-3.0, balance=0, type='consume', created_at=START + timedelta(hours=9)),
+            Transaction(user_id=user.id, amount=-5.0, balance=0, type='consume', created_at=START + timedelta(days=2)),
+        ])
+        db.session.commit()
+        return routes_token(routes_app, user.id)
+
+def custom(routes_app, token, **params):
+    query = '&'.join(f'{key}={value}' for key, value in dict(start_date='2024-03-01', end_date='2024-03-02',
+                                                            token=token, **params).items())
+    return routes_app.test_client().get(f'/api/statistics/custom?{query}')
+
+def test_all_metrics_from_two_queries(routes_app, token):
+    body = custom(routes_app, token).get_json()
+
+    metrics = body['metrics']
+    assert metrics['sms_count'] == {'total_requests': 3, 'received_sms': 3}
+    assert metrics['success_rate']['successful_requests'] == 2
+    assert metrics['avg_response_time']['seconds'] == 60.0
+    assert metrics['cost'] == {'total': 3.0, 'daily_average': 1.5}
+    assert sorted((item['code'], item['count']) for item in metrics['project_distribution']) == [('qq', 1), ('wechat', 2)]
+    assert (metrics['hourly_activity']['hours'][9], metrics['hourly_activity']['hours'][14]) == (2, 1)
+    assert metrics['hourly_activity']['peak_hour'] == 9
+    assert body['profile']['queries'] == 2
+
+def test_project_code_filters_request_metrics(routes_app, token):
+    metrics = custom(routes_app, token, project_code='qq', metrics='sms_count,project_distribution').get_json()['metrics']
+
+    assert metrics['sms_count']['total_requests'] == 1
+    assert [item['code'] for item in metrics['project_distribution']] == ['qq']
+
+def test_cost_only_skips_request_query(routes_app, token):
+    body = custom(routes_app, token, metrics='cost').get_json()
+
+    assert list(body['metrics']) == ['cost']
+    assert body['profile']['queries'] == 1
+
+def test_sqlite_expressions(routes_app):
+    with routes_app.app_context():
+        dialect = stats_dialect()
+        at = literal(datetime(2024, 3, 1, 14, 30))
+        hour, seconds = db.session.execute(select(
+            dialect.hour_of_day(at),
+            dialect.seconds_between(at, literal(datetime(2024, 3, 1, 14, 31, 15)))
+        )).one()
+
+    assert isinstance(dialect, SQLiteStatsDialect)
+    assert hour == 14
+    assert round(seconds, 3) == 75.0
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from app.services.event_bus import EventBus, event_bus
+from app.routes.numbers import numbers_bp
+from tests.factories import add_user, routes_token
+
+@pytest.fixture
+def bus():
+    """独立的事件总线实例（event_bus 是单例）"""
+    bus = object.__new__(EventBus)
+    bus._initialized = False
+    bus.__init__(history_size=5)
+    return bus
+
+def test_events_only_reach_that_users_subscribers(bus):
+    mine, _ = bus.subscribe(1)
+    other, _ = bus.subscribe(2)
+
+    bus.publish(1, 'sms', {'code': '1'})
+
+    assert mine.get(0).data == {'code': '1'}
+    assert other.get(0) is None
+
+def test_resume_replays_missed_events(bus):
+    first = bus.publish(1, 'sms', {'n': 1})
+    bus.publish(1, 'released', {'n': 2})
+    bus.publish(1, 'expired', {'n': 3})
+
+    subscription, resync = bus.subscribe(1, last_event_id=first.id)
+
+    assert resync is False
+    assert [subscription.get(0).type for _ in range(2)] == ['released', 'expired']
+
+def test_resume_past_evicted_history_asks_for_resync(bus):
+    first = bus.publish(1, 'sms', {'n': 0})
+    for n in range(1, 8):
+        bus.publish(1, 'sms', {'n': n})
+
+    subscription, resync = bus.subscribe(1, last_event_id=first.id)
+
+    assert resync is True
+    assert subscription.get(0).data == {'n': 3}
+
+def test_resume_after_restart_asks_for_resync(bus):
+    seen = bus.publish(1, 'sms', {'n': 0})
+    # 重启后的进程（或另一个进程）从头计数，序号更大的事件客户端并没有见过
+    restarted = object.__new__(EventBus)
+    restarted._initialized = False
+    restarted.__init__(history_size=5)
+    for n in range(1, 4):
+        restarted.publish(1, 'sms', {'n': n})
+
+    subscription, resync = restarted.subscribe(1, last_event_id=seen.id)
+
+    assert resync is True
+    assert subscription.get(0) is None
+
+@pytest.mark.parametrize('last_event_id', ['{epoch}-99', '{epoch}-x', '42'])
+def test_unknown_event_id_asks_for_resync(bus, last_event_id):
+    bus.publish(1, 'sms', {'n': 1})
+
+    subscription, resync = bus.subscribe(1, last_event_id=last_event_id.format(epoch=bus.epoch))
+
+    assert resync is True
+    assert subscription.get(0) is None
+
+def test_slow_subscriber_is_dropped(bus):
+    subscription, _ = bus.subscribe(1, max_buffer=2)
+    for n in range(3):
+        bus.publish(1, 'sms', {'n': n})
+
+    assert subscription.closed and subscription.close_reason == 'overflow'
+    assert bus.snapshot()['connections'] == 0
+    assert bus.stats['overflows'] == 1
+
+def test_stream_resumes_from_last_event_id(make_routes_app):
+    routes_app = make_routes_app({numbers_bp: '/api/numbers'}, SSE_MAX_DURATION=0.2, SSE_HEARTBEAT_SECONDS=0.05)
+    with routes_app.app_context():
+        user = add_user()
+        token = routes_token(routes_app, user.id)
+    seen = event_bus.publish(user.id, 'sms', {'code': 'old'})
+    missed = event_bus.publish(user.id, 'released', {'request_id': 'req_1'})
+
+    response = routes_app.test_client().get(f'/api/numbers/stream?token={token}',
+                                            headers={'Last-Event-ID': str(seen.id)})
+    body = response.get_data(as_text=True)
+
+    assert response.mimetype == 'text/event-stream'
+    assert f"id: {missed.id}\nevent: released\n" in body
+    assert 'old' not in body
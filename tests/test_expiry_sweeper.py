@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models import db, User, Transaction, PhoneNumber
+from app.routes.numbers import numbers_bp
+from app.services.expiry_sweeper import ExpirySweeper
+from tests.factories import add_user, add_project, routes_token
+
+class FailingRelease:
+    """上游释放总是失败的客户端"""
+    use_mock = False
+
+    def __init__(self):
+        self.calls = []
+
+    def release_phone_numbers(self, items):
+        self.calls.append([request_id for request_id, _ in items])
+        return [{'success': False}] * len(items)
+
+def new_sweeper(app):
+    """独立的清理器实例（expiry_sweeper 是单例），不启动清理线程"""
+    sweeper = object.__new__(ExpirySweeper)
+    sweeper._initialized = False
+    sweeper.__init__()
+    sweeper._app = app
+    return sweeper
+
+@pytest.fixture
+def routes_app(make_routes_app):
+    return make_routes_app({numbers_bp: '/api/numbers'}, EXPIRY_MAX_RELEASE_ATTEMPTS=2)
+
+def age_all_numbers():
+    db.session.execute(PhoneNumber.__table__.update().values(created_at=datetime.utcnow() - timedelta(hours=1)))
+    db.session.commit()
+
+def test_single_and_batch_numbers_are_refunded_once(routes_app):
+    with routes_app.app_context():
+        user = add_user(balance=10.0)
+        add_project(price=1.0)
+        token = routes_token(routes_app, user.id)
+    client = routes_app.test_client()
+
+    assert client.get(f'/api/numbers/get?project_code=wechat&token={token}').status_code == 200
+    assert client.get(f'/api/numbers/batch-get?project_code=wechat&count=3&token={token}').status_code == 200
+
+    sweeper = new_sweeper(routes_app)
+    with routes_app.app_context():
+        assert db.session.get(User, user.id).balance == pytest.approx(6.0)
+        age_all_numbers()
+
+        assert sweeper.sweep() == 4
+        # 已经超时的号码再清理一次也不会重复退款
+        PhoneNumber.query.update({'status': 'available'})
+        db.session.commit()
+        sweeper.sweep()
+
+        db.session.expire_all()
+        assert db.session.get(User, user.id).balance == pytest.approx(10.0)
+        refunds = Transaction.query.filter_by(type='refund').all()
+        assert sorted(row.amount for row in refunds) == [1.0] * 4
+        assert len({row.reference_id for row in refunds}) == 4
+
+def test_number_that_got_code_is_neither_released_nor_refunded(routes_app, monkeypatch):
+    from app.services.provider_router import provider_router
+
+    fake = FailingRelease()
+    monkeypatch.setattr(provider_router, 'client', lambda max_cost=None: fake)
+    with routes_app.app_context():
+        user = add_user(balance=10.0)
+        project = add_project()
+        db.session.add_all([
+            PhoneNumber(number='13800000001', status='available', project_id=project.id, user_id=user.id,
+                        request_id='req_late'),
+            PhoneNumber(number='13800000002', status='available', project_id=project.id, user_id=user.id,
+                        request_id='req_idle'),
+        ])
+        db.session.commit()
+        age_all_numbers()
+        rows = db.session.query(
+            PhoneNumber.id, PhoneNumber.request_id, PhoneNumber.upstream_request_id, PhoneNumber.user_id,
+            PhoneNumber.project_id, PhoneNumber.number, PhoneNumber.provider, PhoneNumber.created_at
+        ).order_by(PhoneNumber.id).all()
+        # 查询之后、标记之前收到了验证码
+        PhoneNumber.query.filter_by(request_id='req_late').update({'status': 'used', 'sms_code': '123456'})
+        db.session.commit()
+
+        sweeper = new_sweeper(routes_app)
+        assert sweeper.expire_batch(rows) == 1
+
+        assert fake.calls == [['req_idle']]
+        assert PhoneNumber.query.filter_by(request_id='req_late').one().status == 'used'
+        # 上游释放失败的号码下一轮重试，达到次数上限后放弃
+        sweeper.sweep()
+        assert fake.calls == [['req_idle'], ['req_idle']]
+        assert sweeper.snapshot()['pending_release_retries'] == 0
+
+@pytest.mark.parametrize('returning', [True, False])
+def test_number_expired_by_another_sweep_in_same_instant_is_not_claimed(routes_app, monkeypatch, returning):
+    from app.services import expiry_sweeper as expiry_sweeper_module
+    from app.services.provider_router import provider_router
+
+    now = datetime.utcnow()
+
+    class FrozenDatetime(datetime):
+        @classmethod
+        def utcnow(cls):
+            return now
+
+    monkeypatch.setattr(expiry_sweeper_module, 'datetime', FrozenDatetime)
+    fake = FailingRelease()
+    monkeypatch.setattr(provider_router, 'client', lambda max_cost=None: fake)
+    with routes_app.app_context():
+        monkeypatch.setattr(db.engine.dialect, 'update_returning', returning)
+        user = add_user()
+        project = add_project()
+        for request_id in ('req_ours', 'req_theirs'):
+            db.session.add(PhoneNumber(number='13800000000', status='available', project_id=project.id,
+                                       user_id=user.id, request_id=request_id))
+        db.session.commit()
+        rows = db.session.query(
+            PhoneNumber.id, PhoneNumber.request_id, PhoneNumber.upstream_request_id, PhoneNumber.user_id,
+            PhoneNumber.project_id, PhoneNumber.number, PhoneNumber.provider, PhoneNumber.created_at
+        ).order_by(PhoneNumber.id).all()
+        # 另一次清理在同一时刻已经标记了超时
+        PhoneNumber.query.filter_by(request_id='req_theirs').update(
+            {'status': 'expired', 'released_at': now, 'updated_at': now})
+        db.session.commit()
+
+        assert new_sweeper(routes_app).expire_batch(rows) == 1
+        assert fake.calls == [['req_ours']]
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import threading
+from datetime import datetime
+
+import pytest
+
+from app.models import db, PhoneNumber
+from app.routes.numbers import numbers_bp
+from app.routes.exports import exports_bp
+from app.services import export_jobs as export_jobs_module
+from app.services.export_jobs import export_jobs, ExportJobLimitError
+from tests.factories import add_user, add_project, routes_token
+
+@pytest.fixture
+def routes_app(make_routes_app):
+    return make_routes_app({numbers_bp: '/api/numbers', exports_bp: '/api/exports'},
+                           EXPORT_JOB_USE_PROCESSES=False, EXPORT_JOB_MAX_PER_USER=1)
+
+@pytest.fixture
+def user_id(routes_app):
+    with routes_app.app_context():
+        user = add_user()
+        project = add_project()
+        db.session.add_all([
+            PhoneNumber(number=f'1380000{n:04d}', status='available', project_id=project.id, user_id=user.id,
+                        request_id=f'req_{n}', created_at=datetime.now())
+            for n in range(30)
+        ])
+        db.session.commit()
+        return user.id
+
+@pytest.fixture
+def blocking_kind(monkeypatch):
+    """一直运行到被放行的导出类型，用于测试并发限制和取消"""
+    release = threading.Event()
+
+    def slow(user_id, params, export_format, compress, output, report):
+        output.write(b'partial')
+        while not release.wait(0.01):
+            report(1, 10)
+        return 1
+
+    monkeypatch.setitem(export_jobs_module.EXPORT_KINDS, 'slow', slow)
+    yield release
+    release.set()
+
+def wait_for(job_id, statuses=('completed', 'failed', 'cancelled'), timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = export_jobs.get(job_id)
+        if job['status'] in statuses:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f'导出任务 {job_id} 未在 {timeout} 秒内结束')
+
+def test_async_export_completes_and_supports_range(routes_app, user_id):
+    token = routes_token(routes_app, user_id)
+    client = routes_app.test_client()
+
+    submitted = client.get(f'/api/numbers/export?format=csv&async=true&token={token}')
+    assert submitted.status_code == 202
+    job_id = submitted.get_json()['job']['job_id']
+    wait_for(job_id)
+
+    status = client.get(f'/api/exports/{job_id}?token={token}').get_json()['job']
+    assert (status['status'], status['rows']) == ('completed', 30)
+    full = client.get(f'/api/exports/{job_id}/download?token={token}')
+    partial = client.get(f'/api/exports/{job_id}/download?token={token}', headers={'Range': 'bytes=3-12'})
+    assert partial.status_code == 206
+    assert partial.get_data() == full.get_data()[3:13]
+    # 其他用户看不到这个任务
+    other = routes_token(routes_app, user_id + 1)
+    assert client.get(f'/api/exports/{job_id}?token={other}').status_code == 404
+
+def test_per_user_limit_and_cancel_running_job(routes_app, user_id, blocking_kind):
+    with routes_app.app_context():
+        job = export_jobs.submit(user_id, 'slow', {}, 'csv')
+        wait_for(job['job_id'], statuses=('running',))
+        with pytest.raises(ExportJobLimitError):
+            export_jobs.submit(user_id, 'slow', {}, 'csv')
+
+        export_jobs.cancel(job['job_id'])
+        cancelled = wait_for(job['job_id'])
+
+    assert cancelled['status'] == 'cancelled'
+    spool_dir = routes_app.config['EXPORT_SPOOL_DIR']
+    assert not os.path.exists(os.path.join(spool_dir, f"{job['job_id']}.part"))
+    assert not os.path.exists(os.path.join(spool_dir, f"{job['job_id']}.data"))
+
+def test_cleanup_removes_expired_files(routes_app, user_id):
+    with routes_app.app_context():
+        job = export_jobs.submit(user_id, 'numbers', {'start_date': '2000-01-01', 'end_date': '2100-01-01'}, 'csv')
+    wait_for(job['job_id'])
+    routes_app.config['EXPORT_JOB_TTL'] = -1
+
+    assert export_jobs.cleanup() == 2
+    assert export_jobs.get(job['job_id']) is None
+
+def test_exports_route_is_registered(client):
+    assert client.get('/api/exports').status_code == 401
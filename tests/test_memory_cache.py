@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+import pytest
+
+from app.services.cache_service import MemoryCache
+from app.services.monitoring import metrics_collector
+
+@pytest.fixture
+def cache():
+    """单分段、不启动后台清理线程的缓存"""
+    return MemoryCache(max_entries=3, stripes=1, sweep_interval=0)
+
+def test_least_recently_used_entry_is_evicted(cache):
+    for key in ('a', 'b', 'c'):
+        cache.set(key, key.upper())
+    cache.get('a')
+
+    cache.set('d', 'D')
+
+    assert cache.get('b') is None
+    assert [cache.get(key) for key in ('a', 'c', 'd')] == ['A', 'C', 'D']
+    assert cache.stats()['evictions'] == 1
+
+def test_expired_entry_is_a_miss(cache, monkeypatch):
+    now = time.time()
+    cache.set('token', {'user_id': 1}, ttl=10)
+
+    assert cache.get('token') == {'user_id': 1}
+    monkeypatch.setattr(time, 'time', lambda: now + 11)
+    assert cache.get('token') is None
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['expired'], stats['entries']) == (1, 1, 1, 0)
+
+def test_write_drops_expired_oldest_entries(cache, monkeypatch):
+    now = time.time()
+    cache.set('old1', 1, ttl=1)
+    cache.set('old2', 2, ttl=1)
+    monkeypatch.setattr(time, 'time', lambda: now + 2)
+
+    cache.set('new', 3)
+
+    assert cache.stats()['entries'] == 1
+    assert cache.stats()['evictions'] == 0
+
+def test_sweep_removes_expired_entries_in_every_stripe(monkeypatch):
+    cache = MemoryCache(max_entries=1000, stripes=4, sweep_interval=0)
+    now = time.time()
+    for n in range(100):
+        cache.set(f'short{n}', n, ttl=1)
+        cache.set(f'long{n}', n, ttl=60)
+    monkeypatch.setattr(time, 'time', lambda: now + 2)
+
+    assert cache.sweep(batch=7) == 100
+    assert cache.stats()['entries'] == 100
+    assert cache.get('long5') == 5
+
+def test_overwrite_and_delete_keep_byte_count(cache):
+    cache.set('k', 'x' * 100)
+    cache.set('k', 'y')
+    cache.delete('k')
+    cache.delete('missing')
+
+    assert (cache.stats()['entries'], cache.stats()['bytes']) == (0, 0)
+
+def test_concurrent_writers_stay_within_capacity():
+    cache = MemoryCache(max_entries=64, stripes=8, sweep_interval=0)
+
+    def work(worker):
+        for n in range(2000):
+            cache.set((worker, n), n)
+            cache.get((worker, n - 1))
+
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = cache.stats()
+    assert stats['entries'] <= 64
+    assert stats['entries'] + stats['evictions'] == 8 * 2000
+
+def test_sweeper_thread_reports_stats():
+    cache = MemoryCache(max_entries=10, stripes=1, sweep_interval=0.01, name='test_sweeper')
+    try:
+        cache.set('k', 'v', ttl=0.001)
+        deadline = time.time() + 2
+        while time.time() < deadline:
+            reported = metrics_collector.get_metrics()['caches'].get('test_sweeper')
+            if reported and reported['expired']:
+                break
+            time.sleep(0.01)
+    finally:
+        cache.stop()
+
+    assert (reported['entries'], reported['expired'], reported['capacity']) == (0, 1, 10)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from sqlalchemy import create_engine, inspect, text
+
+from app import migrations
+
+def columns(engine, table):
+    return {item['name'] for item in inspect(engine).get_columns(table)}
+
+def indexes(engine, table):
+    return {item['name'] for item in inspect(engine).get_indexes(table)}
+
+def test_upgrade_is_recorded_and_idempotent(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'empty.db'}")
+
+    first = migrations.upgrade(engine)
+
+    assert first == [version for version, _, _ in migrations.MIGRATIONS]
+    assert migrations.upgrade(engine) == []
+    assert all(applied for _, _, applied in migrations.status(engine))
+
+def test_views_phone_numbers_gain_upstream_columns(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE phone_numbers (id INTEGER PRIMARY KEY, request_id VARCHAR(50), "
+            "number VARCHAR(20), message_count INTEGER)"
+        ))
+        conn.execute(text("INSERT INTO phone_numbers (request_id, number, message_count) VALUES ('r1', '138', 0)"))
+
+    migrations.upgrade(engine)
+
+    assert {'upstream_request_id', 'provider'} <= columns(engine, 'phone_numbers')
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT request_id FROM phone_numbers")).scalar() == 'r1'
+
+def test_routes_phone_numbers_gain_provider(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'routes.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE phone_numbers (id INTEGER PRIMARY KEY, number VARCHAR(20), status VARCHAR(20), "
+            "sms_code VARCHAR(20), request_id VARCHAR(100), created_at DATETIME)"
+        ))
+
+    migrations.upgrade(engine)
+
+    assert {'provider', 'upstream_request_id'} <= columns(engine, 'phone_numbers')
+    assert 'ix_phone_numbers_upstream_request_id' in indexes(engine, 'phone_numbers')
+
+def test_sms_deliveries_table_is_created(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'deliveries.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE phone_numbers (id INTEGER PRIMARY KEY, number VARCHAR(20))"))
+
+    migrations.upgrade(engine)
+
+    assert {'content_hash', 'request_id', 'phone_number_id'} <= columns(engine, 'sms_deliveries')
+    assert {'ix_sms_deliveries_request_id', 'ix_sms_deliveries_number'} <= indexes(engine, 'sms_deliveries')
+    assert inspect(engine).get_foreign_keys('sms_deliveries')[0]['referred_table'] == 'phone_numbers'
+
+def test_code_rules_table_is_created(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'rules.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE projects (id INTEGER PRIMARY KEY, code VARCHAR(50))"))
+
+    migrations.upgrade(engine)
+
+    assert {'ix_code_rules_scope', 'ix_code_rules_updated_at'} <= indexes(engine, 'code_rules')
+    assert inspect(engine).get_foreign_keys('code_rules')[0]['referred_table'] == 'projects'
+
+def test_sms_messages_gain_code_and_index(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'sms.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE sms_messages (id INTEGER PRIMARY KEY, phone_request_id INTEGER, "
+            "content TEXT, received_at DATETIME)"
+        ))
+
+    migrations.upgrade(engine)
+
+    assert 'code' in columns(engine, 'sms_messages')
+    assert 'ix_sms_messages_request_received' in indexes(engine, 'sms_messages')
+
+def test_expiry_index_and_job_leases(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'expiry.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE phone_numbers (id INTEGER PRIMARY KEY, number VARCHAR(20), status VARCHAR(20), "
+            "sms_code VARCHAR(20), request_id VARCHAR(100), created_at DATETIME)"
+        ))
+
+    migrations.upgrade(engine)
+
+    assert 'ix_phone_numbers_status_created' in indexes(engine, 'phone_numbers')
+    assert {'name', 'owner', 'expires_at', 'updated_at'} == columns(engine, 'job_leases')
+
+def test_phone_numbers_number_index(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'number.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE phone_numbers (id INTEGER PRIMARY KEY, number VARCHAR(20))"))
+
+    migrations.upgrade(engine)
+
+    assert 'ix_phone_numbers_number' in indexes(engine, 'phone_numbers')
+
+def test_stats_rollup_tables_are_created(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'stats.db'}")
+
+    migrations.upgrade(engine)
+
+    for table in ('stats_hourly', 'stats_daily'):
+        assert inspect(engine).get_pk_constraint(table)['constrained_columns'] == ['user_id', 'project_id', 'bucket']
+        assert f'ix_{table}_bucket' in indexes(engine, table)
+
+def test_statistics_range_indexes(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'ranges.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE transactions (id INTEGER PRIMARY KEY, user_id INTEGER, type VARCHAR(20), created_at DATETIME)"
+        ))
+        conn.execute(text("CREATE TABLE phone_requests (id INTEGER PRIMARY KEY, user_id INTEGER, created_at DATETIME)"))
+
+    migrations.upgrade(engine)
+
+    assert 'ix_transactions_user_type_created' in indexes(engine, 'transactions')
+    assert 'ix_phone_requests_user_created' in indexes(engine, 'phone_requests')
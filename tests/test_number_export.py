@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import csv
+import gzip
+import json
+from datetime import datetime
+
+import pytest
+
+from app.models import db, PhoneNumber
+from app.routes.numbers import numbers_bp
+from app.services.number_export import EXPORT_FIELDS, CHUNK_SIZE, encode_rows
+from tests.factories import add_user, add_project, routes_token
+
+@pytest.fixture
+def routes_app(make_routes_app):
+    return make_routes_app({numbers_bp: '/api/numbers'})
+
+@pytest.fixture
+def token(routes_app):
+    with routes_app.app_context():
+        user = add_user()
+        project = add_project(name='微信')
+        now = datetime.now()
+        db.session.add_all([
+            PhoneNumber(number=f'1380000{n:04d}', status='used' if n % 2 else 'available', project_id=project.id,
+                        user_id=user.id, request_id=f'req_{n}', sms_code='123456' if n % 2 else None,
+                        created_at=now)
+            for n in range(50)
+        ])
+        # 项目已被删除的号码
+        db.session.add(PhoneNumber(number='13900000000', status='available', project_id=9999, user_id=user.id,
+                                   request_id='req_orphan', created_at=now))
+        db.session.commit()
+        return routes_token(routes_app, user.id)
+
+def export(routes_app, token, **params):
+    query = '&'.join(f'{key}={value}' for key, value in params.items())
+    return routes_app.test_client().get(f'/api/numbers/export?token={token}&{query}')
+
+def test_csv_is_streamed_as_attachment(routes_app, token):
+    response = export(routes_app, token, format='csv')
+
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert 'attachment; filename=numbers_export_' in response.headers['Content-Disposition']
+    rows = list(csv.reader(io.StringIO(response.get_data().decode('utf-8-sig'))))
+    assert rows[0] == EXPORT_FIELDS
+    assert len(rows) == 52
+    by_request_id = {row[5]: row for row in rows[1:]}
+    assert by_request_id['req_1'][3:5] == ['微信', 'wechat']
+    assert by_request_id['req_orphan'][3] == '未知项目'
+
+def test_gzip_ndjson_and_json_formats(routes_app, token):
+    ndjson = export(routes_app, token, format='ndjson', compress='true')
+    assert ndjson.mimetype == 'application/gzip'
+    lines = gzip.decompress(ndjson.get_data()).decode('utf-8').splitlines()
+    assert len(lines) == 51 and json.loads(lines[0])['status'] in ('used', 'available')
+
+    items = json.loads(export(routes_app, token, format='json', status='used').get_data())
+    assert len(items) == 25 and all(item['sms_code'] == '123456' for item in items)
+
+def test_excel_export_opens(routes_app, token):
+    openpyxl = pytest.importorskip('openpyxl')
+
+    response = export(routes_app, token, format='excel')
+
+    sheet = openpyxl.load_workbook(io.BytesIO(response.get_data()), read_only=True)['numbers']
+    assert sum(1 for _ in sheet.iter_rows()) == 52
+
+def test_no_rows_and_bad_format(routes_app, token):
+    assert export(routes_app, token, format='csv', status='blacklisted').status_code == 404
+    assert export(routes_app, token, format='pdf').status_code == 400
+
+def test_encoder_yields_bounded_chunks():
+    rows = ((n, '13800000000', 'used', '微信', 'wechat', f'req_{n}', '', '', '', '') for n in range(20000))
+
+    chunks = list(encode_rows(rows, 'csv'))
+
+    assert len(chunks) > 5
+    assert max(len(chunk) for chunk in chunks) < CHUNK_SIZE * 2
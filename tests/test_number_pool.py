@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.services.number_pool import number_pool, PooledNumber
+
+class FakeUpstream:
+    """记录调用的上游客户端"""
+
+    def __init__(self):
+        self.acquired = 0
+        self.released = []
+
+    def get_phone_number(self, project_code):
+        self.acquired += 1
+        return {'success': True, 'provider': 'p1',
+                'phone_number': {'number': f'1380000{self.acquired:04d}', 'request_id': f'up{self.acquired}'}}
+
+    def get_phone_numbers(self, project_code, count):
+        return [self.get_phone_number(project_code) for _ in range(count)]
+
+    def release_phone_number(self, request_id, provider=None):
+        self.released.append((request_id, provider))
+        return {'success': True}
+
+def payload(request_id, number='13800000000', provider='p1'):
+    return {'success': True, 'provider': provider, 'phone_number': {'number': number, 'request_id': request_id}}
+
+@pytest.fixture
+def pool(app):
+    number_pool._pools = {}
+    number_pool._demand = {}
+    number_pool._app = app
+    for key in number_pool.stats:
+        number_pool.stats[key] = 0
+    yield number_pool
+    number_pool._pools = {}
+    number_pool._demand = {}
+    number_pool._app = None
+
+def test_acquire_prefers_pool_and_falls_back_to_upstream(pool):
+    upstream = FakeUpstream()
+    pool.restock('wechat', [payload('pooled')])
+
+    assert pool.acquire('wechat', upstream)['phone_number']['request_id'] == 'pooled'
+    assert pool.acquire('wechat', upstream)['phone_number']['request_id'] == 'up1'
+    assert pool.snapshot()['stats']['hits'] == 1
+    assert pool.snapshot()['stats']['misses'] == 1
+
+def test_expired_numbers_are_released_not_served(pool, app):
+    upstream = FakeUpstream()
+    pool.restock('wechat', [payload('stale')])
+    pool._pools['wechat'][0].pooled_at -= app.config['NUMBER_POOL_TTL'] + 1
+
+    result = pool.acquire('wechat', upstream)
+
+    assert result['phone_number']['request_id'] == 'up1'
+    assert upstream.released == [('stale', 'p1')]
+
+def test_refill_tops_up_to_high_watermark(pool, app):
+    upstream = FakeUpstream()
+    low, high = pool.watermarks('wechat')
+
+    assert pool.refill('wechat', upstream) == high
+    assert pool.size('wechat') == high
+    # 高于低水位时不补货
+    assert pool.refill('wechat', upstream) == 0
+
+def test_watermarks_scale_with_demand(pool, app):
+    base_low, base_high = pool.watermarks('wechat')
+    pool._demand['wechat'] = base_high * 60  # 每分钟 base_high 个
+
+    low, high = pool.watermarks('wechat')
+
+    assert high == min(base_high * app.config['NUMBER_POOL_COVERAGE_MINUTES'], app.config['NUMBER_POOL_MAX_SIZE'])
+    assert low > base_low
+
+def test_update_demand_reads_recent_numbers(pool, app):
+    from app.database import db
+    from app.models.project import Project
+    from app.models.number import PhoneNumber, NumberStatus
+
+    session = db.get_session()
+    project = Project(name='微信', code='wechat', price=1.0)
+    session.add(project)
+    session.flush()
+    now = datetime.utcnow()
+    for i in range(12):
+        session.add(PhoneNumber(request_id=f'r{i}', number='13800000000', project_id=project.id,
+                                status=NumberStatus.ACTIVE, created_at=now - timedelta(minutes=i)))
+    # 窗口之外的号码不计入
+    session.add(PhoneNumber(request_id='old', number='13800000000', project_id=project.id,
+                            status=NumberStatus.ACTIVE, created_at=now - timedelta(days=3)))
+    session.commit()
+    db.close_session()
+
+    demand = pool.update_demand()
+
+    assert set(demand) == {'wechat'}
+    assert 0 < demand['wechat'] <= 12
+    assert pool.size('wechat') == 0 and 'wechat' in pool._pools
+
+def _create_user_and_project(balance=10.0, price=1.0):
+    from app.database import db
+    from app.models.user import User
+    from app.models.project import Project
+
+    session = db.get_session()
+    user = User(username='alice', email='alice@example.com', balance=balance)
+    user.password = 'secret'
+    project = Project(name='微信', code='wechat', price=price)
+    session.add_all([user, project])
+    session.commit()
+    ids = user.id, project.id
+    db.close_session()
+    return ids
+
+def test_get_number_keeps_upstream_request_id_and_provider(pool, client, make_token):
+    from app.database import db
+    from app.models.number import PhoneNumber
+
+    user_id, project_id = _create_user_and_project()
+    pool.restock('wechat', [payload('upstream-1', number='13912345678', provider='p2')])
+
+    response = client.get(f'/api/numbers/get?project_id={project_id}',
+                          headers={'Authorization': f'Bearer {make_token(user_id)}'})
+
+    assert response.status_code == 200
+    assert response.get_json()['number']['number'] == '13912345678'
+    row = db.get_session().query(PhoneNumber).one()
+    assert (row.upstream_request_id, row.provider) == ('upstream-1', 'p2')
+    db.close_session()
+
+def test_get_number_without_upstream_number_fails(pool, client, make_token, monkeypatch):
+    released = []
+    monkeypatch.setattr(pool, 'release', lambda code, payloads, api_client=None: released.extend(payloads))
+    user_id, project_id = _create_user_and_project()
+    pool.restock('wechat', [{'success': True, 'phone_number': {'request_id': 'no-number'}}])
+
+    response = client.get(f'/api/numbers/get?project_id={project_id}',
+                          headers={'Authorization': f'Bearer {make_token(user_id)}'})
+
+    assert response.status_code == 503
+    assert [item['phone_number']['request_id'] for item in released] == ['no-number']
+    assert pool.size('wechat') == 0
+
+def test_get_number_returns_number_to_pool_on_database_error(pool, client, make_token, monkeypatch):
+    import app.views.number as number_views
+
+    def broken_debit(*args, **kwargs):
+        raise SQLAlchemyError('database is down')
+
+    monkeypatch.setattr(number_views, 'conditional_debit', broken_debit)
+    user_id, project_id = _create_user_and_project()
+    pool.restock('wechat', [payload('upstream-1')])
+
+    response = client.get(f'/api/numbers/get?project_id={project_id}',
+                          headers={'Authorization': f'Bearer {make_token(user_id)}'})
+
+    assert response.status_code == 500
+    assert pool.size('wechat') == 1
+    assert isinstance(pool._pools['wechat'][0], PooledNumber)
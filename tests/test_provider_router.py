@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from app.mock_api import MockUpstreamServer
+from app.services.provider_router import provider_router, DEFAULT_PROVIDER
+
+@pytest.fixture
+def upstreams():
+    servers = [MockUpstreamServer().start(), MockUpstreamServer(failure_rate=1.0).start()]
+    yield servers
+    for server in servers:
+        server.stop()
+
+@pytest.fixture
+def routes_app(make_routes_app, upstreams):
+    good, bad = upstreams
+    return make_routes_app(
+        USE_MOCK_API=False,
+        SMS_API_MAX_RETRIES=0,
+        SMS_PROVIDER_EXPLORE_RATE=0,
+        SMS_API_PROVIDERS=[
+            {'name': 'bad', 'base_url': bad.base_url, 'weight': 10.0},
+            {'name': 'good', 'base_url': good.base_url, 'weight': 1.0,
+             'prices': {'wechat_login': 0.5}},
+        ]
+    )
+
+def test_fails_over_to_next_provider(routes_app, upstreams):
+    good, bad = upstreams
+    with routes_app.app_context():
+        result = provider_router.client().get_phone_number('wechat_login')
+
+    assert result['success'] is True
+    assert result['provider'] == 'good'
+    assert bad.request_count == 1 and good.request_count == 1
+
+def test_max_cost_skips_expensive_providers(routes_app):
+    with routes_app.app_context():
+        ranked = provider_router.rank('wechat_login', max_cost=0.4)
+
+    assert [provider.name for provider in ranked] == ['bad']
+
+def test_clients_are_cached_per_provider(routes_app):
+    with routes_app.app_context():
+        first = provider_router.client()
+        second = provider_router.client()
+
+    assert first.clients['good'] is second.clients['good']
+    assert first.clients['bad'] is not first.clients['good']
+
+def test_get_phone_numbers_without_provider_returns_distinct_failures(make_routes_app):
+    routes_app = make_routes_app(SMS_API_PROVIDERS=[{'name': 'p1', 'base_url': 'http://p1.test', 'projects': {}}])
+    with routes_app.app_context():
+        results = provider_router.client().get_phone_numbers('wechat_login', 3)
+
+    assert len(results) == 3
+    assert all(result['success'] is False for result in results)
+    results[0]['message'] = 'changed'
+    assert results[1]['message'] != 'changed'
+
+def test_default_provider_without_config(make_routes_app):
+    routes_app = make_routes_app()
+    with routes_app.app_context():
+        client = provider_router.client()
+
+    assert list(client.clients) == [DEFAULT_PROVIDER]
+
+def test_batch_failover_respects_backup_in_flight_limit(make_routes_app, upstreams):
+    good, bad = upstreams
+    # 新的平台名，不受其他用例留下的得分影响，首选平台总是 flaky
+    routes_app = make_routes_app(
+        USE_MOCK_API=False,
+        SMS_API_MAX_RETRIES=0,
+        SMS_PROVIDER_EXPLORE_RATE=0,
+        SMS_API_PROVIDERS=[
+            {'name': 'flaky', 'base_url': bad.base_url, 'weight': 10.0},
+            {'name': 'backup', 'base_url': good.base_url, 'weight': 1.0},
+        ]
+    )
+    with routes_app.app_context():
+        client = provider_router.client()
+        backup = client._in_flight_limit('backup')
+        held = 0
+        while backup.acquire(blocking=False):
+            held += 1
+
+        # 备用平台名额已满，切换时跳过它
+        saturated = client.get_phone_numbers('wechat_login', 2)
+        for _ in range(held):
+            backup.release()
+        recovered = client.get_phone_numbers('wechat_login', 2)
+
+    assert [result['success'] for result in saturated] == [False, False]
+    assert [result['provider'] for result in recovered] == ['backup', 'backup']
+    assert good.request_count == 2
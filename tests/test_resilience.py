@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from app.services.resilience import CircuitBreaker, CircuitOpenError, deadline, remaining_time, get_breaker
+from app.services.number_pool import number_pool
+from app.routes.numbers import numbers_bp
+from tests.factories import add_user, add_project, routes_token
+
+def test_breaker_opens_and_allows_one_trial_after_cooldown():
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    breaker.opened_at -= 31
+    breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # 试探请求还没有结果时其他调用仍被拒绝
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+def test_deadline_nests_to_earliest():
+    assert remaining_time() is None
+    with deadline(10):
+        with deadline(1):
+            assert remaining_time() <= 1
+        assert 1 < remaining_time() <= 10
+
+def test_expired_deadline_does_not_take_half_open_trial(app):
+    from app.utils import SMSApiClient
+
+    with app.app_context():
+        client = SMSApiClient(base_url='http://deadline.test', api_key='k')
+    breaker = get_breaker('http://deadline.test:check_balance', client.breaker_threshold, client.breaker_reset_timeout)
+    for _ in range(client.breaker_threshold):
+        breaker.record_failure()
+    breaker.opened_at -= client.breaker_reset_timeout + 1
+
+    with deadline(0):
+        result = client._request('check_balance', 'GET', '/account/balance')
+
+    assert result['success'] is False
+    # 半开试探名额没有被占用
+    breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+@pytest.fixture
+def routes_app(make_routes_app):
+    return make_routes_app({numbers_bp: '/api/numbers'}, UPSTREAM_REQUEST_DEADLINE=7)
+
+def _login(routes_app):
+    with routes_app.app_context():
+        user = add_user(balance=10.0)
+        add_project()
+        return routes_token(routes_app, user.id)
+
+def test_get_number_runs_under_request_deadline(routes_app, monkeypatch):
+    seen = []
+
+    def acquire(project_code, api_client=None):
+        seen.append(remaining_time())
+        return {'success': False, 'message': '无号'}
+
+    monkeypatch.setattr(number_pool, 'acquire', acquire)
+    token = _login(routes_app)
+
+    routes_app.test_client().get(f'/api/numbers/get?project_code=wechat&token={token}')
+
+    assert seen and 6 < seen[0] <= 7
+
+def test_open_breaker_returns_503_with_retry_after(routes_app, monkeypatch):
+    def acquire(project_code, api_client=None):
+        raise CircuitOpenError('upstream', 12)
+
+    monkeypatch.setattr(number_pool, 'acquire', acquire)
+    token = _login(routes_app)
+
+    response = routes_app.test_client().get(f'/api/numbers/get?project_code=wechat&token={token}')
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '12'
+
+def test_views_get_number_returns_503_when_breaker_open(client, make_token, monkeypatch):
+    from app.database import db
+    from app.models.user import User
+    from app.models.project import Project
+
+    session = db.get_session()
+    user = User(username='bob', email='bob@example.com', balance=10.0)
+    user.password = 'secret'
+    project = Project(name='微信', code='wechat', price=1.0)
+    session.add_all([user, project])
+    session.commit()
+    user_id, project_id = user.id, project.id
+    db.close_session()
+
+    def acquire(project_code, api_client=None):
+        raise CircuitOpenError('upstream', 3)
+
+    monkeypatch.setattr(number_pool, 'acquire', acquire)
+
+    response = client.get(f'/api/numbers/get?project_id={project_id}',
+                          headers={'Authorization': f'Bearer {make_token(user_id)}'})
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '3'
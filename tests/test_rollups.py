@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models import db, PhoneNumber, StatsHourly, StatsDaily
+from app.routes.numbers import numbers_bp
+from app.routes.statistics import statistics_bp
+from app.services import rollups
+from app.services.sms_ingest import SmsIngestBatcher, parse_delivery
+from app.services.expiry_sweeper import ExpirySweeper
+from tests.factories import add_user, add_project, routes_token
+
+@pytest.fixture
+def routes_app(make_routes_app):
+    return make_routes_app({numbers_bp: '/api/numbers', statistics_bp: '/api/statistics'},
+                           USE_MOCK_API=True)
+
+def new_instance(cls, app):
+    instance = object.__new__(cls)
+    instance._initialized = False
+    instance.__init__()
+    instance._app = app
+    return instance
+
+def test_events_in_same_bucket_are_merged(routes_app):
+    at = datetime(2024, 5, 1, 10, 30)
+    with routes_app.app_context():
+        rollups.record_many([
+            {'user_id': 1, 'project_id': 2, 'at': at, 'numbers': 1, 'spend': 1.5},
+            {'user_id': 1, 'project_id': 2, 'at': at + timedelta(minutes=20), 'numbers': 2, 'spend': 3.0},
+            {'user_id': 1, 'project_id': None, 'at': at, 'numbers': 5},
+        ])
+        rollups.record(1, 2, at=at + timedelta(hours=1), successes=1)
+        db.session.commit()
+
+        hourly = [(row.bucket.hour, row.numbers, row.successes) for row in StatsHourly.query.order_by(StatsHourly.bucket)]
+        daily = StatsDaily.query.one()
+        assert hourly == [(10, 3, 0), (11, 0, 1)]
+        assert (daily.numbers, daily.successes, daily.spend) == (3, 1, 4.5)
+
+def test_statistics_follow_acquisition_codes_and_refunds(routes_app):
+    with routes_app.app_context():
+        user = add_user(balance=10.0)
+        project = add_project(price=2.0)
+        token = routes_token(routes_app, user.id)
+    client = routes_app.test_client()
+    client.get(f'/api/numbers/batch-get?project_code=wechat&count=3&token={token}')
+
+    with routes_app.app_context():
+        first, second, third = PhoneNumber.query.order_by(PhoneNumber.id).all()
+        # 推送写入验证码
+        delivery, _ = parse_delivery('default', {'request_id': first.request_id, 'content': '验证码 123456', 'code': '123456'})
+        new_instance(SmsIngestBatcher, routes_app).persist([delivery])
+        db.session.execute(PhoneNumber.__table__.update().values(created_at=datetime.utcnow() - timedelta(hours=1)))
+        db.session.commit()
+        new_instance(ExpirySweeper, routes_app).sweep()
+
+    stats = client.get(f'/api/statistics?type=daily&token={token}').get_json()['statistics']['statistics']
+
+    assert [(row['count'], row['success']) for row in stats['phone_usage']] == [(3, 1)]
+    assert [(row['amount'], row['refund']) for row in stats['spending']] == [(6.0, 4.0)]
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import hmac
+import json
+import queue
+import hashlib
+from datetime import datetime
+
+import pytest
+from flask import Flask
+
+from app.models import db, PhoneNumber, SmsDelivery
+from app.routes.webhooks import webhooks_bp
+from app.services import sms_ingest as sms_ingest_module
+from app.services.sms_ingest import SmsIngestBatcher, sms_ingest, parse_delivery
+from tests.factories import add_user, add_project
+
+SECRET = 'webhook-secret'
+
+def new_batcher(app):
+    """独立的批处理器实例（sms_ingest 是单例），不启动写库线程"""
+    batcher = object.__new__(SmsIngestBatcher)
+    batcher._initialized = False
+    batcher.__init__()
+    batcher._app = app
+    batcher._queue = queue.Queue()
+    return batcher
+
+def sign(body):
+    return 'sha256=' + hmac.new(SECRET.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+@pytest.fixture
+def routes_app(make_routes_app):
+    return make_routes_app({webhooks_bp: '/api/webhooks'}, SMS_WEBHOOK_SECRETS={'default': SECRET},
+                           SMS_INGEST_FLUSH_INTERVAL=0.01, SMS_INGEST_MAX_ATTEMPTS=1)
+
+def add_phone(request_id, status='available', upstream_request_id=None):
+    user = add_user()
+    project = add_project(code=f'p_{request_id}')
+    db.session.add(PhoneNumber(number='13800000000', status=status, project_id=project.id,
+                               user_id=user.id, request_id=request_id, upstream_request_id=upstream_request_id))
+    db.session.commit()
+
+def delivery(request_id, code='123456'):
+    parsed, error = parse_delivery('default', {'request_id': request_id, 'content': f'验证码{code}', 'code': code})
+    assert error is None
+    return parsed
+
+def test_signed_webhook_writes_code(routes_app):
+    with routes_app.app_context():
+        add_phone('req_push')
+    body = json.dumps({'request_id': 'req_push', 'content': '您的验证码是 482913', 'code': '482913'}).encode('utf-8')
+
+    response = routes_app.test_client().post('/api/webhooks/sms', data=body, content_type='application/json',
+                                             headers={'X-Signature': sign(body)})
+    sms_ingest.flush()
+
+    assert response.status_code == 202
+    assert response.get_json()['accepted'] == 1
+    with routes_app.app_context():
+        phone = PhoneNumber.query.filter_by(request_id='req_push').one()
+        assert (phone.status, phone.sms_code) == ('used', '482913')
+
+def test_released_number_is_not_flipped_back_to_used(routes_app):
+    batcher = new_batcher(routes_app)
+    with routes_app.app_context():
+        add_phone('req_released', status='released')
+
+        arrived = batcher.persist([delivery('req_released')])
+
+        phone = PhoneNumber.query.filter_by(request_id='req_released').one()
+        assert arrived == []
+        assert (phone.status, phone.sms_code) == ('released', None)
+        # 推送本身仍然记录下来
+        assert SmsDelivery.query.count() == 1
+
+def test_push_matches_by_upstream_request_id(routes_app):
+    batcher = new_batcher(routes_app)
+    with routes_app.app_context():
+        add_phone('req_local', upstream_request_id='up_push')
+
+        # 上游推送的是它自己的请求ID，本地请求ID不会误匹配
+        arrived = batcher.persist([delivery('up_push'), delivery('req_local', code='111111')])
+
+        phone = PhoneNumber.query.filter_by(request_id='req_local').one()
+        assert [item['request_id'] for _, item in arrived] == ['req_local']
+        assert phone.sms_code == '123456'
+
+@pytest.mark.parametrize('returning', [True, False])
+def test_code_written_by_another_writer_in_same_instant_is_not_claimed(routes_app, monkeypatch, returning):
+    now = datetime.utcnow()
+
+    class FrozenDatetime(datetime):
+        @classmethod
+        def utcnow(cls):
+            return now
+
+    monkeypatch.setattr(sms_ingest_module, 'datetime', FrozenDatetime)
+    batcher = new_batcher(routes_app)
+    with routes_app.app_context():
+        monkeypatch.setattr(db.engine.dialect, 'update_returning', returning)
+        add_phone('req_ours')
+        add_phone('req_theirs')
+        # 另一个写入者在同一时刻写入了验证码
+        PhoneNumber.query.filter_by(request_id='req_theirs').update(
+            {'status': 'used', 'sms_code': '999999', 'updated_at': now})
+        db.session.commit()
+
+        arrived = batcher.persist([delivery('req_ours'), delivery('req_theirs'), delivery('req_ours', code='654321')])
+
+        codes = dict(db.session.query(PhoneNumber.request_id, PhoneNumber.sms_code))
+        assert [phone['request_id'] for _, phone in arrived] == ['req_ours']
+        assert codes == {'req_ours': '123456', 'req_theirs': '999999'}
+
+def test_failed_batch_is_spooled_and_replayed(routes_app, monkeypatch):
+    batcher = new_batcher(routes_app)
+    with routes_app.app_context():
+        add_phone('req_spool')
+    batch = [delivery('req_spool')]
+
+    def fail(batch):
+        raise RuntimeError('数据库不可用')
+
+    monkeypatch.setattr(batcher, 'persist', fail)
+    assert batcher._persist_with_retry(batch, attempts=1) is None
+    path = batcher.spool(batch)
+    # 数据库仍不可用时文件保留，等下次重放
+    assert batcher.replay_spool() == 0
+    assert os.path.exists(path)
+
+    monkeypatch.undo()
+    assert batcher.replay_spool() == 1
+    assert not os.listdir(routes_app.config['SMS_INGEST_SPOOL_DIR'])
+    with routes_app.app_context():
+        assert PhoneNumber.query.filter_by(request_id='req_spool').one().sms_code == '123456'
+
+def test_stop_spools_queued_deliveries(routes_app):
+    batcher = new_batcher(routes_app)
+    batcher._queue.put_nowait(delivery('req_queued'))
+
+    batcher.stop()
+
+    names = os.listdir(routes_app.config['SMS_INGEST_SPOOL_DIR'])
+    assert len(names) == 1 and names[0].endswith('.ndjson')
+    assert batcher.stats['spooled'] == 1
+
+def test_create_app_does_not_accept_pushes_it_cannot_store(client):
+    body = json.dumps({'request_id': 'req_views', 'content': '验证码 123456'}).encode('utf-8')
+    received = sms_ingest.stats['received']
+
+    response = client.post('/api/webhooks/sms', data=body, content_type='application/json',
+                           headers={'X-Signature': sign(body)})
+
+    # create_app 的数据库里没有推送相关的表，回调不注册，而不是应答202后转存
+    assert response.status_code == 404
+    assert sms_ingest.stats['received'] == received
+
+def test_registering_without_database_fails_at_startup():
+    app = Flask(__name__)
+
+    with pytest.raises(RuntimeError):
+        app.register_blueprint(webhooks_bp, url_prefix='/api/webhooks')
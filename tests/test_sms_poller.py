@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+
+import pytest
+
+from app.models import db, PhoneNumber
+from app.services import sms_poller as sms_poller_module
+from app.services.sms_poller import SmsPoller
+from app.services.event_bus import event_bus
+from tests.factories import add_user, add_project
+
+class FakeRoutedClient:
+    """返回固定结果的上游客户端"""
+    base_url = 'http://poller.test'
+    max_in_flight = 4
+
+    def __init__(self, result, use_mock=False):
+        self.result = result
+        self.use_mock = use_mock
+        self.request_ids = []
+
+    def client_for(self, provider=None):
+        return self
+
+    def get_sms_code(self, request_id, provider=None):
+        self.request_ids.append(request_id)
+        return self.result
+
+def new_poller(app):
+    """独立的轮询器实例（sms_poller 是单例），不启动调度线程"""
+    poller = object.__new__(SmsPoller)
+    poller._initialized = False
+    poller.__init__()
+    poller._app = app
+    poller._running = True
+    return poller
+
+@pytest.fixture
+def routes_app(make_routes_app):
+    return make_routes_app(USE_MOCK_API=True)
+
+def add_phone(request_id, status='available', upstream_request_id=None):
+    user = add_user()
+    project = add_project(code=f'p_{request_id}')
+    phone = PhoneNumber(number='13800000000', status=status, project_id=project.id, user_id=user.id,
+                        request_id=request_id, upstream_request_id=upstream_request_id, created_at=datetime.utcnow())
+    db.session.add(phone)
+    db.session.commit()
+    return phone
+
+def test_tracks_numbers_with_mock_api(routes_app):
+    poller = new_poller(routes_app)
+    with routes_app.app_context():
+        phone = add_phone('req_mock')
+
+        assert poller.track(phone) is True
+        stored = poller.poll_batch(list(poller._tracked.values()), FakeRoutedClient({'success': False}, use_mock=True))
+
+        assert stored == 1
+        db.session.expire_all()
+        phone = PhoneNumber.query.filter_by(request_id='req_mock').one()
+        assert phone.status == 'used' and len(phone.sms_code) == 6
+    assert not poller.is_tracking('req_mock')
+
+def test_released_number_is_not_flipped_back_to_used(routes_app):
+    poller = new_poller(routes_app)
+    with routes_app.app_context():
+        phone = add_phone('req_released')
+        poller.track(phone)
+        user_id = phone.user_id
+        db.session.execute(PhoneNumber.__table__.update().values(status='released'))
+        db.session.commit()
+        subscription, _ = event_bus.subscribe(user_id)
+
+        stored = poller.poll_batch(list(poller._tracked.values()), FakeRoutedClient({'success': True, 'code': '123456'}))
+
+        db.session.expire_all()
+        phone = PhoneNumber.query.filter_by(request_id='req_released').one()
+        assert stored == 0
+        assert (phone.status, phone.sms_code) == ('released', None)
+        assert subscription.get(0) is None
+        event_bus.unsubscribe(subscription)
+    assert not poller.is_tracking('req_released')
+
+@pytest.mark.parametrize('returning', [True, False])
+def test_code_written_by_another_writer_in_same_instant_is_not_claimed(routes_app, monkeypatch, returning):
+    now = datetime.utcnow()
+
+    class FrozenDatetime(datetime):
+        @classmethod
+        def utcnow(cls):
+            return now
+
+    monkeypatch.setattr(sms_poller_module, 'datetime', FrozenDatetime)
+    poller = new_poller(routes_app)
+    with routes_app.app_context():
+        monkeypatch.setattr(db.engine.dialect, 'update_returning', returning)
+        poller.track(add_phone('req_ours'))
+        poller.track(add_phone('req_theirs'))
+        # 另一个写入者在同一时刻写入了验证码
+        PhoneNumber.query.filter_by(request_id='req_theirs').update(
+            {'status': 'used', 'sms_code': '999999', 'updated_at': now})
+        db.session.commit()
+
+        stored = poller.poll_batch(list(poller._tracked.values()), FakeRoutedClient({'success': True, 'code': '123456'}))
+
+        db.session.expire_all()
+        codes = dict(db.session.query(PhoneNumber.request_id, PhoneNumber.sms_code))
+        assert stored == 1
+        assert codes == {'req_ours': '123456', 'req_theirs': '999999'}
+
+def test_in_flight_limit_follows_each_numbers_provider(routes_app, monkeypatch):
+    from app import utils
+
+    class Client(FakeRoutedClient):
+        def __init__(self, base_url):
+            super().__init__({'success': False})
+            self.base_url = base_url
+
+    class TwoProviders(FakeRoutedClient):
+        clients = {'alpha': Client('http://alpha.test'), 'beta': Client('http://beta.test')}
+
+        def client_for(self, provider=None):
+            return self.clients[provider]
+
+    limited = []
+    real_limit = utils.get_in_flight_limit
+    monkeypatch.setattr(utils, 'get_in_flight_limit',
+                        lambda base_url, max_in_flight: limited.append(base_url) or real_limit(base_url, max_in_flight))
+    poller = new_poller(routes_app)
+    with routes_app.app_context():
+        for request_id, provider in (('req_alpha', 'alpha'), ('req_beta', 'beta')):
+            phone = add_phone(request_id)
+            phone.provider = provider
+            poller.track(phone)
+
+        poller.poll_batch(list(poller._tracked.values()), TwoProviders({'success': False}))
+
+    assert sorted(limited) == ['http://alpha.test', 'http://beta.test']
+
+def test_only_lease_holder_recovers_waiting_numbers(routes_app):
+    first, second = new_poller(routes_app), new_poller(routes_app)
+    with routes_app.app_context():
+        add_phone('req_orphan')
+
+    first._check_lease()
+    second._check_lease()
+
+    assert first._holding and first.is_tracking('req_orphan')
+    assert not second._holding and not second.is_tracking('req_orphan')
+
+    # 持有者停止后释放租约，其他进程下一次检查时接管
+    first.stop()
+    second._lease_checked_at = float('-inf')
+    second._check_lease()
+    assert second._holding and second.is_tracking('req_orphan')
+
+def test_polls_upstream_with_its_own_request_id(routes_app):
+    poller = new_poller(routes_app)
+    with routes_app.app_context():
+        poller.track(add_phone('req_local', upstream_request_id='up_poll'))
+        fake = FakeRoutedClient({'success': True, 'code': '123456'})
+
+        assert poller.poll_batch(list(poller._tracked.values()), fake) == 1
+        assert fake.request_ids == ['up_poll']
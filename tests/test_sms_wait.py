@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+
+import pytest
+
+from app.models import db, PhoneNumber
+from app.routes.numbers import numbers_bp
+from app.services.sms_poller import sms_poller
+from app.services.sms_waiter import sms_waiter
+from app.services.provider_router import provider_router
+from tests.factories import add_user, add_project, routes_token
+
+class FakeRoutedClient:
+    """依次返回给定结果的上游客户端"""
+    use_mock = False
+
+    def __init__(self, results):
+        self.results = list(results)
+        self.calls = 0
+        self.request_ids = []
+
+    def get_sms_code(self, request_id, provider=None):
+        self.calls += 1
+        self.request_ids.append(request_id)
+        return self.results.pop(0) if len(self.results) > 1 else self.results[0]
+
+@pytest.fixture(autouse=True)
+def _clear_waiter():
+    sms_waiter._recent.clear()
+    yield
+    sms_waiter._recent.clear()
+
+@pytest.fixture
+def routes_app(make_routes_app):
+    return make_routes_app({numbers_bp: '/api/numbers'}, SMS_WAIT_POLL_INTERVAL=0.02)
+
+@pytest.fixture
+def phone(routes_app):
+    with routes_app.app_context():
+        user = add_user()
+        project = add_project()
+        db.session.add(PhoneNumber(number='13800000000', status='available', project_id=project.id,
+                                   user_id=user.id, request_id='req_wait', upstream_request_id='up_wait'))
+        db.session.commit()
+        return routes_token(routes_app, user.id)
+
+def test_immediate_code_includes_release_url(routes_app, phone, monkeypatch):
+    fake = FakeRoutedClient([{'success': True, 'code': '123456'}])
+    monkeypatch.setattr(provider_router, 'client', lambda max_cost=None: fake)
+
+    response = routes_app.test_client().get(f'/api/numbers/sms/req_wait?token={phone}')
+
+    body = response.get_json()
+    assert response.status_code == 200
+    assert body['code'] == '123456'
+    # 上游按它自己的请求ID查询
+    assert fake.request_ids == ['up_wait']
+    assert body['release_url'].endswith(f'/api/numbers/release/req_wait?token={phone}')
+
+def test_wait_returns_code_through_same_response(routes_app, phone, monkeypatch):
+    fake = FakeRoutedClient([{'success': False, 'message': '暂无'}, {'success': True, 'code': '654321'}])
+    monkeypatch.setattr(provider_router, 'client', lambda max_cost=None: fake)
+
+    response = routes_app.test_client().get(f'/api/numbers/sms/req_wait?wait=2&token={phone}')
+
+    body = response.get_json()
+    assert response.status_code == 200
+    assert body['code'] == '654321'
+    assert 'release_url' in body
+    assert fake.calls == 2
+
+def test_wait_timeout_keeps_release_url(routes_app, phone, monkeypatch):
+    monkeypatch.setattr(provider_router, 'client', lambda max_cost=None: FakeRoutedClient([{'success': False, 'message': '暂无'}]))
+
+    response = routes_app.test_client().get(f'/api/numbers/sms/req_wait?wait=0.1&token={phone}')
+
+    assert response.status_code == 400
+    assert response.get_json()['release_url'].endswith(f'/api/numbers/release/req_wait?token={phone}')
+
+def test_tracked_number_waits_for_published_code(routes_app, phone, monkeypatch):
+    monkeypatch.setattr(sms_poller, 'is_tracking', lambda request_id: True)
+
+    def deliver():
+        with routes_app.app_context():
+            db.session.execute(PhoneNumber.__table__.update().values(sms_code='777777', status='used'))
+            db.session.commit()
+        sms_waiter.publish('req_wait', {'success': True, 'code': '777777'})
+
+    timer = threading.Timer(0.1, deliver)
+    timer.start()
+    response = routes_app.test_client().get(f'/api/numbers/sms/req_wait?wait=2&token={phone}')
+    timer.join()
+
+    body = response.get_json()
+    assert response.status_code == 200
+    assert body['code'] == '777777'
+    assert 'release_url' in body
+
+def test_tracked_number_pending_keeps_release_url(routes_app, phone, monkeypatch):
+    monkeypatch.setattr(sms_poller, 'is_tracking', lambda request_id: True)
+
+    response = routes_app.test_client().get(f'/api/numbers/sms/req_wait?token={phone}')
+
+    assert response.status_code == 400
+    assert 'release_url' in response.get_json()
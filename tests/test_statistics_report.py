@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app.models import db, PhoneRequest, SMS, Transaction
+from app.routes.statistics import statistics_bp, build_statistics_report
+from tests.factories import add_user, add_project, routes_token
+
+START = datetime(2024, 3, 1)
+
+@pytest.fixture
+def routes_app(make_routes_app):
+    return make_routes_app({statistics_bp: '/api/statistics'})
+
+def add_request(user_id, project_id, request_id, status, created_at, response_seconds=None):
+    phone_request = PhoneRequest(request_id=request_id, user_id=user_id, project_id=project_id,
+                                 phone_number='13800000000', status=status, created_at=created_at)
+    db.session.add(phone_request)
+    db.session.flush()
+    if response_seconds is not None:
+        db.session.add(SMS(phone_request_id=phone_request.id, content='验证码',
+                           received_at=created_at + timedelta(seconds=response_seconds)))
+
+@pytest.fixture
+def history(routes_app):
+    """3月1日两个项目各有请求，3月3日一个请求，3月2日没有数据"""
+    with routes_app.app_context():
+        user = add_user()
+        other = add_user()
+        wechat = add_project(code='wechat', name='微信')
+        qq = add_project(code='qq', name='QQ')
+        add_request(user.id, wechat.id, 'r1', 'used', START + timedelta(hours=1), response_seconds=10)
+        add_request(user.id, wechat.id, 'r2', 'expired', START + timedelta(hours=2))
+        add_request(user.id, qq.id, 'r3', 'completed', START + timedelta(hours=3), response_seconds=30)
+        add_request(user.id, wechat.id, 'r4', 'used', START + timedelta(days=2, hours=23), response_seconds=20)
+        add_request(other.id, wechat.id, 'r5', 'used', START + timedelta(hours=1))
+        db.session.add_all([
+            Transaction(user_id=user.id, amount=-1.5, balance=0, type='consume', created_at=START + timedelta(hours=1)),
+            Transaction(user_id=user.id, amount=-2.0, balance=0, type='consume', created_at=START + timedelta(days=2)),
+            Transaction(user_id=user.id, amount=10.0, balance=0, type='topup', created_at=START + timedelta(days=2)),
+        ])
+        db.session.commit()
+        return user.id
+
+def build(routes_app, user_id, days, report_type, project_code=None):
+    end = START + timedelta(days=days) - timedelta(seconds=1)
+    with routes_app.app_context():
+        return build_statistics_report(user_id, START, end, report_type, project_code)
+
+def count_queries(routes_app, call):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append(statement)
+
+    with routes_app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        call()
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return len(statements)
+
+def test_daily_report_emits_every_day(routes_app, history):
+    rows = build(routes_app, history, 3, 'daily')
+
+    assert [(row['date'], row['total_requests'], row['successful_requests'], row['cost']) for row in rows] == [
+        ('2024-03-01', 3, 2, 1.5), ('2024-03-02', 0, 0, 0), ('2024-03-03', 1, 1, 2.0)]
+    assert rows[0]['success_rate'] == 66.67
+
+def test_daily_report_filters_by_project(routes_app, history):
+    rows = build(routes_app, history, 3, 'daily', project_code='qq')
+
+    assert [row['total_requests'] for row in rows] == [1, 0, 0]
+
+def test_project_report_groups_counts_and_response_time(routes_app, history):
+    rows = build(routes_app, history, 3, 'project')
+
+    by_code = {row['project_code']: row for row in rows}
+    assert (by_code['wechat']['total_requests'], by_code['wechat']['successful_requests']) == (3, 2)
+    assert by_code['wechat']['avg_response_time'] == 15.0
+    assert (by_code['qq']['success_rate'], by_code['qq']['avg_response_time']) == (100.0, 30.0)
+
+def test_summary_report(routes_app, history):
+    summary, = build(routes_app, history, 3, 'summary')
+
+    assert (summary['total_requests'], summary['successful_requests'], summary['project_count']) == (4, 3, 2)
+    assert (summary['total_cost'], summary['total_days']) == (3.5, 3)
+
+@pytest.mark.parametrize('report_type', ['daily', 'project', 'summary'])
+def test_query_count_does_not_depend_on_range(routes_app, history, report_type):
+    short = count_queries(routes_app, lambda: build(routes_app, history, 3, report_type))
+    long = count_queries(routes_app, lambda: build(routes_app, history, 300, report_type))
+
+    assert short == long
+
+def test_export_accepts_ranges_up_to_configured_limit(routes_app, history):
+    with routes_app.app_context():
+        token = routes_token(routes_app, history)
+    client = routes_app.test_client()
+
+    year = client.get(f'/api/statistics/export?start_date=2024-01-01&end_date=2024-12-31&format=json&type=summary&token={token}')
+    too_long = client.get(f'/api/statistics/export?start_date=2024-01-01&end_date=2025-01-01&format=json&type=summary&token={token}')
+
+    assert year.status_code == 200
+    assert year.get_json()[0]['total_requests'] == 4
+    assert too_long.status_code == 400
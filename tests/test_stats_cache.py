@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from app.models import db
+from app.services.stats_cache import StatsCache, _LocalStore, stats_cache, user_tag
+from tests.factories import add_user
+
+def new_cache(max_entries=10, max_bytes=1024):
+    """独立的缓存实例（stats_cache 是单例）"""
+    cache = object.__new__(StatsCache)
+    cache._initialized = False
+    cache.__init__()
+    cache._store = _LocalStore(max_entries, max_bytes)
+    return cache
+
+def test_invalidated_entry_is_not_served():
+    cache = new_cache()
+    cache.get_or_compute('k', [user_tag(1)], lambda: (b'old', True))
+
+    cache.invalidate_now([1])
+
+    assert cache.get_or_compute('k', [user_tag(1)], lambda: (b'new', True)) == (b'new', False)
+    assert cache.get_or_compute('k', [user_tag(1)], lambda: (b'unused', True)) == (b'new', True)
+
+def test_lru_respects_byte_limit():
+    store = _LocalStore(max_entries=10, max_bytes=10)
+    store.set('a', ['t'], store.versions(['t']), b'12345', 60)
+    store.set('b', ['t'], store.versions(['t']), b'12345', 60)
+    store.get('a', ['t'])
+
+    store.set('c', ['t'], store.versions(['t']), b'12345', 60)
+
+    assert store.get('b', ['t']) is None
+    assert store.get('a', ['t']) == b'12345'
+    assert store.evictions == 1
+
+def test_versions_only_kept_for_tags_with_entries():
+    store = _LocalStore(max_entries=5, max_bytes=1024)
+    store.set('kept', ['user:1'], store.versions(['user:1']), b'x', 60)
+
+    # 没有缓存条目的用户不断写入，版本号表不随用户数增长
+    for user_id in range(2, 1000):
+        store.bump([f'user:{user_id}', 'global'])
+
+    assert store.size()['tags'] <= 2 * 5
+    assert store.get('kept', ['user:1']) == b'x'
+
+def test_snapshot_taken_before_pruned_invalidation_stays_stale():
+    store = _LocalStore(max_entries=1, max_bytes=1024)
+    snapshot = store.versions(['user:1'])
+    store.bump(['user:1'])
+    # 标签版本号被清理后，计算前取得的版本号也不会与当前相等
+    store.bump(['user:2'])
+    assert 'user:1' not in store._versions
+
+    store.set('k', ['user:1'], snapshot, b'stale', 60)
+
+    assert store.get('k', ['user:1']) is None
+
+def test_evicted_entries_release_their_tags():
+    store = _LocalStore(max_entries=1, max_bytes=1024)
+    store.set('a', ['user:1'], store.versions(['user:1']), b'x', 60)
+    store.set('b', ['user:2'], store.versions(['user:2']), b'y', 60)
+
+    store.bump(['user:3'])
+
+    assert set(store._versions) == {'user:2'}
+    assert store.get('b', ['user:2']) == b'y'
+
+@pytest.fixture
+def routes_app(make_routes_app):
+    return make_routes_app()
+
+def test_invalidation_waits_for_commit(routes_app):
+    with routes_app.app_context():
+        user = add_user()
+        tags = [user_tag(user.id)]
+        before = stats_cache.versions(tags)
+
+        stats_cache.invalidate_user(user.id)
+        db.session.rollback()
+        assert stats_cache.versions(tags) == before
+
+        stats_cache.invalidate_user(user.id)
+        assert stats_cache.versions(tags) == before
+        db.session.commit()
+        assert stats_cache.versions(tags) != before
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import pickle
+import datetime
+from decimal import Decimal
+
+import pytest
+
+from app.services.cache_service import MemoryCache, TieredCache, RedisCache, CacheSerializer
+from app.services.local_redis import LocalRedis, redis_from_url
+
+VALUE = {
+    'user': {'id': 1, 'name': '张三', 'tags': ['a', 'b']},
+    'balance': Decimal('12.50'),
+    'created_at': datetime.datetime(2024, 3, 1, 9, 30, 15),
+    'day': datetime.date(2024, 3, 1),
+    'active': True,
+    'note': None,
+}
+
+@pytest.fixture
+def redis_client():
+    return LocalRedis()
+
+@pytest.fixture
+def make_tiered(redis_client):
+    caches = []
+
+    def make():
+        """同一个Redis上的一个工作进程"""
+        tiered = TieredCache(redis_client, MemoryCache(max_entries=100, stripes=1, sweep_interval=0), l1_ttl=30)
+        assert tiered.wait_subscribed(2)
+        caches.append(tiered)
+        return tiered
+
+    yield make
+    for tiered in caches:
+        tiered.stop()
+
+def wait_for(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def test_local_redis_commands(redis_client):
+    redis_client.setex('short', 0.05, 'x')
+    redis_client.set('a', 1)
+    pipe = redis_client.pipeline()
+    pipe.incr('counter').incr('counter', 5)
+
+    assert pipe.execute() == [1, 6]
+    assert redis_client.mget(['a', 'missing', 'short']) == [b'1', None, b'x']
+    assert sorted(redis_client.scan_iter(match='c*')) == [b'counter']
+    time.sleep(0.06)
+    assert redis_client.get('short') is None
+    assert redis_client.delete('a', 'missing') == 1
+
+def test_memory_url_shares_one_instance():
+    assert redis_from_url('memory://tests') is redis_from_url('memory://tests')
+    assert redis_from_url('memory://tests') is not redis_from_url('memory://other')
+
+def test_pubsub_delivers_to_subscribers(redis_client):
+    pubsub = redis_client.pubsub()
+    pubsub.subscribe('events')
+
+    assert redis_client.publish('events', 'hello') == 1
+    assert pubsub.get_message(ignore_subscribe_messages=True, timeout=1)['data'] == b'hello'
+    pubsub.close()
+    assert redis_client.publish('events', 'again') == 0
+
+@pytest.mark.parametrize('threshold', [None, 16])
+def test_json_serializer_round_trip(threshold):
+    serializer = CacheSerializer(compress_threshold=threshold)
+    serializer._msgpack = None
+
+    raw = serializer.dumps(VALUE)
+
+    assert raw[:1] == (b'j' if threshold else b'J')
+    assert serializer.loads(raw) == VALUE
+
+def test_msgpack_serializer_round_trip():
+    pytest.importorskip('msgpack')
+    serializer = CacheSerializer(compress_threshold=None)
+
+    raw = serializer.dumps(VALUE)
+
+    assert raw[:1] == b'M'
+    assert serializer.loads(raw) == VALUE
+
+def test_serializer_rejects_unknown_data():
+    serializer = CacheSerializer()
+
+    with pytest.raises(TypeError):
+        serializer.dumps({'value': object()})
+    with pytest.raises(ValueError):
+        serializer.loads(pickle.dumps(VALUE))
+
+def test_legacy_pickle_entry_is_a_miss(redis_client):
+    redis_client.set('legacy', pickle.dumps({'user_id': 1}))
+
+    assert RedisCache(redis_client).get('legacy') is None
+
+def test_l2_hit_fills_l1(make_tiered):
+    writer, reader = make_tiered(), make_tiered()
+    writer.set('user:1', VALUE, ttl=300)
+
+    assert reader.get('user:1') == VALUE
+    assert reader.get('user:1') == VALUE
+    stats = reader.stats()
+    assert (stats['l2_hits'], stats['l1_hits']) == (1, 1)
+    assert reader.l1.get('user:1') == VALUE
+
+def test_write_invalidates_other_processes_l1(make_tiered):
+    first, second = make_tiered(), make_tiered()
+    first.set('user:1', {'balance': 1})
+    assert second.get('user:1') == {'balance': 1}
+
+    first.set('user:1', {'balance': 2})
+
+    assert wait_for(lambda: second.l1.get('user:1') is None)
+    assert second.get('user:1') == {'balance': 2}
+    # 自己发出的失效消息不会清掉本进程刚写入的L1
+    assert first.stats()['invalidations_received'] == 0
+    assert first.l1.get('user:1') == {'balance': 2}
+
+def test_delete_and_flush_reach_other_processes(make_tiered):
+    first, second = make_tiered(), make_tiered()
+    for key in ('a', 'b'):
+        first.set(key, key)
+        second.get(key)
+
+    first.delete('a')
+    assert wait_for(lambda: second.l1.get('a') is None)
+    assert second.get('a') is None
+
+    first.flush()
+    assert wait_for(lambda: second.l1.stats()['entries'] == 0)
+    assert second.get('b') is None
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import socket
+import asyncio
+import threading
+import concurrent.futures
+
+import pytest
+
+from app.mock_api import MockUpstreamServer
+from app.services.async_sms_client import AsyncSMSApiClient
+from app.services.resilience import CircuitOpenError, deadline, get_breaker
+
+@pytest.fixture
+def server():
+    server = MockUpstreamServer().start()
+    yield server
+    server.stop()
+
+def test_mock_server_survives_connection_bursts(server):
+    host, port = server._server.server_address[:2]
+
+    def call(_):
+        with socket.create_connection((host, port), timeout=5) as conn:
+            conn.sendall(b'GET /account/balance HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n')
+            return conn.recv(64)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=64) as executor:
+        responses = list(executor.map(call, range(256)))
+
+    assert all(response.startswith(b'HTTP/1.1 200') for response in responses)
+
+def test_pooled_client_reuses_connections(server, app):
+    from app.utils import SMSApiClient
+
+    with app.app_context():
+        app.config['USE_MOCK_API'] = False
+        try:
+            client = SMSApiClient(base_url=server.base_url, api_key='test')
+        finally:
+            app.config['USE_MOCK_API'] = True
+    results = [client.get_phone_number('wechat_login') for _ in range(10)]
+
+    assert all(result['success'] for result in results)
+    assert server.connection_count == 1
+
+def test_async_client_opens_breaker_shared_with_sync_client(server):
+    server.failure_rate = 1.0
+
+    async def run():
+        async with AsyncSMSApiClient(base_url=server.base_url, api_key='test', use_mock=False) as client:
+            client.max_retries = 0
+            for _ in range(client.breaker_threshold):
+                assert (await client.check_balance())['success'] is False
+            with pytest.raises(CircuitOpenError):
+                await client.check_balance()
+            return await client.call_many(client.check_balance, [()]), client.breaker_threshold
+
+    results, threshold = asyncio.run(run())
+
+    assert results[0]['retry_after'] > 0
+    assert get_breaker(f"{server.base_url}:check_balance").state == 'open'
+    assert server.request_count == threshold
+
+def test_async_client_respects_deadline(server):
+    async def run():
+        async with AsyncSMSApiClient(base_url=server.base_url, api_key='test', use_mock=False) as client:
+            with deadline(0):
+                return await client.get_phone_number('wechat_login')
+
+    result = asyncio.run(run())
+
+    assert result['success'] is False
+    assert server.request_count == 0
+
+def test_saturated_pool_fails_at_deadline(app):
+    from app.utils import SMSApiClient
+
+    server = MockUpstreamServer(latency=1.0).start()
+    try:
+        with app.app_context():
+            app.config.update(USE_MOCK_API=False, SMS_API_POOL_MAXSIZE=1)
+            try:
+                client = SMSApiClient(base_url=server.base_url, api_key='test')
+            finally:
+                app.config.update(USE_MOCK_API=True, SMS_API_POOL_MAXSIZE=32)
+        # 唯一的连接被一个慢请求占用
+        holder = threading.Thread(target=client.get_phone_number, args=('wechat_login',))
+        holder.start()
+        time.sleep(0.2)
+
+        started = time.monotonic()
+        with deadline(0.3):
+            result = client.get_phone_number('wechat_login')
+        elapsed = time.monotonic() - started
+        holder.join(5)
+    finally:
+        server.stop()
+
+    assert result == {'success': False, 'message': '等待上游连接超过截止时间'}
+    assert elapsed < 0.7
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+import pytest
+
+from app import utils
+from app.services.resilience import deadline
+
+@pytest.fixture(autouse=True)
+def _reset_limits():
+    utils._in_flight_limits.clear()
+    yield
+    utils._in_flight_limits.clear()
+
+def test_call_many_caps_in_flight_without_blocking_pool_workers(app):
+    with app.app_context():
+        client = utils.SMSApiClient(base_url='http://fanout.test', api_key='k')
+    client.max_in_flight = 2
+    lock = threading.Lock()
+    state = {'now': 0, 'peak': 0}
+    release = threading.Event()
+
+    def slow(index):
+        with lock:
+            state['now'] += 1
+            state['peak'] = max(state['peak'], state['now'])
+        release.wait(5)
+        with lock:
+            state['now'] -= 1
+        return {'success': True, 'index': index}
+
+    results = []
+    caller = threading.Thread(target=lambda: results.extend(client.call_many(slow, [(i,) for i in range(10)])))
+    caller.start()
+    time.sleep(0.1)
+
+    # 等待名额的是调用方线程，线程池仍能执行其它任务
+    assert utils.upstream_executor.submit(lambda: 'free').result(timeout=1) == 'free'
+    release.set()
+    caller.join(5)
+
+    assert state['peak'] == 2
+    assert [item['index'] for item in results] == list(range(10))
+
+def test_in_flight_limit_follows_config_changes():
+    first = utils.get_in_flight_limit('http://a.test', 2)
+
+    assert utils.get_in_flight_limit('http://a.test', 2) is first
+    assert utils.get_in_flight_limit('http://a.test', 4) is not first
+
+def test_submit_upstream_gives_up_at_deadline():
+    semaphore = threading.BoundedSemaphore(1)
+    semaphore.acquire()
+
+    with deadline(0.05):
+        future = utils.submit_upstream(semaphore, lambda: 'never')
+
+    assert future is None
+    assert utils.gather_upstream([future])[0]['success'] is False
+
+def test_hedges_complete_when_upstream_pool_is_saturated(app, monkeypatch):
+    with app.app_context():
+        client = utils.SMSApiClient(base_url='http://hedge.test', api_key='k')
+    client.use_mock = False
+    client.hedge_delay = 0.01
+    monkeypatch.setattr(client, '_request', lambda op, method, path, **kwargs: (time.sleep(0.05), {'success': True})[1])
+
+    blocker = threading.Event()
+    busy = [utils.upstream_executor.submit(blocker.wait, 5) for _ in range(utils.upstream_executor._max_workers)]
+    try:
+        assert client.get_sms_code('r1') == {'success': True}
+    finally:
+        blocker.set()
+        for future in busy:
+            future.result()